@@ -229,19 +229,21 @@ def main(argv):
     }
 
   if FLAGS.corruptions_interval > 0:
-    if FLAGS.dataset == 'cifar100':
-      data_dir = FLAGS.cifar100_c_path
-    corruption_types, _ = utils.load_corrupted_test_info(FLAGS.dataset)
-    for corruption_type in corruption_types:
-      for severity in range(1, 6):
-        dataset = ub.datasets.get(
-            f'{FLAGS.dataset}_corrupted',
-            corruption_type=corruption_type,
-            severity=severity,
-            split=tfds.Split.TEST,
-            data_dir=data_dir).load(batch_size=batch_size)
-        test_datasets[f'{corruption_type}_{severity}'] = (
-            strategy.experimental_distribute_dataset(dataset))
+    corruption_types, max_intensity = utils.load_corrupted_test_info(
+        FLAGS.dataset)
+    # All corruption types and intensities are read by a single pipeline.
+    corrupted_dataset, steps_per_corrupted_eval = (
+        utils.load_corrupted_test_multiplexed(
+            FLAGS.dataset,
+            corruption_types,
+            batch_size,
+            num_examples_per_corruption=clean_test_builder.num_examples,
+            use_bfloat16=FLAGS.use_bfloat16,
+            max_intensity=max_intensity,
+            path=FLAGS.cifar100_c_path,
+            data_dir=data_dir))
+    test_datasets['corrupted'] = strategy.experimental_distribute_dataset(
+        corrupted_dataset)
 
   summary_writer = tf.summary.create_file_writer(
       os.path.join(FLAGS.output_dir, 'summaries'))
@@ -299,16 +301,8 @@ def main(argv):
       ood_metrics = ood_utils.create_ood_metrics(ood_dataset_names)
       metrics.update(ood_metrics)
     if FLAGS.corruptions_interval > 0:
-      corrupt_metrics = {}
-      for intensity in range(1, 6):
-        for corruption in corruption_types:
-          dataset_name = '{0}_{1}'.format(corruption, intensity)
-          corrupt_metrics['test/nll_{}'.format(dataset_name)] = (
-              tf.keras.metrics.Mean())
-          corrupt_metrics['test/accuracy_{}'.format(dataset_name)] = (
-              tf.keras.metrics.SparseCategoricalAccuracy())
-          corrupt_metrics['test/ece_{}'.format(dataset_name)] = (
-              rm.metrics.ExpectedCalibrationError(num_bins=FLAGS.num_bins))
+      corrupt_metrics = utils.GroupedCorruptMetrics(
+          corruption_types, max_intensity, num_bins=FLAGS.num_bins)
 
     checkpoint = tf.train.Checkpoint(model=model, optimizer=optimizer)
     latest_checkpoint = tf.train.latest_checkpoint(FLAGS.output_dir)
@@ -403,12 +397,8 @@ def main(argv):
           if dataset_name in name:
             metric.update_state(ood_labels, ood_scores)
       else:
-        corrupt_metrics['test/nll_{}'.format(dataset_name)].update_state(
-            negative_log_likelihood)
-        corrupt_metrics['test/accuracy_{}'.format(dataset_name)].update_state(
-            labels, probs)
-        corrupt_metrics['test/ece_{}'.format(dataset_name)].add_batch(
-            probs, label=labels)
+        corrupt_metrics.update_state(labels, probs, inputs['corruption_id'],
+                                     inputs['severity'], inputs['mask'])
 
     for _ in tf.range(tf.cast(num_steps, tf.int32)):
       strategy.run(step_fn, args=(next(iterator),))
@@ -488,7 +478,10 @@ def main(argv):
       logging.info('Testing on dataset %s', dataset_name)
       logging.info('Starting to run eval at epoch: %s', epoch)
       test_start_time = time.time()
-      test_step(test_iterator, 'test', dataset_name, steps_per_eval)
+      num_steps = (
+          steps_per_corrupted_eval
+          if dataset_name == 'corrupted' else steps_per_eval)
+      test_step(test_iterator, 'test', dataset_name, num_steps)
       ms_per_example = (time.time() - test_start_time) * 1e6 / batch_size
       metrics['test/ms_per_example'].update_state(ms_per_example)
 
@@ -507,8 +500,8 @@ def main(argv):
     corrupt_results = {}
     if (FLAGS.corruptions_interval > 0 and
         (epoch + 1) % FLAGS.corruptions_interval == 0):
-      corrupt_results = utils.aggregate_corrupt_metrics(corrupt_metrics,
-                                                        corruption_types)
+      corrupt_results = utils.aggregate_corrupt_metrics(
+          corrupt_metrics.result(), corruption_types, max_intensity)
 
     logging.info('Train Loss: %.4f, Accuracy: %.2f%%',
                  metrics['train/loss'].result(),
@@ -532,8 +525,7 @@ def main(argv):
       metric.reset_states()
 
     if FLAGS.corruptions_interval > 0:
-      for metric in corrupt_metrics.values():
-        metric.reset_states()
+      corrupt_metrics.reset_states()
 
     if (FLAGS.checkpoint_interval > 0 and
         (epoch + 1) % FLAGS.checkpoint_interval == 0):
@@ -27,10 +27,10 @@ from absl import flags
 from absl import logging
 
 import numpy as np
-import robustness_metrics as rm
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import uncertainty_baselines as ub
+import ensemble_utils  # local file import from baselines.cifar
 import ood_utils  # local file import from baselines.cifar
 import utils  # local file import from baselines.cifar
 
@@ -45,6 +45,10 @@ flags.DEFINE_list('ood_dataset', 'cifar100,svhn_cropped',
                   'list of OOD datasets to evaluate on.')
 flags.DEFINE_bool('dempster_shafer_ood', False,
                   'Wheter to use DempsterShafer Uncertainty score.')
+flags.DEFINE_string(
+    'logits_store_dir', None,
+    'Directory of the content-addressed store of member logits, which can be '
+    'shared across ensembles. Defaults to `output_dir`/logits.')
 
 FLAGS = flags.FLAGS
 
@@ -96,21 +100,19 @@ def main(argv):
         batch_size,
         drop_remainder=FLAGS.drop_remainder_for_eval)
     test_datasets.update(ood_datasets)
-  if FLAGS.dataset == 'cifar100':
-    data_dir = FLAGS.cifar100_c_path
-  corruption_types, _ = utils.load_corrupted_test_info(FLAGS.dataset)
-  for corruption_type in corruption_types:
-    for severity in range(1, 6):
-      dataset = ub.datasets.get(
-          f'{FLAGS.dataset}_corrupted',
-          corruption_type=corruption_type,
-          download_data=FLAGS.download_data,
+  corruption_types, max_intensity = utils.load_corrupted_test_info(
+      FLAGS.dataset)
+  # All corruption types and intensities are read by a single pipeline.
+  test_datasets['corrupted'], steps_per_corrupted_eval = (
+      utils.load_corrupted_test_multiplexed(
+          FLAGS.dataset,
+          corruption_types,
+          batch_size,
+          num_examples_per_corruption=ds_info.splits['test'].num_examples,
+          max_intensity=max_intensity,
+          path=FLAGS.cifar100_c_path,
           data_dir=data_dir,
-          severity=severity,
-          split=tfds.Split.TEST,
-          drop_remainder=FLAGS.drop_remainder_for_eval).load(
-              batch_size=batch_size)
-      test_datasets[f'{corruption_type}_{severity}'] = dataset
+          download_data=FLAGS.download_data))
 
   model = ub.models.wide_resnet(
       input_shape=ds_info.features['image'].shape,
@@ -132,127 +134,104 @@ def main(argv):
   logging.info('Ensemble filenames: %s', str(ensemble_filenames))
   checkpoint = tf.train.Checkpoint(model=model)
 
-  # Write model predictions to files.
-  num_datasets = len(test_datasets)
-  for m, ensemble_filename in enumerate(ensemble_filenames):
-    checkpoint.restore(ensemble_filename)
-    for n, (name, test_dataset) in enumerate(test_datasets.items()):
-      filename = '{dataset}_{member}.npy'.format(
-          dataset=name.replace('/', '_'), member=m)  # ood dataset name has '/'
-      filename = os.path.join(FLAGS.output_dir, filename)
-      if not tf.io.gfile.exists(filename):
-        logits = []
-        test_iterator = iter(test_dataset)
-        steps = steps_per_eval if 'ood/' not in name else steps_per_ood[name]
-        for _ in range(steps):
-          features = next(test_iterator)['features']  # pytype: disable=unsupported-operands
-          logits.append(model(features, training=False))
-
-        logits = tf.concat(logits, axis=0)
-        with tf.io.gfile.GFile(filename, 'w') as f:
-          np.save(f, logits.numpy())
-      percent = (m * num_datasets + (n + 1)) / (ensemble_size * num_datasets)
-      message = ('{:.1%} completion for prediction: ensemble member {:d}/{:d}. '
-                 'Dataset {:d}/{:d}'.format(percent,
-                                            m + 1,
-                                            ensemble_size,
-                                            n + 1,
-                                            num_datasets))
-      logging.info(message)
-
-  metrics = {
-      'test/negative_log_likelihood': tf.keras.metrics.Mean(),
-      'test/gibbs_cross_entropy': tf.keras.metrics.Mean(),
-      'test/accuracy': tf.keras.metrics.SparseCategoricalAccuracy(),
-      'test/ece': rm.metrics.ExpectedCalibrationError(
-          num_bins=FLAGS.num_bins),
-      'test/diversity': rm.metrics.AveragePairwiseDiversity(),
+  # Compute the logits of every member which are not stored yet.
+  store = ensemble_utils.LogitsStore(
+      FLAGS.logits_store_dir or os.path.join(FLAGS.output_dir, 'logits'))
+  steps = {
+      name: steps_per_eval if 'ood/' not in name else steps_per_ood[name]
+      for name in test_datasets
+  }
+  steps['corrupted'] = steps_per_corrupted_eval
+  fingerprints = {
+      name: ensemble_utils.dataset_fingerprint(
+          name,
+          dataset=FLAGS.dataset,
+          batch_size=batch_size,
+          steps=steps[name],
+          train_proportion=FLAGS.train_proportion,
+          drop_remainder=FLAGS.drop_remainder_for_eval)
+      for name in test_datasets
   }
+  member_fingerprints = ensemble_utils.compute_member_logits(
+      store, model, checkpoint, ensemble_filenames, test_datasets, steps,
+      fingerprints)
+
+  metrics = {}
   if FLAGS.eval_on_ood:
     ood_metrics = ood_utils.create_ood_metrics(ood_dataset_names)
     metrics.update(ood_metrics)
+  # Metrics of the whole clean and corrupted test sets, computed at once.
+  clean_results = {}
   corrupt_metrics = {}
-  for name in test_datasets:
-    corrupt_metrics['test/nll_{}'.format(name)] = tf.keras.metrics.Mean()
-    corrupt_metrics['test/accuracy_{}'.format(name)] = (
-        tf.keras.metrics.SparseCategoricalAccuracy())
-    corrupt_metrics['test/ece_{}'.format(name)] = (
-        rm.metrics.ExpectedCalibrationError(num_bins=FLAGS.num_bins))
-  for i in range(ensemble_size):
-    metrics['test/nll_member_{}'.format(i)] = tf.keras.metrics.Mean()
-    metrics['test/accuracy_member_{}'.format(i)] = (
-        tf.keras.metrics.SparseCategoricalAccuracy())
-
-  # Evaluate model predictions.
-  for n, (name, test_dataset) in enumerate(test_datasets.items()):
-    logits_dataset = []
-    for m in range(ensemble_size):
-      filename = '{dataset}_{member}.npy'.format(
-          dataset=name.replace('/', '_'), member=m)  # ood dataset name has '/'
-      filename = os.path.join(FLAGS.output_dir, filename)
-      with tf.io.gfile.GFile(filename, 'rb') as f:
-        logits_dataset.append(np.load(f))
-
-    logits_dataset = tf.convert_to_tensor(logits_dataset)
-    test_iterator = iter(test_dataset)
-    steps = steps_per_eval if 'ood/' not in name else steps_per_ood[name]
-    for step in range(steps):
-      inputs = next(test_iterator)
-      labels = inputs['labels']  # pytype: disable=unsupported-operands
-      logits = logits_dataset[:, (step*batch_size):((step+1)*batch_size)]
-      labels = tf.cast(labels, tf.int32)
-      negative_log_likelihood_metric = rm.metrics.EnsembleCrossEntropy()
-      negative_log_likelihood_metric.add_batch(logits, labels=labels)
-      negative_log_likelihood = list(
-          negative_log_likelihood_metric.result().values())[0]
-      per_probs = tf.nn.softmax(logits)
-      probs = tf.reduce_mean(per_probs, axis=0)
-      logits_mean = tf.reduce_mean(logits, axis=0)
 
+  # Evaluate model predictions, over all members and examples at once.
+  num_datasets = len(test_datasets)
+  for n, name in enumerate(test_datasets):
+    logits = ensemble_utils.load_ensemble_logits(store, member_fingerprints,
+                                                 fingerprints[name])
+    if name.startswith('ood/'):
+      ood_labels = 1 - np.asarray(
+          store.get('is_in_distribution', fingerprints[name]))
+      if FLAGS.dempster_shafer_ood:
+        ood_scores = ood_utils.DempsterShaferUncertainty(
+            tf.reduce_mean(logits, axis=0))
+      else:
+        probs = tf.reduce_mean(tf.nn.softmax(logits), axis=0)
+        ood_scores = 1 - tf.reduce_max(probs, axis=-1)
+      for metric_name, metric in metrics.items():
+        if name in metric_name:
+          metric.update_state(ood_labels, ood_scores)
+    elif name == 'corrupted':
+      # Metrics of every corruption type and intensity, in a single pass.
+      labels = np.asarray(store.get('labels', fingerprints[name]))
+      corruption_ids = np.asarray(
+          store.get('corruption_id', fingerprints[name]))
+      severities = np.asarray(store.get('severity', fingerprints[name]))
+      groups = (severities - 1) * len(corruption_types) + corruption_ids
+      results = ensemble_utils.grouped_ensemble_metrics(
+          logits,
+          labels.astype(np.int32),
+          groups,
+          num_groups=len(corruption_types) * max_intensity,
+          mask=np.asarray(store.get('mask', fingerprints[name])),
+          num_bins=FLAGS.num_bins)
+      for intensity in range(1, max_intensity + 1):
+        for i, corruption_type in enumerate(corruption_types):
+          group = (intensity - 1) * len(corruption_types) + i
+          dataset_name = '{0}_{1}'.format(corruption_type, intensity)
+          corrupt_metrics['test/nll_{}'.format(dataset_name)] = (
+              results['negative_log_likelihood'][group])
+          corrupt_metrics['test/accuracy_{}'.format(dataset_name)] = (
+              results['accuracy'][group])
+          corrupt_metrics['test/ece_{}'.format(dataset_name)] = (
+              results['ece'][group])
+    else:
+      labels = np.asarray(store.get('labels', fingerprints[name]))
+      results = ensemble_utils.ensemble_metrics(
+          logits, labels.astype(np.int32), num_bins=FLAGS.num_bins)
       if name == 'clean':
-        gibbs_ce_metric = rm.metrics.GibbsCrossEntropy()
-        gibbs_ce_metric.add_batch(logits, labels=labels)
-        gibbs_ce = list(gibbs_ce_metric.result().values())[0]
-        metrics['test/negative_log_likelihood'].update_state(
-            negative_log_likelihood)
-        metrics['test/gibbs_cross_entropy'].update_state(gibbs_ce)
-        metrics['test/accuracy'].update_state(labels, probs)
-        metrics['test/ece'].add_batch(probs, label=labels)
-
+        clean_results['test/negative_log_likelihood'] = (
+            results['negative_log_likelihood'])
+        clean_results['test/gibbs_cross_entropy'] = (
+            results['gibbs_cross_entropy'])
+        clean_results['test/accuracy'] = results['accuracy']
+        clean_results['test/ece'] = results['ece']
+        clean_results['test/diversity'] = results['diversity']
         for i in range(ensemble_size):
-          member_probs = per_probs[i]
-          member_loss = tf.keras.losses.sparse_categorical_crossentropy(
-              labels, member_probs)
-          metrics['test/nll_member_{}'.format(i)].update_state(member_loss)
-          metrics['test/accuracy_member_{}'.format(i)].update_state(
-              labels, member_probs)
-        metrics['test/diversity'].add_batch(per_probs)
-
-      elif name.startswith('ood/'):
-        ood_labels = 1 - inputs['is_in_distribution']  # pytype: disable=unsupported-operands
-        if FLAGS.dempster_shafer_ood:
-          ood_scores = ood_utils.DempsterShaferUncertainty(logits_mean)
-        else:
-          ood_scores = 1 - tf.reduce_max(probs, axis=-1)
-
-        for metric_name, metric in metrics.items():
-          if name in metric_name:
-            metric.update_state(ood_labels, ood_scores)
-      else:
-        corrupt_metrics['test/nll_{}'.format(name)].update_state(
-            negative_log_likelihood)
-        corrupt_metrics['test/accuracy_{}'.format(name)].update_state(
-            labels, probs)
-        corrupt_metrics['test/ece_{}'.format(name)].add_batch(
-            probs, label=labels)
+          clean_results['test/nll_member_{}'.format(i)] = (
+              results['nll_member'][i])
+          clean_results['test/accuracy_member_{}'.format(i)] = (
+              results['accuracy_member'][i])
 
     message = ('{:.1%} completion for evaluation: dataset {:d}/{:d}'.format(
         (n + 1) / num_datasets, n + 1, num_datasets))
     logging.info(message)
 
   corrupt_results = utils.aggregate_corrupt_metrics(corrupt_metrics,
-                                                    corruption_types)
+                                                    corruption_types,
+                                                    max_intensity)
   total_results = {name: metric.result() for name, metric in metrics.items()}
+  total_results.update(clean_results)
   total_results.update(corrupt_results)
   # Results from Robustness Metrics themselves return a dict, so flatten them.
   total_results = utils.flatten_dictionary(total_results)
@@ -0,0 +1,262 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utilities to evaluate ensembles on CIFAR from cached predictions.
+
+Member predictions are stored in a `LogitsStore`, a content-addressed store
+keyed by the fingerprint of the checkpoint and of the evaluation dataset. The
+metrics are then computed over all members and all examples of a dataset at
+once, with vectorized NumPy reductions or a single batch of the Robustness
+Metrics.
+"""
+
+import hashlib
+import json
+import os
+
+from absl import logging
+import numpy as np
+import robustness_metrics as rm
+import scipy.special
+import tensorflow as tf
+import utils  # local file import from baselines.cifar
+
+
+def checkpoint_fingerprint(checkpoint_path):
+  """Returns a fingerprint of the content of a TF checkpoint.
+
+  The `.index` file of a TF checkpoint lists the shape, dtype and checksum of
+  every saved tensor, so hashing it identifies the checkpoint content without
+  reading the (large) data files.
+
+  Args:
+    checkpoint_path: Path to the checkpoint, without the `.index` suffix.
+
+  Returns:
+    A hex digest string.
+  """
+  with tf.io.gfile.GFile(checkpoint_path + '.index', 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+
+def dataset_fingerprint(name, **config):
+  """Returns a fingerprint of an evaluation dataset and its configuration.
+
+  Args:
+    name: Name of the dataset, e.g. 'clean' or 'gaussian_noise_3'.
+    **config: Any configuration that changes the examples or their order, e.g.
+      the dataset name, split, batch size or number of steps.
+
+  Returns:
+    A hex digest string.
+  """
+  config = dict(config, name=name)
+  serialized = json.dumps(config, sort_keys=True, default=str)
+  return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class LogitsStore:
+  """Content-addressed store of prediction arrays.
+
+  Each entry is a `.npy` file named after the hash of its key. Local entries
+  are memory-mapped when read, so evaluating many members and datasets does
+  not need to hold all predictions in memory at once.
+  """
+
+  def __init__(self, store_dir):
+    self.store_dir = store_dir
+    tf.io.gfile.makedirs(store_dir)
+
+  def _path(self, *key):
+    digest = hashlib.sha256('/'.join(key).encode('utf-8')).hexdigest()
+    return os.path.join(self.store_dir, digest + '.npy')
+
+  def contains(self, *key):
+    return tf.io.gfile.exists(self._path(*key))
+
+  def get(self, *key):
+    """Returns the array stored under `key`, memory-mapped if possible."""
+    path = self._path(*key)
+    if '://' not in path:
+      return np.load(path, mmap_mode='r', allow_pickle=False)
+    with tf.io.gfile.GFile(path, 'rb') as f:
+      return np.load(f, allow_pickle=False)
+
+  def put(self, value, *key):
+    """Stores `value` under `key`, atomically replacing any previous entry."""
+    path = self._path(*key)
+    path_tmp = path + '-TEMPORARY'
+    with tf.io.gfile.GFile(path_tmp, 'wb') as f:
+      np.save(f, np.asarray(value), allow_pickle=False)
+    tf.io.gfile.rename(path_tmp, path, overwrite=True)
+
+
+def compute_member_logits(store, model, checkpoint, checkpoint_paths,
+                          test_datasets, steps, fingerprints):
+  """Computes and stores the logits of each member that are not yet stored.
+
+  Adding a member to an ensemble therefore only computes the logits of that
+  member. The labels (and `is_in_distribution` flags of OOD datasets, or the
+  corruption ids, severities and masks of the multiplexed corrupted test sets)
+  of every dataset are stored as well, so the evaluation does not need to iterate over
+  the datasets again.
+
+  Args:
+    store: LogitsStore.
+    model: tf.keras.Model to restore the checkpoints into.
+    checkpoint: tf.train.Checkpoint tracking `model`.
+    checkpoint_paths: List of checkpoint paths, one per ensemble member.
+    test_datasets: Dictionary of dataset names to tf.data.Datasets.
+    steps: Dictionary of dataset names to the number of evaluation steps.
+    fingerprints: Dictionary of dataset names to dataset fingerprints.
+
+  Returns:
+    The list of checkpoint fingerprints, one per ensemble member.
+  """
+  member_fingerprints = [checkpoint_fingerprint(p) for p in checkpoint_paths]
+  for m, (path, member) in enumerate(zip(checkpoint_paths,
+                                         member_fingerprints)):
+    missing = [
+        name for name in test_datasets
+        if not store.contains(member, fingerprints[name])
+    ]
+    if not missing:
+      continue
+    checkpoint.restore(path)
+    for name in missing:
+      logits = []
+      targets = {
+          'labels': [],
+          'is_in_distribution': [],
+          'corruption_id': [],
+          'severity': [],
+          'mask': [],
+      }
+      test_iterator = iter(test_datasets[name])
+      for _ in range(steps[name]):
+        inputs = next(test_iterator)
+        logits.append(model(inputs['features'], training=False))
+        for key, values in targets.items():
+          if key in inputs:
+            values.append(inputs[key])
+      store.put(tf.concat(logits, axis=0).numpy(), member, fingerprints[name])
+      for key, values in targets.items():
+        if values and not store.contains(key, fingerprints[name]):
+          store.put(tf.concat(values, axis=0).numpy(), key, fingerprints[name])
+      logging.info('Computed logits of ensemble member %d/%d on %s.', m + 1,
+                   len(checkpoint_paths), name)
+  return member_fingerprints
+
+
+def load_ensemble_logits(store, member_fingerprints, dataset_key):
+  """Returns the stacked [ensemble_size, num_examples, num_classes] logits."""
+  return np.stack(
+      [store.get(member, dataset_key) for member in member_fingerprints])
+
+
+def ensemble_metrics(logits, labels, num_bins=15):
+  """Computes ensemble and per-member metrics over a whole dataset.
+
+  Args:
+    logits: Array of shape [ensemble_size, num_examples, num_classes].
+    labels: Integer array of shape [num_examples].
+    num_bins: Number of confidence bins for the ECE.
+
+  Returns:
+    Dictionary of metrics. The ensemble metrics are floats and the per-member
+    metrics arrays of shape [ensemble_size].
+  """
+  logits = np.asarray(logits, dtype=np.float64)
+  labels = np.asarray(labels, dtype=np.int64)
+  ensemble_size, num_examples = logits.shape[:2]
+  log_probs = scipy.special.log_softmax(logits, axis=-1)
+  label_log_probs = log_probs[:, np.arange(num_examples), labels]
+  ensemble_log_probs = (
+      scipy.special.logsumexp(log_probs, axis=0) - np.log(ensemble_size))
+  per_probs = np.exp(log_probs)
+  probs = np.exp(ensemble_log_probs)
+  member_predictions = np.argmax(log_probs, axis=-1)
+  ece = rm.metrics.ExpectedCalibrationError(num_bins=num_bins)
+  ece.add_batch(probs, label=labels)
+  diversity = rm.metrics.AveragePairwiseDiversity()
+  diversity.add_batch(per_probs)
+  return {
+      'negative_log_likelihood':
+          float(-np.mean(ensemble_log_probs[np.arange(num_examples), labels])),
+      'gibbs_cross_entropy':
+          float(-np.mean(label_log_probs)),
+      'accuracy':
+          float(np.mean(np.argmax(probs, axis=-1) == labels)),
+      'ece':
+          float(list(ece.result().values())[0]),
+      'nll_member':
+          -np.mean(label_log_probs, axis=-1),
+      'accuracy_member':
+          np.mean(member_predictions == labels, axis=-1),
+      'diversity':
+          diversity.result(),
+  }
+
+
+def grouped_ensemble_metrics(logits, labels, groups, num_groups, mask=None,
+                             num_bins=15):
+  """Computes the ensemble NLL, accuracy and ECE of groups of examples.
+
+  Each metric is computed for all groups at once with segment sums, e.g. for
+  the multiplexed corrupted test sets grouped by corruption type and
+  intensity. The ECE uses the confidence bins of `utils.calibration_bin_sums`.
+
+  Args:
+    logits: Array of shape [ensemble_size, num_examples, num_classes].
+    labels: Integer array of shape [num_examples].
+    groups: Integer array of shape [num_examples] with the group of every
+      example, in [0, num_groups).
+    num_groups: Number of groups.
+    mask: Optional array of shape [num_examples], 0 for padding examples.
+    num_bins: Number of confidence bins for the ECE.
+
+  Returns:
+    Dictionary of arrays of shape [num_groups] with the negative
+    log-likelihood, accuracy and ECE of every group.
+  """
+  logits = np.asarray(logits, dtype=np.float64)
+  labels = np.asarray(labels, dtype=np.int64)
+  groups = np.asarray(groups, dtype=np.int64)
+  num_examples = labels.shape[0]
+  if mask is None:
+    mask = np.ones(num_examples)
+  mask = np.asarray(mask, dtype=np.float64)
+  groups = np.clip(groups, 0, num_groups - 1)
+  ensemble_log_probs = (
+      scipy.special.logsumexp(scipy.special.log_softmax(logits, axis=-1),
+                              axis=0) - np.log(logits.shape[0]))
+  probs = np.exp(ensemble_log_probs)
+  nll = -ensemble_log_probs[np.arange(num_examples), labels]
+  confidences = np.max(probs, axis=-1)
+  correct = (np.argmax(probs, axis=-1) == labels).astype(np.float64)
+
+  def segment_sum(values):
+    return np.bincount(groups, weights=values * mask, minlength=num_groups)
+
+  count = np.maximum(segment_sum(1.), 1.)
+  bin_correct_sum, bin_confidence_sum = utils.calibration_bin_sums(
+      confidences, correct, groups, num_groups, num_bins, mask)
+  ece = utils.expected_calibration_error(bin_correct_sum, bin_confidence_sum,
+                                         count)
+  return {
+      'negative_log_likelihood': segment_sum(nll) / count,
+      'accuracy': segment_sum(correct) / count,
+      'ece': ece.numpy(),
+  }
@@ -0,0 +1,114 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the evaluation of CIFAR ensembles from cached predictions."""
+
+import numpy as np
+import robustness_metrics as rm
+import tensorflow as tf
+import uncertainty_baselines as ub
+import ensemble_utils  # local file import from baselines.cifar
+
+_ENSEMBLE_SIZE = 4
+_NUM_EXAMPLES = 32
+_NUM_CLASSES = 5
+
+
+def _logits_and_labels():
+  rng = np.random.RandomState(0)
+  logits = 2. * rng.randn(_ENSEMBLE_SIZE, _NUM_EXAMPLES, _NUM_CLASSES)
+  labels = rng.randint(0, _NUM_CLASSES, _NUM_EXAMPLES)
+  return logits.astype(np.float32), labels.astype(np.int32)
+
+
+def _rm_result(metric):
+  return list(metric.result().values())[0]
+
+
+class EnsembleUtilsTest(tf.test.TestCase):
+
+  def testLogitsStore(self):
+    store = ensemble_utils.LogitsStore(self.get_temp_dir())
+    key = ('member', ensemble_utils.dataset_fingerprint('clean', steps=2))
+    self.assertFalse(store.contains(*key))
+    store.put(np.arange(6.).reshape(2, 3), *key)
+    self.assertTrue(store.contains(*key))
+    self.assertAllEqual(store.get(*key), np.arange(6.).reshape(2, 3))
+    self.assertFalse(store.contains(
+        'member', ensemble_utils.dataset_fingerprint('clean', steps=3)))
+
+  def testEnsembleMetrics(self):
+    logits, labels = _logits_and_labels()
+    results = ensemble_utils.ensemble_metrics(logits, labels, num_bins=10)
+
+    nll = rm.metrics.EnsembleCrossEntropy()
+    nll.add_batch(logits, labels=labels)
+    self.assertAllClose(results['negative_log_likelihood'], _rm_result(nll),
+                        atol=1e-5)
+    gibbs_ce = rm.metrics.GibbsCrossEntropy()
+    gibbs_ce.add_batch(logits, labels=labels)
+    self.assertAllClose(results['gibbs_cross_entropy'], _rm_result(gibbs_ce),
+                        atol=1e-5)
+
+    per_probs = tf.nn.softmax(logits)
+    probs = tf.reduce_mean(per_probs, axis=0)
+    accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+    accuracy.update_state(labels, probs)
+    self.assertAllClose(results['accuracy'], accuracy.result())
+    ece = rm.metrics.ExpectedCalibrationError(num_bins=10)
+    ece.add_batch(probs, label=labels)
+    self.assertAllClose(results['ece'], _rm_result(ece), atol=1e-5)
+
+    diversity = rm.metrics.AveragePairwiseDiversity()
+    diversity.add_batch(per_probs)
+    expected_diversity = diversity.result()
+    self.assertCountEqual(results['diversity'], expected_diversity)
+    for key, value in expected_diversity.items():
+      self.assertAllClose(results['diversity'][key], value, atol=1e-5)
+
+    for i in range(_ENSEMBLE_SIZE):
+      member_nll = tf.reduce_mean(
+          tf.keras.losses.sparse_categorical_crossentropy(
+              labels, logits[i], from_logits=True))
+      self.assertAllClose(results['nll_member'][i], member_nll, atol=1e-5)
+      member_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+      member_accuracy.update_state(labels, per_probs[i])
+      self.assertAllClose(results['accuracy_member'][i],
+                          member_accuracy.result())
+
+  def testGreedySelection(self):
+    logits, labels = _logits_and_labels()
+    members, accuracy, nll = ub.ensemble_selection.greedy_selection(
+        logits, labels, max_ensemble_size=3, replacement=False)
+    self.assertNotEmpty(members)
+    self.assertLen(set(members), len(members))
+
+    # The objectives of the selected ensemble are its metrics.
+    results = ensemble_utils.ensemble_metrics(logits[members], labels)
+    self.assertAllClose(nll, results['negative_log_likelihood'], atol=1e-5)
+    self.assertAllClose(accuracy, results['accuracy'])
+    expected_nll = rm.metrics.EnsembleCrossEntropy()
+    expected_nll.add_batch(logits[members], labels=labels)
+    self.assertAllClose(nll, _rm_result(expected_nll), atol=1e-5)
+
+    # No other ensemble of the same members and one more candidate is better.
+    for candidate in set(range(_ENSEMBLE_SIZE)) - set(members[:-1]):
+      results = ensemble_utils.ensemble_metrics(
+          logits[members[:-1] + [candidate]], labels)
+      self.assertGreaterEqual(results['negative_log_likelihood'] + 1e-6, nll)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -46,6 +46,9 @@ flags.DEFINE_integer('ensemble_size', 4, 'Size of ensemble.')
 flags.DEFINE_enum('greedy_objective', 'nll',
                   enum_values=['nll', 'acc', 'nll-acc'],
                   help='Objective that drives the greedy selection.')
+flags.DEFINE_integer('greedy_chunk_size', None,
+                     'Number of candidates scored together at every greedy '
+                     'step. If None, all the candidates are scored together.')
 flags.register_validator('train_proportion',
                          lambda tp: tp > 0.0 and tp <= 1.0,
                          message='--train_proportion must be in (0, 1].')
@@ -67,58 +70,6 @@ def parse_checkpoint_dir(checkpoint_dir):
   return paths
 
 
-def _ensemble_accuracy(labels, logits_list):
-  """Compute the accuracy resulting from the ensemble prediction."""
-  per_probs = tf.nn.softmax(logits_list)
-  probs = tf.reduce_mean(per_probs, axis=0)
-  acc = tf.keras.metrics.SparseCategoricalAccuracy()
-  acc.update_state(labels, probs)
-  return acc.result()
-
-
-def greedy_selection(val_logits, val_labels, max_ens_size, objective='nll'):
-  """Greedy procedure from Caruana et al. 2004, with replacement."""
-
-  assert_msg = 'Unknown objective type (received {}).'.format(objective)
-  assert objective in ('nll', 'acc', 'nll-acc'), assert_msg
-
-  if objective == 'nll':
-    get_objective = lambda acc, nll: nll
-  elif objective == 'acc':
-    get_objective = lambda acc, nll: acc
-  else:
-    get_objective = lambda acc, nll: nll-acc
-
-  best_acc = 0.
-  best_nll = np.inf
-  best_objective = np.inf
-  ens = []
-
-  def get_ens_size():
-    return len(set(ens))
-
-  while get_ens_size() < max_ens_size:
-    current_val_logits = [val_logits[model_id] for model_id in ens]
-    best_model_id = None
-    for model_id, logits in enumerate(val_logits):
-      acc = _ensemble_accuracy(val_labels, current_val_logits + [logits])
-      negative_log_likelihood_metric = rm.metrics.EnsembleCrossEntropy()
-      negative_log_likelihood_metric.add_batch(
-          current_val_logits + [logits], labels=val_labels)
-      nll = list(negative_log_likelihood_metric.result().values())[0]
-      obj = get_objective(acc, nll)
-      if obj < best_objective:
-        best_acc = acc
-        best_nll = nll
-        best_objective = obj
-        best_model_id = model_id
-    if best_model_id is None:
-      logging.info('Ensemble could not be improved: Greedy selection stops.')
-      break
-    ens.append(best_model_id)
-  return ens, best_acc, best_nll
-
-
 def main(argv):
   del argv  # unused arg
   if not FLAGS.use_gpu:
@@ -201,7 +152,7 @@ def main(argv):
       if m == 0:
         val_labels.append(labels)
 
-    val_logits.append(tf.concat(val_logits_m, axis=0))
+    val_logits.append(tf.concat(val_logits_m, axis=0).numpy())
     if m == 0:
       val_labels = tf.concat(val_labels, axis=0)
 
@@ -210,9 +161,12 @@ def main(argv):
                'model {:d}/{:d}.'.format(percent, m + 1, model_pool_size))
     logging.info(message)
 
-  selected_members, val_acc, val_nll = greedy_selection(val_logits, val_labels,
-                                                        FLAGS.ensemble_size,
-                                                        FLAGS.greedy_objective)
+  selected_members, val_acc, val_nll = ub.ensemble_selection.greedy_selection(
+      val_logits,
+      val_labels,
+      FLAGS.ensemble_size,
+      FLAGS.greedy_objective,
+      chunk_size=FLAGS.greedy_chunk_size)
   unique_selected_members = list(set(selected_members))
   message = ('Members selected by greedy procedure: {} (with {} unique '
              'member(s))\n\t{}').format(
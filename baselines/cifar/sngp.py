@@ -643,6 +643,11 @@ def main(argv):
         if step % 20 == 0:
           logging.info(message)
 
+    if FLAGS.use_gp_layer:
+      # Factorizes the GP posterior covariance once per epoch, such that the
+      # test steps do not invert the precision matrix.
+      ub.models.classifier_utils.cache_gp_covariance(model)
+
     datasets_to_evaluate = {'clean': test_datasets['clean']}
     if use_validation_set:
       datasets_to_evaluate['val'] = validation_dataset
@@ -208,6 +208,317 @@ def load_corrupted_test_info(dataset):
   return corruption_types, max_intensity
 
 
+def _corrupted_test_files(dataset, corruption_type, intensity, path=None,
+                          data_dir=None, download_data=False):
+  """Returns the files of the corrupted test set of a corruption/intensity."""
+  if dataset == 'cifar100':
+    return [
+        os.path.join(path,
+                     '{0}-{1}.tfrecords'.format(corruption_type, intensity))
+    ]
+  builder = tfds.builder(
+      'cifar10_corrupted/{0}_{1}'.format(corruption_type, intensity),
+      data_dir=data_dir)
+  if download_data:
+    builder.download_and_prepare()
+  return builder.info.splits[tfds.Split.TEST].filepaths
+
+
+def load_corrupted_test_multiplexed(dataset,
+                                    corruption_types,
+                                    batch_size,
+                                    num_examples_per_corruption,
+                                    use_bfloat16=False,
+                                    max_intensity=5,
+                                    path=None,
+                                    data_dir=None,
+                                    normalize=True,
+                                    cycle_length=16,
+                                    download_data=False):
+  """Loads all corruptions and intensities of CIFAR-C in a single pipeline.
+
+  Rather than one pipeline per corruption type and intensity, the files of
+  all the corrupted test sets are read in parallel by a single interleaved
+  pipeline. Every example carries the index of its corruption type in
+  `corruption_types` and its intensity, so that `GroupedCorruptMetrics` can
+  compute the metrics of every corrupted test set in one pass. The order of the
+  examples is deterministic, such that predictions of several models can be
+  aligned, e.g. for ensembles. The last batch
+  is padded with examples of zero `mask`, such that no example is dropped and
+  all the batches have a static shape.
+
+  Args:
+    dataset: Either 'cifar10' or 'cifar100'.
+    corruption_types: List of corruption types.
+    batch_size: The batch size.
+    num_examples_per_corruption: Number of examples of each corrupted test set.
+    use_bfloat16: Whether to load the images in bfloat16 or float32.
+    max_intensity: Int, of maximum intensity.
+    path: Directory of the CIFAR-100-C TFRecords files, named
+      '{corruption_type}-{intensity}.tfrecords'. Only used if `dataset` is
+      'cifar100'.
+    data_dir: data_dir of the CIFAR-10-C TFDS builders. Only used if `dataset`
+      is 'cifar10'.
+    normalize: Whether to normalize the images by the CIFAR-10 mean and std.
+    cycle_length: Number of files read in parallel.
+    download_data: Whether to download and prepare the CIFAR-10-C TFDS
+      builders before loading. Only used if `dataset` is 'cifar10'.
+
+  Returns:
+    A tuple of the dataset of dictionaries with keys 'features', 'labels',
+    'corruption_id', 'severity' and 'mask', and the number of steps to iterate
+    over it once.
+  """
+  dtype = tf.bfloat16 if use_bfloat16 else tf.float32
+  filenames, corruption_ids, severities = [], [], []
+  for intensity in range(1, max_intensity + 1):
+    for corruption_id, corruption_type in enumerate(corruption_types):
+      files = _corrupted_test_files(dataset, corruption_type, intensity,
+                                    path=path, data_dir=data_dir,
+                                    download_data=download_data)
+      filenames.extend(files)
+      corruption_ids.extend([corruption_id] * len(files))
+      severities.extend([intensity] * len(files))
+  num_examples = (
+      len(corruption_types) * max_intensity * num_examples_per_corruption)
+
+  if dataset == 'cifar100':
+    def parse(serialized_example):
+      features = tf.io.parse_single_example(
+          serialized_example,
+          features={
+              'image': tf.io.FixedLenFeature([], tf.string),
+              'label': tf.io.FixedLenFeature([], tf.int64),
+          })
+      image = tf.io.decode_raw(features['image'], tf.uint8)
+      return tf.reshape(image, [32, 32, 3]), features['label']
+  else:
+    features_dict = tfds.builder(
+        'cifar10_corrupted/{}_1'.format(corruption_types[0]),
+        data_dir=data_dir).info.features
+    def parse(serialized_example):
+      example = features_dict.deserialize_example(serialized_example)
+      return example['image'], example['label']
+
+  def preprocess(serialized_example, corruption_id, severity):
+    image, label = parse(serialized_example)
+    image = tf.image.convert_image_dtype(image, dtype)
+    if normalize:
+      mean = tf.constant([0.4914, 0.4822, 0.4465], dtype=dtype)
+      std = tf.constant([0.2470, 0.2435, 0.2616], dtype=dtype)
+      image = (image - mean) / std
+    return {
+        'features': image,
+        'labels': tf.cast(label, tf.float32),
+        'corruption_id': corruption_id,
+        'severity': severity,
+        'mask': tf.constant(1., tf.float32),
+    }
+
+  files = tf.data.Dataset.from_tensor_slices(
+      (filenames, tf.constant(corruption_ids, tf.int32),
+       tf.constant(severities, tf.int32)))
+  dataset = files.interleave(
+      lambda f, c, s: tf.data.TFRecordDataset(f).map(lambda x: (x, c, s)),
+      cycle_length=cycle_length,
+      num_parallel_calls=tf.data.experimental.AUTOTUNE)
+  dataset = dataset.map(
+      preprocess, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+  # Pads the last batch with masked examples.
+  padding_example = tf.nest.map_structure(
+      lambda spec: tf.zeros(spec.shape, spec.dtype)[None],
+      dataset.element_spec)
+  padding = tf.data.Dataset.from_tensor_slices(padding_example)
+  dataset = dataset.concatenate(padding.repeat(batch_size - 1))
+  dataset = dataset.batch(batch_size, drop_remainder=True)
+  dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+  steps = -(-num_examples // batch_size)
+  return dataset, steps
+
+
+def calibration_bin_sums(confidences, correct, groups, num_groups, num_bins,
+                         weights=None):
+  """Sums the correct predictions and confidences of every calibration bin.
+
+  The confidences are binned into `num_bins` equal-width bins, as in
+  `rm.metrics.ExpectedCalibrationError`, separately for every group of
+  examples.
+
+  Args:
+    confidences: Float tensor of shape [num_examples], the probabilities of the
+      predicted classes.
+    correct: Tensor of shape [num_examples], 1 for correct predictions.
+    groups: Integer tensor of shape [num_examples] with the group of every
+      example, in [0, num_groups).
+    num_groups: Number of groups.
+    num_bins: Number of confidence bins.
+    weights: Optional tensor of shape [num_examples], 0 for padding examples.
+
+  Returns:
+    Tuple of the sums of `correct` and of `confidences` in every bin, with
+    shape [num_groups, num_bins].
+  """
+  confidences = tf.convert_to_tensor(confidences)
+  correct = tf.cast(correct, confidences.dtype)
+  if weights is None:
+    weights = tf.ones_like(confidences)
+  weights = tf.cast(weights, confidences.dtype)
+  bins = tf.minimum(tf.cast(confidences * num_bins, tf.int32), num_bins - 1)
+  group_bins = tf.cast(groups, tf.int32) * num_bins + bins
+
+  def bin_sum(values):
+    return tf.reshape(
+        tf.math.unsorted_segment_sum(values * weights, group_bins,
+                                     num_groups * num_bins),
+        [num_groups, num_bins])
+
+  return bin_sum(correct), bin_sum(confidences)
+
+
+def expected_calibration_error(bin_correct_sum, bin_confidence_sum, count):
+  """Returns the ECE of every group from its `calibration_bin_sums`.
+
+  Args:
+    bin_correct_sum: Sums of the correct predictions of every group and bin, of
+      shape [num_groups, num_bins].
+    bin_confidence_sum: Sums of the confidences of every group and bin, of
+      shape [num_groups, num_bins].
+    count: Number of examples of every group, of shape [num_groups].
+
+  Returns:
+    The ECE of every group, of shape [num_groups].
+  """
+  return tf.reduce_sum(
+      tf.abs(bin_correct_sum - bin_confidence_sum), axis=-1) / count
+
+
+class GroupedCorruptMetrics(tf.keras.metrics.Metric):
+  """NLL, accuracy and ECE of every corrupted test set, in a single pass.
+
+  The examples of all the corrupted test sets are grouped by corruption type
+  and intensity, and the sufficient statistics of the metrics of all groups
+  are updated at once with segment reductions. The ECE uses the confidence
+  bins of `calibration_bin_sums`.
+  """
+
+  def __init__(self, corruption_types, max_intensity=5, num_bins=15,
+               prefix='test', name='grouped_corrupt_metrics', **kwargs):
+    super().__init__(name=name, **kwargs)
+    self._corruption_types = list(corruption_types)
+    self._max_intensity = max_intensity
+    self._num_bins = num_bins
+    self._prefix = prefix
+    self._num_groups = len(self._corruption_types) * max_intensity
+    self._count = self.add_weight(
+        name='count', shape=(self._num_groups,), initializer='zeros')
+    self._nll_sum = self.add_weight(
+        name='nll_sum', shape=(self._num_groups,), initializer='zeros')
+    self._correct_sum = self.add_weight(
+        name='correct_sum', shape=(self._num_groups,), initializer='zeros')
+    # Per group and confidence bin, the sums of correct predictions and of
+    # confidences.
+    self._bin_correct_sum = self.add_weight(
+        name='bin_correct_sum', shape=(self._num_groups, num_bins),
+        initializer='zeros')
+    self._bin_confidence_sum = self.add_weight(
+        name='bin_confidence_sum', shape=(self._num_groups, num_bins),
+        initializer='zeros')
+
+  def update_state(self, labels, probs, corruption_id, severity, mask=None):
+    """Accumulates a batch of predictions.
+
+    Args:
+      labels: Integer labels of shape [batch_size].
+      probs: Predicted probabilities of shape [batch_size, num_classes].
+      corruption_id: Indices of the corruption types, of shape [batch_size].
+      severity: Intensities in [1, max_intensity], of shape [batch_size].
+      mask: Optional weights of shape [batch_size], 0 for padding examples.
+    """
+    probs = tf.cast(probs, tf.float32)
+    labels = tf.cast(tf.reshape(labels, [-1]), tf.int32)
+    if mask is None:
+      mask = tf.ones_like(labels, tf.float32)
+    mask = tf.cast(mask, tf.float32)
+    # Padding examples may have invalid ids, which are clipped and masked.
+    groups = ((tf.cast(severity, tf.int32) - 1) * len(self._corruption_types) +
+              tf.cast(corruption_id, tf.int32))
+    groups = tf.clip_by_value(groups, 0, self._num_groups - 1)
+
+    label_probs = tf.gather(probs, labels, axis=1, batch_dims=1)
+    nll = -tf.math.log(tf.maximum(label_probs, 1e-30))
+    confidences = tf.reduce_max(probs, axis=-1)
+    correct = tf.cast(
+        tf.equal(tf.argmax(probs, axis=-1, output_type=tf.int32), labels),
+        tf.float32)
+
+    def segment_sum(values):
+      return tf.math.unsorted_segment_sum(values * mask, groups,
+                                          self._num_groups)
+
+    self._count.assign_add(segment_sum(1.))
+    self._nll_sum.assign_add(segment_sum(nll))
+    self._correct_sum.assign_add(segment_sum(correct))
+    bin_correct_sum, bin_confidence_sum = calibration_bin_sums(
+        confidences, correct, groups, self._num_groups, self._num_bins, mask)
+    self._bin_correct_sum.assign_add(bin_correct_sum)
+    self._bin_confidence_sum.assign_add(bin_confidence_sum)
+
+  def result(self):
+    """Returns the metrics of every corrupted test set.
+
+    Returns:
+      Dictionary with keys '{prefix}/{nll,accuracy,ece}_{corruption}_{i}', as
+      expected by `aggregate_corrupt_metrics`.
+    """
+    count = tf.maximum(self._count, 1.)
+    nll = self._nll_sum / count
+    accuracy = self._correct_sum / count
+    ece = expected_calibration_error(self._bin_correct_sum,
+                                     self._bin_confidence_sum, count)
+    results = {}
+    for intensity in range(1, self._max_intensity + 1):
+      for i, corruption_type in enumerate(self._corruption_types):
+        group = (intensity - 1) * len(self._corruption_types) + i
+        dataset_name = '{0}_{1}'.format(corruption_type, intensity)
+        results['{0}/nll_{1}'.format(self._prefix, dataset_name)] = nll[group]
+        results['{0}/accuracy_{1}'.format(self._prefix,
+                                          dataset_name)] = accuracy[group]
+        results['{0}/ece_{1}'.format(self._prefix, dataset_name)] = ece[group]
+    return results
+
+  def reset_state(self):
+    for variable in self.variables:
+      variable.assign(tf.zeros_like(variable))
+
+  def reset_states(self):
+    self.reset_state()
+
+  def get_config(self):
+    config = {
+        'corruption_types': self._corruption_types,
+        'max_intensity': self._max_intensity,
+        'num_bins': self._num_bins,
+        'prefix': self._prefix,
+    }
+    config.update(super().get_config())
+    return config
+
+
+def _metric_result(metric):
+  """Returns the scalar result of a metric or an already computed value."""
+  if isinstance(metric, (float, np.ndarray, np.generic)):
+    return metric
+  if isinstance(metric, tf.Tensor):
+    return metric.numpy()
+  result = metric.result()
+  # TODO(dusenberrymw): rm.ECE returns a dictionary with a single item. Can
+  # this be cleaned up?
+  if isinstance(result, dict):
+    return list(result.values())[0]
+  return result
+
+
 # TODO(baselines): Remove reliance on hard-coded metric names.
 def aggregate_corrupt_metrics(metrics,
                               corruption_types,
@@ -219,7 +530,8 @@ def aggregate_corrupt_metrics(metrics,
   """Aggregates metrics across intensities and corruption types.
 
   Args:
-    metrics: Dictionary of tf.keras.metrics to be aggregated.
+    metrics: Dictionary of tf.keras.metrics to be aggregated. Values may also be
+      already computed floats.
     corruption_types: List of corruption types.
     max_intensity: Int, of maximum intensity.
     log_fine_metrics: Bool, whether log fine metrics to main training script.
@@ -260,30 +572,32 @@ def aggregate_corrupt_metrics(metrics,
 
     for i in range(len(corruption_types)):
       dataset_name = '{0}_{1}'.format(corruption_types[i], intensity)
-      nll[i] = metrics['{0}/nll_{1}'.format(prefix, dataset_name)].result()
+      nll[i] = _metric_result(metrics['{0}/nll_{1}'.format(prefix,
+                                                           dataset_name)])
       if '{0}/kl_{1}'.format(prefix, dataset_name) in metrics.keys():
-        kl[i] = metrics['{0}/kl_{1}'.format(prefix, dataset_name)].result()
+        kl[i] = _metric_result(metrics['{0}/kl_{1}'.format(prefix,
+                                                         dataset_name)])
       else:
         kl[i] = 0.
       if '{0}/elbo_{1}'.format(prefix, dataset_name) in metrics.keys():
-        elbo[i] = metrics['{0}/elbo_{1}'.format(prefix, dataset_name)].result()
+        elbo[i] = _metric_result(metrics['{0}/elbo_{1}'.format(
+            prefix, dataset_name)])
       else:
         elbo[i] = 0.
-      acc[i] = metrics['{0}/accuracy_{1}'.format(prefix, dataset_name)].result()
-      # TODO(dusenberrymw): rm.ECE returns a dictionary with a single item. Can
-      # this be cleaned up?
-      ece[i] = list(metrics['{0}/ece_{1}'.format(
-          prefix, dataset_name)].result().values())[0]
+      acc[i] = _metric_result(metrics['{0}/accuracy_{1}'.format(
+          prefix, dataset_name)])
+      ece[i] = _metric_result(metrics['{0}/ece_{1}'.format(
+          prefix, dataset_name)])
       if '{0}/member_acc_mean_{1}'.format(prefix,
                                           dataset_name) in metrics.keys():
-        member_acc[i] = metrics['{0}/member_acc_mean_{1}'.format(
-            prefix, dataset_name)].result()
+        member_acc[i] = _metric_result(metrics['{0}/member_acc_mean_{1}'.format(
+            prefix, dataset_name)])
       else:
         member_acc[i] = 0.
       if '{0}/member_ece_mean_{1}'.format(prefix,
                                           dataset_name) in metrics.keys():
-        member_ece[i] = list(metrics['{0}/member_ece_mean_{1}'.format(
-            prefix, dataset_name)].result().values())[0]
+        member_ece[i] = _metric_result(metrics['{0}/member_ece_mean_{1}'.format(
+            prefix, dataset_name)])
       else:
         member_ece[i] = 0.
       if corrupt_diversity is not None:
@@ -0,0 +1,182 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the multiplexed evaluation of the CIFAR corrupted test sets."""
+
+import os
+
+import numpy as np
+import robustness_metrics as rm
+import tensorflow as tf
+import ensemble_utils  # local file import from baselines.cifar
+import utils  # local file import from baselines.cifar
+
+_CORRUPTION_TYPES = ['fog', 'zoom_blur']
+_MAX_INTENSITY = 2
+_NUM_EXAMPLES = 5
+_NUM_CLASSES = 4
+
+
+def _write_cifar100_c(path):
+  """Writes small CIFAR-100-C files, returns their images and labels."""
+  rng = np.random.RandomState(0)
+  examples = {}
+  for intensity in range(1, _MAX_INTENSITY + 1):
+    for corruption_type in _CORRUPTION_TYPES:
+      images = rng.randint(0, 256, (_NUM_EXAMPLES, 32, 32, 3), dtype=np.uint8)
+      labels = rng.randint(0, _NUM_CLASSES, _NUM_EXAMPLES)
+      filename = os.path.join(
+          path, '{0}-{1}.tfrecords'.format(corruption_type, intensity))
+      with tf.io.TFRecordWriter(filename) as writer:
+        for image, label in zip(images, labels):
+          example = tf.train.Example(features=tf.train.Features(feature={
+              'image': tf.train.Feature(
+                  bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+              'label': tf.train.Feature(
+                  int64_list=tf.train.Int64List(value=[label])),
+          }))
+          writer.write(example.SerializeToString())
+      examples[(corruption_type, intensity)] = (images, labels)
+  return examples
+
+
+class CorruptedTestMultiplexedTest(tf.test.TestCase):
+
+  def testLoadCorruptedTestMultiplexed(self):
+    # The path has no trailing separator, as passed to the datasets.
+    path = self.get_temp_dir()
+    examples = _write_cifar100_c(path)
+    batch_size = 8
+    dataset, steps = utils.load_corrupted_test_multiplexed(
+        'cifar100',
+        _CORRUPTION_TYPES,
+        batch_size,
+        num_examples_per_corruption=_NUM_EXAMPLES,
+        max_intensity=_MAX_INTENSITY,
+        path=path,
+        normalize=False)
+
+    batches = list(dataset.as_numpy_iterator())
+    num_examples = len(examples) * _NUM_EXAMPLES
+    self.assertLen(batches, steps)
+    self.assertEqual(steps, -(-num_examples // batch_size))
+    batch = {
+        key: np.concatenate([b[key] for b in batches]) for key in batches[0]
+    }
+    mask = batch['mask'] == 1.
+    self.assertEqual(mask.sum(), num_examples)
+    # Every corrupted test set is read once, with its corruption and intensity.
+    for corruption_id, corruption_type in enumerate(_CORRUPTION_TYPES):
+      for intensity in range(1, _MAX_INTENSITY + 1):
+        images, labels = examples[(corruption_type, intensity)]
+        group = mask & (batch['corruption_id'] == corruption_id) & (
+            batch['severity'] == intensity)
+        order = np.argsort([image.sum() for image in images])
+        observed_order = np.argsort(
+            [image.sum() for image in batch['features'][group]])
+        self.assertAllClose(batch['features'][group][observed_order],
+                            images[order] / 255., atol=1e-6)
+        self.assertAllEqual(batch['labels'][group][observed_order],
+                            labels[order])
+
+  def testExpectedCalibrationError(self):
+    rng = np.random.RandomState(3)
+    num_examples, num_groups, num_bins = 200, 3, 10
+    probs = rng.dirichlet(0.5 * np.ones(_NUM_CLASSES), num_examples)
+    labels = rng.randint(0, _NUM_CLASSES, num_examples)
+    groups = rng.randint(0, num_groups, num_examples)
+    weights = (rng.rand(num_examples) < 0.9).astype(np.float32)
+
+    confidences = np.max(probs, axis=-1)
+    correct = np.argmax(probs, axis=-1) == labels
+    bin_correct_sum, bin_confidence_sum = utils.calibration_bin_sums(
+        confidences, correct, groups, num_groups, num_bins, weights)
+    count = np.bincount(groups, weights=weights, minlength=num_groups)
+    ece = utils.expected_calibration_error(bin_correct_sum,
+                                           bin_confidence_sum, count)
+
+    for group in range(num_groups):
+      in_group = (weights == 1.) & (groups == group)
+      expected = rm.metrics.ExpectedCalibrationError(num_bins=num_bins)
+      expected.add_batch(probs[in_group], label=labels[in_group])
+      self.assertAllClose(ece[group], list(expected.result().values())[0],
+                          atol=1e-6)
+
+  def testGroupedCorruptMetrics(self):
+    rng = np.random.RandomState(1)
+    num_examples = 64
+    probs = rng.dirichlet(np.ones(_NUM_CLASSES), num_examples)
+    labels = rng.randint(0, _NUM_CLASSES, num_examples)
+    corruption_ids = rng.randint(0, len(_CORRUPTION_TYPES), num_examples)
+    severities = rng.randint(1, _MAX_INTENSITY + 1, num_examples)
+    # Padding examples, with invalid ids, are ignored.
+    mask = np.ones(num_examples, np.float32)
+    mask[-4:] = 0.
+    corruption_ids[-4:] = 0
+    severities[-4:] = 0
+
+    grouped_metrics = utils.GroupedCorruptMetrics(
+        _CORRUPTION_TYPES, max_intensity=_MAX_INTENSITY)
+    for batch in np.array_split(np.arange(num_examples), 4):
+      grouped_metrics.update_state(labels[batch], probs[batch],
+                                   corruption_ids[batch], severities[batch],
+                                   mask[batch])
+    results = grouped_metrics.result()
+
+    # The metrics of each corrupted test set, as updated by the separate
+    # pipelines.
+    for corruption_id, corruption_type in enumerate(_CORRUPTION_TYPES):
+      for intensity in range(1, _MAX_INTENSITY + 1):
+        group = (mask == 1.) & (corruption_ids == corruption_id) & (
+            severities == intensity)
+        nll = tf.keras.metrics.Mean()
+        nll.update_state(
+            tf.keras.losses.sparse_categorical_crossentropy(
+                labels[group], probs[group]))
+        accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+        accuracy.update_state(labels[group], probs[group])
+        ece = rm.metrics.ExpectedCalibrationError(num_bins=15)
+        ece.add_batch(probs[group], label=labels[group])
+
+        dataset_name = '{0}_{1}'.format(corruption_type, intensity)
+        self.assertAllClose(results['test/nll_' + dataset_name],
+                            nll.result(), atol=1e-5)
+        self.assertAllClose(results['test/accuracy_' + dataset_name],
+                            accuracy.result(), atol=1e-6)
+        self.assertAllClose(results['test/ece_' + dataset_name],
+                            list(ece.result().values())[0], atol=1e-5)
+
+  def testGroupedEnsembleMetrics(self):
+    rng = np.random.RandomState(2)
+    ensemble_size, num_examples = 3, 64
+    logits = rng.randn(ensemble_size, num_examples, _NUM_CLASSES)
+    labels = rng.randint(0, _NUM_CLASSES, num_examples)
+    groups = rng.randint(0, 4, num_examples)
+    mask = np.ones(num_examples)
+    mask[-4:] = 0.
+
+    results = ensemble_utils.grouped_ensemble_metrics(
+        logits, labels, groups, num_groups=4, mask=mask)
+
+    for group in range(4):
+      in_group = (mask == 1.) & (groups == group)
+      expected = ensemble_utils.ensemble_metrics(logits[:, in_group],
+                                                 labels[in_group])
+      for key in ['negative_log_likelihood', 'accuracy', 'ece']:
+        self.assertAllClose(results[key][group], expected[key])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -34,11 +34,22 @@ def create_config(config_dir: str) -> configs.BertConfig:
   return configs.BertConfig(**bert_config)
 
 
-def create_feature_and_label(inputs, feature_size: int):
-  """Creates features and labels for a BERT model."""
+def create_feature_and_label(inputs, feature_size: Optional[int] = None):
+  """Creates features and labels for a BERT model.
+
+  Args:
+    inputs: A batch of the ClincIntentDetectionDataset.
+    feature_size: The length of the padded token ids. If None, then it is read
+      from the token ids, which is needed when bucketing by sequence length.
+
+  Returns:
+    The BERT features (token ids, input mask and type ids) and the labels.
+  """
   input_token_ids = inputs['features']
   labels = inputs['labels']
   num_tokens = inputs['num_tokens']
+  if feature_size is None:
+    feature_size = tf.shape(input_token_ids)[-1]
 
   input_mask = tf.sequence_mask(num_tokens, feature_size, dtype=tf.int32)
   type_id = tf.sequence_mask(num_tokens, feature_size, dtype=tf.int32)
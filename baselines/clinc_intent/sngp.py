@@ -126,6 +126,16 @@ flags.DEFINE_float(
 flags.DEFINE_integer('seed', 42, 'Random seed.')
 flags.DEFINE_integer('per_core_batch_size', 64, 'Batch size per TPU core/GPU.')
 flags.DEFINE_integer('eval_batch_size', 512, 'Batch size for CPU evaluation.')
+flags.DEFINE_bool(
+    'bucket_by_sequence_length', False,
+    'Whether to batch together the utterances of similar lengths, padded to 8, '
+    '16 or 32 tokens, instead of padding all of them to 32 tokens. Only '
+    'supported on GPU.')
+flags.DEFINE_integer(
+    'max_tokens_per_batch', None,
+    'Optional token budget of the eval batches when bucketing by sequence '
+    'length, which then replaces the eval batch size. The train batches keep '
+    'per_core_batch_size examples, so that an epoch is a pass over the data.')
 flags.DEFINE_float(
     'base_learning_rate', 5e-5,
     'Base learning rate when total batch size is 128. It is '
@@ -194,22 +204,33 @@ def main(argv):
     tf.tpu.experimental.initialize_tpu_system(resolver)
     strategy = tf.distribute.TPUStrategy(resolver)
 
+  if FLAGS.bucket_by_sequence_length and not FLAGS.use_gpu:
+    raise ValueError(
+        'bucket_by_sequence_length is only supported on GPU, since the batches '
+        'of different buckets have different shapes.')
+
   batch_size = FLAGS.per_core_batch_size * FLAGS.num_cores
+  dataset_kwargs = dict(
+      data_dir=FLAGS.data_dir,
+      bucket_by_sequence_length=FLAGS.bucket_by_sequence_length)
   train_dataset_builder = ub.datasets.ClincIntentDetectionDataset(
       split='train',
-      data_dir=FLAGS.data_dir,
+      **dataset_kwargs,
       data_mode='ind')
   ind_dataset_builder = ub.datasets.ClincIntentDetectionDataset(
       split='test',
-      data_dir=FLAGS.data_dir,
+      **dataset_kwargs,
+      max_tokens_per_batch=FLAGS.max_tokens_per_batch,
       data_mode='ind')
   ood_dataset_builder = ub.datasets.ClincIntentDetectionDataset(
       split='test',
-      data_dir=FLAGS.data_dir,
+      **dataset_kwargs,
+      max_tokens_per_batch=FLAGS.max_tokens_per_batch,
       data_mode='ood')
   all_dataset_builder = ub.datasets.ClincIntentDetectionDataset(
       split='test',
-      data_dir=FLAGS.data_dir,
+      **dataset_kwargs,
+      max_tokens_per_batch=FLAGS.max_tokens_per_batch,
       data_mode='all')
 
   dataset_builders = {
@@ -223,6 +244,9 @@ def main(argv):
 
   ds_info = train_dataset_builder.tfds_info
   feature_size = ds_info.metadata['feature_size']
+  # The token ids of each batch are padded to the length of their bucket.
+  input_feature_size = (
+      None if FLAGS.bucket_by_sequence_length else feature_size)
   # num_classes is number of valid intents plus out-of-scope intent
   num_classes = ds_info.features['intent_label'].num_classes + 1
 
@@ -233,8 +257,8 @@ def main(argv):
   for dataset_name, dataset_builder in dataset_builders.items():
     test_datasets[dataset_name] = dataset_builder.load(
         batch_size=FLAGS.eval_batch_size)
-    steps_per_eval[dataset_name] = (
-        dataset_builder.num_examples // FLAGS.eval_batch_size)
+    steps_per_eval[dataset_name] = dataset_builder.num_batches(
+        dataset_builder.num_examples, FLAGS.eval_batch_size)
 
   if FLAGS.use_bfloat16:
     tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
@@ -345,7 +369,7 @@ def main(argv):
     def step_fn(inputs):
       """Per-Replica StepFn."""
       features, labels = bert_utils.create_feature_and_label(
-          inputs, feature_size)
+          inputs, input_feature_size)
 
       with tf.GradientTape() as tape:
         # Set learning phase to enable dropout etc during training.
@@ -385,7 +409,7 @@ def main(argv):
     def step_fn(inputs):
       """Per-Replica StepFn."""
       features, labels = bert_utils.create_feature_and_label(
-          inputs, feature_size)
+          inputs, input_feature_size)
 
       # Compute ensemble prediction over Monte Carlo forward-pass samples.
       logits_list = []
@@ -397,7 +421,7 @@ def main(argv):
           # If model returns a tuple of (logits, covmat), extract both.
           logits, covmat = logits
         else:
-          covmat = tf.eye(FLAGS.eval_batch_size)
+          covmat = tf.eye(tf.shape(logits)[0])
 
         if FLAGS.use_bfloat16:
           logits = tf.cast(logits, tf.float32)
@@ -449,8 +473,12 @@ def main(argv):
         metrics['test/auprc_{}'.format(dataset_name)].update_state(
             ood_labels, ood_probs)
 
+    # `num_steps` is an upper bound when bucketing by sequence length.
     for _ in tf.range(tf.cast(num_steps, tf.int32)):
-      step_fn(next(iterator))
+      inputs = iterator.get_next_as_optional()
+      if not inputs.has_value():
+        break
+      step_fn(inputs.get_value())
 
   train_iterator = iter(train_dataset)
   start_time = time.time()
@@ -35,6 +35,8 @@ import numpy as np
 import scipy
 import tensorflow as tf
 
+import async_checkpoint_utils  # local file import from baselines.jft
+
 Params = MutableMapping[str, Any]
 
 
@@ -209,6 +211,35 @@ def checkpoint_trained_model(
   save_checkpoint(tree, path, step_for_copy)
 
 
+snapshot_replicated = async_checkpoint_utils.snapshot_replicated
+
+
+class AsyncCheckpointManager(async_checkpoint_utils.AsyncCheckpointManager):
+  """Writes checkpoints with `checkpoint_trained_model` in a background thread.
+
+  See `async_checkpoint_utils.AsyncCheckpointManager`.
+  """
+
+  def __init__(self,
+               max_in_flight: int = 1,
+               keep_last_n: Optional[int] = None,
+               timeout: Optional[float] = None):
+    """Initializes the manager.
+
+    Args:
+      max_in_flight: Maximum number of checkpoints being written at once.
+      keep_last_n: If set, only the `keep_last_n` most recent step copies
+        (`path-{step}`) are kept, older ones are deleted.
+      timeout: If set, the number of seconds `save` waits for a previous
+        checkpoint before raising a `TimeoutError`.
+    """
+    super().__init__(
+        checkpoint_trained_model,
+        max_in_flight=max_in_flight,
+        keep_last_n=keep_last_n,
+        timeout=timeout)
+
+
 def _flatten_jax_params_dict(d: Params, parent_key: str = "",
                              sep: str = "/") -> Params:
   """Flattens a dictionary, keeping empty leaves."""
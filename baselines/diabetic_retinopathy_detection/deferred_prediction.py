@@ -45,7 +45,6 @@ import collections
 import datetime
 import functools
 import inspect
-import os
 from typing import Any, Callable, Dict, Optional, Sequence, Text, Tuple, Union
 
 import numpy as np
@@ -53,6 +52,7 @@ import pandas as pd
 from scipy.stats import bernoulli
 import tensorflow as tf
 import tensorflow_datasets as tfds
+from utils import results_storage_utils  # local file import from baselines.diabetic_retinopathy_detection
 
 
 def dropout_predict(x,
@@ -503,8 +503,8 @@ def store_keras_metrics(metrics_dict: Dict[str, Any],
       evaluation, e.g., through `run_deferred_prediction.py`.
     model_type: `str`, type of model that was evaluated (e.g., 'deterministic').
       See run_deferred_prediction.py.
-    model_results_path: `str`, path at which model results DataFrame should be
-      stored.
+    model_results_path: `str`, directory at which model results DataFrame
+      should be stored, see `results_storage_utils.append_results_dataframe`.
     train_seed: `int`, seed used for training the model currently being
       evaluated.
     eval_seed: `int`, seed used in evaluating the current model (e.g., for MC
@@ -545,25 +545,8 @@ def store_keras_metrics(metrics_dict: Dict[str, Any],
   new_results_df['run_datetime'] = pd.to_datetime(
       new_results_df['run_datetime'])
 
-  model_results_path = os.path.join(model_results_path, 'results.tsv')
-
-  # Update or initialize results DataFrame
-  try:
-    with tf.io.gfile.GFile(model_results_path, 'r') as f:
-      previous_results_df = pd.read_csv(f, sep='\t')
-    results_df = pd.concat([previous_results_df, new_results_df])
-    action_str = 'updated'
-  except (FileNotFoundError, tf.errors.NotFoundError):
-    print(f'No previous results found at path {model_results_path}. '
-          f'Storing a new results dataframe.')
-    results_df = new_results_df
-    action_str = 'stored initial'
-
-  # Store to file
-  with tf.io.gfile.GFile(model_results_path, 'w') as f:
-    results_df.to_csv(path_or_buf=f, sep='\t', index=False)
-
-  print(f'Successfully {action_str} results dataframe at {model_results_path}.')
+  results_storage_utils.append_results_dataframe(
+      model_results_path, 'results', new_results_df)
 
   if return_parsed_dict:
     for metric_name in parsed_dict.keys():
@@ -58,6 +58,10 @@ flags.DEFINE_bool('load_from_checkpoint', False,
                   'Attempt to load from checkpoint')
 flags.DEFINE_string('checkpoint_dir', None, 'Path to load Keras checkpoints.')
 flags.DEFINE_bool('cache_eval_datasets', False, 'Caches eval datasets.')
+flags.DEFINE_string(
+    'preprocessed_cache_dir', None,
+    'Optional local directory of a persistent cache of the resized images, '
+    'reused across runs and seeds.')
 
 # Logging and hyperparameter tuning.
 flags.DEFINE_bool('use_wandb', False, 'Use wandb for logging.')
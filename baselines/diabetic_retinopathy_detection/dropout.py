@@ -58,6 +58,10 @@ flags.DEFINE_bool('load_from_checkpoint', False,
                   'Attempt to load from checkpoint')
 flags.DEFINE_string('checkpoint_dir', None, 'Path to load Keras checkpoints.')
 flags.DEFINE_bool('cache_eval_datasets', False, 'Caches eval datasets.')
+flags.DEFINE_string(
+    'preprocessed_cache_dir', None,
+    'Optional local directory of a persistent cache of the resized images, '
+    'reused across runs and seeds.')
 
 # Logging and hyperparameter tuning.
 flags.DEFINE_bool('use_wandb', False, 'Use wandb for logging.')
@@ -113,6 +117,10 @@ flags.DEFINE_integer(
 flags.DEFINE_float('dropout_rate', 0.17798, 'Dropout rate, between [0.0, 1.0).')
 flags.DEFINE_integer('num_dropout_samples_eval', 5,
                      'Number of dropout samples to use for prediction.')
+flags.DEFINE_integer(
+    'mc_max_batch_size', None,
+    'If set, compute several MC samples per forward pass at evaluation, by '
+    'tiling the batch up to this many examples.')
 flags.DEFINE_bool(
     'filterwise_dropout', False,
     'Dropout whole convolutional filters instead of '
@@ -278,7 +286,10 @@ def main(argv):
   eval_estimator = utils.wrap_retinopathy_estimator(
       model, use_mixed_precision=FLAGS.use_bfloat16, numpy_outputs=False)
 
-  estimator_args = {'num_samples': FLAGS.num_dropout_samples_eval}
+  estimator_args = {
+      'num_samples': FLAGS.num_dropout_samples_eval,
+      'max_batch_size': FLAGS.mc_max_batch_size
+  }
 
   @tf.function
   def train_step(iterator):
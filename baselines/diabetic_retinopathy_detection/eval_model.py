@@ -58,6 +58,10 @@ flags.DEFINE_string('data_dir', 'gs://ub-data/retinopathy',
 flags.DEFINE_bool('use_validation', True, 'Whether to use a validation split.')
 flags.DEFINE_bool('use_test', True, 'Whether to use a test split.')
 flags.DEFINE_bool('cache_eval_datasets', False, 'Caches eval datasets.')
+flags.DEFINE_string(
+    'preprocessed_cache_dir', None,
+    'Optional local directory of a persistent cache of the resized images, '
+    'reused across runs and seeds.')
 flags.DEFINE_string(
     'dr_decision_threshold', None,
     ('specifies where to binarize the labels {0, 1, 2, 3, 4} to create the '
@@ -95,6 +99,10 @@ flags.DEFINE_string('tuning_domain', None,
 flags.DEFINE_integer(
     'num_mc_samples', 5,
     'Number of Monte Carlo samples to use for prediction, if applicable.')
+flags.DEFINE_integer(
+    'mc_max_batch_size', None,
+    'If set, compute several MC samples per forward pass at evaluation, by '
+    'tiling the batch up to this many examples.')
 
 # Metric flags.
 flags.DEFINE_integer('num_bins', 15, 'Number of bins for ECE.')
@@ -262,6 +270,11 @@ def main(argv):
 
       # Wrap models: apply sigmoid on logits, use mixed precision,
       # and cast to NumPy array for use with generic Uncertainty Utils.
+      # Batched MC sampling runs the models inside a `tf.function`, and only
+      # copies the uncertainty estimates to NumPy.
+      numpy_outputs = not (FLAGS.use_distribution_strategy or
+                           (FLAGS.mc_max_batch_size and
+                            model_type != 'deterministic'))
       if 'fsvi' in model_type:
         if use_ensemble or single_model_multi_train_seeds:
           estimator = [m.model for m in model]
@@ -274,7 +287,7 @@ def main(argv):
               utils.wrap_retinopathy_estimator(
                   loaded_model,
                   use_mixed_precision=FLAGS.use_bfloat16,
-                  numpy_outputs=not FLAGS.use_distribution_strategy)
+                  numpy_outputs=numpy_outputs)
               for loaded_model in model
           ]
           # pylint: enable=g-complex-comprehension
@@ -282,7 +295,7 @@ def main(argv):
           estimator = utils.wrap_retinopathy_estimator(
               model,
               use_mixed_precision=FLAGS.use_bfloat16,
-              numpy_outputs=not FLAGS.use_distribution_strategy)
+              numpy_outputs=numpy_outputs)
 
   assert (not sample_from_ensemble or len(estimator) >= k_ensemble_members), (
       f'The number of models in the ensemble ({len(estimator)}) ',
@@ -299,6 +312,8 @@ def main(argv):
     # we don't sample MC samples
     # for either a single deterministic model or deep ensemble
     estimator_args['num_samples'] = num_mc_samples
+    if 'fsvi' not in model_type:
+      estimator_args['max_batch_size'] = FLAGS.mc_max_batch_size
   if 'fsvi' in model_type:
     if use_ensemble or single_model_multi_train_seeds:
       estimator_args['params'] = [m.params for m in model]
@@ -226,6 +226,10 @@ flags.DEFINE_bool(
     "Should always be enabled - required to load train split of the dataset.",
 )
 flags.DEFINE_bool("cache_eval_datasets", False, "Caches eval datasets.")
+flags.DEFINE_string(
+    "preprocessed_cache_dir", None,
+    "Optional local directory of a persistent cache of the resized images, "
+    "reused across runs and seeds.")
 
 # Logging and hyperparameter tuning.
 flags.DEFINE_bool("use_wandb", True, "Use wandb for logging.")
@@ -15,17 +15,18 @@
 
 """Input pipeline utilities for the ViT experiments."""
 import math
-from typing import Optional, Union, Callable
+from typing import Callable, Dict, Optional, Union
 
 from absl import logging
 from clu import deterministic_data
-import flax
 import jax
 import jax.numpy as jnp
 import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+import prefetch_utils  # local file import from baselines.jft
+
 
 def _get_dataset_builder(
     dataset: Union[str, tfds.core.DatasetBuilder],
@@ -268,17 +269,46 @@ def get_data(
   return dataset.prefetch(prefetch_size)
 
 
-def start_input_pipeline(dataset, n_prefetch, devices=None):
-  """Creates a data iterator with optional prefetching and padding."""
-  it = iter(dataset)
+def start_input_pipeline(dataset, n_prefetch, devices=None, num_threads=2):
+  """Creates a data iterator with optional prefetching and padding.
+
+  With `n_prefetch`, the batches are converted and transferred to the devices
+  on `num_threads` background threads, see
+  `prefetch_utils.DevicePrefetchIterator`.
+
+  Args:
+    dataset: The dataset, with batches of shape [num_devices,
+      per_device_batch_size, ...].
+    n_prefetch: Number of batches prefetched to the devices, or 0 to iterate
+      over numpy batches on the host.
+    devices: Devices to transfer the batches to, by default the local ones.
+    num_threads: Number of threads transferring the batches to the devices.
+
+  Returns:
+    An iterator over the batches.
+  """
+  if n_prefetch:
+    return prefetch_utils.DevicePrefetchIterator(
+        dataset, n_prefetch, devices=devices, num_threads=num_threads)
 
   def _prepare(x):
     # Transforms x into read-only numpy array without copy if possible, see:
     # https://github.com/tensorflow/tensorflow/issues/33254#issuecomment-542379165
     return np.asarray(memoryview(x))
 
-  it = (jax.tree_map(_prepare, xs) for xs in it)
+  return (jax.tree_map(_prepare, xs) for xs in iter(dataset))
 
-  if n_prefetch:
-    it = flax.jax_utils.prefetch_to_device(it, n_prefetch, devices=devices)
-  return it
+
+def get_input_metrics(it) -> Dict[str, float]:
+  """Returns the metrics of an iterator from `start_input_pipeline`.
+
+  Args:
+    it: Iterator returned by `start_input_pipeline`.
+
+  Returns:
+    The queue depth and wait time metrics averaged since the previous call, or
+    an empty dictionary if the batches are not prefetched to the devices.
+  """
+  if isinstance(it, prefetch_utils.DevicePrefetchIterator):
+    return it.metrics()
+  return {}
@@ -364,7 +364,10 @@ def main(_):
   write_note(f'Replicating...\n{chrono.note}')
   opt_repl = flax.jax_utils.replicate(opt_cpu)
 
-  checkpoint_writer = None
+  checkpoint_manager = checkpoint_utils.AsyncCheckpointManager(
+      max_in_flight=config.get('checkpoint_max_in_flight', 1),
+      keep_last_n=config.get('keep_last_n_checkpoints'),
+      timeout=config.get('checkpoint_timeout', 1))
 
   # Note: we return the train loss, val loss, and fewshot best l2s for use in
   # reproducibility unit tests.
@@ -406,13 +409,13 @@ def main(_):
         step, config.get('checkpoint_steps'), total_steps, process=0):
       write_note('Checkpointing...')
       chrono.pause()
-      train_utils.checkpointing_timeout(checkpoint_writer,
-                                        config.get('checkpoint_timeout', 1))
       accumulated_train_time = chrono.accum_train_time
-      # We need to transfer the weights over now or else we risk keeping them
-      # alive while they'll be updated in a future step, creating hard to debug
+      # We need to snapshot the weights now or else we risk keeping them alive
+      # while they'll be updated in a future step, creating hard to debug
       # memory errors (see b/160593526). Also, takes device 0's params only.
-      opt_cpu = jax.tree_util.tree_map(lambda x: np.array(x[0]), opt_repl)
+      # The snapshot stays on device; the transfer to host, serialization and
+      # writing happen in the background.
+      opt_cpu = checkpoint_utils.snapshot_replicated(opt_repl)
 
       # Check whether we want to keep a copy of the current checkpoint.
       copy_step = None
@@ -428,9 +431,7 @@ def main(_):
           optimizer=opt_cpu,
           accumulated_train_time=accumulated_train_time)
 
-      checkpoint_writer = pool.apply_async(
-          checkpoint_utils.checkpoint_trained_model,
-          (checkpoint_data, save_checkpoint_path, copy_step))
+      checkpoint_manager.save(checkpoint_data, save_checkpoint_path, copy_step)
       chrono.resume()
 
     # Report training progress
@@ -442,6 +443,7 @@ def main(_):
       train_measurements = {}
       train_measurements.update(flax.jax_utils.unreplicate(extra_measurements))
       train_measurements.update(timing_measurements)
+      train_measurements.update(input_utils.get_input_metrics(train_iter))
       writer.write_scalars(step, train_measurements)
       # Keep to return for reproducibility tests.
       # train_loss = train_measurements['training_loss']
@@ -539,6 +541,7 @@ def main(_):
       break
 
   write_note(f'Done!\n{chrono.note}')
+  checkpoint_manager.close()
   pool.close()
   pool.join()
   writer.close()
@@ -37,6 +37,12 @@ flags.DEFINE_string(
     'the number of MC samples. Each of those directories should follow the '
     'format output by `eval_model_backup.py`.')
 flags.mark_flag_as_required('results_dir')
+flags.DEFINE_string(
+    'results_index_path', None,
+    'Optional local path of a SQLite index of the per-prediction results in '
+    '`results_dir`. If provided, the index is created or updated with new '
+    'runs, and the results are memory-mapped through it rather than read by '
+    'walking all result directories.')
 flags.DEFINE_string(
     'output_dir',
     '/tmp/diabetic_retinopathy_detection/plots',
@@ -59,6 +65,23 @@ flags.DEFINE_integer('num_bins', 15, 'Number of bins for ECE.')
 FLAGS = flags.FLAGS
 
 
+def parse_model_dir(model_dir):
+  """Parses a `{model_type}_k{k}_{tuning_domain}_mc{n_samples}` directory."""
+  try:
+    model_type, ensemble_str, tuning_domain, mc_str = (
+        model_dir.strip('/').split('_'))
+  except:
+    raise ValueError('Expected model directory in format '
+                     '{model_type}_k{k}_{tuning_domain}_mc{n_samples}')
+
+  k = int(ensemble_str[1:])  # format f'k{k}'
+  # Tuning domain is either `indomain`, `joint` in our implementation.
+  num_mc_samples = mc_str[2:]  # format f'mc{num_mc_samples}'
+  is_deterministic = model_type == 'deterministic' and k == 1
+  print(model_type, ensemble_str, tuning_domain, mc_str)
+  return (model_type, k, is_deterministic, tuning_domain, num_mc_samples)
+
+
 def main(argv):
   del argv  # unused arg
   tf.io.gfile.makedirs(FLAGS.output_dir)
@@ -78,40 +101,36 @@ def main(argv):
   dataset_to_model_results = collections.defaultdict(
       lambda: collections.defaultdict(lambda: collections.defaultdict(list)))
 
-  model_dirs = tf.io.gfile.listdir(results_dir)
-  for model_dir in model_dirs:
-    try:
-      model_type, ensemble_str, tuning_domain, mc_str = model_dir.split('_')
-    except:
-      raise ValueError('Expected model directory in format '
-                       '{model_type}_k{k}_{tuning_domain}_mc{n_samples}')
-
-    k = int(ensemble_str[1:])  # format f'k{k}'
-    # Tuning domain is either `indomain`, `joint` in our implementation.
-    num_mc_samples = mc_str[2:][:-1]  # format f'mc{num_mc_samples}/'
-    is_deterministic = model_type == 'deterministic' and k == 1
-    print(model_type, ensemble_str, tuning_domain, mc_str)
-
-    model_dir_path = os.path.join(results_dir, model_dir)
-    dataset_subdirs = [
-        file_or_dir for file_or_dir in tf.io.gfile.listdir(model_dir_path)
-        if tf.io.gfile.isdir(os.path.join(model_dir_path, file_or_dir))]
-    for dataset_subdir in dataset_subdirs:
-      dataset_name = dataset_subdir[:-1]
-      print(dataset_name)
-      dataset_subdir_path = os.path.join(model_dir_path, dataset_subdir)
-      random_seed_dirs = tf.io.gfile.listdir(dataset_subdir_path)
-      seeds = [int(random_seed_dir.split('_')[-1].split('/')[0])
-               for random_seed_dir in random_seed_dirs]
-      seeds = sorted(seeds)
-      for seed in seeds:
-        key = (model_type, k, is_deterministic, tuning_domain, num_mc_samples)
-        eval_results = utils.load_eval_results(
-            eval_results_dir=dataset_subdir_path, epoch=seed)
-
-        for arr_name, arr in eval_results.items():
-          if arr.ndim > 0 and arr.shape[0] > 1:
-            dataset_to_model_results[dataset_name][key][arr_name].append(arr)
+  if FLAGS.results_index_path:
+    index = utils.ResultsIndex(FLAGS.results_index_path)
+    utils.index_eval_results(results_dir, index)
+    run_results = utils.load_indexed_eval_results(index)
+    for (model_dir, dataset_name), array_dict in run_results.items():
+      key = parse_model_dir(model_dir)
+      dataset_to_model_results[dataset_name][key] = array_dict
+  else:
+    model_dirs = tf.io.gfile.listdir(results_dir)
+    for model_dir in model_dirs:
+      key = parse_model_dir(model_dir)
+      model_dir_path = os.path.join(results_dir, model_dir)
+      dataset_subdirs = [
+          file_or_dir for file_or_dir in tf.io.gfile.listdir(model_dir_path)
+          if tf.io.gfile.isdir(os.path.join(model_dir_path, file_or_dir))]
+      for dataset_subdir in dataset_subdirs:
+        dataset_name = dataset_subdir[:-1]
+        print(dataset_name)
+        dataset_subdir_path = os.path.join(model_dir_path, dataset_subdir)
+        random_seed_dirs = tf.io.gfile.listdir(dataset_subdir_path)
+        seeds = [int(random_seed_dir.split('_')[-1].split('/')[0])
+                 for random_seed_dir in random_seed_dirs]
+        seeds = sorted(seeds)
+        for seed in seeds:
+          eval_results = utils.load_eval_results(
+              eval_results_dir=dataset_subdir_path, epoch=seed)
+
+          for arr_name, arr in eval_results.items():
+            if arr.ndim > 0 and arr.shape[0] > 1:
+              dataset_to_model_results[dataset_name][key][arr_name].append(arr)
 
   utils.plot_retention_curves(
       distribution_shift_name=distribution_shift,
@@ -114,6 +114,7 @@ def load_kaggle_severity_shift_dataset(train_batch_size,
         split=split,
         data_dir=data_dir,
         cache=(flags.cache_eval_datasets and split != 'train'),
+        cache_dir=flags.preprocessed_cache_dir,
         drop_remainder=not load_for_eval,
         builder_config=f'{dataset_name}/{flags.preproc_builder_config}')
     dataset = dataset_builder.load(batch_size=split_to_batch_size[split])
@@ -182,6 +183,7 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
       is_training=not flags.use_validation,
       decision_threshold=flags.dr_decision_threshold,
       cache=flags.cache_eval_datasets,
+      cache_dir=flags.preprocessed_cache_dir,
       drop_remainder=not load_for_eval,
       builder_config=f'{dr_dataset_name}/{flags.preproc_builder_config}')
   validation_batch_size = (
@@ -200,6 +202,7 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         data_dir=data_dir,
         decision_threshold=flags.dr_decision_threshold,
         cache=flags.cache_eval_datasets,
+        cache_dir=flags.preprocessed_cache_dir,
         drop_remainder=not load_for_eval,
         builder_config=f'aptos/{flags.preproc_builder_config}')
     dataset_ood_validation = aptos_validation_builder.load(
@@ -221,6 +224,7 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         split='train',
         data_dir=data_dir,
         decision_threshold=flags.dr_decision_threshold,
+        cache_dir=flags.preprocessed_cache_dir,
         builder_config=f'{dr_dataset_name}/{flags.preproc_builder_config}')
     dataset_train = dataset_train_builder.load(batch_size=train_batch_size)
 
@@ -246,6 +250,7 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         data_dir=data_dir,
         decision_threshold=flags.dr_decision_threshold,
         cache=flags.cache_eval_datasets,
+        cache_dir=flags.preprocessed_cache_dir,
         drop_remainder=not load_for_eval,
         builder_config=f'{dr_dataset_name}/{flags.preproc_builder_config}')
     dataset_test = dataset_test_builder.load(batch_size=eval_batch_size)
@@ -261,6 +266,7 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         data_dir=data_dir,
         decision_threshold=flags.dr_decision_threshold,
         cache=flags.cache_eval_datasets,
+        cache_dir=flags.preprocessed_cache_dir,
         drop_remainder=not load_for_eval,
         builder_config=f'aptos/{flags.preproc_builder_config}')
     dataset_ood_test = aptos_test_builder.load(batch_size=eval_batch_size)
@@ -1190,6 +1190,21 @@ def get_retention_curve_normalizer(use_oracle, n_objects):
     return normalizer[::-1]
 
 
+def _compute_retained_sums(values, uncertainty):
+  """Sums the values of the i least uncertain objects, for every i.
+
+  Args:
+    values: np.ndarray, per-example values, e.g. losses or accuracies.
+    uncertainty: np.ndarray, per-example uncertainties for the same dataset,
+      should follow the order of the values.
+  Returns:
+    np.ndarray of size n_objects + 1 with the sum over the i least uncertain
+      objects at index i.
+  """
+  values = values[uncertainty.argsort()]
+  return np.concatenate([[0.], np.cumsum(values)])
+
+
 def compute_retention_curve_on_losses(losses, uncertainty, use_oracle=False):
   """Computes a retention curve on a loss (where lower loss is better)
   and corresponding per-example uncertainty values.
@@ -1208,12 +1223,7 @@ def compute_retention_curve_on_losses(losses, uncertainty, use_oracle=False):
       retained (i.e., all points referred to an expert).
   """
   n_objects = losses.shape[0]
-  uncertainty_order = uncertainty.argsort()
-
-  # Losses in order of increasing uncertainty
-  losses = losses[uncertainty_order]
-  error_rates = np.zeros(n_objects + 1)
-  error_rates[:-1] = np.cumsum(losses)[::-1]
+  error_rates = _compute_retained_sums(losses, uncertainty)[::-1]
 
   # With oracle:
   # * Divide by total number of predictions
@@ -1248,20 +1258,14 @@ def compute_retention_curve_on_accuracies(
       retained (i.e., all points referred to an expert).
   """
   n_objects = accuracies.shape[0]
-  uncertainty_order = uncertainty.argsort()
-
-  # Per-point accuracy (binary) in order of increasing uncertainty
-  accuracies = accuracies[uncertainty_order]
-  retention_arr = np.zeros(n_objects + 1)
-
-  for i in range(1, n_objects):
-    accuracy_i = accuracies[:i].sum()
-
-    if use_oracle:
-      j = n_objects - i
-      accuracy_i += j
-
-    retention_arr[i] = accuracy_i
+  # The number of correct predictions when retaining the i most certain points.
+  retention_arr = _compute_retained_sums(accuracies, uncertainty)
+  if use_oracle:
+    # The oracle is correct on the remaining n_objects - i referred points.
+    retention_arr += n_objects - np.arange(n_objects + 1)
+  else:
+    # Assume perfect performance when all examples have been referred.
+    retention_arr[0] = 1
 
   # With oracle:
   # * Divide by total number of predictions
@@ -1270,10 +1274,6 @@ def compute_retention_curve_on_accuracies(
   # * referral rate
   normalizer = get_retention_curve_normalizer(use_oracle, n_objects)
 
-  # Assume perfect performance when all examples have been referred.
-  retention_arr[0] = n_objects if use_oracle else 1
-  retention_arr[-1] = accuracies.sum()
-
   acc_rates = retention_arr[::-1] / normalizer
   return acc_rates
 
@@ -1303,18 +1303,7 @@ def compute_auc_retention_curve(y_pred,
     np.ndarray, AUC or AUPRC retention curve at specified number of thresholds.
   """
 
-  def compute_auroc(true, pred):
-    return roc_auc_score(y_true=true, y_score=pred)
-
-  def compute_auprc(true, pred):
-    precision, recall, _ = precision_recall_curve(y_true=true, probas_pred=pred)
-    return auc(recall, precision)
-
-  if auc_str == 'roc':
-    auc_fn = compute_auroc
-  elif auc_str == 'prc':
-    auc_fn = compute_auprc
-  else:
+  if auc_str not in ('roc', 'prc'):
     raise NotImplementedError
 
   n_objects = y_pred.shape[0]
@@ -1325,57 +1314,50 @@ def compute_auc_retention_curve(y_pred,
   y_pred = y_pred[uncertainty_order]
   y_true = y_true[uncertainty_order]
 
-  retention_arr = np.zeros(n_buckets + 1)
-
   if use_oracle:
     # We will later divide by n_objects
     perfect_performance = n_objects
   else:
     perfect_performance = 1
 
+  # Number of retained (least uncertain) objects at each retention threshold,
+  # the last one corresponding to no referral.
+  n_retained = np.append(bucket_indices[1:], n_objects)
+  if auc_str == 'roc':
+    auc_values = _compute_retained_roc_aucs(y_pred, y_true)[n_retained]
+  else:
+    auc_values = _compute_retained_pr_aucs(y_pred, y_true, n_retained)
+  # sklearn raises a ValueError on empty inputs, which counts as a zero AUC.
+  auc_values[n_retained == 0] = 0.
+
+  # For the first few low uncertainty points, we may be predicting the same
+  # (correct) label, which would break AUC. We default to assigning
+  # perfect AUC until this condition is broken.
+  y_true_bool = y_true.astype(bool)
+  n_pos = np.concatenate([[0], np.cumsum(y_true_bool)])[n_retained]
+  n_mismatch = np.concatenate(
+      [[0], np.cumsum((y_pred > 0.5) != y_true_bool)])[n_retained]
+  single_correct_label = ((n_retained > 0) &
+                          ((n_pos == 0) | (n_pos == n_retained)) &
+                          (n_mismatch == 0))
+  # The check stops at the first threshold for which the condition is broken,
+  # and never applies to the last threshold (no referral).
+  single_correct_label[-1] = False
+  n_perfect = np.argmin(single_correct_label)
+
+  # As with sklearn, the AUC is NaN if only one class is retained, and the
+  # AUPRC is 0.5 if no positive is retained.
+  if use_oracle:
+    # Weight current AUC/AUPRC by number of objects, and
+    # add weight of oracle's perfect prediction.
+    retention_arr = n_retained * auc_values + (n_objects - n_retained)
+    retention_arr[-1] = n_objects * auc_values[-1]
+  else:
+    retention_arr = auc_values
+  retention_arr[:n_perfect] = perfect_performance
+
   # Assume perfect performance when all examples have been referred.
-  retention_arr[0] = perfect_performance
-
-  check_n_unique = True
-
-  for i_buckets in range(1, n_buckets):
-    i_objects = bucket_indices[i_buckets]
-    j_objects = n_objects - i_objects
-    y_pred_curr = y_pred[:i_objects]
-    y_true_curr = y_true[:i_objects]
-
-    # For the first few low uncertainty points, we may be predicting the same
-    # (correct) label, which would break AUC. We default to assigning
-    # perfect AUC until this condition is broken.
-    if (check_n_unique and
-        len(np.unique(y_true_curr)) == 1 and
-        np.array_equal(y_pred_curr > 0.5, y_true_curr)):
-      retention_arr[i_buckets] = perfect_performance
-    else:
-      try:
-        auc_val = auc_fn(true=y_true_curr, pred=y_pred_curr)
-        if use_oracle:
-          # Weight current AUC/AUPRC by number of objects, and
-          # add weight of oracle's perfect prediction.
-          retention_arr[i_buckets] = (i_objects * auc_val) + j_objects
-        else:
-          retention_arr[i_buckets] = auc_val
-      except ValueError:  # All of the preds are the same
-        if use_oracle:
-          retention_arr[i_buckets] = j_objects
-        else:
-          retention_arr[i_buckets] = 0
-      check_n_unique = False
-
-  # Handle the case when no examples have been referred.
-  try:
-    auc_val = auc_fn(true=y_true, pred=y_pred)
-    if use_oracle:
-      retention_arr[-1] = n_objects * auc_val
-    else:
-      retention_arr[-1] = auc_val
-  except ValueError:
-    retention_arr[-1] = 0
+  retention_arr = np.concatenate([[perfect_performance], retention_arr])
 
   if use_oracle:
     auc_retention = retention_arr[::-1] / n_objects
@@ -1385,6 +1367,128 @@ def compute_auc_retention_curve(y_pred,
   return auc_retention
 
 
+def _count_preceding(ranks, mask):
+  """Counts the preceding masked objects with a lower and an equal rank.
+
+  Every pair of objects j < i is counted at the level of a divide and conquer
+  over the positions where j and i fall in the left and right halves of the
+  same block. The counts of all the objects of a level are computed at once
+  with a sort and a binary search, in O(n log(n)^2) overall.
+
+  Args:
+    ranks: np.ndarray of non-negative ints, the rank of each object.
+    mask: np.ndarray of bools, whether each object is counted.
+
+  Returns:
+    Tuple of np.ndarrays of ints, the number of masked objects j < i with
+      ranks[j] < ranks[i], and with ranks[j] == ranks[i].
+  """
+  n_objects = ranks.shape[0]
+  positions = np.arange(n_objects)
+  n_ranks = np.int64(ranks.max(initial=0)) + 1
+  lower = np.zeros(n_objects, dtype=np.int64)
+  equal = np.zeros(n_objects, dtype=np.int64)
+  half = 1
+  while half < n_objects:
+    block = positions // (2 * half)
+    is_left = positions % (2 * half) < half
+    # Ranks offset by block, to search all the blocks at once.
+    keys = block * n_ranks + ranks
+    left_keys = np.sort(keys[is_left & mask])
+    right_keys = keys[~is_left]
+    block_start = np.searchsorted(left_keys, block[~is_left] * n_ranks)
+    below = np.searchsorted(left_keys, right_keys, side='left')
+    lower[~is_left] += below - block_start
+    equal[~is_left] += (
+        np.searchsorted(left_keys, right_keys, side='right') - below)
+    half *= 2
+  return lower, equal
+
+
+def _compute_retained_roc_aucs(y_pred, y_true):
+  """Computes the ROC AUC of every prefix of the objects.
+
+  The AUC is the fraction of (positive, negative) pairs ranked in the right
+  order, ties counting half, as in `sklearn.metrics.roc_auc_score`. Retaining
+  one more object adds the pairs it forms with the previously retained
+  objects, so the AUCs of all the prefixes follow from a cumulative sum.
+
+  Args:
+    y_pred: np.ndarray, predicted sigmoid probabilities.
+    y_true: np.ndarray, ground truth values.
+
+  Returns:
+    np.ndarray of size n_objects + 1 with the AUC of y_pred[:i] at index i,
+      NaN where only one class is retained.
+  """
+  y_true = y_true.astype(bool)
+  ranks = np.unique(y_pred, return_inverse=True)[1].reshape(-1)
+  neg_lower, neg_equal = _count_preceding(ranks, ~y_true)
+  pos_lower, pos_equal = _count_preceding(ranks, y_true)
+  n_pos = np.concatenate([[0], np.cumsum(y_true)])
+  n_neg = np.arange(y_true.shape[0] + 1) - n_pos
+  pos_higher = n_pos[:-1] - pos_lower - pos_equal
+  # A positive is ranked above the preceding negatives with a lower score, a
+  # negative below the preceding positives with a higher score.
+  ordered_pairs = np.where(y_true, neg_lower + 0.5 * neg_equal,
+                           pos_higher + 0.5 * pos_equal)
+  n_ordered_pairs = np.concatenate([[0.], np.cumsum(ordered_pairs)])
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return n_ordered_pairs / (n_pos * n_neg)
+
+
+def _compute_retained_pr_aucs(y_pred, y_true, n_retained, chunk_size=16):
+  """Computes the PR AUC of the first objects for many thresholds.
+
+  Unlike the ROC AUC, the PR AUC has no incremental update: retaining one more
+  negative lowers the precision at every lower decision threshold. The objects
+  are instead sorted once by prediction, and for every threshold the true and
+  false positive counts at all distinct prediction values are cumulative sums
+  over the retained objects, from which the AUC is integrated with the
+  trapezoidal rule as in `sklearn.metrics`. This costs O(n log n) for the sort
+  plus O(n) per threshold, instead of a sort per threshold.
+
+  Args:
+    y_pred: np.ndarray, predicted sigmoid probabilities.
+    y_true: np.ndarray, ground truth values.
+    n_retained: np.ndarray of ints, the number of retained objects at each
+      threshold; the retained objects are y_pred[:n_retained[i]].
+    chunk_size: int, number of thresholds processed at once.
+
+  Returns:
+    np.ndarray of size len(n_retained) with the AUPRC at each threshold.
+  """
+  pred_order = np.argsort(-y_pred, kind='mergesort')
+  sorted_pred = y_pred[pred_order]
+  sorted_true = y_true[pred_order].astype(bool)
+  # Last position of each group of equal predictions, i.e., the distinct
+  # decision thresholds.
+  group_end = np.append(sorted_pred[1:] != sorted_pred[:-1], True)
+
+  aucs = np.zeros(len(n_retained))
+  for start in range(0, len(n_retained), chunk_size):
+    thresholds = n_retained[start:start + chunk_size]
+    # Whether an object is retained, in prediction order: [chunk, n_objects].
+    retained = pred_order[None, :] < thresholds[:, None]
+    tps = np.cumsum(retained & sorted_true, axis=1)[:, group_end]
+    fps = np.cumsum(retained & ~sorted_true, axis=1)[:, group_end]
+    n_pos = tps[:, -1:]
+    # Thresholds above all retained objects lie on the starting point.
+    above_all = tps + fps == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+      # As in sklearn, the recall is 1 if no positive is retained.
+      recall = np.where(above_all, 0., np.where(n_pos > 0, tps / n_pos, 1.))
+      precision = np.where(above_all, 1., tps / (tps + fps))
+    # The PR curve starts at (recall=0, precision=1).
+    recall = np.concatenate([np.zeros_like(recall[:, :1]), recall], axis=1)
+    precision = np.concatenate(
+        [np.ones_like(precision[:, :1]), precision], axis=1)
+    aucs[start:start + chunk_size] = np.sum(
+        np.diff(recall, axis=1) * (precision[:, 1:] + precision[:, :-1]) / 2,
+        axis=1)
+  return aucs
+
+
 def compute_ood_calibration_curve(y_pred: np.ndarray):
   """OOO calibration curve.
   Form a curve by sweeping over confidences in [0, 1], and counting
@@ -0,0 +1,157 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the retention curves of the diabetic retinopathy evaluation."""
+
+import warnings
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from sklearn.metrics import auc
+from sklearn.metrics import precision_recall_curve
+from sklearn.metrics import roc_auc_score
+from utils import eval_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+
+def _reference_auc_retention_curve(y_pred, y_true, uncertainty, auc_str,
+                                   n_buckets, use_oracle):
+  """Computes the retention curve with one sklearn AUC per threshold."""
+
+  def auc_fn(true, pred):
+    with warnings.catch_warnings():
+      warnings.simplefilter('ignore')
+      if auc_str == 'roc':
+        return roc_auc_score(y_true=true, y_score=pred)
+      precision, recall, _ = precision_recall_curve(y_true=true, y_score=pred)
+      return auc(recall, precision)
+
+  n_objects = y_pred.shape[0]
+  bucket_indices = ((np.arange(n_buckets) / n_buckets) * n_objects).astype(int)
+  uncertainty_order = uncertainty.argsort()
+  y_pred = y_pred[uncertainty_order]
+  y_true = y_true[uncertainty_order]
+  perfect_performance = n_objects if use_oracle else 1
+  retention_arr = np.zeros(n_buckets + 1)
+  retention_arr[0] = perfect_performance
+  check_n_unique = True
+  for i_buckets in range(1, n_buckets + 1):
+    i_objects = (
+        bucket_indices[i_buckets] if i_buckets < n_buckets else n_objects)
+    y_pred_curr = y_pred[:i_objects]
+    y_true_curr = y_true[:i_objects]
+    if (i_buckets < n_buckets and check_n_unique and
+        len(np.unique(y_true_curr)) == 1 and
+        np.array_equal(y_pred_curr > 0.5, y_true_curr)):
+      retention_arr[i_buckets] = perfect_performance
+      continue
+    check_n_unique = False
+    try:
+      auc_val = auc_fn(y_true_curr, y_pred_curr)
+    except ValueError:
+      auc_val = 0.
+    if use_oracle:
+      retention_arr[i_buckets] = i_objects * auc_val + n_objects - i_objects
+    else:
+      retention_arr[i_buckets] = auc_val
+  if use_oracle:
+    return retention_arr[::-1] / n_objects
+  return retention_arr[::-1]
+
+
+def _reference_retained_sums(values, uncertainty):
+  values = values[uncertainty.argsort()]
+  return np.array([values[:i].sum() for i in range(len(values) + 1)])
+
+
+class RetentionCurveTest(parameterized.TestCase):
+
+  def _predictions(self, n_objects, seed=0):
+    rng = np.random.RandomState(seed)
+    y_true = rng.randint(0, 2, n_objects)
+    # Rounded predictions, to have ties.
+    y_pred = np.round(
+        np.clip(0.5 * y_true + 0.6 * rng.rand(n_objects) - 0.05, 0., 1.), 2)
+    uncertainty = rng.rand(n_objects)
+    # The least uncertain objects have a single class, and one of them is
+    # mispredicted, so the first retained prefixes have undefined AUCs.
+    least_uncertain = np.argsort(uncertainty)[:n_objects // 5]
+    y_true[least_uncertain] = 0
+    y_pred[least_uncertain[-1]] = 0.9
+    return y_pred, y_true, uncertainty
+
+  @parameterized.product(
+      auc_str=['roc', 'prc'], use_oracle=[False, True],
+      n_objects=[7, 250])
+  def test_auc_retention_curve(self, auc_str, use_oracle, n_objects):
+    y_pred, y_true, uncertainty = self._predictions(n_objects)
+    expected = _reference_auc_retention_curve(
+        y_pred, y_true, uncertainty, auc_str, n_buckets=20,
+        use_oracle=use_oracle)
+    np.testing.assert_allclose(
+        eval_utils.compute_auc_retention_curve(
+            y_pred, y_true, uncertainty, auc_str, n_buckets=20,
+            use_oracle=use_oracle),
+        expected, atol=1e-10)
+
+  @parameterized.parameters('roc', 'prc')
+  def test_auc_retention_curve_single_class(self, auc_str):
+    y_pred, _, uncertainty = self._predictions(50)
+    for label in (0, 1):
+      y_true = np.full(50, label)
+      for use_oracle in (False, True):
+        np.testing.assert_allclose(
+            eval_utils.compute_auc_retention_curve(
+                y_pred, y_true, uncertainty, auc_str, n_buckets=10,
+                use_oracle=use_oracle),
+            _reference_auc_retention_curve(
+                y_pred, y_true, uncertainty, auc_str, n_buckets=10,
+                use_oracle=use_oracle),
+            atol=1e-10)
+
+  def test_retained_roc_aucs(self):
+    y_pred, y_true, _ = self._predictions(60, seed=1)
+    aucs = eval_utils._compute_retained_roc_aucs(y_pred, y_true)  # pylint: disable=protected-access
+    for i in range(61):
+      if len(np.unique(y_true[:i])) < 2:
+        self.assertTrue(np.isnan(aucs[i]))
+      else:
+        self.assertAlmostEqual(aucs[i], roc_auc_score(y_true[:i], y_pred[:i]))
+
+  @parameterized.parameters(False, True)
+  def test_retention_curves_on_losses_and_accuracies(self, use_oracle):
+    rng = np.random.RandomState(2)
+    losses = rng.rand(30)
+    accuracies = rng.randint(0, 2, 30)
+    uncertainty = rng.rand(30)
+    normalizer = eval_utils.get_retention_curve_normalizer(use_oracle, 30)
+    np.testing.assert_allclose(
+        eval_utils.compute_retention_curve_on_losses(losses, uncertainty,
+                                                     use_oracle),
+        _reference_retained_sums(losses, uncertainty)[::-1] / normalizer)
+
+    expected = _reference_retained_sums(accuracies, uncertainty)
+    if use_oracle:
+      expected += 30 - np.arange(31)
+    else:
+      expected[0] = 1
+    np.testing.assert_allclose(
+        eval_utils.compute_retention_curve_on_accuracies(
+            accuracies, uncertainty, use_oracle),
+        expected[::-1] / normalizer)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -24,11 +24,14 @@
 # pylint: disable=logging-fstring-interpolation
 # pylint: disable=missing-function-docstring
 import collections
+import contextlib
 import json
 import os
 import pathlib
 import pdb
 import pickle
+import re
+import sqlite3
 from typing import Dict, List, Union
 from typing import Optional
 from typing import Tuple
@@ -43,6 +46,10 @@ JOINT_SPLIT_TO_CONSTITUENT_SPLITS = {
     'joint_test': ['in_domain_test', 'ood_test']
 }
 
+RESULTS_INDEX_FILE_NAME = 'results.sqlite'
+EVAL_RESULTS_TABLE = 'eval_results'
+_EVAL_RESULTS_DIR_PATTERN = re.compile(r'^eval_results_(-?\d+)$')
+
 
 def merge_and_store_scalar_results(scalar_results_list: List[Dict],
                                    output_dir,
@@ -277,7 +284,25 @@ def store_eval_results(eval_results_dir,
   logging.info(f'Stored eval results to {eval_results_dir}')
 
 
-def load_eval_results(eval_results_dir, epoch=None, name_filter=None):
+def load_eval_array(np_eval_results_path, mmap=False):
+  """Load a per-prediction array, memory-mapped if `mmap` and possible.
+
+  Arrays of Python objects (e.g., image names) and arrays on remote file
+  systems cannot be memory-mapped, and are read into memory instead.
+  """
+  if mmap and '://' not in np_eval_results_path:
+    try:
+      return np.load(np_eval_results_path, mmap_mode='r')
+    except ValueError:
+      pass
+  with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
+    return np.load(f, allow_pickle=True)
+
+
+def load_eval_results(eval_results_dir,
+                      epoch=None,
+                      name_filter=None,
+                      mmap=False):
   if epoch is None:
     eval_results_name = 'eval_results'
   else:
@@ -291,69 +316,363 @@ def load_eval_results(eval_results_dir, epoch=None, name_filter=None):
   eval_results = {}
   for arr_name in arr_names:
     np_eval_results_path = os.path.join(eval_results_dir, arr_name)
-    with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
-      arr = np.load(f, allow_pickle=True)
-      eval_results[arr_name.split('.')[0]] = arr
+    eval_results[arr_name.split('.')[0]] = load_eval_array(
+        np_eval_results_path, mmap=mmap)
 
   logging.info(f'Loaded eval results from {eval_results_dir}')
   return eval_results
 
 
-def cache_eval_results(output_dir, metadata_df, results_df):
+def _quote_identifier(name):
+  return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def _sql_type(dtype):
+  if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+    return 'INTEGER'
+  if pd.api.types.is_float_dtype(dtype):
+    return 'REAL'
+  return 'TEXT'
+
+
+class ResultsIndex:
+  """Append-only SQLite index of evaluation results.
+
+  Each table holds the rows of a results DataFrame (e.g., `metadata` or
+  `results`). Appending rows never rewrites the rows already stored, and every
+  append is a single transaction holding the database write lock, so
+  concurrent evaluation jobs can append to the same index without losing each
+  other's results. Columns that are missing from a table are added when rows
+  with new columns are appended.
+
+  Loading pushes the filters down to SQLite, so loading the results of a few
+  models or seeds does not read the results of all the others.
+
+  SQLite needs a local (or network mounted) file system; use the TSV files for
+  remote storage.
+  """
+
+  def __init__(self, path: str, timeout: float = 60.):
+    """Initializes the index.
+
+    Args:
+      path: `str`, local path of the SQLite database file. The file is created
+        when the first rows are appended.
+      timeout: `float`, seconds to wait for the write lock held by another
+        process before raising an error.
+    """
+    self.path = path
+    self.timeout = timeout
+
+  @contextlib.contextmanager
+  def _connect(self):
+    conn = sqlite3.connect(self.path, timeout=self.timeout,
+                           isolation_level=None)
+    try:
+      yield conn
+    finally:
+      conn.close()
+
+  def _columns(self, conn, table):
+    rows = conn.execute(f'PRAGMA table_info({_quote_identifier(table)})')
+    return [row[1] for row in rows]
+
+  def has_table(self, table: str) -> bool:
+    if not os.path.exists(self.path):
+      return False
+    with self._connect() as conn:
+      return bool(self._columns(conn, table))
+
+  def append(self, table: str, df: pd.DataFrame):
+    """Appends the rows of `df` to `table`, creating it if needed."""
+    if df.empty:
+      return
+    df = df.copy()
+    for column in df.columns:
+      if pd.api.types.is_datetime64_any_dtype(df[column].dtype):
+        df[column] = df[column].astype(str)
+    rows = df.astype(object).where(pd.notna(df), None).values.tolist()
+    columns = ', '.join(_quote_identifier(column) for column in df.columns)
+    placeholders = ', '.join('?' * len(df.columns))
+
+    with self._connect() as conn:
+      # Take the write lock before inspecting the schema, so that concurrent
+      # writers cannot create the table or add columns in between.
+      conn.execute('BEGIN IMMEDIATE')
+      try:
+        existing_columns = self._columns(conn, table)
+        if not existing_columns:
+          column_defs = ', '.join(
+              f'{_quote_identifier(column)} {_sql_type(dtype)}'
+              for column, dtype in df.dtypes.items())
+          conn.execute(
+              f'CREATE TABLE {_quote_identifier(table)} ({column_defs})')
+        else:
+          for column, dtype in df.dtypes.items():
+            if column not in existing_columns:
+              conn.execute(f'ALTER TABLE {_quote_identifier(table)} ADD COLUMN '
+                           f'{_quote_identifier(column)} {_sql_type(dtype)}')
+        conn.executemany(
+            f'INSERT INTO {_quote_identifier(table)} ({columns}) '
+            f'VALUES ({placeholders})', rows)
+        conn.execute('COMMIT')
+      except:  # pylint: disable=bare-except
+        conn.execute('ROLLBACK')
+        raise
+
+  def create_index(self, table: str, columns: List[str]):
+    """Creates an index on `columns` of `table` to speed up loading."""
+    name = _quote_identifier('__'.join([table] + list(columns)))
+    column_list = ', '.join(_quote_identifier(column) for column in columns)
+    with self._connect() as conn:
+      conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON '
+                   f'{_quote_identifier(table)} ({column_list})')
+
+  def load(self,
+           table: str,
+           columns: Optional[List[str]] = None,
+           distinct: bool = False,
+           **filters) -> pd.DataFrame:
+    """Loads the rows of `table` matching `filters`.
+
+    Args:
+      table: `str`, name of the table.
+      columns: optional list of the columns to load. Loads all columns if None.
+      distinct: `bool`, only load distinct rows.
+      **filters: column name to the value, or list of values, that the loaded
+        rows must have, e.g. `model_type='dropout', train_seed=[0, 1]`.
+
+    Returns:
+      pd.DataFrame with the matching rows.
+    """
+    if not self.has_table(table):
+      raise FileNotFoundError(f'No table {table} in index {self.path}.')
+    if columns is None:
+      select = '*'
+    else:
+      select = ', '.join(_quote_identifier(column) for column in columns)
+    conditions = []
+    params = []
+    for column, value in filters.items():
+      if isinstance(value, (list, tuple, set, np.ndarray)):
+        value = list(value)
+        if not value:
+          conditions.append('0')
+          continue
+        conditions.append(f'{_quote_identifier(column)} IN '
+                          f"({', '.join('?' * len(value))})")
+        params.extend(value)
+      else:
+        conditions.append(f'{_quote_identifier(column)} = ?')
+        params.append(value)
+    if distinct:
+      select = f'DISTINCT {select}'
+    query = f'SELECT {select} FROM {_quote_identifier(table)}'
+    if conditions:
+      query += ' WHERE ' + ' AND '.join(conditions)
+    with self._connect() as conn:
+      return pd.read_sql_query(query, conn, params=params)
+
+
+def get_results_index(results_dir, index_path=None) -> ResultsIndex:
+  """Returns the `ResultsIndex` of `results_dir`.
+
+  Args:
+    results_dir: `str`, results directory.
+    index_path: `str`, optional local path of the index. Defaults to a
+      `results.sqlite` file in `results_dir`, which must then be local.
+  """
+  if index_path is None:
+    if '://' in results_dir:
+      raise ValueError(
+          f'Cannot store a SQLite results index in {results_dir}; provide a '
+          'local index_path.')
+    index_path = os.path.join(results_dir, RESULTS_INDEX_FILE_NAME)
+  return ResultsIndex(index_path)
+
+
+def _read_npy_length(np_eval_results_path):
+  """Reads the length of the first axis of a `.npy` file from its header."""
+  with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+      shape, _, _ = np.lib.format.read_array_header_1_0(f)
+    else:
+      shape, _, _ = np.lib.format.read_array_header_2_0(f)
+  return shape[0] if shape else 0
+
+
+def index_eval_results(results_dir, index: ResultsIndex):
+  """Adds the per-prediction arrays under `results_dir` to `index`.
+
+  Every `eval_results_{seed}` directory found below `results_dir` adds one row
+  per array to the `eval_results` table, with the columns
+    run_dir: directory of the run relative to `results_dir`, e.g.
+      `{model_dir}/{eval_type}`,
+    dataset: name of the dataset directory,
+    seed: the seed (or epoch) of the eval results,
+    name: name of the array, e.g. `y_pred`,
+    length: length of the first axis of the array (0 for scalars),
+    path: path of the `.npy` file.
+  Directories that are already indexed are not read again, so updating the
+  index after adding runs only reads the headers of the new arrays.
+  """
+  indexed_paths = set()
+  if index.has_table(EVAL_RESULTS_TABLE):
+    indexed_paths = set(index.load(EVAL_RESULTS_TABLE, columns=['path'])['path'])
+
+  rows = []
+  for dir_path, child_dirs, _ in tf.io.gfile.walk(results_dir):
+    for child_dir in child_dirs:
+      match = _EVAL_RESULTS_DIR_PATTERN.match(child_dir.strip('/'))
+      if not match:
+        continue
+      eval_results_dir = os.path.join(dir_path, child_dir)
+      relative_dir = os.path.relpath(dir_path, results_dir)
+      run_dir, dataset = os.path.split(relative_dir)
+      for arr_name in tf.io.gfile.listdir(eval_results_dir):
+        path = os.path.join(eval_results_dir, arr_name)
+        if path in indexed_paths or not arr_name.endswith('.npy'):
+          continue
+        rows.append((run_dir, dataset, int(match.group(1)),
+                     arr_name.split('.')[0], _read_npy_length(path), path))
+
+  index.append(
+      EVAL_RESULTS_TABLE,
+      pd.DataFrame(
+          rows,
+          columns=['run_dir', 'dataset', 'seed', 'name', 'length', 'path']))
+  if index.has_table(EVAL_RESULTS_TABLE):
+    index.create_index(EVAL_RESULTS_TABLE, ['run_dir', 'dataset', 'seed'])
+  logging.info(f'Indexed {len(rows)} new eval result arrays in {results_dir}.')
+
+
+def load_indexed_eval_results(index: ResultsIndex, mmap=True, **filters):
+  """Loads the indexed per-prediction arrays matching `filters`.
+
+  Args:
+    index: `ResultsIndex` populated by `index_eval_results`.
+    mmap: `bool`, memory-map the arrays where possible.
+    **filters: filters on the `eval_results` table columns, e.g.
+      `run_dir=['dropout_k1_indomain_mc5'], seed=[0, 1]`.
+
+  Returns:
+    Dict from (run_dir, dataset) to a dict from array name to the list of
+    arrays of the different seeds, ordered by seed. As in `load_dataset_dir`,
+    scalars and arrays of length 1 are skipped.
+  """
+  rows = index.load(EVAL_RESULTS_TABLE, **filters)
+  rows = rows[rows['length'] > 1].sort_values('seed', kind='mergesort')
+  results = collections.defaultdict(lambda: collections.defaultdict(list))
+  for run_dir, dataset, name, path in zip(rows['run_dir'], rows['dataset'],
+                                          rows['name'], rows['path']):
+    results[(run_dir, dataset)][name].append(load_eval_array(path, mmap=mmap))
+  return results
+
+
+def append_results_dataframe(output_dir, storage_type, df, index_path=None):
+  """Appends the rows of `df` to the `storage_type` results of `output_dir`.
+
+  If `output_dir` is local (or `index_path` is provided), the rows are
+  appended to the `storage_type` table of a `ResultsIndex` without rereading
+  or rewriting previous rows. Otherwise, they are appended to
+  `{storage_type}.tsv`.
+  """
+  if index_path is not None or '://' not in output_dir:
+    tf.io.gfile.makedirs(output_dir)
+    index = get_results_index(output_dir, index_path=index_path)
+    index.append(storage_type, df)
+    logging.info(f'Appended {len(df)} rows to the {storage_type} table of '
+                 f'{index.path}.')
+    return
+
+  path = os.path.join(output_dir, f'{storage_type}.tsv')
+
+  # Update or initialize results DataFrame
+  try:
+    with tf.io.gfile.GFile(path, 'r') as f:
+      previous_df = pd.read_csv(f, sep='\t')
+      df = pd.concat([previous_df, df])
+      action_str = 'updated'
+  except (FileNotFoundError, tf.errors.NotFoundError):
+    logging.info(f'No previous {storage_type} found at path {path}. '
+                 f'Storing a new {storage_type} dataframe.')
+    action_str = 'stored initial'
+
+  # Store to file
+  with tf.io.gfile.GFile(path, 'w') as f:
+    df.to_csv(path_or_buf=f, sep='\t', index=False)
+
+  logging.info(f'Successfully {action_str} {storage_type} dataframe at {path}.')
+
+
+def cache_eval_results(output_dir, metadata_df, results_df, index_path=None):
   """A results entry is uniquely identified by:
 
     model_type
     train_seed
     eval_seed
     run_datetime
-  """
-  metadata_path = os.path.join(output_dir, 'metadata.tsv')
-  results_path = os.path.join(output_dir, 'results.tsv')
-
-  for storage_type, df, path in zip(['metadata', 'results'],
-                                    [metadata_df, results_df],
-                                    [metadata_path, results_path]):
-    # Update or initialize results DataFrame
-    try:
-      with tf.io.gfile.GFile(path, 'r') as f:
-        previous_df = pd.read_csv(f, sep='\t')
-        df = pd.concat([previous_df, df])
-        action_str = 'updated'
-    except (FileNotFoundError, tf.errors.NotFoundError):
-      logging.info(f'No previous {storage_type} found at path {path}. '
-                   f'Storing a new {storage_type} dataframe.')
-      action_str = 'stored initial'
-
-    # Store to file
-    with tf.io.gfile.GFile(path, 'w') as f:
-      df.to_csv(path_or_buf=f, sep='\t', index=False)
 
-    logging.info(
-        f'Successfully {action_str} {storage_type} dataframe at {path}.')
+  The entries are appended with `append_results_dataframe`, i.e. to a
+  `ResultsIndex` if `output_dir` is local (or `index_path` is provided), and
+  to `metadata.tsv` and `results.tsv` otherwise.
+  """
+  for storage_type, df in zip(['metadata', 'results'],
+                              [metadata_df, results_df]):
+    append_results_dataframe(
+        output_dir, storage_type, df, index_path=index_path)
+
+
+def _filter_dataframe(df, **filters):
+  for column, value in filters.items():
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+      df = df[df[column].isin(list(value))]
+    else:
+      df = df[df[column] == value]
+  return df
 
 
-def get_results_from_model_dir(model_dir: str):
+def get_results_from_model_dir(model_dir: str, **filters):
   """Get results from a subdir.
 
   Args:
-    model_dir: `str`, subdirectory that contains a `results.tsv` file for the
-      corresponding model type.
+    model_dir: `str`, subdirectory that contains a results index (see
+      `cache_eval_results`) and/or a `results.tsv` file for the corresponding
+      model type.
+    **filters: column name to the value, or list of values, of the results to
+      load, e.g. `train_seed=[0, 1]`. These are pushed down to the index.
 
   Returns:
     Results pd.DataFrame, or None, from a subdirectory containing
     results from a particular model type run on deferred prediction.
   """
+  results_dfs = []
+  if '://' not in model_dir:
+    index = get_results_index(model_dir)
+    if index.has_table('results'):
+      logging.info('Found results index at %s.', index.path)
+      results_dfs.append(index.load('results', **filters))
+
+  # Results stored before the index was introduced stay in `results.tsv`, and
+  # are loaded along with the indexed results.
   model_results_path = os.path.join(model_dir, 'results.tsv')
-  if not tf.io.gfile.exists(model_results_path):
-    return None
+  if tf.io.gfile.exists(model_results_path):
+    logging.info('Found results at %s.', model_results_path)
+    with tf.io.gfile.GFile(model_results_path, 'r') as f:
+      results_dfs.append(
+          _filter_dataframe(pd.read_csv(f, sep='\t'), **filters))
 
-  logging.info('Found results at %s.', model_results_path)
-
-  with tf.io.gfile.GFile(model_results_path, 'r') as f:
-    return pd.read_csv(f, sep='\t')
+  if not results_dfs:
+    return None
+  # Frames without matching rows would turn the columns to object dtype.
+  non_empty_dfs = [df for df in results_dfs if not df.empty]
+  return pd.concat(non_empty_dfs or results_dfs[:1], axis=0, ignore_index=True)
 
 
-def load_directory_results(results_dir: str, model_type: Optional[str] = None):
+def load_directory_results(results_dir: str,
+                           model_type: Optional[str] = None,
+                           **filters):
   """Load evaluation results from the specified directory.
 
   Args:
@@ -365,6 +684,8 @@ def load_directory_results(results_dir: str, model_type: Optional[str] = None):
       and the `model_type` argument should be provided.
     model_type: `str`, should be provided if generating a plot for only one
       particular model.
+    **filters: column name to the value, or list of values, of the results to
+      load, e.g. `train_seed=[0, 1]`.
   """
   if model_type is None:
     dir_path, child_dir_suffixes, _ = next(tf.io.gfile.walk(results_dir))
@@ -383,7 +704,7 @@ def load_directory_results(results_dir: str, model_type: Optional[str] = None):
       model_dirs.append(model_dir)
 
     for model_dir in model_dirs:
-      results = get_results_from_model_dir(model_dir)
+      results = get_results_from_model_dir(model_dir, **filters)
       if results is not None:
         results_dfs.append(results)
 
@@ -391,12 +712,9 @@ def load_directory_results(results_dir: str, model_type: Optional[str] = None):
   else:
     logging.info(
         f'Plotting deferred prediction results for model type {model_type}.')
-    model_results_path = os.path.join(results_dir, 'results.tsv')
-    try:
-      with tf.io.gfile.GFile(model_results_path, 'r') as f:
-        results_df = pd.read_csv(f, sep='\t')
-    except (FileNotFoundError, tf.errors.NotFoundError):
-      raise FileNotFoundError(f'No results found at path {model_results_path}.')
+    results_df = get_results_from_model_dir(results_dir, **filters)
+    if results_df is None:
+      raise FileNotFoundError(f'No results found at path {results_dir}.')
 
   return results_df
 
@@ -454,7 +772,7 @@ def load_model_dir_result_with_cache(model_dir_path,
     for eval_type in tqdm(eval_types):
       dataset_results[eval_type] = load_list_datasets_dir(
           os.path.join(model_dir_path, eval_type))
-    if dataset_results:
+    if not dataset_results:
       logging.info(
           f"{model_dir_path} is empty directory, won't create cache file.")
       return {}
@@ -473,7 +791,9 @@ def parse_model_dir_name_v1(model_dir: str) -> Tuple:
     raise ValueError('Expected model directory in format '
                      '{model_type}_k{k}_{tuning_domain}_mc{n_samples}')
   k = int(ensemble_str[1:])  # format f'k{k}'
-  num_mc_samples = mc_str[2:][:-1]  # format f'mc{num_mc_samples}/'
+  # Format f'mc{num_mc_samples}', followed by a slash if listed by
+  # `tf.io.gfile.listdir` on remote file systems.
+  num_mc_samples = mc_str.strip('/')[2:]
   is_deterministic = model_type == 'deterministic' and k == 1
   key = (model_type, k, is_deterministic, tuning_domain, num_mc_samples)
   return key
@@ -511,11 +831,73 @@ def decide_model_name_version(model_name: str) -> int:
 
 def fast_load_dataset_to_model_results(results_dir,
                                        model_dir_cache_file_name='cache',
-                                       invalid_cache=False):
+                                       invalid_cache=False,
+                                       use_index=False,
+                                       index_path=None,
+                                       model_dirs=None,
+                                       datasets=None,
+                                       seeds=None):
+  """Loads the per-prediction results of all models in `results_dir`.
+
+  Args:
+    results_dir: `str`, directory with one subdirectory per model, each with
+      `{eval_type}/{dataset}/eval_results_{seed}` subdirectories.
+    model_dir_cache_file_name: `str`, name of the pickled cache of each model
+      directory. Unused with `use_index`.
+    invalid_cache: `bool`, ignore and rewrite the existing caches or index.
+    use_index: `bool`, load through a `ResultsIndex` rather than the pickled
+      caches. The index is updated with new runs, only the arrays matching
+      `model_dirs`, `datasets` and `seeds` are loaded, and these are
+      memory-mapped.
+    index_path: `str`, optional local path of the index, see
+      `get_results_index`.
+    model_dirs: optional list of the model directories to load.
+    datasets: optional list of the datasets to load.
+    seeds: optional list of the seeds to load. Only used with `use_index`.
+
+  Returns:
+    Dict from dataset to a dict from the parsed model key to a dict from array
+    name to the list of arrays of the different seeds.
+  """
   dataset_to_model_results = collections.defaultdict(
       lambda: collections.defaultdict(lambda: collections.defaultdict(list)))
 
-  model_dirs = tf.io.gfile.listdir(results_dir)
+  if use_index:
+    index = get_results_index(results_dir, index_path=index_path)
+    if invalid_cache and os.path.exists(index.path):
+      os.remove(index.path)
+    index_eval_results(results_dir, index)
+    filters = {}
+    if model_dirs is not None:
+      # Selects the runs of the model directories among the distinct indexed
+      # runs, such that the query only reads the rows of these runs.
+      model_dirs = {model_dir.strip('/') for model_dir in model_dirs}
+      run_dirs = index.load(
+          EVAL_RESULTS_TABLE, columns=['run_dir'], distinct=True)['run_dir']
+      filters['run_dir'] = [
+          run_dir for run_dir in run_dirs
+          if os.path.split(run_dir)[0] in model_dirs
+      ]
+    if datasets is not None:
+      filters['dataset'] = datasets
+    if seeds is not None:
+      filters['seed'] = seeds
+    run_results = load_indexed_eval_results(index, **filters)
+    for (run_dir, dataset), array_dict in run_results.items():
+      model_dir, eval_type = os.path.split(run_dir)
+      parsed_model_key = parse_model_dir_name(model_dir, eval_type=eval_type)
+      if parsed_model_key in dataset_to_model_results[dataset]:
+        raise ValueError(
+            'Already have keys {}.'.format(
+                dataset_to_model_results[dataset].keys()))
+      dataset_to_model_results[dataset][parsed_model_key] = array_dict
+    return dataset_to_model_results
+
+  if model_dirs is None:
+    model_dirs = [
+        file_or_dir for file_or_dir in tf.io.gfile.listdir(results_dir)
+        if tf.io.gfile.isdir(os.path.join(results_dir, file_or_dir))
+    ]
   for model_dir in tqdm(model_dirs, desc='loading model results...'):
     model_dir_path = os.path.join(results_dir, model_dir)
     model_result = load_model_dir_result_with_cache(
@@ -525,6 +907,8 @@ def fast_load_dataset_to_model_results(results_dir,
     )
     for eval_type, eval_dict in model_result.items():
       for dataset, array_dict in eval_dict.items():
+        if datasets is not None and dataset not in datasets:
+          continue
         parsed_model_key = parse_model_dir_name(model_dir, eval_type=eval_type)
         if parsed_model_key in dataset_to_model_results[dataset]:
           raise ValueError(
@@ -0,0 +1,187 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the storage of the diabetic retinopathy evaluation results."""
+
+import os
+from unittest import mock
+
+from absl.testing import absltest
+import numpy as np
+import pandas as pd
+from utils import results_storage_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+
+def _results_df(model_type, train_seed, values):
+  return pd.DataFrame({
+      'metric': ['auroc'] * len(values),
+      'retain_proportion': np.linspace(0.5, 1., len(values)),
+      'value': values,
+      'model_type': model_type,
+      'train_seed': train_seed,
+      'eval_seed': 0,
+  })
+
+
+class ResultsStorageUtilsTest(absltest.TestCase):
+
+  def test_results_index_append_and_reload(self):
+    results_dir = self.create_tempdir().full_path
+    index = results_storage_utils.get_results_index(results_dir)
+    self.assertFalse(index.has_table('results'))
+
+    first = _results_df('dropout', 0, [0.5, 0.6])
+    index.append('results', first)
+    # Rows with a new column add the column to the table.
+    second = _results_df('deterministic', 1, [0.7, 0.8, 0.9])
+    second['run_datetime'] = pd.to_datetime('2022-01-01')
+    index.append('results', second)
+
+    # Reopening the index sees the rows appended before.
+    index = results_storage_utils.get_results_index(results_dir)
+    loaded = index.load('results')
+    self.assertLen(loaded, 5)
+    self.assertTrue(loaded['run_datetime'].iloc[:2].isna().all())
+    self.assertEqual(loaded['run_datetime'].iloc[2], '2022-01-01')
+    np.testing.assert_allclose(loaded['value'], [0.5, 0.6, 0.7, 0.8, 0.9])
+
+    loaded = index.load(
+        'results', columns=['value'], model_type='deterministic',
+        retain_proportion=[0.5, 1.])
+    self.assertEqual(list(loaded.columns), ['value'])
+    np.testing.assert_allclose(loaded['value'], [0.7, 0.9])
+
+  def test_eval_results_index(self):
+    results_dir = self.create_tempdir().full_path
+    dataset_dir = os.path.join(results_dir, 'dropout_k1', 'single',
+                               'in_domain_test')
+    for seed in (1, 0):
+      results_storage_utils.store_eval_results(
+          dataset_dir, {
+              'y_pred': np.full(4, seed, dtype=np.float32),
+              'ms_per_example': np.float32(seed),
+          },
+          epoch=seed)
+    index = results_storage_utils.get_results_index(results_dir)
+    results_storage_utils.index_eval_results(results_dir, index)
+    self.assertLen(index.load(results_storage_utils.EVAL_RESULTS_TABLE), 4)
+
+    # Indexing again only adds the arrays of the new seeds.
+    results_storage_utils.store_eval_results(
+        dataset_dir, {'y_pred': np.full(4, 2, dtype=np.float32)}, epoch=2)
+    results_storage_utils.index_eval_results(results_dir, index)
+    self.assertLen(index.load(results_storage_utils.EVAL_RESULTS_TABLE), 5)
+
+    results = results_storage_utils.load_indexed_eval_results(
+        index, mmap=False, seed=[0, 2])
+    self.assertEqual(
+        list(results), [(os.path.join('dropout_k1', 'single'),
+                         'in_domain_test')])
+    arrays = results[(os.path.join('dropout_k1', 'single'), 'in_domain_test')]
+    # Scalars are skipped, and the arrays are ordered by seed.
+    self.assertEqual(list(arrays), ['y_pred'])
+    np.testing.assert_array_equal(arrays['y_pred'], [[0.] * 4, [2.] * 4])
+
+  def test_fast_load_with_index(self):
+    results_dir = self.create_tempdir().full_path
+    for model_dir in ('dropout_k1_indomain_mc5', 'radial_k1_indomain_mc5'):
+      for seed in (0, 1):
+        results_storage_utils.store_eval_results(
+            os.path.join(results_dir, model_dir, 'single', 'in_domain_test'),
+            {'y_pred': np.full(3, seed, dtype=np.float32)},
+            epoch=seed)
+
+    index = results_storage_utils.get_results_index(results_dir)
+    with mock.patch.object(
+        results_storage_utils.ResultsIndex, 'load',
+        autospec=True, side_effect=results_storage_utils.ResultsIndex.load
+    ) as load:
+      results = results_storage_utils.fast_load_dataset_to_model_results(
+          results_dir, use_index=True, model_dirs=['dropout_k1_indomain_mc5/'],
+          seeds=[1])
+    # The model directories are filtered by the query of the arrays.
+    self.assertEqual(
+        load.call_args.kwargs['run_dir'],
+        [os.path.join('dropout_k1_indomain_mc5', 'single')])
+    self.assertEqual(list(results), ['in_domain_test'])
+    model_results = results['in_domain_test']
+    self.assertEqual(list(model_results),
+                     [('dropout', 1, False, 'indomain', '5')])
+    np.testing.assert_array_equal(
+        model_results[('dropout', 1, False, 'indomain', '5')]['y_pred'],
+        [[1.] * 3])
+    self.assertLen(index.load(results_storage_utils.EVAL_RESULTS_TABLE), 4)
+
+  def test_get_results_from_model_dir_with_legacy_tsv(self):
+    model_dir = self.create_tempdir().full_path
+    self.assertIsNone(
+        results_storage_utils.get_results_from_model_dir(model_dir))
+
+    # Results stored in a `results.tsv` before the index was introduced.
+    legacy = _results_df('dropout', 0, [0.1, 0.2])
+    legacy.to_csv(os.path.join(model_dir, 'results.tsv'), sep='\t',
+                  index=False)
+    results_storage_utils.cache_eval_results(
+        model_dir, metadata_df=pd.DataFrame({'model_type': ['dropout']}),
+        results_df=_results_df('dropout', 1, [0.3, 0.4]))
+    self.assertTrue(
+        os.path.exists(
+            os.path.join(model_dir,
+                         results_storage_utils.RESULTS_INDEX_FILE_NAME)))
+
+    results = results_storage_utils.get_results_from_model_dir(model_dir)
+    self.assertLen(results, 4)
+    self.assertCountEqual(results['value'], [0.1, 0.2, 0.3, 0.4])
+
+    results = results_storage_utils.get_results_from_model_dir(
+        model_dir, train_seed=0)
+    np.testing.assert_allclose(results['value'], [0.1, 0.2])
+    results = results_storage_utils.get_results_from_model_dir(
+        model_dir, train_seed=[1])
+    np.testing.assert_allclose(results['value'], [0.3, 0.4])
+
+
+  def test_load_model_dir_result_with_cache(self):
+    model_dir = self.create_tempdir().full_path
+    self.assertEqual(
+        results_storage_utils.load_model_dir_result_with_cache(model_dir), {})
+    self.assertFalse(os.path.exists(os.path.join(model_dir, 'cache')))
+
+    results_storage_utils.store_eval_results(
+        os.path.join(model_dir, 'single', 'in_domain_test'),
+        {'y_pred': np.arange(3, dtype=np.float32)},
+        epoch=0)
+    results = results_storage_utils.load_model_dir_result_with_cache(model_dir)
+    self.assertTrue(os.path.exists(os.path.join(model_dir, 'cache')))
+    np.testing.assert_array_equal(
+        results['single']['in_domain_test']['y_pred'], [[0., 1., 2.]])
+
+    # The second call reads the cache, and does not see the new seed.
+    results_storage_utils.store_eval_results(
+        os.path.join(model_dir, 'single', 'in_domain_test'),
+        {'y_pred': np.arange(3, dtype=np.float32)},
+        epoch=1)
+    results = results_storage_utils.load_model_dir_result_with_cache(model_dir)
+    self.assertLen(results['single']['in_domain_test']['y_pred'], 1)
+
+  def test_parse_model_dir_name_v1(self):
+    expected = ('dropout', 3, False, 'indomain', '5')
+    for model_dir in ('dropout_k3_indomain_mc5', 'dropout_k3_indomain_mc5/'):
+      self.assertEqual(
+          results_storage_utils.parse_model_dir_name_v1(model_dir), expected)
+
+
+if __name__ == '__main__':
+  absltest.main()
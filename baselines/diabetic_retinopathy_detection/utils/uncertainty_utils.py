@@ -170,8 +170,87 @@ def predict_and_decompose_uncertainty_np(mc_samples: np.ndarray):
   }
 
 
-def variational_predict_and_decompose_uncertainty_np(x, model, training_setting,
-                                                     num_samples):
+def mc_samples_tf(x,
+                  model,
+                  training_setting,
+                  num_samples,
+                  max_batch_size,
+                  per_example_noise=True):
+  """Draws Monte Carlo samples from a model in as few forward passes as possible.
+
+  The input is tiled along the batch dimension so that each forward pass
+  computes up to `max_batch_size // B` samples, and the samples stay on the
+  device. Tiling only yields (pseudo-)independent samples for models whose
+  noise is drawn per example, such as dropout or Flipout layers. Models that
+  draw their weights once per forward pass, such as rank-1 BNNs, should use
+  `per_example_noise=False`, which computes a single sample per pass.
+
+  Args:
+    x: `tf.Tensor`, datapoints from input space, with shape [B, H, W, 3].
+    model: a probabilistic model which accepts input with shape [N, H, W, 3]
+      and outputs sigmoid probabilities with shape [N].
+    training_setting: bool, if True, run model prediction in training mode.
+    num_samples: `int`, number of Monte Carlo samples.
+    max_batch_size: `int`, maximum number of examples in a forward pass.
+    per_example_noise: bool, whether the model draws its noise per example.
+
+  Returns:
+    `tf.Tensor`, Monte Carlo samples with shape [num_samples, B].
+  """
+  b = tf.shape(x)[0]
+  if per_example_noise:
+    samples_per_pass = tf.clip_by_value(max_batch_size // b, 1, num_samples)
+  else:
+    samples_per_pass = tf.constant(1)
+  num_passes = (num_samples + samples_per_pass - 1) // samples_per_pass
+  multiples = tf.concat(
+      [[samples_per_pass], tf.ones([tf.rank(x) - 1], tf.int32)], axis=0)
+  tiled_x = tf.tile(x, multiples)
+
+  def body(i, samples):
+    probs = tf.cast(model(tiled_x, training=training_setting), tf.float32)
+    return i + 1, samples.write(i, tf.reshape(probs, [samples_per_pass, b]))
+
+  _, samples = tf.while_loop(
+      lambda i, _: i < num_passes, body,
+      (tf.constant(0), tf.TensorArray(tf.float32, size=num_passes)))
+  return samples.concat()[:num_samples]
+
+
+def ensemble_mc_samples_tf(x, models, training_setting, num_samples,
+                           max_batch_size, per_example_noise=True):
+  """Returns `mc_samples_tf` of each model, concatenated along the samples."""
+  return tf.concat([
+      mc_samples_tf(x, model, training_setting, num_samples, max_batch_size,
+                    per_example_noise) for model in models
+  ], axis=0)
+
+
+@tf.function
+def _batched_variational_predict_and_decompose_uncertainty_tf(
+    x, models, training_setting, num_samples, max_batch_size,
+    per_example_noise):
+  mc_samples = ensemble_mc_samples_tf(x, models, training_setting, num_samples,
+                                      max_batch_size, per_example_noise)
+  return predict_and_decompose_uncertainty_tf(mc_samples=mc_samples)
+
+
+def _batched_variational_predict_and_decompose_uncertainty_np(
+    x, models, training_setting, num_samples, max_batch_size,
+    per_example_noise):
+  """Batched estimator; only the [B] summaries are copied to the host."""
+  pred_and_uncert = _batched_variational_predict_and_decompose_uncertainty_tf(
+      tf.convert_to_tensor(x), tuple(models), training_setting, num_samples,
+      max_batch_size, per_example_noise)
+  return {key: value.numpy() for key, value in pred_and_uncert.items()}
+
+
+def variational_predict_and_decompose_uncertainty_np(x,
+                                                     model,
+                                                     training_setting,
+                                                     num_samples,
+                                                     max_batch_size=None,
+                                                     per_example_noise=True):
   """Monte Carlo uncertainty estimator for a variational model.
 
   Should work for all variational methods which sample from model posterior
@@ -189,6 +268,10 @@ def variational_predict_and_decompose_uncertainty_np(x, model, training_setting,
       note in docstring at top of file.
     num_samples: `int`, number of Monte Carlo samples (i.e. forward passes from
       dropout) used for the calculation of predictive mean and uncertainty.
+    max_batch_size: `int`, if set, compute several samples per forward pass
+      with up to `max_batch_size` examples, see `mc_samples_tf`.
+    per_example_noise: bool, whether the model draws its noise per example,
+      see `mc_samples_tf`.
 
   Returns:
     Dict: {
@@ -200,6 +283,12 @@ def variational_predict_and_decompose_uncertainty_np(x, model, training_setting,
     }
   """
 
+  if max_batch_size:
+    # The model must output a `tf.Tensor` to be run inside a `tf.function`.
+    return _batched_variational_predict_and_decompose_uncertainty_np(
+        x, (model,), training_setting, num_samples, max_batch_size,
+        per_example_noise)
+
   # Get shapes of data
   b, _, _, _ = x.shape
 
@@ -212,8 +301,12 @@ def variational_predict_and_decompose_uncertainty_np(x, model, training_setting,
   return predict_and_decompose_uncertainty_np(mc_samples=mc_samples)
 
 
-def variational_predict_and_decompose_uncertainty_tf(x, model, training_setting,
-                                                     num_samples):
+def variational_predict_and_decompose_uncertainty_tf(x,
+                                                     model,
+                                                     training_setting,
+                                                     num_samples,
+                                                     max_batch_size=None,
+                                                     per_example_noise=True):
   """Monte Carlo uncertainty estimator for a variational model.
 
   Should work for all variational methods which sample from model posterior
@@ -230,6 +323,10 @@ def variational_predict_and_decompose_uncertainty_tf(x, model, training_setting,
       note in docstring at top of file.
     num_samples: `int`, number of Monte Carlo samples (i.e. forward passes from
       dropout) used for the calculation of predictive mean and uncertainty.
+    max_batch_size: `int`, if set, compute several samples per forward pass
+      with up to `max_batch_size` examples, see `mc_samples_tf`.
+    per_example_noise: bool, whether the model draws its noise per example,
+      see `mc_samples_tf`.
 
   Returns:
     Dict: {
@@ -241,6 +338,11 @@ def variational_predict_and_decompose_uncertainty_tf(x, model, training_setting,
     }
   """
 
+  if max_batch_size:
+    mc_samples = mc_samples_tf(x, model, training_setting, num_samples,
+                               max_batch_size, per_example_noise)
+    return predict_and_decompose_uncertainty_tf(mc_samples=mc_samples)
+
   # Get shapes of data
   b = tf.shape(x)[0]
 
@@ -258,7 +360,12 @@ def variational_predict_and_decompose_uncertainty_tf(x, model, training_setting,
 
 
 def variational_ensemble_predict_and_decompose_uncertainty_np(
-    x, models, training_setting, num_samples):
+    x,
+    models,
+    training_setting,
+    num_samples,
+    max_batch_size=None,
+    per_example_noise=True):
   """Monte Carlo uncertainty estimator for ensembles of variational models.
 
   Should work for all variational methods which sample from model posterior
@@ -277,6 +384,10 @@ def variational_ensemble_predict_and_decompose_uncertainty_np(
       note in docstring at top of file.
     num_samples: `int`, number of Monte Carlo samples (i.e. forward passes from
       dropout) used for the calculation of predictive mean and uncertainty.
+    max_batch_size: `int`, if set, compute several samples per forward pass
+      with up to `max_batch_size` examples, see `mc_samples_tf`.
+    per_example_noise: bool, whether the model draws its noise per example,
+      see `mc_samples_tf`.
 
   Returns:
     Dict: {
@@ -288,6 +399,12 @@ def variational_ensemble_predict_and_decompose_uncertainty_np(
     }
   """
 
+  if max_batch_size:
+    # The models must output a `tf.Tensor` to be run inside a `tf.function`.
+    return _batched_variational_predict_and_decompose_uncertainty_np(
+        x, models, training_setting, num_samples, max_batch_size,
+        per_example_noise)
+
   # Get shapes of data
   b, _, _, _ = x.shape
 
@@ -306,7 +423,12 @@ def variational_ensemble_predict_and_decompose_uncertainty_np(
 
 
 def variational_ensemble_predict_and_decompose_uncertainty_tf(
-    x, models, training_setting, num_samples):
+    x,
+    models,
+    training_setting,
+    num_samples,
+    max_batch_size=None,
+    per_example_noise=True):
   """Monte Carlo uncertainty estimator for ensembles of variational models.
 
   Should work for all variational methods which sample from model posterior
@@ -324,6 +446,10 @@ def variational_ensemble_predict_and_decompose_uncertainty_tf(
       note in docstring at top of file.
     num_samples: `int`, number of Monte Carlo samples (i.e. forward passes from
       dropout) used for the calculation of predictive mean and uncertainty.
+    max_batch_size: `int`, if set, compute several samples per forward pass
+      with up to `max_batch_size` examples, see `mc_samples_tf`.
+    per_example_noise: bool, whether the model draws its noise per example,
+      see `mc_samples_tf`.
 
   Returns:
     Dict: {
@@ -335,6 +461,12 @@ def variational_ensemble_predict_and_decompose_uncertainty_tf(
     }
   """
 
+  if max_batch_size:
+    mc_samples = ensemble_mc_samples_tf(x, models, training_setting,
+                                        num_samples, max_batch_size,
+                                        per_example_noise)
+    return predict_and_decompose_uncertainty_tf(mc_samples=mc_samples)
+
   # Get shapes of data
   b = x.shape[0]
 
@@ -713,9 +845,13 @@ RETINOPATHY_MODEL_TO_DECOMPOSED_UNCERTAINTY_ESTIMATOR = {
     ('variational_inference', True):
         (variational_ensemble_predict_and_decompose_uncertainty_np),
     ('rank1', False):
-        variational_predict_and_decompose_uncertainty_np,
+        functools.partial(
+            variational_predict_and_decompose_uncertainty_np,
+            per_example_noise=False),
     ('rank1', True):
-        variational_ensemble_predict_and_decompose_uncertainty_np,
+        functools.partial(
+            variational_ensemble_predict_and_decompose_uncertainty_np,
+            per_example_noise=False),
     ('swag', False):
         None,  # SWAG requires sampling outside the dataset loop
     ('swag', True):
@@ -745,10 +881,16 @@ RETINOPATHY_MODEL_TO_TF_DECOMPOSED_UNCERTAINTY_ESTIMATOR = {
         (variational_predict_and_decompose_uncertainty_tf),
     ('variational_inference', True):
         (variational_ensemble_predict_and_decompose_uncertainty_tf),
-    # Rank 1 BNNs also have default functionality for mixture posteriors
-    ('rank1', False): (variational_predict_and_decompose_uncertainty_tf),
+    # Rank 1 BNNs also have default functionality for mixture posteriors.
+    # Their rank-1 factors are sampled once per forward pass.
+    ('rank1', False):
+        functools.partial(
+            variational_predict_and_decompose_uncertainty_tf,
+            per_example_noise=False),
     ('rank1', True):
-        (variational_ensemble_predict_and_decompose_uncertainty_tf),
+        functools.partial(
+            variational_ensemble_predict_and_decompose_uncertainty_tf,
+            per_example_noise=False),
     ('swag', False):
         None,  # SWAG requires sampling outside the dataset loop
     ('swag', True):
@@ -0,0 +1,120 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the batched Monte Carlo estimators of the retinopathy models."""
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+from utils import uncertainty_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+_BATCH_SIZE = 3
+_NUM_SAMPLES = 7
+
+
+class _SampleSequenceModel:
+  """Returns the next rows of fixed MC samples, one row per input copy.
+
+  A per-sample forward pass of a batch returns one row, while a forward pass of
+  the batch tiled k times returns the next k rows, so both sampling schemes
+  see the same sequence of samples.
+  """
+
+  def __init__(self, seed):
+    rng = np.random.RandomState(seed)
+    # Extra rows for the samples of the last pass that are dropped.
+    self._samples = tf.constant(
+        rng.uniform(0.01, 0.99, (2 * _NUM_SAMPLES, _BATCH_SIZE)), tf.float32)
+    self._next_row = tf.Variable(0)
+    self.num_calls = tf.Variable(0)
+
+  @property
+  def samples(self):
+    return self._samples[:_NUM_SAMPLES].numpy()
+
+  def reset(self):
+    self._next_row.assign(0)
+    self.num_calls.assign(0)
+
+  def __call__(self, x, training):
+    del training
+    num_rows = tf.shape(x)[0] // _BATCH_SIZE
+    rows = self._samples[self._next_row:self._next_row + num_rows]
+    self._next_row.assign_add(num_rows)
+    self.num_calls.assign_add(1)
+    return tf.reshape(rows, [-1, 1])
+
+
+class UncertaintyUtilsTest(parameterized.TestCase, tf.test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._x = tf.zeros([_BATCH_SIZE, 4, 4, 3])
+    self._models = [_SampleSequenceModel(seed) for seed in range(2)]
+
+  def _reset(self):
+    for model in self._models:
+      model.reset()
+
+  @parameterized.parameters(
+      # max_batch_size, per_example_noise, expected number of passes.
+      (3, True, 7),
+      (6, True, 4),
+      (9, True, 3),
+      (100, True, 1),
+      (100, False, 7),
+  )
+  def test_mc_samples_tf(self, max_batch_size, per_example_noise,
+                         expected_num_calls):
+    model = self._models[0]
+    mc_samples = uncertainty_utils.mc_samples_tf(
+        self._x, model, False, _NUM_SAMPLES, max_batch_size,
+        per_example_noise)
+    self.assertAllEqual(mc_samples, model.samples)
+    self.assertEqual(model.num_calls.numpy(), expected_num_calls)
+
+  @parameterized.parameters(
+      (None, True), (6, True), (100, True), (100, False))
+  def test_batched_estimators_match_per_sample_decomposition(
+      self, max_batch_size, per_example_noise):
+    for ensemble in (False, True):
+      models = self._models if ensemble else self._models[:1]
+      expected = uncertainty_utils.predict_and_decompose_uncertainty_np(
+          np.concatenate([model.samples for model in models]))
+      if ensemble:
+        estimators = (
+            uncertainty_utils
+            .variational_ensemble_predict_and_decompose_uncertainty_np,
+            uncertainty_utils
+            .variational_ensemble_predict_and_decompose_uncertainty_tf)
+        model_arg = models
+      else:
+        estimators = (
+            uncertainty_utils.variational_predict_and_decompose_uncertainty_np,
+            uncertainty_utils.variational_predict_and_decompose_uncertainty_tf)
+        model_arg = models[0]
+      for estimator in estimators:
+        self._reset()
+        results = estimator(
+            self._x, model_arg, training_setting=False,
+            num_samples=_NUM_SAMPLES, max_batch_size=max_batch_size,
+            per_example_noise=per_example_noise)
+        self.assertCountEqual(results, expected)
+        for key, value in expected.items():
+          self.assertAllClose(results[key], value, atol=1e-5, msg=key)
+
+
+if __name__ == '__main__':
+  tf.test.main()
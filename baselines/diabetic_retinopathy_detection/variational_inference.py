@@ -69,6 +69,10 @@ flags.DEFINE_bool('load_from_checkpoint', False,
                   'Attempt to load from checkpoint')
 flags.DEFINE_string('checkpoint_dir', None, 'Path to load Keras checkpoints.')
 flags.DEFINE_bool('cache_eval_datasets', False, 'Caches eval datasets.')
+flags.DEFINE_string(
+    'preprocessed_cache_dir', None,
+    'Optional local directory of a persistent cache of the resized images, '
+    'reused across runs and seeds.')
 
 # Logging and hyperparameter tuning.
 flags.DEFINE_bool('use_wandb', True, 'Use wandb for logging.')
@@ -106,6 +110,10 @@ flags.DEFINE_integer('num_mc_samples_train', 1,
                      'Number of MC samples used during training.')
 flags.DEFINE_integer('num_mc_samples_eval', 5,
                      'Number of MC samples to use for prediction.')
+flags.DEFINE_integer(
+    'mc_max_batch_size', None,
+    'If set, compute several MC samples per forward pass at evaluation, by '
+    'tiling the batch up to this many examples.')
 flags.DEFINE_bool(
     'tied_mean_prior', True,
     'If True, fix the mean of the prior to that of the variational posterior. '
@@ -329,7 +337,10 @@ def main(argv):
   eval_estimator = utils.wrap_retinopathy_estimator(
       model, use_mixed_precision=FLAGS.use_bfloat16, numpy_outputs=False)
 
-  estimator_args = {'num_samples': FLAGS.num_mc_samples_eval}
+  estimator_args = {
+      'num_samples': FLAGS.num_mc_samples_eval,
+      'max_batch_size': FLAGS.mc_max_batch_size
+  }
 
   @tf.function
   def train_step(iterator):
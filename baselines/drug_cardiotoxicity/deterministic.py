@@ -115,6 +115,13 @@ flags.DEFINE_float(
     'mask_stddev', 0.5, 'Standard deviation of random normal distribution used '
     'to generate features of mask.')
 
+flags.DEFINE_enum(
+    'graph_format', 'dense', ['dense', 'sparse'],
+    'Whether to batch molecules padded to the same number of atoms with dense '
+    'adjacency tensors, or packed into a single graph with a list of bonds, '
+    'such that message passing only computes messages along the bonds. The '
+    'sparse format is only supported on a single GPU or CPU.')
+
 # Loss type.
 flags.DEFINE_enum('loss_type', 'xent', ['xent', 'focal'],
                   'Type of loss function to use.')
@@ -323,15 +330,20 @@ def main(argv: Sequence[str]):
   else:
     logging.info('Using GPU for training.')
     strategy = tf.distribute.MirroredStrategy()
+  utils.check_graph_format(FLAGS.graph_format, strategy, FLAGS.use_gpu)
+  if FLAGS.graph_format == 'sparse' and FLAGS.augmentations:
+    raise ValueError('Graph augmentations require the dense graph format.')
 
   train_dataset, steps_per_epoch = utils.load_dataset(FLAGS.data_dir,
                                                       tfds.Split.TRAIN,
-                                                      FLAGS.batch_size)
+                                                      FLAGS.batch_size,
+                                                      FLAGS.graph_format)
 
   eval_identifiers = ['tune', 'test1', 'test2']
   splits = [tfds.Split.VALIDATION, tfds.Split.TEST, tfds.Split('test2')]
   eval_datasets, steps_per_eval = utils.load_eval_datasets(
-      eval_identifiers, splits, FLAGS.data_dir, FLAGS.batch_size)
+      eval_identifiers, splits, FLAGS.data_dir, FLAGS.batch_size,
+      FLAGS.graph_format)
 
   logging.info('Steps for eval datasets: %s', steps_per_eval)
   graph_augmenter = None
@@ -95,6 +95,13 @@ flags.DEFINE_float('spec_norm_multiplier_mp', 1.0,
                    'Multiplier used to control the magnitude of'
                    'eigenvalue of the message passing layer weight matrix.')
 
+flags.DEFINE_enum(
+    'graph_format', 'dense', ['dense', 'sparse'],
+    'Whether to batch molecules padded to the same number of atoms with dense '
+    'adjacency tensors, or packed into a single graph with a list of bonds, '
+    'such that message passing only computes messages along the bonds. The '
+    'sparse format is only supported on a single GPU or CPU.')
+
 # Loss type.
 flags.DEFINE_enum('loss_type', 'xent', ['xent', 'focal'],
                   'Type of loss function to use.')
@@ -303,15 +310,18 @@ def main(argv: Sequence[str]):
   else:
     logging.info('Using GPU for training.')
     strategy = tf.distribute.MirroredStrategy()
+  utils.check_graph_format(FLAGS.graph_format, strategy, FLAGS.use_gpu)
 
   train_dataset, steps_per_epoch = utils.load_dataset(FLAGS.data_dir,
                                                       tfds.Split.TRAIN,
-                                                      FLAGS.batch_size)
+                                                      FLAGS.batch_size,
+                                                      FLAGS.graph_format)
 
   eval_identifiers = ['tune', 'test1', 'test2']
   splits = [tfds.Split.VALIDATION, tfds.Split.TEST, tfds.Split('test2')]
   eval_datasets, steps_per_eval = utils.load_eval_datasets(
-      eval_identifiers, splits, FLAGS.data_dir, FLAGS.batch_size)
+      eval_identifiers, splits, FLAGS.data_dir, FLAGS.batch_size,
+      FLAGS.graph_format)
 
   logging.info('Steps for eval datasets: %s', steps_per_eval)
 
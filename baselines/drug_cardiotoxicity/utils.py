@@ -82,6 +82,24 @@ class GATParameters:
   steps_per_epoch: Optional[int] = None
 
 
+def check_graph_format(graph_format: str, strategy: tf.distribute.Strategy,
+                       use_gpu: bool):
+  """Checks that the graph format is supported by the distribution strategy.
+
+  Sparse batches pack a varying number of atoms and bonds, which can neither
+  be compiled for TPUs nor split across replicas.
+
+  Args:
+    graph_format: Either 'dense' or 'sparse'.
+    strategy: The distribution strategy.
+    use_gpu: Whether the strategy runs on GPUs rather than TPUs.
+  """
+  if graph_format == 'sparse' and (not use_gpu or
+                                   strategy.num_replicas_in_sync > 1):
+    raise ValueError('The sparse graph format is only supported on a single '
+                     'GPU or CPU.')
+
+
 def get_tpu_strategy(master: str) -> tf.distribute.TPUStrategy:
   """Builds a TPU distribution strategy."""
   logging.info('TPU master: %s', master)
@@ -109,7 +127,7 @@ def get_metric_result_value(metric):
     raise ValueError(f'Metric type {type(metric)} not supported.')
 
 
-def load_dataset(data_dir, split, batch_size):
+def load_dataset(data_dir, split, batch_size, graph_format='dense'):
   """Loads a single dataset with specific split."""
   known_splits = [
       tfds.Split.TRAIN, tfds.Split.VALIDATION, tfds.Split.TEST,
@@ -123,7 +141,10 @@ def load_dataset(data_dir, split, batch_size):
         'than "train", "validation", "test".'.format(split))
 
   builder = DrugCardiotoxicityDataset(
-      split=split, data_dir=data_dir, is_training=is_training)
+      split=split,
+      data_dir=data_dir,
+      is_training=is_training,
+      graph_format=graph_format)
   dataset = builder.load(
       batch_size=batch_size).map(lambda x: (x['features'], x['labels']))
   steps = builder.num_examples//batch_size
@@ -133,13 +154,17 @@ def load_dataset(data_dir, split, batch_size):
   return dataset, steps
 
 
-def load_eval_datasets(identifiers, splits, data_dir, batch_size):
+def load_eval_datasets(identifiers,
+                       splits,
+                       data_dir,
+                       batch_size,
+                       graph_format='dense'):
   """Loads all the eval datasets with specific splits."""
   eval_datasets = {}
   steps_per_eval = {}
 
   for identifier, split in zip(identifiers, splits):
-    dataset, steps = load_dataset(data_dir, split, batch_size)
+    dataset, steps = load_dataset(data_dir, split, batch_size, graph_format)
     eval_datasets[identifier] = dataset
     steps_per_eval[identifier] = steps
 
@@ -50,6 +50,9 @@ flags.DEFINE_float('base_learning_rate', 0.1,
 flags.DEFINE_float('one_minus_momentum', 0.1, 'Optimizer momentum.')
 flags.DEFINE_float('l2', 1e-4, 'L2 coefficient.')
 flags.DEFINE_string('data_dir', None, 'Path to training and testing data.')
+flags.DEFINE_string('preprocessed_cache_dir', None,
+                    'Optional local directory of a persistent cache of the '
+                    'decoded and resized images, reused across runs and seeds.')
 flags.DEFINE_string('output_dir', '/tmp/imagenet',
                     'The directory where the model weights and '
                     'training/evaluation summaries are stored.')
@@ -137,10 +140,14 @@ def main(argv):
       one_hot=True,
       mixup_params=mixup_params,
       validation_percent=1.0 - FLAGS.train_proportion,
-      data_dir=data_dir)
+      data_dir=data_dir,
+      cache_dir=FLAGS.preprocessed_cache_dir)
   steps_per_epoch = train_builder.num_examples // batch_size
   test_builder = ub.datasets.ImageNetDataset(
-      split=tfds.Split.TEST, use_bfloat16=FLAGS.use_bfloat16, data_dir=data_dir)
+      split=tfds.Split.TEST,
+      use_bfloat16=FLAGS.use_bfloat16,
+      data_dir=data_dir,
+      cache_dir=FLAGS.preprocessed_cache_dir)
   train_dataset = train_builder.load(batch_size=batch_size, strategy=strategy)
   test_dataset = test_builder.load(batch_size=batch_size, strategy=strategy)
   steps_per_test_eval = IMAGENET_VALIDATION_IMAGES // batch_size
@@ -153,7 +160,8 @@ def main(argv):
         use_bfloat16=FLAGS.use_bfloat16,
         mixup_params=mixup_params,
         validation_percent=1.0 - FLAGS.train_proportion,
-        data_dir=data_dir)
+        data_dir=data_dir,
+        cache_dir=FLAGS.preprocessed_cache_dir)
     validation_dataset = validation_builder.load(
         batch_size=batch_size, strategy=strategy)
     steps_per_validation_eval = validation_builder.num_examples // batch_size
@@ -165,7 +173,8 @@ def main(argv):
         split=tfds.Split.TRAIN,
         use_bfloat16=FLAGS.use_bfloat16,
         one_hot=True,
-        data_dir=data_dir)
+        data_dir=data_dir,
+        cache_dir=FLAGS.preprocessed_cache_dir)
     tr_data_no_mixup = imagenet_train_no_mixup.load(
         batch_size=batch_size, strategy=strategy)
 
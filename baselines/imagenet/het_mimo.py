@@ -66,6 +66,9 @@ flags.DEFINE_float('temperature', 1.5,
                    'Temperature for heteroscedastic head.')
 flags.DEFINE_integer('num_mc_samples', 1000,
                      'Num MC samples for heteroscedastic layer.')
+flags.DEFINE_integer('num_eval_mc_samples', None,
+                     'Num MC samples for heteroscedastic layer at evaluation. '
+                     'Defaults to num_mc_samples.')
 flags.DEFINE_bool('share_het_layer', True,
                   'Whether to use a single heteroscedastic layer of output size'
                   '(num_classes * ensemble_size), or to generate an ensemble'
@@ -137,6 +140,7 @@ def main(argv):
         num_factors=FLAGS.num_factors,
         temperature=FLAGS.temperature,
         num_mc_samples=FLAGS.num_mc_samples,
+        num_eval_mc_samples=FLAGS.num_eval_mc_samples,
         share_het_layer=FLAGS.share_het_layer,
         width_multiplier=FLAGS.width_multiplier,
         return_unaveraged_logits=True)
@@ -98,6 +98,20 @@ flags.DEFINE_float('temperature', 1.5,
                    'Temperature for heteroscedastic head.')
 flags.DEFINE_integer('num_mc_samples', 5000,
                      'Num MC samples for heteroscedastic layer.')
+flags.DEFINE_integer('num_eval_mc_samples', None,
+                     'Num MC samples for heteroscedastic layer at evaluation. '
+                     'Defaults to num_mc_samples.')
+flags.DEFINE_integer('mc_chunk_size', None,
+                     'If set, accumulate the MC estimate over chunks of this '
+                     'many samples instead of materializing the logits of all '
+                     'the samples. The joint NLL is then not computed.')
+flags.DEFINE_bool('antithetic_mc_samples', False,
+                  'Whether to draw antithetic pairs of MC samples. Requires '
+                  'mc_chunk_size.')
+flags.DEFINE_float('eval_mc_stderr_tolerance', None,
+                   'If set, stop MC sampling at evaluation once the standard '
+                   'error of the predictive probabilities is below this '
+                   'tolerance. Requires mc_chunk_size.')
 flags.DEFINE_bool('multiclass', True,
                   'Whether to use a softmax (multiclass=True) or sigmoid loss.')
 flags.DEFINE_bool('tune_temperature', False,
@@ -209,15 +223,21 @@ def main(argv):
       mean_labels = tf.Variable(tf.zeros((NUM_CLASSES,), dtype=tf.float32))
 
     logging.info('Building Keras ResNet-50 model')
+    # The chunked MC estimate does not return the unaveraged logits.
+    chunked_mc_samples = FLAGS.mc_chunk_size is not None
     model = ub.models.resnet50_heteroscedastic(
         input_shape=IMAGE_SHAPE, num_classes=NUM_CLASSES,
         temperature=FLAGS.temperature, num_factors=FLAGS.num_factors,
         num_mc_samples=FLAGS.num_mc_samples,
-        return_unaveraged_logits=True,
+        return_unaveraged_logits=not chunked_mc_samples,
         multiclass=FLAGS.multiclass,
         tune_temperature=FLAGS.tune_temperature,
         temperature_lower_bound=FLAGS.temperature_lower_bound,
-        temperature_upper_bound=FLAGS.temperature_upper_bound)
+        temperature_upper_bound=FLAGS.temperature_upper_bound,
+        num_eval_mc_samples=FLAGS.num_eval_mc_samples,
+        mc_chunk_size=FLAGS.mc_chunk_size,
+        antithetic_mc_samples=FLAGS.antithetic_mc_samples,
+        eval_mc_stderr_tolerance=FLAGS.eval_mc_stderr_tolerance)
     logging.info('Model input shape: %s', model.input_shape)
     logging.info('Model output shape: %s', model.output_shape)
     logging.info('Model number of weights: %s', model.count_params())
@@ -245,11 +265,12 @@ def main(argv):
             num_bins=FLAGS.num_bins),
         'train/temperature': tf.keras.metrics.Mean(),
         'test/negative_log_likelihood': tf.keras.metrics.Mean(),
-        'test/joint_nll': tf.keras.metrics.Mean(),
         'test/accuracy': tf.keras.metrics.SparseCategoricalAccuracy(),
         'test/ece': rm.metrics.ExpectedCalibrationError(
             num_bins=FLAGS.num_bins),
     }
+    if not chunked_mc_samples:
+      metrics['test/joint_nll'] = tf.keras.metrics.Mean()
     logging.info('Finished building Keras ResNet-50 model')
 
     if enable_mixup:
@@ -324,7 +345,9 @@ def main(argv):
 
       with tf.GradientTape() as tape:
 
-        logits, _ = model(images, training=True)
+        logits = model(images, training=True)
+        if not chunked_mc_samples:
+          logits, _ = logits
         if FLAGS.use_bfloat16:
           logits = tf.cast(logits, tf.float32)
 
@@ -384,22 +407,28 @@ def main(argv):
       images = inputs['features']
       labels = inputs['labels']
 
-      logits, unaveraged_logits = model(images, training=False)
+      if chunked_mc_samples:
+        logits = model(images, training=False)
+      else:
+        logits, unaveraged_logits = model(images, training=False)
       if FLAGS.use_bfloat16:
         logits = tf.cast(logits, tf.float32)
-        unaveraged_logits = tf.cast(unaveraged_logits, tf.float32)
 
       update_test_metrics(labels, logits)
-      joint_nll = dyadic_nll(tf.transpose(unaveraged_logits, [1, 0, 2]),
-                             tf.expand_dims(labels, axis=1))
-      metrics['test/joint_nll'].update_state(joint_nll)
+      if not chunked_mc_samples:
+        unaveraged_logits = tf.cast(unaveraged_logits, tf.float32)
+        joint_nll = dyadic_nll(tf.transpose(unaveraged_logits, [1, 0, 2]),
+                               tf.expand_dims(labels, axis=1))
+        metrics['test/joint_nll'].update_state(joint_nll)
 
       # Rescaling logic in Eq.(15) from [2]
       if enable_mixup:
         images *= mean_theta
         images += (1.-mean_theta) * tf.cast(mean_images, images.dtype)
 
-        scaled_logits, _ = model(images, training=False)
+        scaled_logits = model(images, training=False)
+        if not chunked_mc_samples:
+          scaled_logits, _ = scaled_logits
         if FLAGS.use_bfloat16:
           scaled_logits = tf.cast(scaled_logits, tf.float32)
 
@@ -501,6 +530,10 @@ def main(argv):
         'num_factors': FLAGS.num_factors,
         'temperature': FLAGS.temperature,
         'num_mc_samples': FLAGS.num_mc_samples,
+        'num_eval_mc_samples': FLAGS.num_eval_mc_samples or (
+            FLAGS.num_mc_samples),
+        'mc_chunk_size': FLAGS.mc_chunk_size or 0,
+        'antithetic_mc_samples': FLAGS.antithetic_mc_samples,
         'tune_temperature': FLAGS.tune_temperature,
         'temperature_lower_bound': FLAGS.temperature_lower_bound,
         'temperature_upper_bound': FLAGS.temperature_upper_bound
@@ -142,6 +142,9 @@ flags.DEFINE_float('temperature', 1.25,
                    'Temperature for heteroscedastic head.')
 flags.DEFINE_integer('num_mc_samples', 5000,
                      'Num MC samples for heteroscedastic layer.')
+flags.DEFINE_integer('num_eval_mc_samples', None,
+                     'Num MC samples for heteroscedastic layer at evaluation. '
+                     'Defaults to num_mc_samples.')
 
 # HetSNGP-specific flags
 flags.DEFINE_float('sngp_var_weight', 1., 'Weight for the SNGP variance.')
@@ -254,6 +257,7 @@ def main(argv):
         spec_norm_bound=FLAGS.spec_norm_bound,
         temperature=FLAGS.temperature,
         num_mc_samples=FLAGS.num_mc_samples,
+        num_eval_mc_samples=FLAGS.num_eval_mc_samples,
         sngp_var_weight=FLAGS.sngp_var_weight,
         het_var_weight=FLAGS.het_var_weight)
     logging.info('Model input shape: %s', model.input_shape)
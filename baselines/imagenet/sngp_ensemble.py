@@ -45,6 +45,22 @@ flags.DEFINE_integer('num_bins', 15, 'Number of bins for ECE computation.')
 flags.DEFINE_bool('evaluate_corrupted_data', False,
                   'Evaluate on `imagenet2012_corrupted` datasets.')
 
+# Greedy ensemble selection flags.
+flags.DEFINE_integer(
+    'greedy_ensemble_size', 0,
+    'If positive, greedily select (with replacement) at most this many unique '
+    'members among the checkpoints, following Caruana et al. (2004), instead '
+    'of averaging all of them.')
+flags.DEFINE_enum('greedy_objective', 'nll',
+                  enum_values=['nll', 'acc', 'nll-acc'],
+                  help='Objective that drives the greedy selection.')
+flags.DEFINE_float(
+    'greedy_validation_percent', 0.01,
+    'Percent of the training set held out to select the ensemble members.')
+flags.DEFINE_integer('greedy_chunk_size', None,
+                     'Number of candidates scored together at every greedy '
+                     'step. If None, all the candidates are scored together.')
+
 # SNGP ensemble flags
 flags.DEFINE_float(
     'gp_mean_field_factor_ensemble', -1,
@@ -192,10 +208,61 @@ def main(argv):
   logging.info('Ensemble filenames: %s', str(ensemble_filenames))
   checkpoint = tf.train.Checkpoint(model=model)
 
+  members = list(range(ensemble_size))
+  if FLAGS.greedy_ensemble_size > 0:
+    val_builder = ub.datasets.ImageNetDataset(
+        split=tfds.Split.VALIDATION,
+        validation_percent=FLAGS.greedy_validation_percent,
+        use_bfloat16=FLAGS.use_bfloat16,
+        data_dir=FLAGS.data_dir)
+    val_dataset = val_builder.load(batch_size=batch_size)
+    steps_per_val_eval = val_builder.num_examples // batch_size
+    labels_filename = os.path.join(FLAGS.output_dir, 'val_labels.npy')
+    val_logits = []
+    for m, ensemble_filename in enumerate(ensemble_filenames):
+      filename = os.path.join(FLAGS.output_dir, 'val_{}.npy'.format(m))
+      if not (tf.io.gfile.exists(filename) and
+              tf.io.gfile.exists(labels_filename)):
+        checkpoint.restore(ensemble_filename)
+        logits, labels = [], []
+        val_iterator = iter(val_dataset)
+        for _ in range(steps_per_val_eval):
+          inputs = next(val_iterator)  # pytype: disable=attribute-error
+          logits_member, covmat_member = model(inputs['features'],  # pytype: disable=unsupported-operands
+                                               training=False)
+          # Select the members on the predictions used for the evaluation.
+          logits.append(
+              ed.layers.utils.mean_field_logits(
+                  logits_member, covmat_member,
+                  FLAGS.gp_mean_field_factor_ensemble))
+          labels.append(tf.reshape(inputs['labels'], [-1]))  # pytype: disable=unsupported-operands
+        with tf.io.gfile.GFile(filename, 'w') as f:
+          np.save(f, tf.concat(logits, axis=0).numpy())
+        with tf.io.gfile.GFile(labels_filename, 'w') as f:
+          np.save(f, tf.concat(labels, axis=0).numpy())
+      with tf.io.gfile.GFile(filename, 'rb') as f:
+        val_logits.append(np.load(f))
+      logging.info('Computed validation logits of ensemble member %d/%d.',
+                   m + 1, ensemble_size)
+    with tf.io.gfile.GFile(labels_filename, 'rb') as f:
+      val_labels = np.load(f)
+
+    members, val_acc, val_nll = ub.ensemble_selection.greedy_selection(
+        val_logits,
+        val_labels,
+        FLAGS.greedy_ensemble_size,
+        FLAGS.greedy_objective,
+        chunk_size=FLAGS.greedy_chunk_size)
+    logging.info(
+        'Members selected by greedy procedure: %s (val accuracy %.4f, val NLL '
+        '%.4f)\n\t%s', members, val_acc, val_nll,
+        [ensemble_filenames[m] for m in members])
+  unique_members = sorted(set(members))
+
   # Write model predictions to files.
   num_datasets = len(test_datasets)
-  for m, ensemble_filename in enumerate(ensemble_filenames):
-    checkpoint.restore(ensemble_filename)
+  for i, m in enumerate(unique_members):
+    checkpoint.restore(ensemble_filenames[m])
     for n, (name, test_dataset) in enumerate(test_datasets.items()):
       filename = '{dataset}_{member}.npy'.format(dataset=name, member=m)
       filename = os.path.join(FLAGS.output_dir, filename)
@@ -220,11 +287,12 @@ def main(argv):
           np.save(f, logits.numpy())
         with tf.io.gfile.GFile(filename_stddev, 'w') as f:
           np.save(f, stddev.numpy())
-      percent = (m * num_datasets + (n + 1)) / (ensemble_size * num_datasets)
+      percent = ((i * num_datasets + (n + 1)) /
+                 (len(unique_members) * num_datasets))
       message = ('{:.1%} completion for prediction: ensemble member {:d}/{:d}. '
                  'Dataset {:d}/{:d}'.format(percent,
-                                            m + 1,
-                                            ensemble_size,
+                                            i + 1,
+                                            len(unique_members),
                                             n + 1,
                                             num_datasets))
       logging.info(message)
@@ -252,7 +320,7 @@ def main(argv):
   for n, (name, test_dataset) in enumerate(test_datasets.items()):
     logits_dataset = []
     stddev_dataset = []
-    for m in range(ensemble_size):
+    for m in members:
       filename = '{dataset}_{member}.npy'.format(dataset=name, member=m)
       filename = os.path.join(FLAGS.output_dir, filename)
       filename_stddev = '{dataset}_{member}_stddev.npy'.format(
@@ -278,7 +346,7 @@ def main(argv):
       # Generate logit samples.
       logits_samples = []
       logits_mean_fields = []
-      for m in range(ensemble_size):
+      for m in range(len(members)):
         logits_mean, logits_stddev = logits[m], stddev[m]
         # Compute mean-field logits for posterior mean computation.
         logits_mean_field = ed.layers.utils.mean_field_logits(
@@ -46,6 +46,7 @@ from clu import preprocess_spec
 import flax
 import flax.jax_utils as flax_utils
 import jax
+from jax.experimental import multihost_utils
 import jax.numpy as jnp
 from ml_collections.config_flags import config_flags
 import numpy as np
@@ -76,29 +77,21 @@ FLAGS = flags.FLAGS
 NINF_SCORE = float('-inf')
 
 
-def get_ids_logits_masks(*,
-                         model,
-                         opt_repl,
-                         ds,
-                         use_pre_logits=False,
-                         average_logits=True,
-                         prefetch_to_device=1,
-                         config=None):
-  """Obtain (pre) logits for each datapoint.
-
-  This can be then used to compute entropies, and so on.
+def make_compute_batch_outputs_fn(*,
+                                  model,
+                                  use_pre_logits=False,
+                                  average_logits=True,
+                                  config=None):
+  """Builds the pmapped function computing (pre) logits of a batch.
 
   Args:
     model: a initialized model.
-    opt_repl: an optimizer with parameters.
-    ds: a dataset.
     use_pre_logits: if True, return pre logit instead of logit
     average_logits: if True, average the logits.
-    prefetch_to_device: how many batches to prefix
     config: experiment config.
 
   Returns:
-    a tuple of jnp arrays of ids, logits, labels and masks.
+    a function mapping replicated params and images to the batch outputs.
   """
 
   @partial(jax.pmap, axis_name='batch')
@@ -133,31 +126,70 @@ def get_ids_logits_masks(*,
       else:
         output = logits
 
-    # TODO(joost,andreas): For multi host this requires:
-    # output = jax.lax.all_gather(output, axis_name='batch')
+    # The outputs are not gathered across hosts: each host scores its own
+    # shard of the pool and only the top candidates are exchanged, see
+    # `select_acquisition_batch_indices`.
     return output
 
+  return compute_batch_outputs
+
+
+def get_ids_logits_masks(*,
+                         model,
+                         opt_repl,
+                         ds,
+                         use_pre_logits=False,
+                         average_logits=True,
+                         prefetch_to_device=1,
+                         config=None):
+  """Obtain (pre) logits for each datapoint.
+
+  This can be then used to compute entropies, and so on.
+
+  Args:
+    model: a initialized model.
+    opt_repl: an optimizer with parameters.
+    ds: a dataset.
+    use_pre_logits: if True, return pre logit instead of logit
+    average_logits: if True, average the logits.
+    prefetch_to_device: how many batches to prefix
+    config: experiment config.
+
+  Returns:
+    a tuple of jnp arrays of ids, logits, labels and masks.
+  """
+  compute_batch_outputs = make_compute_batch_outputs_fn(
+      model=model,
+      use_pre_logits=use_pre_logits,
+      average_logits=average_logits,
+      config=config)
+
   iter_ds = input_utils.start_input_pipeline(ds, prefetch_to_device)
 
   outputs = []
   ids = []
   labels = []
   masks = []
+  pending_output = None
   for _, batch in enumerate(iter_ds):
     batch_id = batch['id']
     batch_label = batch['labels']
     batch_mask = batch['mask']
     batch_output = compute_batch_outputs(opt_repl.target, batch['image'])
 
-    # This moves the batch_output from TPU to CPU right away.
-    batch_output = jax.device_put(batch_output, jax.devices('cpu')[0])
+    # Start moving the batch_output from TPU to CPU, and only wait for the
+    # previous batch, so that the copies overlap with the computation. Each host
+    # only holds the outputs of its own shard of the dataset.
+    batch_output.copy_to_host_async()
+    if pending_output is not None:
+      outputs.append(np.asarray(pending_output))
+    pending_output = batch_output
 
-    # TODO(joost,andreas): if we run on multi host, we need to index
-    # batch_outputs: batch_outputs[0]
     ids.append(batch_id)
-    outputs.append(batch_output)
     labels.append(batch_label)
     masks.append(batch_mask)
+  if pending_output is not None:
+    outputs.append(np.asarray(pending_output))
 
   if average_logits:
     # 0 dimension is TPU shard, 1 is batch
@@ -178,6 +210,177 @@ def get_ids_logits_masks(*,
   return ids, outputs, labels, masks
 
 
+class PoolOutputs:
+  """Host buffer of the (pre) logits of the pool set across acquisition rounds.
+
+  The first `update` runs over the whole pool, writes the outputs of each batch
+  into a preallocated host buffer (grown geometrically if the pool is larger
+  than `capacity`) and builds an `al_utils.IdIndex` from the pool ids to the
+  buffer rows. Later updates may run over a subset of the pool only, whose
+  outputs are scattered into the buffer through the index, so an acquisition
+  round does not need to recompute the outputs of the whole pool.
+
+  Rows are stored in the order of the pool dataset, including the padding of
+  the last batch (with a False mask). The outputs of each row have the shape of
+  a single example, with the ensemble axis first for ensemble logits. With
+  multiple hosts, each host holds the outputs of its own shard of the pool.
+  """
+
+  def __init__(self,
+               *,
+               compute_batch_outputs,
+               ensemble_logits=False,
+               capacity=0):
+    """Init function.
+
+    Args:
+      compute_batch_outputs: the function returned by
+        `make_compute_batch_outputs_fn`.
+      ensemble_logits: True if the outputs are the (not averaged) logits of an
+        ensemble, which have the ensemble axis before the batch axis.
+      capacity: the number of rows to preallocate, e.g. the pool size.
+    """
+    self.compute_batch_outputs = compute_batch_outputs
+    self.ensemble_logits = ensemble_logits
+    self.num_rows = 0
+    self.num_updates = 0
+    self.index = None
+    self._capacity = capacity
+    self._ids = None
+    self._masks = None
+    self._outputs = None
+    self._acquired = None
+    self._last_update = None
+
+  @property
+  def ids(self):
+    return self._ids[:self.num_rows]
+
+  @property
+  def masks(self):
+    return self._masks[:self.num_rows]
+
+  @property
+  def outputs(self):
+    return self._outputs[:self.num_rows]
+
+  @property
+  def acquired(self):
+    return self._acquired[:self.num_rows]
+
+  def _allocate(self, num_rows, example_shape, dtype):
+    """Grows the buffers to hold at least `num_rows` rows."""
+    if self._outputs is not None and num_rows <= len(self._outputs):
+      return
+    capacity = max(num_rows, self._capacity)
+    if self._outputs is not None:
+      capacity = max(capacity, 2 * len(self._outputs))
+    self._capacity = capacity
+
+    def grow(buffer, shape, dtype, fill_value):
+      new_buffer = np.full((capacity,) + shape, fill_value, dtype=dtype)
+      if buffer is not None:
+        new_buffer[:self.num_rows] = buffer[:self.num_rows]
+      return new_buffer
+
+    self._ids = grow(self._ids, (), np.int64, -1)
+    self._masks = grow(self._masks, (), bool, False)
+    self._outputs = grow(self._outputs, example_shape, dtype, 0)
+    self._acquired = grow(self._acquired, (), bool, False)
+    self._last_update = grow(self._last_update, (), np.int64, -1)
+
+  def update(self, params, ds, prefetch_to_device=1):
+    """Computes the outputs of the examples of `ds` and stores them.
+
+    Args:
+      params: the replicated model parameters.
+      ds: the whole pool dataset for the first update, and the whole pool or a
+        subset of it afterwards.
+      prefetch_to_device: how many batches to prefix
+    """
+    initial = self.index is None
+    iter_ds = input_utils.start_input_pipeline(ds, prefetch_to_device)
+    pending = None
+    for batch in iter_ds:
+      batch_outputs = self.compute_batch_outputs(params, batch['image'])
+      # Start copying the outputs to the host, and store the previous batch
+      # while this one is computed and copied.
+      batch_outputs.copy_to_host_async()
+      if pending is not None:
+        self._store(*pending, initial=initial)
+      pending = (batch_outputs, batch['id'], batch['mask'])
+    if pending is not None:
+      self._store(*pending, initial=initial)
+
+    if initial:
+      valid_rows = np.flatnonzero(self.masks)
+      self.index = al_utils.IdIndex(self.ids[valid_rows], valid_rows)
+    self.num_updates += 1
+
+  def _store(self, batch_outputs, batch_ids, batch_masks, *, initial):
+    """Stores the outputs of a batch in the host buffer."""
+    batch_outputs = np.asarray(batch_outputs)
+    if self.ensemble_logits:
+      # [num_cores, ens_size, per_core_batch_size, ...] ->
+      # [num_cores, per_core_batch_size, ens_size, ...]
+      batch_outputs = np.moveaxis(batch_outputs, 1, 2)
+    # Flatten the TPU shard and batch axes into rows.
+    batch_outputs = batch_outputs.reshape((-1,) + batch_outputs.shape[2:])
+    batch_ids = np.asarray(batch_ids).ravel()
+    batch_masks = np.asarray(batch_masks, dtype=bool).ravel()
+
+    if initial:
+      rows = np.arange(self.num_rows, self.num_rows + len(batch_ids))
+      self._allocate(rows[-1] + 1, batch_outputs.shape[1:],
+                     batch_outputs.dtype)
+      self._ids[rows] = batch_ids
+      self._masks[rows] = batch_masks
+      self.num_rows += len(batch_ids)
+    else:
+      rows = self.index.lookup(batch_ids[batch_masks])
+      batch_outputs = batch_outputs[batch_masks]
+    self._outputs[rows] = batch_outputs
+    self._last_update[rows] = self.num_updates
+
+  def mark_acquired(self, ids):
+    """Marks the pool examples with `ids` as acquired.
+
+    Ids that are not in the pool (e.g., in the pool shard of another host) are
+    ignored.
+
+    Args:
+      ids: an iterable of ids.
+    """
+    ids = np.fromiter(ids, dtype=np.int64)
+    ids = ids[self.index.contains(ids)]
+    self._acquired[self.index.lookup(ids)] = True
+
+  def candidate_masks(self):
+    """Returns the masks of the pool examples that can still be acquired."""
+    return self.masks & ~self.acquired
+
+  def select_refresh_ids(self, *, refresh_fraction, max_staleness, rng):
+    """Selects the ids of the pool examples to recompute the outputs of.
+
+    Args:
+      refresh_fraction: the fraction of the candidate pool examples to refresh
+        at random.
+      max_staleness: refresh all candidates whose outputs were computed this
+        many updates ago or earlier. None to not refresh stale outputs.
+      rng: rng to sample the random subset.
+
+    Returns:
+      an array of ids.
+    """
+    candidates = self.candidate_masks()
+    refresh = np.array(
+        jax.random.uniform(rng, shape=candidates.shape) < refresh_fraction)
+    if max_staleness is not None:
+      staleness = self.num_updates - self._last_update[:self.num_rows]
+      refresh |= staleness >= max_staleness
+    return self.ids[candidates & refresh]
+
+
 def get_entropy_scores(logits, masks):
   """Obtain scores using entropy scoring.
 
@@ -297,6 +500,56 @@ def get_uniform_scores(masks, rng):
   return uniform_scores
 
 
+def fit_gaussian_stats(*, model, opt_repl, ds, prefetch_to_device=1,
+                       config=None):
+  """Fits class conditional Gaussians on the pre logits of a dataset.
+
+  The pre logits are streamed batch by batch into a
+  `ood_utils.GaussianStatsAccumulator`, so host memory does not grow with the
+  size of the dataset.
+
+  Args:
+    model: an initialized model.
+    opt_repl: the current optimizer.
+    ds: the dataset to fit the Gaussians on.
+    prefetch_to_device: how many batches to prefix
+    config: experiment config.
+
+  Returns:
+    a `ood_utils.GaussianStatsAccumulator` with the statistics of `ds`.
+  """
+  compute_batch_outputs = make_compute_batch_outputs_fn(
+      model=model, use_pre_logits=True, config=config)
+  iter_ds = input_utils.start_input_pipeline(ds, prefetch_to_device)
+
+  # The statistics are sized from the output shapes rather than from the first
+  # unmasked batch, so that a host whose shard holds only padding still has
+  # (empty) statistics to contribute to the merge across hosts.
+  image_spec = ds.element_spec['image']
+  pre_logits_shape = jax.eval_shape(
+      compute_batch_outputs, opt_repl.target,
+      jax.ShapeDtypeStruct(
+          tuple(image_spec.shape), image_spec.dtype.as_numpy_dtype)).shape
+  gaussian_stats = ood_utils.GaussianStatsAccumulator(
+      num_classes=ds.element_spec['labels'].shape[-1],
+      n_dim=pre_logits_shape[2],
+      ens_size=pre_logits_shape[3] if len(pre_logits_shape) == 4 else None)
+  for batch in iter_ds:
+    # pre_logits [num_cores, per_core_batch_size, hidden_size(, ens_size)]
+    pre_logits = np.asarray(
+        compute_batch_outputs(opt_repl.target, batch['image']))
+    masks_bool = np.asarray(batch['mask'], dtype=bool)
+    if not np.any(masks_bool):
+      continue
+    labels = np.asarray(batch['labels'])[masks_bool]
+    gaussian_stats.update(pre_logits[masks_bool], np.argmax(labels, axis=-1))
+
+  # The outputs are not gathered across hosts, so each host only saw its own
+  # shard of the dataset.
+  gaussian_stats.merge_across_hosts()
+  return gaussian_stats
+
+
 def get_density_scores(*,
                        model,
                        opt_repl,
@@ -318,76 +571,66 @@ def get_density_scores(*,
     a list of scores belonging to the pool set.
   """
   # Fit LDA
-  _, train_pre_logits, train_labels, train_masks = get_ids_logits_masks(
-      model=model,
-      opt_repl=opt_repl,
-      ds=train_ds,
-      use_pre_logits=True,
-      config=config)
-
-  # train_masks_bool [num_cores, per_core_batch_size]
-  train_masks_bool = train_masks.astype(bool)
-  # train_pre_logits [num_cores, per_core_batch_size, hidden_size, ens_size]
-  # train_embeds [batch_size, hidden_size, ens_size]
-  # batch_size = num_cores * per_core_batch_size
-  train_embeds = train_pre_logits[train_masks_bool]
-  train_labels = np.argmax(train_labels[train_masks_bool], axis=-1).ravel()
-
-  use_ens = False
-  if len(train_embeds.shape) == 3:
-    # The output needs to the ensembled
-    # embeds is of the shape [batch_size, hidden_size, ens_size]
-    use_ens = True
-    ens_size = train_embeds.shape[-1]
-
+  gaussian_stats = fit_gaussian_stats(
+      model=model, opt_repl=opt_repl, ds=train_ds, config=config)
+  use_ens = gaussian_stats.ens_size is not None
+  ens_size = gaussian_stats.ens_size
+
+  # The covariance factorization and the projected class means are computed
+  # once per model and shared across the whole pool.
+  mean_list, cov = gaussian_stats.mean_and_cov()
   if not use_ens:
     # Single model
-    # train_embeds shape [batch_size, hidden_size]
-    mean_list, cov = ood_utils.compute_mean_and_cov(train_embeds, train_labels)
+    scorer = ood_utils.MahalanobisScorer(
+        mean_list, cov, dtype=np.float32, use_jit=True)
   else:
     # Ensemble models
-    # train_embeds shape [batch_size, hidden_size, ens_size]
-    mean_list, cov = [], []
-    for m in range(ens_size):
-      mu, sigma = ood_utils.compute_mean_and_cov(train_embeds[..., m],
-                                                 train_labels)
-      mean_list.append(mu)
-      cov.append(sigma)
+    scorer = [
+        ood_utils.MahalanobisScorer(mu, sigma, dtype=np.float32, use_jit=True)
+        for mu, sigma in zip(mean_list, cov)
+    ]
 
   # Evaluate LDA on pool set
   if not use_ens:
     # Single model
     # pool_pre_logits [num_cores, per_core_batch_size, hidden_size]
     pool_pre_logits = pool_pre_logits.reshape(-1, pool_pre_logits.shape[-1])
-    dists = ood_utils.compute_mahalanobis_distance(pool_pre_logits, mean_list,
-                                                   cov)
+    dists = scorer(pool_pre_logits)
     scores = np.array(jax.nn.logsumexp(-dists / 2, axis=-1))
   else:
     # Ensemble models
     # pool_pre_logits [num_cores, per_core_batch_size, hidden_size, ens_size]
     pool_pre_logits = pool_pre_logits.reshape(
         [-1] + [s for s in pool_pre_logits.shape[2:]])
+    scores_list = []
     for m in range(ens_size):
-      scores_list = []
-      d = ood_utils.compute_mahalanobis_distance(pool_pre_logits[..., m],
-                                                 mean_list[m], cov[m])
+      d = scorer[m](pool_pre_logits[..., m])
       s = np.array(jax.nn.logsumexp(-d / 2, axis=-1))
       scores_list.append(s)
     scores = np.mean(np.array(scores_list), axis=0)
 
   # Convert likelihood to AL score
   pool_masks_bool = np.array(pool_masks.ravel(), dtype=bool)
-  scores[pool_masks_bool] = (
-      scores[pool_masks_bool].max() - scores[pool_masks_bool])
+  max_score = scores[pool_masks_bool].max(initial=NINF_SCORE)
+  if jax.process_count() > 1:
+    # Each host scores its own shard of the pool, so the scores are offset by
+    # the maximum over all hosts.
+    max_score = np.max(multihost_utils.process_allgather(max_score))
+  scores[pool_masks_bool] = max_score - scores[pool_masks_bool]
   scores[~pool_masks_bool] = NINF_SCORE
 
   return scores
 
 
+def gumbel_noised_scores(scores, beta, rng):
+  """Adds Gumbel noise with temperature 1 / beta to the scores."""
+  noise = jax.random.gumbel(rng, [len(scores)])
+  return scores + noise / beta
+
+
 def stochastic_score_acquisition(scores, acquisition_batch_size, beta, rng):
   """Stochastic acquisition method for batch selection https://arxiv.org/abs/2106.12059."""
-  noise = jax.random.gumbel(rng, [len(scores)])
-  noised_scores = scores + noise / beta
+  noised_scores = gumbel_noised_scores(scores, beta, rng)
 
   selected_noised_scores, selected_indices = jax.lax.top_k(
       noised_scores, acquisition_batch_size)
@@ -398,6 +641,46 @@ def stochastic_score_acquisition(scores, acquisition_batch_size, beta, rng):
   return selected_scores, selected_indices
 
 
+def merge_top_k_across_hosts(*, ranking_scores, ids, scores, k):
+  """Merges the top-k candidates of each host into the global top-k.
+
+  Only the `k` candidates of each host are exchanged, rather than the scores
+  of the whole pool.
+
+  Args:
+    ranking_scores: the scores the candidates of this host are ranked by, e.g.
+      the noised log scores for power acquisition.
+    ids: the ids of the candidates of this host.
+    scores: the acquisition scores of the candidates of this host.
+    k: the number of candidates to select over all hosts.
+
+  Returns:
+    a tuple of arrays with the ids and scores of the selected candidates.
+  """
+  # Pad to k candidates, so that all hosts gather arrays of the same shape.
+  num_padding = k - len(ids)
+  ranking_scores = np.pad(
+      np.asarray(ranking_scores, dtype=np.float32), (0, num_padding),
+      constant_values=NINF_SCORE)
+  scores = np.pad(
+      np.asarray(scores, dtype=np.float32), (0, num_padding),
+      constant_values=NINF_SCORE)
+  ids = np.pad(np.asarray(ids), (0, num_padding), constant_values=-1)
+
+  all_candidates = multihost_utils.process_allgather({
+      'ranking_scores': ranking_scores,
+      'ids': ids,
+      'scores': scores,
+  })
+  all_ids = np.asarray(all_candidates['ids']).ravel()
+  all_scores = np.asarray(all_candidates['scores']).ravel()
+  all_ranking_scores = jnp.asarray(all_candidates['ranking_scores']).ravel()
+  _, selected_indices = jax.lax.top_k(all_ranking_scores, k)
+  selected_indices = np.asarray(selected_indices)
+  selected_indices = selected_indices[all_ids[selected_indices] != -1]
+  return all_ids[selected_indices], all_scores[selected_indices]
+
+
 def select_acquisition_batch_indices(*,
                                      acquisition_batch_size,
                                      scores,
@@ -407,6 +690,10 @@ def select_acquisition_batch_indices(*,
                                      rng=None):
   """Select what data points to acquire from the pool set.
 
+  With multiple hosts, each host passes the scores of its own shard of the
+  pool. Each host then selects its top candidates, which are merged into the
+  same global selection on all hosts.
+
   Args:
     acquisition_batch_size: the number of data point to acquire.
     scores: acquisition scores assigned to data points.
@@ -418,33 +705,57 @@ def select_acquisition_batch_indices(*,
   Returns:
     a tuple of lists with the ids to be acquired and their scores.
   """
-  scores = jnp.array(scores.ravel())
-  ids = jnp.array(ids.ravel())
+  scores = np.array(scores.ravel())
+  ids = np.asarray(ids).ravel()
 
   # Ignore already acquired ids
-  # TODO(joost,andreas): vectorize this
-  ids_list = ids.tolist()
-  for ignored_id in ignored_ids:
-    scores = scores.at[ids_list.index(ignored_id)].set(NINF_SCORE)
+  ignored_ids = np.fromiter(ignored_ids, dtype=ids.dtype)
+  if ignored_ids.size:
+    ignored_rows = al_utils.IdIndex(ignored_ids).contains(ids)
+    scores[ignored_rows] = NINF_SCORE
+  scores = jnp.array(scores)
+  ids = jnp.array(ids)
 
   f_ent = scores[scores > NINF_SCORE]
-  logging.info(msg=f'Score statistics pool set - '
-               f'min: {f_ent.min()}, mean: {f_ent.mean()}, max: {f_ent.max()}')
+  if f_ent.size:
+    logging.info(msg=f'Score statistics pool set - '
+                 f'min: {f_ent.min()}, mean: {f_ent.mean()}, '
+                 f'max: {f_ent.max()}')
+  else:
+    # With multiple hosts, a shard may have no candidates left, e.g. when all
+    # of its ids were already acquired or it only holds padding.
+    logging.info(msg='Score statistics pool set - no candidates.')
 
+  multihost = jax.process_count() > 1
+  local_batch_size = min(acquisition_batch_size, len(scores))
   if power_acquisition:
     assert rng is not None, ('rng should not be None if power acquisition is '
                              'used.')
     beta = 1
-    _, selected_indices = stochastic_score_acquisition(
-        jnp.log(scores), acquisition_batch_size, beta, rng)
+    if multihost:
+      # Each host draws independent noise for its own shard of the pool.
+      rng = jax.random.fold_in(rng, jax.process_index())
+    ranking_scores = gumbel_noised_scores(jnp.log(scores), beta, rng)
+    selected_ranking_scores, selected_indices = jax.lax.top_k(
+        ranking_scores, local_batch_size)
+    logging.info(msg=f'selected_noised_scores = {selected_ranking_scores}; '
+                 f'selected_scores = {jnp.log(scores)[selected_indices]}')
   else:
     # Use top-k otherwise.
-    selected_scores, selected_indices = jax.lax.top_k(scores,
-                                                      acquisition_batch_size)
-    logging.info(msg=f'Top-k scores: {selected_scores}')
+    selected_ranking_scores, selected_indices = jax.lax.top_k(
+        scores, local_batch_size)
+    logging.info(msg=f'Top-k scores: {selected_ranking_scores}')
 
-  selected_ids = ids[selected_indices].tolist()
-  selected_scores = scores[selected_indices].tolist()
+  selected_ids = ids[selected_indices]
+  selected_scores = scores[selected_indices]
+  if multihost:
+    selected_ids, selected_scores = merge_top_k_across_hosts(
+        ranking_scores=selected_ranking_scores,
+        ids=selected_ids,
+        scores=selected_scores,
+        k=acquisition_batch_size)
+  selected_ids = selected_ids.tolist()
+  selected_scores = selected_scores.tolist()
 
   logging.info(
       msg=f'Data selected - ids: {selected_ids}, with scores: {selected_scores}'
@@ -453,36 +764,92 @@ def select_acquisition_batch_indices(*,
   return selected_ids, selected_scores
 
 
-def acquire_points(model, current_opt_repl, pool_train_ds, train_eval_ds,
+def update_pool_outputs(*, pool_outputs, opt_repl, pool_train_ds,
+                        make_pool_subset_ds, config, rng):
+  """Recomputes the pool outputs that are needed for the next acquisition.
+
+  The first call computes the outputs of the whole pool. Afterwards, a
+  `pool_refresh_fraction` of 1 (the default) recomputes the whole pool every
+  round. Smaller fractions recompute a random subset of the remaining pool,
+  plus all outputs computed `pool_max_staleness` or more rounds ago, and keep
+  the (stale) outputs of the other examples.
+
+  Args:
+    pool_outputs: the `PoolOutputs` of the pool set.
+    opt_repl: the current optimizer.
+    pool_train_ds: the pool dataset.
+    make_pool_subset_ds: a function mapping a list of ids to the dataset of
+      these pool examples.
+    config: experiment config.
+    rng: rng to sample the examples to refresh.
+  """
+  refresh_fraction = config.get('pool_refresh_fraction', 1.0)
+  if pool_outputs.index is None or refresh_fraction >= 1.0:
+    pool_outputs.update(opt_repl.target, pool_train_ds)
+    return
+
+  refresh_ids = pool_outputs.select_refresh_ids(
+      refresh_fraction=refresh_fraction,
+      max_staleness=config.get('pool_max_staleness'),
+      rng=rng)
+  logging.info(msg=f'Refreshing the outputs of {len(refresh_ids)} out of '
+               f'{len(pool_outputs.index)} pool examples.')
+  if refresh_ids.size:
+    pool_outputs.update(opt_repl.target,
+                        make_pool_subset_ds(refresh_ids.tolist()))
+
+
+def acquire_points(model, current_opt_repl, pool_outputs, pool_train_ds,
+                   make_pool_subset_ds, train_eval_ds,
                    train_subset_data_builder, acquisition_method, config,
                    rng_loop):
   """Acquire ids of the current batch."""
-  pool_ids, pool_outputs, _, pool_masks = get_ids_logits_masks(
-      model=model,
-      opt_repl=current_opt_repl,
-      ds=pool_train_ds,
-      use_pre_logits=acquisition_method == 'density',
-      average_logits=acquisition_method != 'bald',
-      config=config)
+  # Uniform acquisition (and density acquisition without training points) only
+  # needs the pool ids, so the pool outputs are not refreshed for it.
+  needs_outputs = acquisition_method != 'uniform' and not (
+      acquisition_method == 'density' and
+      not train_subset_data_builder.subset_ids)
+  if pool_outputs.index is None or needs_outputs:
+    if config.get('pool_refresh_fraction', 1.0) < 1.0:
+      rng_loop, rng_refresh = jax.random.split(rng_loop, 2)
+    else:
+      rng_refresh = None
+    update_pool_outputs(
+        pool_outputs=pool_outputs,
+        opt_repl=current_opt_repl,
+        pool_train_ds=pool_train_ds,
+        make_pool_subset_ds=make_pool_subset_ds,
+        config=config,
+        rng=rng_refresh)
+  pool_outputs.mark_acquired(train_subset_data_builder.subset_ids)
+
+  # Add a TPU shard axis of size 1, as expected by the scoring functions.
+  pool_ids = pool_outputs.ids
+  pool_masks = pool_outputs.masks[None]
+  if acquisition_method == 'bald':
+    # [num_rows, ens_size, num_classes] -> [1, ens_size, num_rows, num_classes]
+    pool_outputs_array = np.moveaxis(pool_outputs.outputs, 1, 0)[None]
+  else:
+    pool_outputs_array = pool_outputs.outputs[None]
 
   if acquisition_method == 'uniform':
     rng_loop, rng_acq = jax.random.split(rng_loop, 2)
     pool_scores = get_uniform_scores(pool_masks, rng_acq)
   elif acquisition_method == 'entropy':
-    pool_scores = get_entropy_scores(pool_outputs, pool_masks)
+    pool_scores = get_entropy_scores(pool_outputs_array, pool_masks)
   elif acquisition_method == 'margin':
-    pool_scores = get_margin_scores(pool_outputs, pool_masks)
+    pool_scores = get_margin_scores(pool_outputs_array, pool_masks)
   elif acquisition_method == 'msp':
-    pool_scores = get_msp_scores(pool_outputs, pool_masks)
+    pool_scores = get_msp_scores(pool_outputs_array, pool_masks)
   elif acquisition_method == 'bald':
-    pool_scores = get_bald_scores(pool_outputs, pool_masks)
+    pool_scores = get_bald_scores(pool_outputs_array, pool_masks)
   elif acquisition_method == 'density':
     if train_subset_data_builder.subset_ids:
       pool_scores = get_density_scores(
           model=model,
           opt_repl=current_opt_repl,
           train_ds=train_eval_ds,
-          pool_pre_logits=pool_outputs,
+          pool_pre_logits=pool_outputs_array,
           pool_masks=pool_masks,
           config=config)
     else:
@@ -491,12 +858,16 @@ def acquire_points(model, current_opt_repl, pool_train_ds, train_eval_ds,
   else:
     raise ValueError('Acquisition method not found.')
 
+  # Ignore already acquired ids.
+  pool_scores = np.array(pool_scores).ravel()
+  pool_scores[pool_outputs.acquired] = NINF_SCORE
+
   rng_loop, rng_acq = jax.random.split(rng_loop, 2)
   acquisition_batch_ids, _ = select_acquisition_batch_indices(
       acquisition_batch_size=config.get('acquisition_batch_size'),
       scores=pool_scores,
       ids=pool_ids,
-      ignored_ids=train_subset_data_builder.subset_ids,
+      ignored_ids=(),
       power_acquisition=config.get('power_acquisition', True),
       rng=rng_acq)
 
@@ -612,8 +983,6 @@ def finetune(*,
 
 
 def main(config, output_dir):
-  if jax.process_count() > 1:
-    raise NotImplementedError
   # Note: switch to ProfileAllHosts() if you need to profile all hosts.
   # (Xprof data become much larger and take longer to load for analysis)
   profiler = periodic_actions.Profile(
@@ -706,6 +1075,16 @@ def main(config, output_dir):
 
   update_fn = model_utils.create_update_fn(model, config)
   evaluation_fn = model_utils.create_evaluation_fn(model, config)
+  # The pool outputs are kept across acquisition rounds, and only refreshed
+  # for the examples selected by `update_pool_outputs`.
+  pool_outputs = PoolOutputs(
+      compute_batch_outputs=make_compute_batch_outputs_fn(
+          model=model,
+          use_pre_logits=acquisition_method == 'density',
+          average_logits=acquisition_method != 'bald',
+          config=config),
+      ensemble_logits=acquisition_method == 'bald',
+      capacity=config.get('pool_size', 0))
 
   # NOTE: We need this because we need an Id field of type int.
   # TODO(andreas): Rename to IdSubsetDatasetBuilder?
@@ -713,9 +1092,10 @@ def main(config, output_dir):
   pool_subset_data_builder = al_utils.SubsetDatasetBuilder(
       data_builder, subset_ids=None)
 
-  # NOTE: below line is necessary on multi host setup
-  # pool_ds_rng = jax.random.fold_in(pool_ds_rng, jax.process_index())
   rng, pool_ds_rng = jax.random.split(rng)
+  if jax.process_count() > 1:
+    # Each host scores its own shard of the pool.
+    pool_ds_rng = jax.random.fold_in(pool_ds_rng, jax.process_index())
   pool_train_ds = input_utils.get_data(
       dataset=pool_subset_data_builder,
       split=config.train_split,
@@ -728,6 +1108,19 @@ def main(config, output_dir):
       prefetch_size=config.get('prefetch_to_host', 2),
       drop_remainder=False)
 
+  def make_pool_subset_ds(ids):
+    return input_utils.get_data(
+        dataset=al_utils.SubsetDatasetBuilder(data_builder, subset_ids=ids),
+        split=config.train_split,
+        rng=pool_ds_rng,
+        process_batch_size=local_batch_size,
+        preprocess_fn=pp_eval,
+        num_epochs=1,
+        repeat_after_batching=True,
+        shuffle=False,
+        prefetch_size=config.get('prefetch_to_host', 2),
+        drop_remainder=False)
+
   # Potentially acquire an initial training set.
   initial_training_set_size = config.get('initial_training_set_size', 10)
 
@@ -739,6 +1132,11 @@ def main(config, output_dir):
         pool_train_ds,
         config.num_classes,
         shuffle_rng=rng_initial)
+    if jax.process_count() > 1:
+      # Each host sampled from its own shard of the pool, so use the ids of
+      # the first host everywhere.
+      initial_training_set_batch_ids = multihost_utils.broadcast_one_to_all(
+          np.asarray(initial_training_set_batch_ids)).tolist()
   else:
     initial_training_set_batch_ids = []
   write_note(f'{len(initial_training_set_batch_ids)} initial training ids '
@@ -889,8 +1287,9 @@ def main(config, output_dir):
     training_sizes.append(current_train_ds_length)
 
     acquisition_batch_ids, rng_loop = acquire_points(
-        model, current_opt_repl, pool_train_ds, train_eval_ds,
-        train_subset_data_builder, acquisition_method, config, rng_loop)
+        model, current_opt_repl, pool_outputs, pool_train_ds,
+        make_pool_subset_ds, train_eval_ds, train_subset_data_builder,
+        acquisition_method, config, rng_loop)
     train_subset_data_builder.subset_ids.update(acquisition_batch_ids)
 
     write_note(f'Training set ids at train set size {current_train_ds_length}:'
@@ -26,6 +26,7 @@ from absl.testing import parameterized
 import flax
 import jax
 import jax.numpy as jnp
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import uncertainty_baselines as ub
@@ -96,6 +97,100 @@ class ActiveLearningTest(parameterized.TestCase, tf.test.TestCase):
     # Get the warmup batch
     self.assertEqual(ids, set(gt_ids))
 
+  def test_pool_outputs(self):
+    num_devices = jax.local_device_count()
+    per_core_batch_size, ens_size, num_classes = 3, 2, 4
+    # Two full batches and a padded one.
+    num_batches = 3
+    num_rows = num_batches * num_devices * per_core_batch_size
+    ids = np.arange(num_rows).reshape(
+        num_batches, num_devices, per_core_batch_size) * 10
+    masks = np.ones_like(ids, dtype=bool)
+    masks[-1, :, -1] = False
+    images = np.random.RandomState(0).normal(
+        size=ids.shape + (ens_size, num_classes)).astype(np.float32)
+
+    def make_ds(selected_ids):
+      selected = np.isin(ids, selected_ids) & masks
+      return tf.data.Dataset.from_tensor_slices({
+          'image': images,
+          'id': ids,
+          'mask': selected,
+      })
+
+    def compute_batch_outputs(params, images):
+      # [num_cores, per_core_batch_size, ens_size, num_classes] ->
+      # [num_cores, ens_size, per_core_batch_size, num_classes]
+      return jnp.swapaxes(images, 1, 2) * params
+
+    pool_outputs = active_learning.PoolOutputs(
+        compute_batch_outputs=compute_batch_outputs,
+        ensemble_logits=True,
+        capacity=2)
+    pool_outputs.update(jnp.ones([num_devices]), make_ds(ids))
+
+    expected = images.reshape(num_rows, ens_size, num_classes)
+    self.assertEqual(pool_outputs.num_rows, num_rows)
+    np.testing.assert_array_equal(pool_outputs.ids, ids.ravel())
+    np.testing.assert_array_equal(pool_outputs.masks, masks.ravel())
+    np.testing.assert_allclose(pool_outputs.outputs, expected)
+
+    pool_outputs.mark_acquired([0, 20])
+    np.testing.assert_array_equal(
+        np.flatnonzero(pool_outputs.acquired), [0, 2])
+    self.assertFalse(pool_outputs.candidate_masks()[[0, 2, -1]].any())
+
+    # Only refresh the stale outputs, with new parameters.
+    refresh_ids = pool_outputs.select_refresh_ids(
+        refresh_fraction=0., max_staleness=1, rng=jax.random.PRNGKey(0))
+    np.testing.assert_array_equal(
+        refresh_ids, ids.ravel()[pool_outputs.candidate_masks()])
+    refresh_ids = refresh_ids[:2]
+    pool_outputs.update(2 * jnp.ones([num_devices]), make_ds(refresh_ids))
+
+    refreshed = np.isin(ids.ravel(), refresh_ids)
+    expected[refreshed] *= 2
+    np.testing.assert_allclose(pool_outputs.outputs, expected)
+    self.assertEqual(pool_outputs.num_rows, num_rows)
+
+  def test_select_acquisition_batch_indices(self):
+    scores = np.array([0.5, 0.9, 0.1, 0.7, float('-inf')])
+    ids = np.array([4, 7, 1, 3, 0])
+    selected_ids, selected_scores = (
+        active_learning.select_acquisition_batch_indices(
+            acquisition_batch_size=2,
+            scores=scores,
+            ids=ids,
+            ignored_ids={7, 11},
+            power_acquisition=False))
+    self.assertEqual(selected_ids, [3, 4])
+    np.testing.assert_allclose(selected_scores, [0.7, 0.5])
+
+  def test_select_acquisition_batch_indices_without_candidates(self):
+    # With multiple hosts, a shard whose candidates were all acquired still
+    # takes part in the selection.
+    selected_ids, selected_scores = (
+        active_learning.select_acquisition_batch_indices(
+            acquisition_batch_size=2,
+            scores=np.array([0.5, float('-inf')]),
+            ids=np.array([4, 0]),
+            ignored_ids={4},
+            power_acquisition=False))
+    self.assertLen(selected_ids, 2)
+    np.testing.assert_array_equal(selected_scores,
+                                  [active_learning.NINF_SCORE] * 2)
+
+  def test_merge_top_k_across_hosts(self):
+    # On a single host, the merge selects the top-k of the host's candidates
+    # and drops the padding.
+    selected_ids, selected_scores = active_learning.merge_top_k_across_hosts(
+        ranking_scores=np.array([0.3, 2.0]),
+        ids=np.array([5, 9]),
+        scores=np.array([0.1, 0.2]),
+        k=3)
+    np.testing.assert_array_equal(selected_ids, [9, 5])
+    np.testing.assert_allclose(selected_scores, [0.2, 0.1])
+
 
 if __name__ == '__main__':
   tf.test.main()
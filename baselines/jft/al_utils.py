@@ -22,6 +22,7 @@ from typing import Dict, Iterable, List, Optional, Set, Union
 from clu.deterministic_data import DatasetBuilder
 import jax
 import jax.numpy as jnp
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
@@ -61,6 +62,59 @@ class TFDSIdToInt:
     return shard_offsets[int(shard_id)] + int(ex_id)
 
 
+class IdIndex:
+  """Maps example ids to rows of host arrays with vectorized lookups.
+
+  The ids are sorted once, so looking up (or masking) `m` ids in a pool of `n`
+  examples takes O(m log n) time instead of the O(n m) of `list.index`.
+  """
+
+  def __init__(self, ids, rows=None):
+    """Init function.
+
+    Args:
+      ids: the unique integer example ids.
+      rows: the rows belonging to `ids`. Defaults to `range(len(ids))`.
+    """
+    ids = np.asarray(ids).ravel()
+    if rows is None:
+      rows = np.arange(len(ids))
+    rows = np.asarray(rows).ravel()
+    if len(rows) != len(ids):
+      raise ValueError(f'Got {len(ids)} ids but {len(rows)} rows.')
+    order = np.argsort(ids, kind='stable')
+    self._sorted_ids = ids[order]
+    self._sorted_rows = rows[order]
+    if np.any(self._sorted_ids[1:] == self._sorted_ids[:-1]):
+      raise ValueError('The ids of an IdIndex must be unique.')
+
+  def __len__(self):
+    return len(self._sorted_ids)
+
+  def _positions(self, ids):
+    ids = np.asarray(ids).ravel()
+    positions = np.searchsorted(self._sorted_ids, ids)
+    positions = np.minimum(positions, max(len(self) - 1, 0))
+    if len(self):
+      found = self._sorted_ids[positions] == ids
+    else:
+      found = np.zeros(len(ids), dtype=bool)
+    return positions, found
+
+  def contains(self, ids):
+    """Returns a boolean array indicating which of `ids` are in the index."""
+    return self._positions(ids)[1]
+
+  def lookup(self, ids):
+    """Returns the rows of `ids`, raising a KeyError for unknown ids."""
+    positions, found = self._positions(ids)
+    if not np.all(found):
+      missing = np.asarray(ids).ravel()[~found]
+      raise KeyError(f'{len(missing)} ids are not in the index, e.g. '
+                     f'{missing[:10].tolist()}.')
+    return self._sorted_rows[positions]
+
+
 def _subset_generator(*, dataset: tf.data.Dataset,
                       dataset_info: tfds.core.DatasetInfo,
                       subset_ids: Optional[Set[int]], splitwise_id: bool):
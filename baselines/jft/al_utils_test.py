@@ -15,6 +15,7 @@
 
 """Tests for al_utils.py."""
 
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 # pylint: disable=unused-import # to register Cifar10Subset as dataset
@@ -103,6 +104,24 @@ class AlUtilsTest(tf.test.TestCase):
       self.assertLen(examples, 1)
       self.assertEqual(examples.next(), i%num_classes)
 
+  def test_id_index(self):
+    ids = np.array([17, 3, 42, 8, 0])
+    rows = np.array([0, 1, 2, 4, 5])
+    index = al_utils.IdIndex(ids, rows)
+
+    self.assertLen(index, 5)
+    np.testing.assert_array_equal(index.lookup([42, 0, 17]), [2, 5, 0])
+    np.testing.assert_array_equal(
+        index.contains([3, 4, 8, 100, -1]), [True, False, True, False, False])
+    with self.assertRaises(KeyError):
+      index.lookup([3, 4])
+    with self.assertRaises(ValueError):
+      al_utils.IdIndex([1, 2, 1])
+
+    empty_index = al_utils.IdIndex([])
+    np.testing.assert_array_equal(empty_index.contains([1, 2]), [False, False])
+    self.assertEmpty(empty_index.lookup([]))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,150 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asynchronous checkpoint writing for the ViT experiments.
+
+Shared by the checkpoint utilities of the JFT and the diabetic retinopathy
+baselines, which each bind it to their own checkpoint format.
+"""
+
+import collections
+from concurrent import futures
+from concurrent.futures import thread
+from typing import Any, Callable, MutableMapping, Optional
+
+from absl import logging
+import jax
+import jax.numpy as jnp
+from tensorflow.io import gfile
+
+Params = MutableMapping[str, Any]
+# Writes a checkpoint data to a path, and to `path-{step_for_copy}` if given.
+SaveFn = Callable[[Any, str, Optional[int]], None]
+
+
+def snapshot_replicated(tree: Params) -> Params:
+  """Takes a snapshot of device 0's copy of a replicated pytree.
+
+  The snapshot is an on-device copy, so it is not affected by later updates of
+  `tree` (including donated buffers), and taking it does not wait for a
+  device-to-host transfer. The transfer happens when the snapshot is saved.
+
+  Args:
+    tree: A pytree of arrays replicated across the local devices.
+
+  Returns:
+    A pytree with the arrays of the first local device.
+  """
+  return jax.tree_util.tree_map(lambda x: jnp.array(x[0], copy=True), tree)
+
+
+class AsyncCheckpointManager:
+  """Writes checkpoints in a background thread.
+
+  The training loop hands over a checkpoint data of on-device snapshots (see
+  `snapshot_replicated`) and immediately continues. Transferring the arrays to
+  host, serializing them and renaming the written checkpoint into place all
+  happen in the background, one checkpoint at a time.
+
+  Example:
+    manager = AsyncCheckpointManager(
+        checkpoint_utils.checkpoint_trained_model, max_in_flight=1, timeout=1)
+    ...
+    manager.save(checkpoint_data, path, step_for_copy)
+    ...
+    manager.wait_until_finished()
+  """
+
+  def __init__(self,
+               save_fn: SaveFn,
+               max_in_flight: int = 1,
+               keep_last_n: Optional[int] = None,
+               timeout: Optional[float] = None):
+    """Initializes the manager.
+
+    Args:
+      save_fn: Function writing a checkpoint data to a path, called as
+        `save_fn(checkpoint_data, path, step_for_copy)`, e.g.
+        `checkpoint_utils.checkpoint_trained_model`.
+      max_in_flight: Maximum number of checkpoints being written at once.
+        `save` waits for the oldest checkpoint to be written once reached.
+      keep_last_n: If set, only the `keep_last_n` most recent step copies
+        (`path-{step}`) are kept, older ones are deleted.
+      timeout: If set, the number of seconds `save` waits for a previous
+        checkpoint before raising a `TimeoutError`, since it indicates that
+        checkpoint writing is a bottleneck.
+    """
+    self._save_fn = save_fn
+    self._max_in_flight = max_in_flight
+    self._keep_last_n = keep_last_n
+    self._timeout = timeout
+    # A single worker keeps the checkpoints written in order.
+    self._executor = thread.ThreadPoolExecutor(max_workers=1)
+    self._in_flight = collections.deque()
+
+  def _save(self, checkpoint_data: Any, path: str,
+            step_for_copy: Optional[int]) -> None:
+    self._save_fn(checkpoint_data, path, step_for_copy)
+    if step_for_copy is not None and self._keep_last_n is not None:
+      copies = sorted(gfile.glob(f"{path}-[0-9]*"))
+      for copy_path in copies[:-self._keep_last_n]:
+        logging.info("Deleting old checkpoint %s", copy_path)
+        if gfile.isdir(copy_path):
+          gfile.rmtree(copy_path)
+        else:
+          gfile.remove(copy_path)
+
+  def save(self,
+           checkpoint_data: Any,
+           path: str,
+           step_for_copy: Optional[int] = None) -> None:
+    """Schedules a checkpoint to be written in the background.
+
+    Args:
+      checkpoint_data: Checkpoint data passed to `save_fn`, e.g. a
+        `checkpoint_utils.CheckpointData` instance. Its arrays must not be
+        modified afterwards, so device arrays should be snapshots.
+      path: A path to save the checkpoint.
+      step_for_copy: Optional integer that, when not None, will be used to save
+        a copy of the checkpoint with the name `path-{step_for_copy}`.
+
+    Raises:
+      TimeoutError: If a previous checkpoint was not written within `timeout`.
+    """
+    while len(self._in_flight) >= self._max_in_flight:
+      future = self._in_flight.popleft()
+      try:
+        future.result(timeout=self._timeout)
+      except futures.TimeoutError as e:
+        raise TimeoutError(
+            "Checkpoint writing seems to be a bottleneck. Make sure you do "
+            "not do something wrong, like writing checkpoints to a distant "
+            "cell. In a case you are OK with checkpoint writing being a "
+            "bottleneck, you can configure `checkpoint_timeout` parameter"
+        ) from e
+    self._in_flight.append(
+        self._executor.submit(self._save, checkpoint_data, path,
+                              step_for_copy))
+
+  def wait_until_finished(self) -> None:
+    """Waits for all scheduled checkpoints to be written."""
+    while self._in_flight:
+      # Re-raises any error that occurred in the background.
+      self._in_flight.popleft().result()
+
+  def close(self) -> None:
+    """Waits for all scheduled checkpoints and shuts the manager down."""
+    self.wait_until_finished()
+    self._executor.shutdown(wait=True)
@@ -471,7 +471,11 @@ def main(config, output_dir):
         representation_fn, config.fewshot,
         config.fewshot.get('batch_size') or batch_size_eval)
 
-  checkpoint_writer = None
+  checkpoint_manager = checkpoint_utils.AsyncCheckpointManager(
+      max_in_flight=config.get('checkpoint_max_in_flight', 1),
+      keep_last_n=config.get('keep_last_n_checkpoints'),
+      sharded=config.get('sharded_checkpoint', False),
+      timeout=config.get('checkpoint_timeout', 1))
 
   lr_fn = train_utils.create_learning_rate_schedule(total_steps,
                                                     **config.get('lr', {}))
@@ -518,13 +522,13 @@ def main(config, output_dir):
         step, config.get('checkpoint_steps'), total_steps, process=0):
       write_note('Checkpointing...')
       chrono.pause()
-      train_utils.checkpointing_timeout(checkpoint_writer,
-                                        config.get('checkpoint_timeout', 1))
       accumulated_train_time = chrono.accum_train_time
-      # We need to transfer the weights over now or else we risk keeping them
-      # alive while they'll be updated in a future step, creating hard to debug
+      # We need to snapshot the weights now or else we risk keeping them alive
+      # while they'll be updated in a future step, creating hard to debug
       # memory errors (see b/160593526). Also, takes device 0's params only.
-      opt_cpu = jax.tree_util.tree_map(lambda x: np.array(x[0]), opt_repl)
+      # The snapshot stays on device; the transfer to host, serialization and
+      # writing happen in the background.
+      opt_cpu = checkpoint_utils.snapshot_replicated(opt_repl)
 
       # Check whether we want to keep a copy of the current checkpoint.
       copy_step = None
@@ -539,9 +543,7 @@ def main(config, output_dir):
           train_loop_rngs=train_loop_rngs,
           optimizer=opt_cpu,
           accumulated_train_time=accumulated_train_time)
-      checkpoint_writer = pool.apply_async(
-          checkpoint_utils.checkpoint_trained_model,
-          (checkpoint_data, save_checkpoint_path, copy_step))
+      checkpoint_manager.save(checkpoint_data, save_checkpoint_path, copy_step)
       chrono.resume()
 
     # Report training progress
@@ -714,6 +716,7 @@ def main(config, output_dir):
         break
 
   write_note(f'Done!\n{chrono.note}')
+  checkpoint_manager.close()
   pool.close()
   pool.join()
   writer.close()
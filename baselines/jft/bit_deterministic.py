@@ -460,7 +460,11 @@ def main(config, output_dir):
         representation_fn, config.fewshot,
         config.fewshot.get('batch_size') or batch_size_eval)
 
-  checkpoint_writer = None
+  checkpoint_manager = checkpoint_utils.AsyncCheckpointManager(
+      max_in_flight=config.get('checkpoint_max_in_flight', 1),
+      keep_last_n=config.get('keep_last_n_checkpoints'),
+      sharded=config.get('sharded_checkpoint', False),
+      timeout=config.get('checkpoint_timeout', 1))
 
   lr_fn = train_utils.create_learning_rate_schedule(total_steps,
                                                     **config.get('lr', {}))
@@ -505,14 +509,12 @@ def main(config, output_dir):
         step, config.get('checkpoint_steps'), total_steps, process=0):
       write_note('Checkpointing...')
       chrono.pause()
-      train_utils.checkpointing_timeout(checkpoint_writer,
-                                        config.get('checkpoint_timeout', 1))
-      checkpoint_extra['accum_train_time'] = chrono.accum_train_time
-      checkpoint_extra['rngs_loop'] = rngs_loop
-      # We need to transfer the weights over now or else we risk keeping them
-      # alive while they'll be updated in a future step, creating hard to debug
+      # We need to snapshot the weights now or else we risk keeping them alive
+      # while they'll be updated in a future step, creating hard to debug
       # memory errors (see b/160593526). Also, takes device 0's params only.
-      opt_cpu = jax.tree_util.tree_map(lambda x: np.array(x[0]), opt_repl)
+      # The snapshot stays on device; the transfer to host, serialization and
+      # writing happen in the background.
+      opt_cpu = checkpoint_utils.snapshot_replicated(opt_repl)
 
       # Check whether we want to keep a copy of the current checkpoint.
       copy_step = None
@@ -521,12 +523,13 @@ def main(config, output_dir):
         write_note('Keeping a checkpoint copy...')
         copy_step = step
 
-      # Checkpoint should be a nested dictionary or FLAX datataclasses from
-      # `flax.struct`. Both can be present in a checkpoint.
-      checkpoint = {'opt': opt_cpu, 'extra': checkpoint_extra}
-      checkpoint_writer = pool.apply_async(
-          checkpoint_utils.save_checkpoint,
-          (checkpoint, save_checkpoint_path, copy_step))
+      # Saved as {'opt': ..., 'extra': {'rngs_loop': ..., 'accum_train_time':
+      # ...}}, the tree restored when resuming above.
+      checkpoint_data = checkpoint_utils.CheckpointData(
+          train_loop_rngs=rngs_loop,
+          optimizer=opt_cpu,
+          accumulated_train_time=chrono.accum_train_time)
+      checkpoint_manager.save(checkpoint_data, save_checkpoint_path, copy_step)
       chrono.resume()
 
     # Report training progress
@@ -690,6 +693,7 @@ def main(config, output_dir):
         break
 
   write_note(f'Done!\n{chrono.note}')
+  checkpoint_manager.close()
   pool.close()
   pool.join()
   writer.close()
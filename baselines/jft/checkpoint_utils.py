@@ -22,8 +22,11 @@ https://github.com/google-research/vision_transformer.
 import collections
 from concurrent.futures import thread
 import dataclasses
+import functools
 import io
-from typing import Any, Iterable, MutableMapping, Optional
+import json
+import os
+from typing import Any, Iterable, MutableMapping, Optional, Sequence
 
 from absl import logging
 from clu import parameter_overview
@@ -36,8 +39,14 @@ import numpy as np
 import scipy
 from tensorflow.io import gfile
 
+import async_checkpoint_utils  # local file import from baselines.jft
+
 Params = MutableMapping[str, Any]
 
+# Name of the index file of sharded checkpoints, see `save_checkpoint`.
+SHARDED_INDEX_FILENAME = "index.json"
+_SHARDED_FORMAT_VERSION = 1
+
 
 @dataclasses.dataclass
 class CheckpointData:
@@ -128,12 +137,64 @@ def _read_file(path: str, pool_size: int, buf_size: int) -> bytearray:
   return data
 
 
+def is_sharded_checkpoint(path: str) -> bool:
+  """Returns whether `path` is a checkpoint in the sharded format."""
+  return gfile.exists(os.path.join(path, SHARDED_INDEX_FILENAME))
+
+
+def _matches_prefixes(name: str, prefixes: Optional[Sequence[str]]) -> bool:
+  if prefixes is None:
+    return True
+  return any(name == p or name.startswith(p.rstrip("/") + "/")
+             for p in prefixes)
+
+
+def _read_sharded_index(path: str):
+  with gfile.GFile(os.path.join(path, SHARDED_INDEX_FILENAME), "r") as f:
+    index = json.load(f)
+  if index["version"] != _SHARDED_FORMAT_VERSION:
+    raise ValueError(f"Unsupported sharded checkpoint version "
+                     f"{index['version']} in {path}.")
+  return index["leaves"]
+
+
+def _load_sharded_leaf(path: str, leaf: MutableMapping[str, Any]) -> np.ndarray:
+  """Loads a single leaf of a sharded checkpoint, memory-mapped if possible."""
+  leaf_path = os.path.join(path, leaf["file"])
+  if "://" not in leaf_path:
+    # Local files are memory-mapped: only the pages that are actually used by
+    # the caller are ever read from disk.
+    value = np.load(leaf_path, mmap_mode="r", allow_pickle=False)
+  else:
+    with gfile.GFile(leaf_path, "rb") as f:
+      value = np.load(f, allow_pickle=False)
+  if leaf["dtype"] == "bfloat16":
+    value = value.view(jnp.bfloat16)
+  return value
+
+
+def _load_sharded_checkpoint(path: str, prefixes: Optional[Sequence[str]],
+                             pool_size: int):
+  """Returns the names and values of the leaves of a sharded checkpoint."""
+  leaves = [
+      leaf for leaf in _read_sharded_index(path)
+      if _matches_prefixes(leaf["name"], prefixes)
+  ]
+  with thread.ThreadPoolExecutor(pool_size) as pool:
+    values = list(pool.map(lambda l: _load_sharded_leaf(path, l), leaves))
+  return [leaf["name"] for leaf in leaves], values
+
+
 def load_checkpoint(tree: Optional[Params],
                     path: str,
                     read_in_parallel: bool = True,
                     pool_size: int = 32,
-                    buf_size: int = 128 << 20) -> Params:
-  """Loads JAX pytrees that were stored on disk in a NumPy `.npz` file.
+                    buf_size: int = 128 << 20,
+                    prefixes: Optional[Sequence[str]] = None) -> Params:
+  """Loads JAX pytrees that were stored on disk by `save_checkpoint`.
+
+  Both the NumPy `.npz` format and the sharded format are supported. Leaves of
+  local sharded checkpoints are returned as read-only memory-mapped arrays.
 
   Args:
     tree: Optional JAX pytree to be restored. If None, then the tree will be
@@ -146,21 +207,30 @@ def load_checkpoint(tree: Optional[Params],
       parallel, if possible.
     buf_size: The size of each file chunk to be read in parallel, if possible.
       Defaults to 128M buffer sizes.
+    prefixes: Optional list of leaf name prefixes, e.g. ["opt/target/head"].
+      If set, only the leaves within these subtrees are loaded. Requires `tree`
+      to be None.
 
   Returns:
     A JAX pytree with the same structure as `tree`, but with the leaf values
     restored from the saved checkpoint.
   """
-  if read_in_parallel:
-    file = io.BytesIO(_read_file(path, pool_size=pool_size, buf_size=buf_size))
+  if tree and prefixes is not None:
+    raise ValueError("Partial restores with `prefixes` require `tree=None`.")
+  if is_sharded_checkpoint(path):
+    keys, values = _load_sharded_checkpoint(path, prefixes, pool_size)
   else:
-    file = gfile.GFile(path, "rb")
-  with np.load(file, allow_pickle=False) as data:
-    values = list(data.values())
-    if not tree:
-      keys = list(data.keys())
-  file.close()
-  del file  # Free up RAM.
+    if read_in_parallel and prefixes is None:
+      file = io.BytesIO(
+          _read_file(path, pool_size=pool_size, buf_size=buf_size))
+    else:
+      file = gfile.GFile(path, "rb")
+    with np.load(file, allow_pickle=False) as data:
+      keys = [k for k in data.keys() if _matches_prefixes(k, prefixes)]
+      # Members of the `.npz` archive are only decompressed when accessed.
+      values = [data[k] for k in keys]
+    file.close()
+    del file  # Free up RAM.
   # NOTE: NumPy loses any bfloat16 dtypes when saving, so we recover them here.
   values = jax.tree_util.tree_map(_recover_bfloat16, values)
   if tree:
@@ -213,16 +283,85 @@ def _tree_flatten_with_names(tree):
   return [(val_names[i], v) for i, v in zip(inv_perm, vals)]
 
 
-def save_checkpoint(tree: Params, path: str,
-                    step_for_copy: Optional[int] = None) -> None:
-  """Saves the values of JAX pytrees to disk in a NumPy `.npz` file.
+def _save_sharded_leaf(path: str, file_name: str, value: Any) -> None:
+  value = np.asarray(jax.device_get(value))
+  if value.dtype == jnp.bfloat16:
+    # NumPy loses bfloat16 dtypes when saving, the index records it instead.
+    value = value.view(np.uint16)
+  with gfile.GFile(os.path.join(path, file_name), "wb") as f:
+    np.save(f, value, allow_pickle=False)
+
+
+def _copy_dir(src: str, dst: str) -> None:
+  gfile.makedirs(dst)
+  for name in gfile.listdir(src):
+    gfile.copy(os.path.join(src, name), os.path.join(dst, name), overwrite=True)
+
+
+def _save_sharded_checkpoint(tree: Params, path: str, pool_size: int) -> None:
+  """Saves a JAX pytree as one `.npy` file per leaf plus a JSON index."""
+  names_and_vals = _tree_flatten_with_names(tree)
+  leaves = []
+  for i, (name, value) in enumerate(names_and_vals):
+    # Avoids pulling device arrays to host just to read their dtype.
+    dtype = getattr(value, "dtype", None) or np.asarray(value).dtype
+    leaves.append(
+        dict(
+            name=name,
+            file=f"leaf_{i:05d}.npy",
+            shape=list(np.shape(value)),
+            dtype="bfloat16" if dtype == jnp.bfloat16 else np.dtype(
+                dtype).name))
+
+  path_tmp = path + "-TEMPORARY"
+  if gfile.exists(path_tmp):
+    gfile.rmtree(path_tmp)
+  gfile.makedirs(path_tmp)
+  # Leaves are pulled to host and written one by one, so the host memory never
+  # holds more than `pool_size` leaves at a time.
+  with thread.ThreadPoolExecutor(pool_size) as pool:
+    futures = [
+        pool.submit(_save_sharded_leaf, path_tmp, leaf["file"], value)
+        for leaf, (_, value) in zip(leaves, names_and_vals)
+    ]
+    for future in futures:
+      future.result()
+  # The index is written last, so that a checkpoint with an index is complete.
+  with gfile.GFile(os.path.join(path_tmp, SHARDED_INDEX_FILENAME), "w") as f:
+    json.dump(dict(version=_SHARDED_FORMAT_VERSION, leaves=leaves), f)
+
+  if gfile.exists(path):
+    gfile.rmtree(path)
+  gfile.rename(path_tmp, path)
+
+
+def save_checkpoint(tree: Params,
+                    path: str,
+                    step_for_copy: Optional[int] = None,
+                    sharded: bool = False,
+                    pool_size: int = 32) -> None:
+  """Saves the values of JAX pytrees to disk.
+
+  By default, the checkpoint is a single NumPy `.npz` file. With `sharded`, the
+  checkpoint is instead a directory with one `.npy` file per leaf and a JSON
+  index of the leaf names, shapes and dtypes. Sharded checkpoints are written
+  leaf by leaf without materializing the whole serialized tree in memory, and
+  can be memory-mapped and partially restored by `load_checkpoint`.
 
   Args:
     tree: A JAX pytree to be saved.
     path: A path to save the checkpoint.
     step_for_copy: Optional integer that, when not None, will be used to save a
       copy of the checkpoint with the name `path-{step_for_copy}`.
+    sharded: Whether to save the checkpoint in the sharded format.
+    pool_size: Number of threads writing the leaves of a sharded checkpoint.
   """
+  if sharded:
+    _save_sharded_checkpoint(tree, path, pool_size)
+    if step_for_copy is not None:
+      _copy_dir(path, f"{path}-{step_for_copy:09d}")
+    return
+
   # NOTE: In general, this could be greatly simplified as follows. However, we
   # currently need to store the leaf names as well in order to be able to load
   # and reconstruct the tree directly from the checkpoint when initialized a
@@ -251,7 +390,8 @@ def save_checkpoint(tree: Params, path: str,
 def checkpoint_trained_model(
     checkpoint_data: CheckpointData,
     path: str,
-    step_for_copy: Optional[int] = None) -> None:
+    step_for_copy: Optional[int] = None,
+    sharded: bool = False) -> None:
   """Saves all information pertaining to a trained model in .npz format.
 
   Args:
@@ -259,6 +399,7 @@ def checkpoint_trained_model(
     path: A path to save the checkpoint.
     step_for_copy: Optional integer that, when not None, will be used to save a
       copy of the checkpoint with the name `path-{step_for_copy}`.
+    sharded: Whether to save the checkpoint in the sharded format instead.
   """
   # TODO(zmariet, dusenberrymw): Remove intermediate `checkpoint_extra` dict.
   tree = dict(
@@ -269,7 +410,38 @@ def checkpoint_trained_model(
       )
   if checkpoint_data.fixed_model_states is not None:
     tree["states"] = checkpoint_data.fixed_model_states
-  save_checkpoint(tree, path, step_for_copy)
+  save_checkpoint(tree, path, step_for_copy, sharded=sharded)
+
+
+snapshot_replicated = async_checkpoint_utils.snapshot_replicated
+
+
+class AsyncCheckpointManager(async_checkpoint_utils.AsyncCheckpointManager):
+  """Writes checkpoints with `checkpoint_trained_model` in a background thread.
+
+  See `async_checkpoint_utils.AsyncCheckpointManager`.
+  """
+
+  def __init__(self,
+               max_in_flight: int = 1,
+               keep_last_n: Optional[int] = None,
+               sharded: bool = False,
+               timeout: Optional[float] = None):
+    """Initializes the manager.
+
+    Args:
+      max_in_flight: Maximum number of checkpoints being written at once.
+      keep_last_n: If set, only the `keep_last_n` most recent step copies
+        (`path-{step}`) are kept, older ones are deleted.
+      sharded: Whether to save the checkpoints in the sharded format.
+      timeout: If set, the number of seconds `save` waits for a previous
+        checkpoint before raising a `TimeoutError`.
+    """
+    super().__init__(
+        functools.partial(checkpoint_trained_model, sharded=sharded),
+        max_in_flight=max_in_flight,
+        keep_last_n=keep_last_n,
+        timeout=timeout)
 
 
 def _flatten_jax_params_dict(d: Params, parent_key: str = "",
@@ -484,7 +656,15 @@ def maybe_load_checkpoint(train_loop_rngs: jnp.ndarray,
     reinit_params = config.get("model_reinit_params", default_reinit_params)
     logging.info("Reinitializing these parameters: %s", reinit_params)
 
-    loader = lambda path: load_checkpoint(tree=None, path=path)
+    # Only the parameters are needed from sharded checkpoints, and not the
+    # optimizer state that may be stored alongside.
+    prefixes = None
+    if is_sharded_checkpoint(config.model_init) and any(
+        leaf["name"].startswith("opt/target/")
+        for leaf in _read_sharded_index(config.model_init)):
+      prefixes = ["opt/target"]
+    loader = lambda path: load_checkpoint(tree=None, path=path,  # pylint: disable=g-long-lambda
+                                          prefixes=prefixes)
     loaded_params = loader(config.model_init)
 
     loaded_params = restore_from_pretrained_params(
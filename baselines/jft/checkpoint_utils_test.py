@@ -183,6 +183,75 @@ class CheckpointUtilsTest(parameterized.TestCase, tf.test.TestCase):
       self.assertIsInstance(restored_arr, np.ndarray)
       self.assertTrue(jnp.allclose(arr, restored_arr), msg=(arr, restored_arr))
 
+  def test_sharded_checkpointing(self):
+    key = jax.random.PRNGKey(42)
+    tree = _make_pytree(key)
+    output_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    checkpoint_path = os.path.join(output_dir, "checkpoint")
+    checkpoint_utils.save_checkpoint(
+        tree, checkpoint_path, step_for_copy=3, sharded=True)
+    self.assertTrue(checkpoint_utils.is_sharded_checkpoint(checkpoint_path))
+    self.assertTrue(
+        checkpoint_utils.is_sharded_checkpoint(checkpoint_path + "-000000003"))
+    self.assertFalse(os.path.exists(checkpoint_path + "-TEMPORARY"))
+
+    restored_tree = checkpoint_utils.load_checkpoint(None, checkpoint_path)
+    self.assertEqual(
+        jax.tree_util.tree_structure(tree),
+        jax.tree_util.tree_structure(restored_tree))
+    for arr, restored_arr in zip(
+        jax.tree_util.tree_leaves(tree),
+        jax.tree_util.tree_leaves(restored_tree)):
+      self.assertIsInstance(restored_arr, np.memmap)
+      self.assertEqual(arr.dtype, restored_arr.dtype)
+      np.testing.assert_array_equal(arr, restored_arr)
+
+    # Partial restore of a single subtree.
+    partial_tree = checkpoint_utils.load_checkpoint(
+        None, checkpoint_path, prefixes=["a/b/e"])
+    self.assertEqual(list(partial_tree.keys()), ["a"])
+    self.assertEqual(list(partial_tree["a"].keys()), ["b"])
+    self.assertEqual(list(partial_tree["a"]["b"].keys()), ["e"])
+    np.testing.assert_array_equal(partial_tree["a"]["b"]["e"]["f"],
+                                  tree["a"]["b"]["e"]["f"])
+
+  @parameterized.parameters(True, False)
+  def test_async_checkpoint_manager(self, sharded):
+    output_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    checkpoint_path = os.path.join(output_dir, "checkpoint.npz")
+    manager = checkpoint_utils.AsyncCheckpointManager(
+        max_in_flight=2, keep_last_n=2, sharded=sharded)
+    trees = []
+    for step in range(1, 5):
+      tree = _make_pytree(jax.random.PRNGKey(step))
+      trees.append(tree)
+      replicated = jax.tree_util.tree_map(lambda x: x[None], tree)
+      checkpoint_data = checkpoint_utils.CheckpointData(
+          train_loop_rngs=jax.random.PRNGKey(step),
+          optimizer=checkpoint_utils.snapshot_replicated(replicated),
+          accumulated_train_time=float(step))
+      manager.save(checkpoint_data, checkpoint_path, step_for_copy=step)
+    manager.close()
+
+    self.assertCountEqual(
+        os.listdir(output_dir),
+        ["checkpoint.npz", "checkpoint.npz-000000003",
+         "checkpoint.npz-000000004"])
+    restored = checkpoint_utils.load_checkpoint(None, checkpoint_path)
+    self.assertEqual(float(restored["extra"]["accum_train_time"]), 4.)
+    for arr, restored_arr in zip(
+        jax.tree_util.tree_leaves(trees[-1]),
+        jax.tree_util.tree_leaves(restored["opt"])):
+      np.testing.assert_array_equal(arr, restored_arr)
+
+  def test_npz_checkpointing_prefixes(self):
+    tree = _make_pytree(jax.random.PRNGKey(42))
+    checkpoint_path = self._save_temp_checkpoint(tree)
+    partial_tree = checkpoint_utils.load_checkpoint(
+        None, checkpoint_path, prefixes=["b"])
+    self.assertEqual(list(partial_tree.keys()), ["b"])
+    np.testing.assert_array_equal(partial_tree["b"], tree["b"])
+
   @parameterized.parameters(True, False)
   def test_checkpointing_model(self, read_in_parallel):
     key = jax.random.PRNGKey(42)
@@ -31,6 +31,7 @@ from clu import preprocess_spec
 import flax
 import jax
 import jax.numpy as jnp
+from jax.experimental import multihost_utils
 import ml_collections.config_flags
 import numpy as np
 import robustness_metrics as rm
@@ -122,6 +123,60 @@ def load_checkpoints(config):
   return params
 
 
+def select_ensemble_members(member_logits_fn, params, val_ds, config):
+  """Selects the ensemble members greedily on a validation set.
+
+  Candidates are added without replacement, following Caruana et al. (2004),
+  until the ensemble has `config.greedy_ensemble_size` members or the
+  `config.greedy_objective` on the validation set no longer improves.
+
+  Args:
+    member_logits_fn: Pmapped function of (params, images, labels, mask) that
+      returns the all-gathered per-member logits, labels and mask.
+    params: Replicated ensemble parameters, see `ensemble_prediction_fn`.
+    val_ds: Validation dataset used to select the members.
+    config: Experiment configuration.
+
+  Returns:
+    The (replicated) parameters of the selected members.
+  """
+  logits, labels = [], []
+  val_iter = input_utils.start_input_pipeline(
+      val_ds, config.get('prefetch_to_device', 1))
+  for batch in val_iter:
+    batch_logits, batch_labels, batch_mask = member_logits_fn(
+        params, batch['image'], batch['labels'], batch['mask'])
+    # Shapes [devices, ensemble_size, per_device_batch_size, num_classes] and
+    # [devices, per_device_batch_size, ...], identical on all devices.
+    mask = np.array(batch_mask[0], dtype=bool).reshape(-1)
+    batch_logits = np.array(batch_logits[0])
+    batch_logits = np.concatenate(list(batch_logits), axis=1)[:, mask]
+    logits.append(batch_logits)
+    labels.append(np.array(batch_labels[0]).reshape(
+        -1, batch_labels.shape[-1])[mask])
+  logits = np.concatenate(logits, axis=1)
+  labels = np.argmax(np.concatenate(labels, axis=0), axis=-1)
+
+  members, val_acc, val_nll = ub.ensemble_selection.greedy_selection(
+      logits,
+      labels,
+      config.greedy_ensemble_size,
+      config.get('greedy_objective', 'nll'),
+      replacement=False,
+      chunk_size=config.get('greedy_chunk_size'),
+      backend='jax')
+  # Hosts evaluate different shards of the validation set; use the members
+  # selected by the first one everywhere.
+  selected = np.full(len(params), -1)
+  selected[:len(members)] = members
+  selected = multihost_utils.broadcast_one_to_all(selected)
+  paths = list(params)
+  selected_paths = [paths[i] for i in selected if i >= 0]
+  logging.info('Members selected by greedy procedure (val accuracy %.4f, val '
+               'NLL %.4f): %s', val_acc, val_nll, selected_paths)
+  return {path: params[path] for path in selected_paths}
+
+
 def main(config, output_dir):
 
   seed = config.get('seed', 0)
@@ -333,6 +388,19 @@ def main(config, output_dir):
                                      axis_name='batch')
     return ncorrect, loss, n, metric_args
 
+  @functools.partial(jax.pmap, axis_name='batch')
+  def member_logits_fn(params, images, labels, mask):
+    # Shape [ensemble_size, batch_size, num_classes].
+    logits = jnp.asarray([
+        model.apply({'params': flax.core.freeze(p)}, images, train=False)[0]
+        for p in params.values()
+    ])
+    label_indices = config.get('label_indices')
+    if label_indices:
+      logits = logits[..., label_indices]
+      labels = labels[..., label_indices]
+    return jax.lax.all_gather([logits, labels, mask], axis_name='batch')
+
   # Setup function for computing representation.
   @functools.partial(jax.pmap, axis_name='batch')
   def representation_fn(params, images, labels, mask):
@@ -356,6 +424,20 @@ def main(config, output_dir):
   write_note('Replicating...')
   ensemble_params = flax.jax_utils.replicate(ensemble_params)
 
+  if config.get('greedy_ensemble_size'):
+    if config.get('loss', 'sigmoid_xent') != 'softmax_xent':
+      raise ValueError('Greedy ensemble selection requires the softmax_xent '
+                       f'loss; got instead config.loss={config.get("loss")}.')
+    write_note('Selecting ensemble members...')
+    greedy_ds = _get_val_split(
+        config.dataset,
+        split=config.get('greedy_split') or config.val_split,
+        pp_eval=config.pp_eval,
+        data_dir=config.get('data_dir'))
+    ensemble_params = select_ensemble_members(member_logits_fn,
+                                              ensemble_params, greedy_ds,
+                                              config)
+
   if jax.process_index() == 0:
     writer.write_hparams(dict(config))
 
@@ -112,16 +112,22 @@ def main(config, output_dir):
   write_note('Initializing train dataset...')
   rng, train_ds_rng = jax.random.split(rng)
   train_ds_rng = jax.random.fold_in(train_ds_rng, jax.process_index())
-  train_ds = input_utils.get_data(
-      dataset=config.dataset,
-      split=config.train_split,
-      rng=train_ds_rng,
-      process_batch_size=local_batch_size,
-      preprocess_fn=preprocess_spec.parse(
-          spec=config.pp_train, available_ops=preprocess_utils.all_ops()),
-      shuffle_buffer_size=config.shuffle_buffer_size,
-      prefetch_size=config.get('prefetch_to_host', 2),
-      data_dir=config.get('data_dir'))
+
+  def _get_train_ds(start_index=0):
+    return input_utils.get_data(
+        dataset=config.dataset,
+        split=config.train_split,
+        rng=train_ds_rng,
+        process_batch_size=local_batch_size,
+        preprocess_fn=preprocess_spec.parse(
+            spec=config.pp_train, available_ops=preprocess_utils.all_ops()),
+        shuffle_buffer_size=config.shuffle_buffer_size,
+        shuffle_mode=config.get('shuffle_mode', 'buffer'),
+        start_index=start_index,
+        prefetch_size=config.get('prefetch_to_host', 2),
+        data_dir=config.get('data_dir'))
+
+  train_ds = _get_train_ds()
 
   write_note('Initializing val dataset(s)...')
 
@@ -462,7 +468,11 @@ def main(config, output_dir):
         representation_fn, config.fewshot,
         config.fewshot.get('batch_size') or batch_size_eval)
 
-  checkpoint_writer = None
+  checkpoint_manager = checkpoint_utils.AsyncCheckpointManager(
+      max_in_flight=config.get('checkpoint_max_in_flight', 1),
+      keep_last_n=config.get('keep_last_n_checkpoints'),
+      sharded=config.get('sharded_checkpoint', False),
+      timeout=config.get('checkpoint_timeout', 1))
 
   lr_fn = train_utils.create_learning_rate_schedule(total_steps,
                                                     **config.get('lr', {}))
@@ -470,8 +480,9 @@ def main(config, output_dir):
   # Prefetch all iterators, starting at the current first step.
   if first_step > 0:
     write_note('Advancing the dataset after resuming from a checkpoint...')
-    # TODO(dusenberrymw): Look into checkpointing dataset state instead.
-    train_ds = train_ds.skip(first_step)
+    # Rebuild the pipeline from the first example of `first_step`, which, with
+    # index shuffling, avoids reading the examples of the previous steps.
+    train_ds = _get_train_ds(start_index=first_step * local_batch_size)
 
   # TODO(dusenberrymw): According to flax docs, prefetching shouldn't be
   # necessary for TPUs.
@@ -508,13 +519,13 @@ def main(config, output_dir):
         step, config.get('checkpoint_steps'), total_steps, process=0):
       write_note('Checkpointing...')
       chrono.pause()
-      train_utils.checkpointing_timeout(checkpoint_writer,
-                                        config.get('checkpoint_timeout', 1))
       accumulated_train_time = chrono.accum_train_time
-      # We need to transfer the weights over now or else we risk keeping them
-      # alive while they'll be updated in a future step, creating hard to debug
+      # We need to snapshot the weights now or else we risk keeping them alive
+      # while they'll be updated in a future step, creating hard to debug
       # memory errors (see b/160593526). Also, takes device 0's params only.
-      opt_cpu = jax.tree_util.tree_map(lambda x: np.array(x[0]), opt_repl)
+      # The snapshot stays on device; the transfer to host, serialization and
+      # writing happen in the background.
+      opt_cpu = checkpoint_utils.snapshot_replicated(opt_repl)
 
       # Check whether we want to keep a copy of the current checkpoint.
       copy_step = None
@@ -530,9 +541,7 @@ def main(config, output_dir):
           optimizer=opt_cpu,
           accumulated_train_time=accumulated_train_time)
 
-      checkpoint_writer = pool.apply_async(
-          checkpoint_utils.checkpoint_trained_model,
-          (checkpoint_data, save_checkpoint_path, copy_step))
+      checkpoint_manager.save(checkpoint_data, save_checkpoint_path, copy_step)
       chrono.resume()
 
     # Report training progress.
@@ -544,6 +553,7 @@ def main(config, output_dir):
       train_measurements = {}
       train_measurements.update(flax.jax_utils.unreplicate(extra_measurements))
       train_measurements.update(timing_measurements)
+      train_measurements.update(input_utils.get_input_metrics(train_iter))
       writer.write_scalars(step, train_measurements)
       # Keep train_loss to return for reproducibility tests.
       train_loss = train_measurements['training_loss']
@@ -705,6 +715,7 @@ def main(config, output_dir):
         break
 
   write_note(f'Done!\n{chrono.note}')
+  checkpoint_manager.close()
   pool.close()
   pool.join()
   writer.close()
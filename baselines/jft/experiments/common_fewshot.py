@@ -47,6 +47,10 @@ def get_fewshot(batch_size=None, target_resolution=224, resize_resolution=256,
   config.pp_eval = config.pp_train
   config.shots = [1, 5, 10, 25]
   config.l2_regs = [2.0 ** i for i in range(-10, 20)]
+  # Logistic regression solver: "sklearn" (one thread per l2 reg),
+  # "sklearn_processes" (one process task per l2 reg and ensemble member) or
+  # "jax" (all l2 regs and ensemble members at once with a batched L-BFGS).
+  config.solver = 'sklearn'
   # choose either "all" or "leave-self-out' for l2_selection_scheme.
   config.l2_selection_scheme = 'leave-self-out'
   config.walk_first = ('imagenet', 10) if not runlocal else ('pets', 10)
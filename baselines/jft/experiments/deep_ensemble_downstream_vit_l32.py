@@ -29,6 +29,10 @@ def get_config():
 
   # model_init should be modified per experiment
   config.model_init = ['/path/to/pretrained_model_ckpt.npz',]
+  # If set, greedily select at most this many members of model_init on the
+  # greedy_split (default: val_split) instead of averaging all of them.
+  config.greedy_ensemble_size = None
+  config.greedy_objective = 'nll'  # One of 'nll', 'acc' or 'nll-acc'.
   config.dataset = ''  # set in sweep
   config.test_split = ''  # set in sweep
   config.val_split = ''  # set in sweep
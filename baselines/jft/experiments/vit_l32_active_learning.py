@@ -40,6 +40,10 @@ def get_config():
   config.early_stopping_patience = 128
   config.finetune_head_only = False
   config.power_acquisition = False
+  # Fraction of the remaining pool whose outputs are recomputed every round,
+  # and number of rounds after which stale outputs are always recomputed.
+  config.pool_refresh_fraction = 1.0
+  config.pool_max_staleness = None
 
   # Dataset section
   config.dataset = ''  # set in sweep
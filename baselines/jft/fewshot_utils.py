@@ -15,12 +15,15 @@
 
 """Utils for fewshot learning."""
 
+import concurrent.futures
 import functools
+import multiprocessing
 import multiprocessing.pool
 
 from absl import logging
 from big_vision import input_pipeline
 import big_vision.pp.builder as pp_builder
+import jax
 import jax.numpy as jnp
 import numpy as np
 import robustness_metrics as rm
@@ -37,6 +40,20 @@ def evaluate(clfs, x_test, labels_test, x_ood_test, eval_ood_detection):
   for i, clf in enumerate(clfs):
     probs += clf.predict_proba(x_test[:, i * repr_size : (i + 1) * repr_size])
   probs = probs / ens_size
+
+  ood_probs = None
+  if eval_ood_detection:
+    ood_probs = 0.0
+    for i, clf in enumerate(clfs):
+      ood_probs += clf.predict_proba(x_ood_test[:, i * repr_size:(i + 1) *
+                                                repr_size])
+    ood_probs = ood_probs / ens_size
+
+  return evaluate_probs(probs, labels_test, ood_probs)
+
+
+def evaluate_probs(probs, labels_test, ood_probs=None):
+  """Evaluates metrics for the (ensemble averaged) predictive probabilities."""
   # Accuracy.
   int_preds = jnp.argmax(probs, axis=1)
   accuracy = jnp.mean(int_preds == labels_test)
@@ -65,13 +82,7 @@ def evaluate(clfs, x_test, labels_test, x_ood_test, eval_ood_detection):
   }
 
   ## MSP AUC.
-  if eval_ood_detection:
-    ood_probs = 0.0
-    for i, clf in enumerate(clfs):
-      ood_probs += clf.predict_proba(x_ood_test[:, i * repr_size:(i + 1) *
-                                                repr_size])
-    ood_probs = ood_probs / ens_size
-
+  if ood_probs is not None:
     scores0 = 1 - np.max(probs, axis=-1)
     scores1 = 1 - np.max(ood_probs, axis=-1)
     ood_labels0 = np.zeros_like(scores0)
@@ -85,21 +96,263 @@ def evaluate(clfs, x_test, labels_test, x_ood_test, eval_ood_detection):
   return metric_results
 
 
+def fit_logistic_regression(l2_reg, x, y):
+  """Fits a multinomial sklearn logistic regression at l2_reg."""
+  clf = LogisticRegression(
+      random_state=0, multi_class="multinomial", C=1 / l2_reg, max_iter=150)
+  clf.fit(x, y)
+  return clf
+
+
 def train_and_eval(l2_reg, x, y, ens_size,
                    x_test, labels_test, x_ood_test, eval_ood_detection):
   """Trains logistic regressors at l2_reg and evaluate them right after."""
   clfs = []
   repr_size = x.shape[-1] // ens_size
   for i in range(ens_size):
-    clf = LogisticRegression(
-        random_state=0, multi_class="multinomial", C=1 / l2_reg, max_iter=150)
-    clf.fit(x[:, i * repr_size:(i + 1) * repr_size], y)
+    clf = fit_logistic_regression(l2_reg,
+                                  x[:, i * repr_size:(i + 1) * repr_size], y)
     clfs.append(clf)
   metric_results = evaluate(clfs, x_test, labels_test, x_ood_test,
                             eval_ood_detection)
   return l2_reg, metric_results
 
 
+def train_and_eval_processes(l2_regs, x, y, ens_size, x_test, labels_test,
+                             x_ood_test, eval_ood_detection, num_workers=None):
+  """Fits the regressors of all l2 regs and members in parallel processes.
+
+  Unlike the threads of `train_and_eval`, the processes are not limited by the
+  GIL, and each (l2_reg, member) pair is a separate task.
+
+  Args:
+    l2_regs: list of l2 regularization coefficients.
+    x: training representations of shape [n, ens_size * repr_size].
+    y: training labels of shape [n].
+    ens_size: number of ensemble members.
+    x_test: test representations.
+    labels_test: test labels.
+    x_ood_test: OOD test representations, or None.
+    eval_ood_detection: whether to evaluate OOD detection.
+    num_workers: number of processes. Defaults to the number of CPUs.
+
+  Returns:
+    a list of (l2_reg, metric_results) tuples.
+  """
+  x, y = np.asarray(x), np.asarray(y)
+  repr_size = x.shape[-1] // ens_size
+  # Spawn rather than fork the workers, since forking a process that runs JAX
+  # and TensorFlow threads is unsafe.
+  with concurrent.futures.ProcessPoolExecutor(
+      max_workers=num_workers,
+      mp_context=multiprocessing.get_context("spawn")) as executor:
+    futures = {(l2_reg, i): executor.submit(
+        fit_logistic_regression, l2_reg,
+        x[:, i * repr_size:(i + 1) * repr_size], y)
+               for l2_reg in l2_regs for i in range(ens_size)}
+    output = []
+    for l2_reg in l2_regs:
+      clfs = [futures[l2_reg, i].result() for i in range(ens_size)]
+      output.append((l2_reg, evaluate(clfs, x_test, labels_test, x_ood_test,
+                                      eval_ood_detection)))
+  return output
+
+
+def _lbfgs_minimize(fun, x0, max_iter, history_size, tol):
+  """Minimizes `fun` with L-BFGS and a backtracking Armijo line search.
+
+  All loops are `jax.lax` loops, so that the minimization can be vmapped over
+  a batch of problems.
+
+  Args:
+    fun: scalar function of a vector.
+    x0: initial vector.
+    max_iter: maximum number of iterations.
+    history_size: number of curvature pairs kept for the Hessian estimate.
+    tol: stops when the maximum absolute gradient is below tol.
+
+  Returns:
+    the minimizing vector.
+  """
+  value_and_grad = jax.value_and_grad(fun)
+
+  def search_direction(g, s_hist, y_hist, rho_hist, k):
+    # Two-loop recursion. Unfilled history entries are zero and have no effect.
+    def first_loop(i, carry):
+      q, alphas = carry
+      idx = (k - 1 - i) % history_size
+      alpha = rho_hist[idx] * jnp.dot(s_hist[idx], q)
+      return q - alpha * y_hist[idx], alphas.at[idx].set(alpha)
+
+    q, alphas = jax.lax.fori_loop(0, history_size, first_loop,
+                                  (g, jnp.zeros(history_size, g.dtype)))
+    newest = (k - 1) % history_size
+    y_dot_y = jnp.dot(y_hist[newest], y_hist[newest])
+    gamma = jnp.where(
+        k > 0,
+        jnp.dot(s_hist[newest], y_hist[newest]) / jnp.maximum(y_dot_y, 1e-30),
+        1. / jnp.maximum(jnp.linalg.norm(g), 1e-30))
+
+    def second_loop(i, r):
+      idx = (k + i) % history_size  # From the oldest to the newest entry.
+      beta = rho_hist[idx] * jnp.dot(y_hist[idx], r)
+      return r + (alphas[idx] - beta) * s_hist[idx]
+
+    return -jax.lax.fori_loop(0, history_size, second_loop, gamma * q)
+
+  def line_search(x, f, g, d):
+    slope = jnp.dot(g, d)
+
+    def cond(state):
+      step, f_new, _, num_evals = state
+      return (f_new > f + 1e-4 * step * slope) & (num_evals < 30)
+
+    def body(state):
+      step, _, _, num_evals = state
+      step = step / 2
+      f_new, g_new = value_and_grad(x + step * d)
+      return step, f_new, g_new, num_evals + 1
+
+    f_new, g_new = value_and_grad(x + d)
+    step, f_new, g_new, _ = jax.lax.while_loop(
+        cond, body, (jnp.ones_like(f), f_new, g_new, 1))
+    return step, f_new, g_new
+
+  def cond(state):
+    _, _, g, _, _, _, _, it = state
+    return (it < max_iter) & (jnp.max(jnp.abs(g)) > tol)
+
+  def body(state):
+    x, f, g, s_hist, y_hist, rho_hist, k, it = state
+    d = search_direction(g, s_hist, y_hist, rho_hist, k)
+    # Fall back to steepest descent if d is not a descent direction.
+    d = jnp.where(jnp.dot(g, d) < 0, d, -g)
+    step, f_new, g_new = line_search(x, f, g, d)
+    s = step * d
+    y = g_new - g
+    s_dot_y = jnp.dot(s, y)
+    # Only keep pairs with positive curvature, so the estimate stays positive
+    # definite.
+    keep = s_dot_y > 1e-10
+    idx = k % history_size
+    s_hist = jnp.where(keep, s_hist.at[idx].set(s), s_hist)
+    y_hist = jnp.where(keep, y_hist.at[idx].set(y), y_hist)
+    rho_hist = jnp.where(keep, rho_hist.at[idx].set(1. / s_dot_y), rho_hist)
+    k = jnp.where(keep, k + 1, k)
+    return x + s, f_new, g_new, s_hist, y_hist, rho_hist, k, it + 1
+
+  f0, g0 = value_and_grad(x0)
+  history = jnp.zeros((history_size,) + x0.shape, x0.dtype)
+  state = (x0, f0, g0, history, history,
+           jnp.zeros(history_size, x0.dtype), 0, 0)
+  return jax.lax.while_loop(cond, body, state)[0]
+
+
+@functools.partial(
+    jax.jit, static_argnames=("num_classes", "max_iter", "history_size"))
+def _fit_logistic_regressions(x, y, l2_regs, *, num_classes, max_iter,
+                              history_size, tol):
+  """Fits multinomial logistic regressions for a batch of members and l2s.
+
+  Minimizes the same objective as sklearn's `LogisticRegression` with
+  `C = 1 / l2_reg`, i.e. the summed cross-entropy plus `l2_reg / 2` times the
+  squared norm of the weights (the bias is not regularized), divided by the
+  number of examples.
+
+  Args:
+    x: representations of shape [ens_size, n, repr_size].
+    y: integer labels of shape [n].
+    l2_regs: l2 regularization coefficients of shape [num_l2].
+    num_classes: number of classes.
+    max_iter: maximum number of L-BFGS iterations.
+    history_size: L-BFGS history size.
+    tol: L-BFGS gradient tolerance.
+
+  Returns:
+    weights of shape [num_l2, ens_size, repr_size, num_classes] and biases of
+    shape [num_l2, ens_size, num_classes].
+  """
+  repr_size = x.shape[-1]
+  labels = jax.nn.one_hot(y, num_classes, dtype=x.dtype)
+
+  def fit(x, l2_reg):
+    def loss(params):
+      w = params[:-num_classes].reshape(repr_size, num_classes)
+      b = params[-num_classes:]
+      log_probs = jax.nn.log_softmax(x @ w + b)
+      nll = -jnp.mean(jnp.sum(labels * log_probs, axis=-1))
+      return nll + 0.5 * l2_reg / x.shape[0] * jnp.sum(w**2)
+
+    params0 = jnp.zeros((repr_size + 1) * num_classes, x.dtype)
+    params = _lbfgs_minimize(loss, params0, max_iter, history_size, tol)
+    return (params[:-num_classes].reshape(repr_size, num_classes),
+            params[-num_classes:])
+
+  # Vmap over the l2 regs (outer axis) and ensemble members (inner axis).
+  fit = jax.vmap(jax.vmap(fit, in_axes=(0, None)), in_axes=(None, 0))
+  return fit(x, l2_regs)
+
+
+def batched_train_and_eval(l2_regs, x, y, ens_size, num_classes, x_test,
+                           labels_test, x_ood_test, eval_ood_detection,
+                           max_iter=150, history_size=10, tol=1e-5,
+                           chunk_size=8):
+  """Fits and evaluates the regressors of all l2 regs and members at once.
+
+  The regressors are fitted with a vmapped L-BFGS solver in JAX, so all
+  (l2_reg, member) problems share the same compiled computation and run on
+  the accelerator.
+
+  Args:
+    l2_regs: list of l2 regularization coefficients.
+    x: training representations of shape [n, ens_size * repr_size].
+    y: training labels of shape [n].
+    ens_size: number of ensemble members.
+    num_classes: number of classes.
+    x_test: test representations.
+    labels_test: test labels.
+    x_ood_test: OOD test representations, or None.
+    eval_ood_detection: whether to evaluate OOD detection.
+    max_iter: maximum number of L-BFGS iterations.
+    history_size: L-BFGS history size.
+    tol: L-BFGS gradient tolerance.
+    chunk_size: number of l2 regs fitted at once, to bound the memory of the
+      L-BFGS histories.
+
+  Returns:
+    a list of (l2_reg, metric_results) tuples.
+  """
+
+  def split_members(x):
+    x = jnp.asarray(x, jnp.float32)
+    return jnp.moveaxis(x.reshape(x.shape[0], ens_size, -1), 1, 0)
+
+  def predict(x, w, b):
+    # [ens_size, n, repr_size] -> [num_l2, n, num_classes], averaged over the
+    # members' probabilities.
+    logits = jnp.einsum("mnd,lmdc->lmnc", x, w) + b[:, :, None, :]
+    return np.asarray(jnp.mean(jax.nn.softmax(logits), axis=1))
+
+  x, x_test = split_members(x), split_members(x_test)
+  if eval_ood_detection:
+    x_ood_test = split_members(x_ood_test)
+
+  output = []
+  for start in range(0, len(l2_regs), chunk_size):
+    chunk = list(l2_regs[start:start + chunk_size])
+    w, b = _fit_logistic_regressions(
+        x, jnp.asarray(y), jnp.asarray(chunk, jnp.float32),
+        num_classes=num_classes, max_iter=max_iter, history_size=history_size,
+        tol=tol)
+    probs = predict(x_test, w, b)
+    ood_probs = predict(x_ood_test, w, b) if eval_ood_detection else None
+    for i, l2_reg in enumerate(chunk):
+      output.append((l2_reg, evaluate_probs(
+          probs[i], labels_test,
+          ood_probs[i] if eval_ood_detection else None)))
+  return output
+
+
 def select_best_l2_reg(results, shots_list, l2_regs, how="all"):
   """Selects best l2 regularization for each (dataset, num_shots) pair.
 
@@ -214,6 +467,18 @@ class LogRegFewShotEvaluator:
     self.ood_datasets = fewshot_config.ood_datasets
     self.ens_size = ens_size
     self.l2_selection_scheme = l2_selection_scheme
+    # One of "sklearn" (threads, one per l2 reg), "sklearn_processes" (one
+    # process task per l2 reg and member) or "jax" (batched L-BFGS).
+    self.solver = fewshot_config.get("solver", "sklearn")
+    if self.solver not in ("sklearn", "sklearn_processes", "jax"):
+      raise ValueError(f"Unknown fewshot solver `{self.solver}`.")
+    self.solver_num_workers = fewshot_config.get("solver_num_workers")
+    self.solver_chunk_size = fewshot_config.get("solver_chunk_size", 8)
+    # Cache of the representations of the current `run_all` call, keyed by
+    # (dataset, split, train). This avoids recomputing the representations of
+    # datasets that are used several times, e.g. as both in-distribution and
+    # OOD datasets. None outside of `run_all`.
+    self._reprs = None
 
   # Setup input pipeline.
   def _get_dataset(self, dataset, train_split, test_split):
@@ -264,6 +529,20 @@ class LogRegFewShotEvaluator:
                  f"labels: {labels.shape}")
     return pre_logits, labels
 
+  def _get_cached_repr(self, params, dataset, split, data, steps, *, train,
+                       **kwargs):
+    """Computes the representation of a split, or returns the cached one."""
+    if self._reprs is None:
+      return self._get_repr(params, data, steps, **kwargs)
+    # The train and test splits are preprocessed differently.
+    key = (dataset, split, train)
+    if key not in self._reprs:
+      self._reprs[key] = self._get_repr(params, data, steps, **kwargs)
+    else:
+      logging.info("[fewshot][%s]: Reusing representation of %s", dataset,
+                   split)
+    return self._reprs[key]
+
   def compute_fewshot_metrics(self, params, dataset, train_split, test_split,
                               eval_ood_detection, ood_dataset, ood_train_split,
                               ood_test_split, **kw):
@@ -271,9 +550,11 @@ class LogRegFewShotEvaluator:
     train_ds, steps_tr, test_ds, steps_te, num_classes = self._get_dataset(
         dataset, train_split, test_split)
     logging.info("[fewshot][%s]: Precomputing train (%s)", dataset, train_split)
-    repr_train, labels_train = self._get_repr(params, train_ds, steps_tr, **kw)
+    repr_train, labels_train = self._get_cached_repr(
+        params, dataset, train_split, train_ds, steps_tr, train=True, **kw)
     logging.info("[fewshot][%s]: Precomputing test (%s)", dataset, test_split)
-    repr_test, labels_test = self._get_repr(params, test_ds, steps_te, **kw)
+    repr_test, labels_test = self._get_cached_repr(
+        params, dataset, test_split, test_ds, steps_te, train=False, **kw)
     # For OOD detection.
     if eval_ood_detection:
       _, _, ood_test_ds, steps_ood_te, _ = self._get_dataset(ood_dataset,
@@ -281,7 +562,9 @@ class LogRegFewShotEvaluator:
                                                              ood_test_split)
       logging.info("[fewshot][%s]: Precomputing ood (%s)", dataset,
                    ood_test_split)
-      repr_ood_test, _ = self._get_repr(params, ood_test_ds, steps_ood_te, **kw)
+      repr_ood_test, _ = self._get_cached_repr(
+          params, ood_dataset, ood_test_split, ood_test_ds, steps_ood_te,
+          train=False, **kw)
 
     logging.info("[fewshot][%s]: solving systems", dataset)
 
@@ -305,20 +588,31 @@ class LogRegFewShotEvaluator:
       else:
         x_ood_test = None
 
-      # Prepares train_and_eval for parallelization via multiprocessing.pool.
-      partial_train_and_eval = functools.partial(
-          train_and_eval,
-          x=x,
-          y=y,
-          ens_size=self.ens_size,
-          x_test=x_test,
-          labels_test=labels_test,
-          x_ood_test=x_ood_test,
-          eval_ood_detection=eval_ood_detection)
-
-      worker_count = len(self.l2_regs)
-      with multiprocessing.pool.ThreadPool(worker_count) as pool:
-        output = list(pool.map(partial_train_and_eval, self.l2_regs))
+      if self.solver == "jax":
+        output = batched_train_and_eval(
+            self.l2_regs, x, y, self.ens_size, num_classes, x_test,
+            labels_test, x_ood_test, eval_ood_detection,
+            chunk_size=self.solver_chunk_size)
+      elif self.solver == "sklearn_processes":
+        output = train_and_eval_processes(
+            self.l2_regs, x, y, self.ens_size, x_test, labels_test,
+            x_ood_test, eval_ood_detection,
+            num_workers=self.solver_num_workers)
+      else:
+        # Prepares train_and_eval for parallelization via multiprocessing.pool.
+        partial_train_and_eval = functools.partial(
+            train_and_eval,
+            x=x,
+            y=y,
+            ens_size=self.ens_size,
+            x_test=x_test,
+            labels_test=labels_test,
+            x_ood_test=x_ood_test,
+            eval_ood_detection=eval_ood_detection)
+
+        worker_count = len(self.l2_regs)
+        with multiprocessing.pool.ThreadPool(worker_count) as pool:
+          output = list(pool.map(partial_train_and_eval, self.l2_regs))
 
       for l2_reg, metric_results in output:
         results[shots, l2_reg] = metric_results
@@ -328,15 +622,22 @@ class LogRegFewShotEvaluator:
   def run_all(self, params, datasets, **kwargs):
     """Compute summary over all `datasets` that comes from config."""
     results = {}
-    for name, dataset_args in datasets.items():
-      eval_ood_detection = name in self.ood_datasets
-      if eval_ood_detection:
-        ood_dataset_args = self.ood_datasets[name]
-      else:
-        ood_dataset_args = (None, None, None)
-      results[name] = self.compute_fewshot_metrics(params, *dataset_args,
-                                                   eval_ood_detection,
-                                                   *ood_dataset_args, **kwargs)
+    # The representations depend on `params`, so they are only shared within
+    # this call.
+    self._reprs = {}
+    try:
+      for name, dataset_args in datasets.items():
+        eval_ood_detection = name in self.ood_datasets
+        if eval_ood_detection:
+          ood_dataset_args = self.ood_datasets[name]
+        else:
+          ood_dataset_args = (None, None, None)
+        results[name] = self.compute_fewshot_metrics(params, *dataset_args,
+                                                     eval_ood_detection,
+                                                     *ood_dataset_args,
+                                                     **kwargs)
+    finally:
+      self._reprs = None
 
     best_l2 = select_best_l2_reg(
         results, self.shots, self.l2_regs, how=self.l2_selection_scheme)
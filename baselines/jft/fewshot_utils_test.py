@@ -17,6 +17,8 @@
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import jax
+import numpy as np
 import fewshot_utils  # local file import from baselines.jft
 
 
@@ -68,6 +70,28 @@ class FewshotUtilsTest(parameterized.TestCase):
       fewshot_utils.select_best_l2_reg(
           results, shots_list, l2_regs, how='bad-scheme')
 
+  def test_batched_solver_matches_sklearn(self):
+    rng = np.random.RandomState(0)
+    num_classes, repr_size, ens_size, shots = 4, 8, 2, 10
+    y = np.repeat(np.arange(num_classes), shots)
+    class_means = rng.normal(size=(num_classes, ens_size * repr_size))
+    x = class_means[y] + rng.normal(size=(len(y), ens_size * repr_size))
+    x = ((x - x.mean(0)) / x.std(0)).astype(np.float32)
+    l2_regs = [2.0**-3, 1.0, 2.0**5]
+
+    w, b = fewshot_utils._fit_logistic_regressions(
+        np.moveaxis(x.reshape(len(y), ens_size, repr_size), 1, 0), y,
+        np.array(l2_regs, np.float32), num_classes=num_classes, max_iter=500,
+        history_size=10, tol=1e-6)
+
+    for i, l2_reg in enumerate(l2_regs):
+      for m in range(ens_size):
+        x_m = x[:, m * repr_size:(m + 1) * repr_size]
+        clf = fewshot_utils.fit_logistic_regression(l2_reg, x_m, y)
+        probs = jax.nn.softmax(x_m @ w[i, m] + b[i, m])
+        np.testing.assert_allclose(
+            probs, clf.predict_proba(x_m), atol=2e-3)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -20,13 +20,13 @@ import math
 from typing import Callable, Dict, Optional, Union
 
 from absl import logging
-import flax
 import jax
 import jax.numpy as jnp
 import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import al_utils  # local file import from baselines.jft
+import prefetch_utils  # local file import from baselines.jft
 from uncertainty_baselines.datasets import tfds as ub_tfds
 
 Tensor = Union[tf.Tensor, tf.SparseTensor, tf.RaggedTensor]
@@ -134,7 +134,8 @@ def get_num_examples(dataset: Union[str, tfds.core.DatasetBuilder,
 def _preprocess_with_per_example_rng(ds: tf.data.Dataset,
                                      preprocess_fn: Callable[[Features],
                                                              Features], *,
-                                     rng: jnp.ndarray) -> tf.data.Dataset:
+                                     rng: jnp.ndarray,
+                                     start_index: int = 0) -> tf.data.Dataset:
   """Maps `ds` using the preprocess_fn and a deterministic RNG per example.
 
   Args:
@@ -145,6 +146,8 @@ def _preprocess_with_per_example_rng(ds: tf.data.Dataset,
       convertible into a TF graph.
     rng: Base RNG to use. Per example RNGs will be derived from this by folding
       in the example index.
+    start_index: Index of the first example of `ds`, such that a pipeline
+      resumed from `start_index` uses the same per example RNGs.
 
   Returns:
     The dataset mapped by the `preprocess_fn`.
@@ -159,7 +162,8 @@ def _preprocess_with_per_example_rng(ds: tf.data.Dataset,
       del processed["rng"]
     return processed
 
-  return ds.enumerate().map(_fn, num_parallel_calls=tf.data.AUTOTUNE)
+  return ds.enumerate(start=start_index).map(
+      _fn, num_parallel_calls=tf.data.AUTOTUNE)
 
 
 def _build_dataset(dataset: Union[str, tfds.core.DatasetBuilder,
@@ -192,6 +196,92 @@ def _build_dataset(dataset: Union[str, tfds.core.DatasetBuilder,
   return ds
 
 
+def _epoch_permutation(seed: np.ndarray, epoch: int,
+                       num_examples: int) -> np.ndarray:
+  """Returns the permutation of the example indices for the given epoch."""
+  rng = np.random.default_rng([int(x) for x in np.ravel(seed)] + [epoch])
+  return rng.permutation(num_examples)
+
+
+def _build_index_shuffled_dataset(
+    dataset: Union[str, tfds.core.DatasetBuilder, SubsetDatasetBuilder],
+    data_dir: Optional[str], split: str, seed: np.ndarray, process_index: int,
+    process_count: int, drop_remainder: bool, num_epochs: Optional[int],
+    start_index: int) -> tf.data.Dataset:
+  """Builds the repeated dataset of the process split in shuffled order.
+
+  Every epoch, the examples of the process split are read in the order of a
+  new random permutation of their indices. The examples are read in parallel,
+  with random access to a TFDS data source (e.g. a dataset in the ArrayRecord
+  format), so only the permutation is held in memory rather than a buffer of
+  examples.
+
+  Args:
+    dataset: Either a dataset name or a dataset builder object.
+    data_dir: Directory for the dataset files.
+    split: Specifies which split of the data to load.
+    seed: Seed of the permutations, combined with the epoch.
+    process_index: Integer id of the current process.
+    process_count: Number of global processes.
+    drop_remainder: Whether to drop remainders when splitting across processes.
+    num_epochs: Number of epochs, or None to repeat forever.
+    start_index: Number of examples, over all epochs, to start after.
+
+  Returns:
+    The dataset of examples, with undecoded images.
+  """
+  dataset_builder = _get_dataset_builder(dataset, data_dir)
+  if not isinstance(dataset_builder, tfds.core.DatasetBuilder):
+    raise ValueError(
+        "Index shuffling needs a tfds.core.DatasetBuilder with random access, "
+        f"received {dataset_builder}.")
+  process_split = _get_process_split(
+      split,
+      process_index=process_index,
+      process_count=process_count,
+      drop_remainder=drop_remainder)
+  decoders = {"image": tfds.decode.SkipDecoding()}
+  data_source = dataset_builder.as_data_source(
+      split=process_split, decoders=decoders)
+  # ArrayRecord datasets can not be read with `as_dataset`, so the spec of the
+  # examples is derived from the features, with the images left encoded.
+  element_spec = dataset_builder.info.features.get_tensor_spec()
+  element_spec["image"] = tf.TensorSpec(shape=(), dtype=tf.string)
+  flat_element_spec = tf.nest.flatten(element_spec)
+  num_examples = len(data_source)
+  if not num_examples:
+    raise ValueError(f"The {process_split} split is empty.")
+
+  def _epoch_indices():
+    # Only the permutation of every epoch goes through Python.
+    epoch, offset = divmod(start_index, num_examples)
+    while num_epochs is None or epoch < num_epochs:
+      yield _epoch_permutation(seed, epoch, num_examples)[offset:]
+      epoch, offset = epoch + 1, 0
+
+  def _read_example(index):
+    example = data_source[int(index)]
+    return [
+        np.asarray(value, spec.dtype.as_numpy_dtype)
+        for value, spec in zip(tf.nest.flatten(example), flat_element_spec)
+    ]
+
+  def _read(index):
+    flat_example = tf.numpy_function(
+        _read_example, [index], [spec.dtype for spec in flat_element_spec],
+        stateful=False)
+    for value, spec in zip(flat_example, flat_element_spec):
+      value.set_shape(spec.shape)
+    return tf.nest.pack_sequence_as(element_spec, flat_example)
+
+  indices = tf.data.Dataset.from_generator(
+      _epoch_indices,
+      output_signature=tf.TensorSpec(shape=(None,), dtype=tf.int64)).unbatch()
+  # The examples are read in parallel, and in the order of the indices.
+  return indices.map(
+      _read, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+
+
 def get_data(
     dataset: Union[str, tfds.core.DatasetBuilder, SubsetDatasetBuilder],
     split: str,
@@ -203,6 +293,8 @@ def get_data(
     repeat_after_batching: bool = False,
     shuffle: bool = True,
     shuffle_buffer_size: int = 10_000,
+    shuffle_mode: str = "buffer",
+    start_index: int = 0,
     prefetch_size: int = 4,
     drop_remainder: bool = True,
     data_dir: Optional[str] = None,
@@ -230,6 +322,18 @@ def get_data(
       batching.
     shuffle: Whether to shuffle the dataset (both on file and example level).
     shuffle_buffer_size: Number of examples in the shuffle buffer.
+    shuffle_mode: How to shuffle the examples if `shuffle`. With "buffer", the
+      files and then the examples (within a buffer of `shuffle_buffer_size`)
+      are shuffled. With "index", the examples of the process split are read
+      in the order of a new random permutation of their indices every epoch,
+      which mixes the whole split while holding only the permutation in
+      memory. It needs a dataset with random access, e.g. stored in the
+      ArrayRecord format.
+    start_index: Number of examples of the process split to skip, over all
+      epochs, e.g. `step * process_batch_size` to resume the pipeline of a
+      training restored at `step`. The resumed pipeline yields exactly the
+      same examples, with the same preprocessing RNGs, as the original one.
+      With "index" shuffling, the skipped examples are not even read.
     prefetch_size: The number of elements in the final dataset to prefetch in
       the background. This should be a small (say <10) positive integer or
       tf.data.AUTOTUNE.
@@ -249,6 +353,16 @@ def get_data(
     multi-process setup.
   """
   assert cache in ("loaded", "batched", False, None)
+  if shuffle_mode not in ("buffer", "index"):
+    raise ValueError(
+        f"shuffle_mode must be 'buffer' or 'index', received {shuffle_mode}.")
+  index_shuffle = shuffle and shuffle_mode == "index"
+  if index_shuffle and (cache == "loaded" or repeat_after_batching):
+    raise ValueError("Index shuffling reads the examples in a new order every "
+                     "epoch, so it does not support cache='loaded' or "
+                     "repeat_after_batching.")
+  if start_index and repeat_after_batching:
+    raise ValueError("start_index is not supported with repeat_after_batching.")
 
   rng_available = rng is not None
   if not rng_available and shuffle:
@@ -266,24 +380,40 @@ def get_data(
   else:
     rngs = 3 * [[None, None]]
 
-  ds = _build_dataset(
-      dataset,
-      data_dir=data_dir,
-      split=split,
-      shuffle_files=shuffle,
-      file_shuffle_seed=rngs.pop()[0],
-      process_index=process_index,
-      process_count=process_count,
-      drop_remainder=drop_remainder)
+  file_shuffle_seed = rngs.pop()[0]
+  if index_shuffle:
+    ds = _build_index_shuffled_dataset(
+        dataset,
+        data_dir=data_dir,
+        split=split,
+        seed=np.asarray(rngs.pop()),
+        process_index=process_index,
+        process_count=process_count,
+        drop_remainder=drop_remainder,
+        num_epochs=num_epochs,
+        start_index=start_index)
+  else:
+    ds = _build_dataset(
+        dataset,
+        data_dir=data_dir,
+        split=split,
+        shuffle_files=shuffle,
+        file_shuffle_seed=file_shuffle_seed,
+        process_index=process_index,
+        process_count=process_count,
+        drop_remainder=drop_remainder)
 
-  if cache == "loaded":
-    ds = ds.cache()
+    if cache == "loaded":
+      ds = ds.cache()
 
-  if shuffle:
-    ds = ds.shuffle(shuffle_buffer_size, seed=rngs.pop()[0])
+    if shuffle:
+      ds = ds.shuffle(shuffle_buffer_size, seed=rngs.pop()[0])
 
-  if not repeat_after_batching:
-    ds = ds.repeat(num_epochs)
+    if not repeat_after_batching:
+      ds = ds.repeat(num_epochs)
+
+    if start_index:
+      ds = ds.skip(start_index)
 
   mask_fn = lambda ex: dict(mask=1., **ex)
   if preprocess_fn is not None:
@@ -293,7 +423,7 @@ def get_data(
 
   if rng_available:
     ds = _preprocess_with_per_example_rng(
-        ds, preprocess_and_mask_fn, rng=rngs.pop())
+        ds, preprocess_and_mask_fn, rng=rngs.pop(), start_index=start_index)
   else:
     ds = ds.map(preprocess_and_mask_fn, num_parallel_calls=tf.data.AUTOTUNE)
 
@@ -352,17 +482,46 @@ def cifar_from_sql(sql_database: str,
       element_spec=cifar_element_spec)
 
 
-def start_input_pipeline(dataset, n_prefetch, devices=None):
-  """Creates a data iterator with optional prefetching and padding."""
-  it = iter(dataset)
+def start_input_pipeline(dataset, n_prefetch, devices=None, num_threads=2):
+  """Creates a data iterator with optional prefetching and padding.
+
+  With `n_prefetch`, the batches are converted and transferred to the devices
+  on `num_threads` background threads, see
+  `prefetch_utils.DevicePrefetchIterator`.
+
+  Args:
+    dataset: The dataset, with batches of shape [num_devices,
+      per_device_batch_size, ...].
+    n_prefetch: Number of batches prefetched to the devices, or 0 to iterate
+      over numpy batches on the host.
+    devices: Devices to transfer the batches to, by default the local ones.
+    num_threads: Number of threads transferring the batches to the devices.
+
+  Returns:
+    An iterator over the batches.
+  """
+  if n_prefetch:
+    return prefetch_utils.DevicePrefetchIterator(
+        dataset, n_prefetch, devices=devices, num_threads=num_threads)
 
   def _prepare(x):
     # Transforms x into read-only numpy array without copy if possible, see:
     # https://github.com/tensorflow/tensorflow/issues/33254#issuecomment-542379165
     return np.asarray(memoryview(x))
 
-  it = (jax.tree_map(_prepare, xs) for xs in it)
+  return (jax.tree_map(_prepare, xs) for xs in iter(dataset))
 
-  if n_prefetch:
-    it = flax.jax_utils.prefetch_to_device(it, n_prefetch, devices=devices)
-  return it
+
+def get_input_metrics(it) -> Dict[str, float]:
+  """Returns the metrics of an iterator from `start_input_pipeline`.
+
+  Args:
+    it: Iterator returned by `start_input_pipeline`.
+
+  Returns:
+    The queue depth and wait time metrics averaged since the previous call, or
+    an empty dictionary if the batches are not prefetched to the devices.
+  """
+  if isinstance(it, prefetch_utils.DevicePrefetchIterator):
+    return it.metrics()
+  return {}
@@ -204,6 +204,62 @@ class InputUtilsTest(parameterized.TestCase, tf.test.TestCase):
     self.assertAllClose(val_image_sum, correct_val_image_sum)
     self.assertAllClose(val_labels_sum, correct_val_labels_sum)
 
+  def _get_index_shuffled_labels(self, num_epochs, start_index=0):
+    """Returns the labels of the examples read with index shuffling."""
+    num_examples = 10
+
+    class _DataSource:
+      """Random access data source of examples labeled by their index."""
+
+      def __len__(self):
+        return num_examples
+
+      def __getitem__(self, index):
+        return dict(image=b"", label=index, file_name=str(index).encode())
+
+    def as_data_source_fn(builder, split, decoders=None, **kwargs):
+      del builder, split, decoders, kwargs
+      return _DataSource()
+
+    with tfds.testing.mock_data(
+        num_examples=num_examples,
+        as_data_source_fn=as_data_source_fn,
+        data_dir=self.data_dir):
+      ds = input_utils.get_data(
+          "imagenet2012",
+          split="train",
+          rng=jax.random.PRNGKey(42),
+          process_batch_size=jax.local_device_count(),
+          preprocess_fn=lambda example: {"label": example["label"]},
+          num_epochs=num_epochs,
+          shuffle_mode="index",
+          start_index=start_index,
+          data_dir=self.data_dir,
+          process_index=0,
+          process_count=1)
+      return [
+          int(label) for batch in ds.as_numpy_iterator()
+          for label in batch["label"].ravel()
+      ]
+
+  def test_get_data_index_shuffle(self):
+    labels = self._get_index_shuffled_labels(num_epochs=3)
+    self.assertLen(labels, 30)
+    epochs = [labels[i:i + 10] for i in range(0, 30, 10)]
+    # Each epoch reads every example once, in the order of a new permutation.
+    for epoch in epochs:
+      self.assertCountEqual(epoch, range(10))
+    self.assertNotEqual(epochs[0], epochs[1])
+    self.assertNotEqual(epochs[1], epochs[2])
+
+    # A pipeline resumed in the middle of an epoch yields the remainder of the
+    # uninterrupted stream.
+    for start_index in (4, 10, 13):
+      self.assertEqual(
+          self._get_index_shuffled_labels(num_epochs=3,
+                                          start_index=start_index),
+          labels[start_index:])
+
 
 if __name__ == "__main__":
   tf.test.main()
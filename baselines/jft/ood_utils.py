@@ -26,8 +26,11 @@ Referneces:
 
 from absl import logging
 import jax
+from jax.experimental import multihost_utils
+import jax.numpy as jnp
 import numpy as np
 import scipy
+import scipy.linalg
 import sklearn.metrics
 
 import input_utils  # local file import from baselines.jft
@@ -226,10 +229,240 @@ def compute_mean_and_cov(embeds, labels):
   return mean_list, cov
 
 
+class GaussianStatsAccumulator:
+  """Streaming sufficient statistics of class-conditional Gaussians.
+
+  Accumulates per-class counts and means and the shared within-class scatter
+  matrix batch by batch, merging each batch with the running statistics using
+  the pairwise update of Chan et al. The result matches `compute_mean_and_cov`
+  without keeping the training embeddings around, so the memory footprint does
+  not grow with the dataset size.
+
+  Embeddings may carry a trailing ensemble axis, i.e. be of size
+  [batch_size, n_dim, ens_size], in which case separate statistics are kept for
+  every ensemble member.
+  """
+
+  def __init__(self, num_classes, n_dim, ens_size=None):
+    """Initializes the accumulator.
+
+    Args:
+      num_classes: The number of classes.
+      n_dim: The dimension of the embedding.
+      ens_size: The number of ensemble members, or None for a single model.
+    """
+    self.num_classes = num_classes
+    self.n_dim = n_dim
+    self.ens_size = ens_size
+    n_members = ens_size or 1
+    self.counts = np.zeros((num_classes,), dtype=np.float64)
+    self.means = np.zeros((n_members, num_classes, n_dim), dtype=np.float64)
+    self.scatter = np.zeros((n_members, n_dim, n_dim), dtype=np.float64)
+
+  def _members_first(self, embeds):
+    embeds = np.asarray(embeds, dtype=np.float64)
+    if self.ens_size is None:
+      return embeds[None]
+    # A view of shape [ens_size, batch_size, n_dim]; no copy of the members.
+    return np.moveaxis(embeds, -1, 0)
+
+  def _merge(self, counts, means, scatter):
+    """Merges statistics of a disjoint set of examples into the accumulator."""
+    total = self.counts + counts
+    # Weights n_a * n_b / (n_a + n_b), zero for classes absent from either set.
+    weights = np.divide(
+        self.counts * counts, total, out=np.zeros_like(total), where=total > 0)
+    delta = means - self.means
+    self.scatter += scatter + np.einsum('mcd,c,mce->mde', delta, weights, delta)
+    ratio = np.divide(counts, total, out=np.zeros_like(total), where=total > 0)
+    self.means += delta * ratio[None, :, None]
+    self.counts = total
+
+  def update(self, embeds, labels):
+    """Adds a batch of embeddings.
+
+    Args:
+      embeds: An array of size [batch_size, n_dim], or
+        [batch_size, n_dim, ens_size] for ensembles.
+      labels: An integer array of size [batch_size, ].
+    """
+    labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+    if not labels.size:
+      return
+    embeds = self._members_first(embeds)
+    counts = np.bincount(labels, minlength=self.num_classes).astype(np.float64)
+    one_hot = np.zeros((labels.size, self.num_classes), dtype=np.float64)
+    one_hot[np.arange(labels.size), labels] = 1.
+    sums = np.einsum('bc,mbd->mcd', one_hot, embeds)
+    means = sums / np.maximum(counts, 1)[None, :, None]
+    centered = embeds - means[:, labels]
+    scatter = np.einsum('mbd,mbe->mde', centered, centered)
+    self._merge(counts, means, scatter)
+
+  def merge(self, other):
+    """Merges the statistics of another accumulator over disjoint examples."""
+    self._merge(other.counts, other.means, other.scatter)
+
+  def merge_across_hosts(self):
+    """Combines the statistics accumulated by every host.
+
+    Only use this when each host accumulated a different shard of the data. The
+    batches returned by the evaluation functions are usually already gathered
+    across hosts, in which case merging would count examples several times.
+    """
+    if jax.process_count() == 1:
+      return
+    all_stats = multihost_utils.process_allgather(
+        (self.counts, self.means, self.scatter))
+    merged = GaussianStatsAccumulator(self.num_classes, self.n_dim,
+                                      self.ens_size)
+    for counts, means, scatter in zip(*all_stats):
+      merged._merge(  # pylint: disable=protected-access
+          np.asarray(counts, np.float64), np.asarray(means, np.float64),
+          np.asarray(scatter, np.float64))
+    self.counts, self.means, self.scatter = (merged.counts, merged.means,
+                                             merged.scatter)
+
+  def _unstack(self, mean_lists, covs):
+    if self.ens_size is None:
+      return mean_lists[0], covs[0]
+    return mean_lists, covs
+
+  def mean_and_cov(self):
+    """Returns the class-conditional Gaussians as in `compute_mean_and_cov`.
+
+    Returns:
+      mean_list: A list with the [n_dim] means of the classes seen so far.
+      cov: The shared covariance matrix of the size [n_dim, n_dim].
+      For ensembles, both are lists with one element per ensemble member.
+    """
+    n = self.counts.sum()
+    seen = self.counts > 0
+    mean_lists = [list(means[seen]) for means in self.means]
+    covs = list(self.scatter / n)
+    return self._unstack(mean_lists, covs)
+
+  def background_mean_and_cov(self):
+    """Returns the single Gaussian fitted regardless of the class labels.
+
+    This is equivalent to `compute_mean_and_cov(embeds, zeros_like(labels))`,
+    and is used by the Relative Mahalanobis distance.
+
+    Returns:
+      mean_list: A list with the single [n_dim] mean.
+      cov: The covariance matrix of the size [n_dim, n_dim].
+      For ensembles, both are lists with one element per ensemble member.
+    """
+    n = self.counts.sum()
+    mean = np.einsum('c,mcd->md', self.counts, self.means) / n
+    delta = self.means - mean[:, None]
+    between = np.einsum('mcd,c,mce->mde', delta, self.counts, delta)
+    mean_lists = [[m] for m in mean]
+    covs = list((self.scatter + between) / n)
+    return self._unstack(mean_lists, covs)
+
+
+class MahalanobisScorer:
+  """Batched Mahalanobis distance scorer for class-conditional Gaussians.
+
+  The shared covariance is factorized once (Cholesky, falling back to an
+  eigendecomposition when the covariance is not numerically positive definite)
+  into a whitening matrix `W` such that `W @ W.T = inv(cov)`. The class means
+  are projected into the whitened space once as well, so that scoring a batch
+  is a single matmul followed by the norm expansion
+
+    ||W^T (x - mu_c)||^2 = ||W^T x||^2 - 2 <W^T x, W^T mu_c> + ||W^T mu_c||^2.
+
+  The same precomputation serves the OOD evaluation in `eval_ood_metrics` and
+  the density acquisition scores in `active_learning.get_density_scores`.
+  """
+
+  def __init__(self,
+               mean_list,
+               cov,
+               epsilon=1e-20,
+               dtype=np.float64,
+               chunk_size=None,
+               use_jit=False):
+    """Initializes the scorer.
+
+    Args:
+      mean_list: A list of len n_class, and the i-th element is an np.array of
+        size [n_dim, ] corresponding to the mean of the fitted Guassian
+        distribution for the i-th class.
+      cov: The shared covariance mmatrix of the size [n_dim, n_dim].
+      epsilon: The small value added to the diagonal of the covariance matrix to
+        avoid singularity.
+      dtype: The dtype used for scoring, e.g. np.float32 or jnp.bfloat16 to
+        reduce the memory footprint. The factorization itself is always
+        computed in float64.
+      chunk_size: If set, the maximum number of test samples scored at once.
+        Bounds the peak memory of the [chunk_size, n_class] intermediate.
+      use_jit: If True, score the chunks with a jit-compiled JAX function.
+    """
+    means = np.asarray(mean_list, dtype=np.float64)
+    cov = np.asarray(cov, dtype=np.float64)
+    v = cov + np.eye(cov.shape[0]) * epsilon  # avoid singularity
+    whitening = self._factorize(v)
+    proj_means = means @ whitening
+
+    self.dtype = dtype
+    self.chunk_size = chunk_size
+    self.n_class = means.shape[0]
+    self._whitening = whitening.astype(dtype)
+    self._proj_means = proj_means.astype(dtype)
+    self._proj_means_sq = np.sum(proj_means**2, axis=-1).astype(dtype)
+    self._score_fn = jax.jit(self._score) if use_jit else self._score
+
+  @staticmethod
+  def _factorize(v):
+    """Returns `W` with `W @ W.T = inv(v)`."""
+    try:
+      chol = np.linalg.cholesky(v)
+      # v = L L^T, so inv(v) = L^{-T} L^{-1} and W = L^{-T}.
+      return scipy.linalg.solve_triangular(
+          chol, np.eye(v.shape[0]), lower=True).T
+    except np.linalg.LinAlgError:
+      eigvals, eigvecs = np.linalg.eigh(v)
+      eigvals = np.maximum(eigvals, np.finfo(np.float64).eps * eigvals.max())
+      return eigvecs / np.sqrt(eigvals)
+
+  @staticmethod
+  def _score(embeds, whitening, proj_means, proj_means_sq):
+    xp = np if isinstance(embeds, np.ndarray) else jnp
+    z = embeds @ whitening
+    z_sq = xp.sum(z * z, axis=-1, keepdims=True)
+    out = z_sq - 2 * (z @ proj_means.T) + proj_means_sq[None, :]
+    return xp.maximum(out, 0)
+
+  def __call__(self, embeds):
+    """Computes Mahalanobis distances of `embeds` to the class Gaussians.
+
+    Args:
+      embeds: An array of size [n_test_sample, n_dim].
+
+    Returns:
+      An np.array of size [n_test_sample, n_class] where the [i, j] element
+      corresponds to the Mahalanobis distance between i-th sample to the j-th
+      class Guassian.
+    """
+    embeds = np.asarray(embeds).astype(self.dtype)
+    n_sample = embeds.shape[0]
+    chunk_size = self.chunk_size or max(n_sample, 1)
+    out = np.empty((n_sample, self.n_class), dtype=self.dtype)
+    for start in range(0, n_sample, chunk_size):
+      end = min(start + chunk_size, n_sample)
+      out[start:end] = np.asarray(
+          self._score_fn(embeds[start:end], self._whitening, self._proj_means,
+                         self._proj_means_sq))
+    return out
+
+
 def compute_mahalanobis_distance(embeds, mean_list, cov, epsilon=1e-20):
   """Computes Mahalanobis distance between the input to the fitted Guassians.
 
-  The computation follows Eq.(2) in [1].
+  The computation follows Eq.(2) in [1]. When scoring several batches against
+  the same Gaussians, build a `MahalanobisScorer` once and reuse it instead.
 
   Args:
     embeds: An np.array of size [n_test_sample, n_dim], where n_test_sample is
@@ -246,18 +479,7 @@ def compute_mahalanobis_distance(embeds, mean_list, cov, epsilon=1e-20):
     corresponds to the Mahalanobis distance between i-th sample to the j-th
     class Guassian.
   """
-  n_sample = embeds.shape[0]
-  n_class = len(mean_list)
-
-  v = cov + np.eye(cov.shape[0], dtype=int) * epsilon  # avoid singularity
-  vi = np.linalg.inv(v)
-  means = np.array(mean_list)
-
-  out = np.zeros((n_sample, n_class))
-  for i in range(n_sample):
-    x = embeds[i]
-    out[i, :] = np.diag(np.dot(np.dot((x - means), vi), (x - means).T))
-  return out
+  return MahalanobisScorer(mean_list, cov, epsilon=epsilon)(embeds)
 
 
 def load_ood_datasets(
@@ -333,7 +555,10 @@ def eval_ood_metrics(ood_ds,
                      ood_methods,
                      evaluation_fn,
                      opt_target_repl,
-                     n_prefetch=1):
+                     n_prefetch=1,
+                     maha_dtype=np.float64,
+                     maha_chunk_size=None,
+                     maha_use_jit=False):
   """Evaluate the model for OOD detection and record metrics.
 
   Args:
@@ -347,6 +572,10 @@ def eval_ood_metrics(ood_ds,
       in `opt_target_repl`.
     opt_target_repl: The target of the replicated optmizer (`opt_repl.target`).
     n_prefetch: Number of points to pre-fectch in the dataset iterators.
+    maha_dtype: The dtype used by the `MahalanobisScorer`s.
+    maha_chunk_size: The maximum number of samples scored at once by the
+      `MahalanobisScorer`s.
+    maha_use_jit: Whether the `MahalanobisScorer`s are jit-compiled.
 
   Returns:
     Dictionary of measurements of the OOD detection tasks.
@@ -368,11 +597,14 @@ def eval_ood_metrics(ood_ds,
       ]
 
   output = {}
-  # Mean and cov of class conditional Guassian in Mahalanobis distance.
-  # Mean_background and cov_background for the unified Guassian model
-  # regardless of class labels for computing Relative Mahalanobis distance
-  mean_list, cov = None, None
-  mean_list_background, cov_background = None, None
+  # Scorers for the class conditional Guassians in Mahalanobis distance, and
+  # for the unified Guassian model regardless of class labels for computing
+  # Relative Mahalanobis distance. For ensembles these are lists of scorers,
+  # one per ensemble member.
+  scorer, scorer_background = None, None
+  make_scorer = lambda mu, sigma: MahalanobisScorer(  # pylint: disable=g-long-lambda
+      mu, sigma, dtype=maha_dtype, chunk_size=maha_chunk_size,
+      use_jit=maha_use_jit)
   for ood_ds_name in ood_ds_names:
     # The dataset train_maha must come before ind and ood
     # because the train_maha will be used to esimate the class conditional
@@ -380,7 +612,9 @@ def eval_ood_metrics(ood_ds,
     val_ds = ood_ds[ood_ds_name]
     val_iter = input_utils.start_input_pipeline(val_ds, n_prefetch)
     ncorrect, loss, nseen = 0, 0, 0
-    pre_logits_list, labels_list = [], []
+    # Sufficient statistics of the class conditional Gaussians, accumulated
+    # batch by batch over train_maha.
+    gaussian_stats = None
     for batch in val_iter:
       batch_scores = {}
       batch_ncorrect, batch_losses, batch_n, batch_metric_args = evaluation_fn(
@@ -405,33 +639,32 @@ def eval_ood_metrics(ood_ds,
       if ood_ds_name == 'train_maha':
         # For Mahalanobis distance, we need to first fit class conditional
         # Gaussian using training data.
-        labels_list.append(np.array(labels[0])[masks_bool])
-        pre_logits_list.append(embeds)
+        # The batches are already gathered across hosts, so the statistics
+        # are not merged across hosts afterwards.
+        batch_labels = np.array(labels[0])[masks_bool]
+        if gaussian_stats is None:
+          gaussian_stats = GaussianStatsAccumulator(
+              num_classes=batch_labels.shape[-1],
+              n_dim=embeds.shape[1],
+              ens_size=ens_size if use_ens else None)
+        gaussian_stats.update(embeds, np.argmax(batch_labels, axis=-1))
       else:
         # Computes Mahalanobis distance.
-        if mean_list is not None and cov is not None:
+        if scorer is not None:
           if not use_ens:
-            batch_scores['dists'] = compute_mahalanobis_distance(
-                embeds, mean_list, cov)
+            batch_scores['dists'] = scorer(embeds)
           else:
-            dists_list = []
-            for m in range(ens_size):
-              dists = compute_mahalanobis_distance(embeds[..., m], mean_list[m],
-                                                   cov[m])
-              dists_list.append(dists)
-            batch_scores['dists'] = dists_list
-
-        if mean_list_background is not None and cov_background is not None:
+            batch_scores['dists'] = [
+                scorer[m](embeds[..., m]) for m in range(ens_size)
+            ]
+
+        if scorer_background is not None:
           if not use_ens:
-            batch_scores['dists_background'] = compute_mahalanobis_distance(
-                embeds, mean_list_background, cov_background)
+            batch_scores['dists_background'] = scorer_background(embeds)
           else:
-            dists_background_list = []
-            for m in range(ens_size):
-              dists_background = compute_mahalanobis_distance(
-                  embeds[..., m], mean_list_background[m], cov_background[m])
-              dists_background_list.append(dists_background)
-            batch_scores['dists_background'] = dists_background_list
+            batch_scores['dists_background'] = [
+                scorer_background[m](embeds[..., m]) for m in range(ens_size)
+            ]
 
         # Computes Maximum softmax probability (MSP)
         probs = jax.nn.softmax(logits[0], axis=-1)[masks_bool]
@@ -457,32 +690,20 @@ def eval_ood_metrics(ood_ds,
     logging.info('ood_ds_name %s, nseen %s', ood_ds_name, nseen)
     if ood_ds_name == 'train_maha':
       # Estimate class conditional Gaussian distribution for Mahalanobis dist.
-      # pre_logits_list is a list with elements of np.arrays of shape
-      # [batch_size, hidden_size]
-      pre_logits_train = np.vstack(pre_logits_list)
-      labels_train = np.argmax(np.vstack(labels_list), axis=-1)
-
+      mean_list, cov = gaussian_stats.mean_and_cov()
+      mean_list_background, cov_background = (
+          gaussian_stats.background_mean_and_cov())
       if not use_ens:
         # Single model
-        # pre_logits_train shape [sample_size, hidden_size]
-        # sample_size = num_batches*batch_size
-        mean_list, cov = compute_mean_and_cov(pre_logits_train, labels_train)
-        mean_list_background, cov_background = compute_mean_and_cov(
-            pre_logits_train, np.zeros_like(labels_train))
+        scorer = make_scorer(mean_list, cov)
+        scorer_background = make_scorer(mean_list_background, cov_background)
       else:
         # Multiple models
-        mean_list, cov = [], []
-        mean_list_background, cov_background = [], []
-        # pre_logits_train shape [sample_size, hidden_size, ens_size]
-        for m in range(ens_size):
-          mu, sigma = compute_mean_and_cov(pre_logits_train[..., m],
-                                           labels_train)
-          mu_background, sigma_background = compute_mean_and_cov(
-              pre_logits_train[..., m], np.zeros_like(labels_train))
-          mean_list.append(mu)
-          cov.append(sigma)
-          mean_list_background.append(mu_background)
-          cov_background.append(sigma_background)
+        scorer = [make_scorer(mu, sigma) for mu, sigma in zip(mean_list, cov)]
+        scorer_background = [
+            make_scorer(mu, sigma)
+            for mu, sigma in zip(mean_list_background, cov_background)
+        ]
 
     elif ood_ds_name == 'ind':
       # Evaluate in-distribution prediction accuracy
@@ -69,6 +69,77 @@ class OodUtilsTest(parameterized.TestCase):
                                                    self.cov)
     np.testing.assert_array_equal(np.array([0, 0, 81]), np.min(dists, axis=-1))
 
+  @parameterized.parameters(None, 3)
+  def test_gaussian_stats_accumulator(self, ens_size):
+    rng = np.random.RandomState(0)
+    n_dim, n_class, n_sample = 4, 3, 50
+    shape = (n_sample, n_dim) if ens_size is None else (n_sample, n_dim,
+                                                       ens_size)
+    embeds = rng.randn(*shape) + 5.
+    # Class 1 is never observed.
+    labels = rng.choice([0, 2], size=n_sample)
+
+    stats = ood_utils.GaussianStatsAccumulator(n_class, n_dim, ens_size)
+    for start in range(0, 30, 7):
+      stats.update(embeds[start:min(start + 7, 30)],
+                   labels[start:min(start + 7, 30)])
+    other = ood_utils.GaussianStatsAccumulator(n_class, n_dim, ens_size)
+    other.update(embeds[30:], labels[30:])
+    stats.merge(other)
+    # An empty accumulator, e.g. from a host whose shard is only padding, does
+    # not change the statistics, whichever side of the merge it is on.
+    empty = ood_utils.GaussianStatsAccumulator(n_class, n_dim, ens_size)
+    stats.merge(empty)
+    empty.merge(stats)
+    stats = empty
+
+    mean_list, cov = stats.mean_and_cov()
+    mean_list_bg, cov_bg = stats.background_mean_and_cov()
+    if ens_size is None:
+      mean_list, cov = [mean_list], [cov]
+      mean_list_bg, cov_bg = [mean_list_bg], [cov_bg]
+      embeds = embeds[..., None]
+    for m in range(ens_size or 1):
+      expected_means, expected_cov = ood_utils.compute_mean_and_cov(
+          embeds[..., m], labels)
+      np.testing.assert_allclose(mean_list[m], expected_means)
+      np.testing.assert_allclose(cov[m], expected_cov)
+      expected_means, expected_cov = ood_utils.compute_mean_and_cov(
+          embeds[..., m], np.zeros_like(labels))
+      np.testing.assert_allclose(mean_list_bg[m], expected_means)
+      np.testing.assert_allclose(cov_bg[m], expected_cov)
+
+  @parameterized.parameters(
+      (np.float64, None, False),
+      (np.float32, 7, False),
+      (np.float32, 16, True),
+  )
+  def test_mahalanobis_scorer(self, dtype, chunk_size, use_jit):
+    rng = np.random.RandomState(0)
+    n_dim, n_class, n_sample = 8, 5, 30
+    means = [rng.randn(n_dim) for _ in range(n_class)]
+    a = rng.randn(n_dim, n_dim)
+    cov = a @ a.T + np.identity(n_dim)
+    embeds = rng.randn(n_sample, n_dim)
+
+    vi = np.linalg.inv(cov)
+    expected = np.stack(
+        [np.einsum("nd,de,ne->n", embeds - mu, vi, embeds - mu) for mu in means],
+        axis=-1)
+    scorer = ood_utils.MahalanobisScorer(
+        means, cov, dtype=dtype, chunk_size=chunk_size, use_jit=use_jit)
+    dists = scorer(embeds)
+    self.assertEqual(dists.shape, (n_sample, n_class))
+    self.assertEqual(dists.dtype, dtype)
+    np.testing.assert_allclose(dists, expected, rtol=1e-4, atol=1e-4)
+
+  def test_mahalanobis_scorer_singular_cov(self):
+    # A rank deficient covariance falls back to the eigendecomposition.
+    cov = np.array([[1., 0.], [0., 0.]])
+    scorer = ood_utils.MahalanobisScorer(self.mean_list, cov, epsilon=0.)
+    dists = scorer(np.array([[-1, 0], [3, 0]]))
+    np.testing.assert_allclose(dists, [[0, 4], [16, 4]])
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -0,0 +1,208 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Host-to-device input stage for the ViT experiments.
+
+The batches of a `tf.data` pipeline are read, converted to numpy and copied to
+the local devices on background threads, ahead of the training loop. The
+reader thread keeps the order of the batches, and only schedules the transfer
+of a batch once one of the `n_prefetch` device slots is free, which bounds the
+number of batches held on the devices.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import thread
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import jax
+import numpy as np
+
+# Marks the end of the input in the queue of batches.
+_END = object()
+
+# Seconds between two checks of the stop event while waiting for a slot.
+_POLL_INTERVAL = 0.1
+
+
+def _to_numpy(x) -> np.ndarray:
+  # Transforms x into read-only numpy array without copy if possible, see:
+  # https://github.com/tensorflow/tensorflow/issues/33254#issuecomment-542379165
+  return np.asarray(memoryview(x))
+
+
+def device_put_sharded(x: np.ndarray, devices: Sequence[Any]) -> jax.Array:
+  """Copies the slices x[i] of a [num_devices, ...] array to devices[i]."""
+  if hasattr(jax, "device_put_sharded"):
+    return jax.device_put_sharded(list(x), devices)
+  mesh = jax.sharding.Mesh(np.asarray(devices), ("devices",))
+  sharding = jax.sharding.NamedSharding(mesh,
+                                        jax.sharding.PartitionSpec("devices"))
+  return jax.device_put(x, sharding)
+
+
+class _Stats:
+  """Thread-safe accumulator of the input stage metrics."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.num_batches = 0
+    self.queue_depth = 0
+    self.wait_time = 0.
+    self.max_wait_time = 0.
+
+  def add(self, queue_depth: int, wait_time: float):
+    with self._lock:
+      self.num_batches += 1
+      self.queue_depth += queue_depth
+      self.wait_time += wait_time
+      self.max_wait_time = max(self.max_wait_time, wait_time)
+
+  def pop(self) -> Dict[str, float]:
+    with self._lock:
+      if not self.num_batches:
+        return {}
+      metrics = {
+          "input/queue_depth": self.queue_depth / self.num_batches,
+          "input/wait_ms": 1e3 * self.wait_time / self.num_batches,
+          "input/max_wait_ms": 1e3 * self.max_wait_time,
+      }
+      self.reset()
+      return metrics
+
+
+def _produce(iterator: Iterable[Any], batches: "queue.Queue[Any]",
+             slots: threading.Semaphore, pool: thread.ThreadPoolExecutor,
+             devices: Sequence[Any], stop: threading.Event):
+  """Reads the batches and schedules their transfers, in order."""
+
+  def _transfer(batch):
+    return jax.tree_util.tree_map(
+        lambda x: device_put_sharded(_to_numpy(x), devices), batch)
+
+  def _acquire_slot():
+    while not stop.is_set():
+      if slots.acquire(timeout=_POLL_INTERVAL):
+        return True
+    return False
+
+  try:
+    for batch in iterator:
+      # The slot is released by `__next__` when the batch leaves the queue.
+      if not _acquire_slot():
+        return
+      batches.put(pool.submit(_transfer, batch))
+  except Exception as e:  # pylint: disable=broad-except
+    # Re-raised in the training loop by `__next__`.
+    batches.put(e)
+    return
+  batches.put(_END)
+
+
+class DevicePrefetchIterator:
+  """Iterates over batches transferred to the devices on background threads.
+
+  The batches of `dataset` must have leaves of shape [num_devices,
+  per_device_batch, ...], as built by `input_utils.get_data`. Each leaf is
+  copied with a sharded `device_put`, so its i-th slice is transferred
+  directly to the i-th device, and the iterator yields the same batches as
+  `flax.jax_utils.prefetch_to_device`.
+
+  A reader thread iterates over the dataset and hands every batch to a pool of
+  `num_threads` transfer threads. At most `n_prefetch` batches are transferred
+  or being transferred ahead of the training loop, i.e. the devices hold at
+  most `n_prefetch` batches besides the one returned last. `metrics` reports how many batches were ready when the
+  training loop asked for one, and how long it waited for the input.
+  """
+
+  def __init__(self,
+               dataset: Iterable[Any],
+               n_prefetch: int,
+               devices: Optional[Sequence[Any]] = None,
+               num_threads: int = 2):
+    """Starts the input stage.
+
+    Args:
+      dataset: Iterable of batches, e.g. a `tf.data.Dataset`.
+      n_prefetch: Maximum number of batches transferred ahead of the training
+        loop.
+      devices: Devices to transfer the batches to, by default the local ones.
+      num_threads: Number of threads converting and transferring the batches.
+    """
+    if n_prefetch < 1:
+      raise ValueError(f"n_prefetch must be positive, received {n_prefetch}.")
+    self._devices = devices or jax.local_devices()
+    self._batches = queue.Queue()
+    self._slots = threading.Semaphore(n_prefetch)
+    self._stop = threading.Event()
+    self._stats = _Stats()
+    self._done = False
+    self._pool = thread.ThreadPoolExecutor(
+        max_workers=num_threads, thread_name_prefix="device_prefetch")
+    # The reader thread only references the iterator, the queue and the slots,
+    # such that the input stage is stopped when the training loop drops this
+    # iterator.
+    self._reader = threading.Thread(
+        target=_produce,
+        args=(iter(dataset), self._batches, self._slots, self._pool,
+              self._devices, self._stop),
+        name="device_prefetch_reader",
+        daemon=True)
+    self._reader.start()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._done:
+      raise StopIteration
+    queue_depth = self._batches.qsize()
+    start = time.time()
+    item = self._batches.get()
+    if item is _END or isinstance(item, Exception):
+      self.close()
+      if item is _END:
+        raise StopIteration
+      raise item
+    batch = item.result()
+    self._slots.release()
+    self._stats.add(queue_depth, time.time() - start)
+    return batch
+
+  def metrics(self) -> Dict[str, float]:
+    """Returns the input metrics averaged since the previous call.
+
+    Returns:
+      Dictionary with the average number of batches ready in the queue when
+      a batch was requested ("input/queue_depth"), and the average and maximum
+      time in milliseconds the training loop waited for a batch
+      ("input/wait_ms" and "input/max_wait_ms"). Empty if no batch was
+      requested.
+    """
+    return self._stats.pop()
+
+  def close(self):
+    """Stops the background threads."""
+    self._done = True
+    self._stop.set()
+    self._pool.shutdown(wait=False)
+
+  def __del__(self):
+    if hasattr(self, "_stop"):
+      self.close()
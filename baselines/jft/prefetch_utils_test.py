@@ -0,0 +1,110 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the host-to-device input stage."""
+
+import itertools
+import time
+from unittest import mock
+
+from absl.testing import absltest
+import jax
+import numpy as np
+import prefetch_utils  # local file import from baselines.jft
+
+
+def _make_batches(num_batches):
+  num_devices = jax.local_device_count()
+  return [{
+      'image': np.full((num_devices, 2, 3), i, np.float32),
+      'labels': np.arange(num_devices * 2).reshape(num_devices, 2) + i,
+  } for i in range(num_batches)]
+
+
+class DevicePrefetchIteratorTest(absltest.TestCase):
+
+  def test_keeps_the_order_of_the_batches(self):
+    batches = _make_batches(10)
+    it = prefetch_utils.DevicePrefetchIterator(
+        batches, n_prefetch=2, num_threads=3)
+    outputs = list(it)
+
+    self.assertLen(outputs, len(batches))
+    for output, batch in zip(outputs, batches):
+      self.assertEqual(output.keys(), batch.keys())
+      for key in batch:
+        self.assertIsInstance(output[key], jax.Array)
+        np.testing.assert_array_equal(np.asarray(output[key]), batch[key])
+    metrics = it.metrics()
+    self.assertSameElements(
+        metrics, ['input/queue_depth', 'input/wait_ms', 'input/max_wait_ms'])
+    self.assertBetween(metrics['input/queue_depth'], 0, 2)
+    # The metrics are reset once reported.
+    self.assertEqual(it.metrics(), {})
+
+  def test_raises_the_errors_of_the_input(self):
+
+    def _failing_input():
+      yield from _make_batches(2)
+      raise ValueError('Broken input.')
+
+    it = prefetch_utils.DevicePrefetchIterator(_failing_input(), n_prefetch=1)
+    next(it)
+    next(it)
+    with self.assertRaisesRegex(ValueError, 'Broken input.'):
+      next(it)
+    with self.assertRaises(StopIteration):
+      next(it)
+
+  def test_close_stops_the_reader(self):
+    batch = _make_batches(1)[0]
+    it = prefetch_utils.DevicePrefetchIterator(
+        itertools.repeat(batch), n_prefetch=1)
+    next(it)
+    it.close()
+    # The reader thread waits for a free slot, and exits once it polls the
+    # stop event.
+    it._reader.join(timeout=5.)
+    self.assertFalse(it._reader.is_alive())
+    with self.assertRaises(StopIteration):
+      next(it)
+
+  def test_bounds_the_batches_on_the_devices(self):
+    batch = _make_batches(1)[0]
+    num_transfers = []
+    device_put_sharded = prefetch_utils.device_put_sharded
+
+    def _counting_device_put_sharded(x, devices):
+      num_transfers.append(1)
+      return device_put_sharded(x, devices)
+
+    with mock.patch.object(prefetch_utils, 'device_put_sharded',
+                           _counting_device_put_sharded):
+      it = prefetch_utils.DevicePrefetchIterator(
+          itertools.repeat(batch), n_prefetch=2)
+      for num_batches in range(1, 4):
+        next(it)
+        time.sleep(0.5)
+        # The returned batches, and n_prefetch batches ahead of them.
+        self.assertLen(num_transfers, len(batch) * (num_batches + 2))
+      it.close()
+
+  def test_invalid_n_prefetch(self):
+    with self.assertRaisesRegex(ValueError, 'n_prefetch must be positive'):
+      prefetch_utils.DevicePrefetchIterator([], n_prefetch=0)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -19,7 +19,6 @@ Several functions in this file were ported from
 https://github.com/google-research/vision_transformer.
 """
 
-import multiprocessing
 import numbers
 import re
 import time
@@ -225,20 +224,6 @@ def prefetch_scalar(it, nprefetch=1, devices=None):
   return flax.jax_utils.prefetch_to_device(repl_iter, nprefetch, devices)
 
 
-def checkpointing_timeout(writer, timeout):
-  """Checks that checkpointing is not a bottleneck."""
-  # Make sure checkpoint writing is not a bottleneck
-  if writer is not None:
-    try:
-      writer.get(timeout=timeout)
-    except multiprocessing.TimeoutError:
-      raise TimeoutError(
-          "Checkpoint writing seems to be a bottleneck. Make sure you do "
-          "not do something wrong, like writing checkpoints to a distant "
-          "cell. In a case you are OK with checkpoint writing being a "
-          "bottleneck, you can configure `checkpoint_timeout` parameter")
-
-
 def itstime(step,
             every_n_steps,
             total_steps,
@@ -17,6 +17,7 @@
 
 import numpy as np
 import scipy
+import uncertainty_baselines as ub
 
 
 def one_hot(a, num_classes):
@@ -89,7 +90,7 @@ def calibration(y, p_mean, num_bins=10):
   # Expected Calibration Error
   ece = np.average(
       np.absolute(mean_conf - acc_tab),
-      weights=nb_items_bin.astype(np.float) / np.sum(nb_items_bin))
+      weights=nb_items_bin.astype(np.float64) / np.sum(nb_items_bin))
   # Maximum Calibration Error
   mce = np.max(np.absolute(mean_conf - acc_tab))
   return ece, mce
@@ -100,9 +101,14 @@ def ensemble_metrics(x,
                      model,
                      log_likelihood_fn,
                      n_samples=1,
-                     weight_files=None):
+                     weight_files=None,
+                     batch_size=None):
   """Evaluate metrics of an ensemble.
 
+  The predictions are streamed: each Monte Carlo sample takes a single forward
+  pass per batch, and only running sums over the samples are kept, so memory
+  does not grow with the number of samples.
+
   Args:
     x: numpy array of inputs
     y: numpy array of labels
@@ -114,45 +120,48 @@ def ensemble_metrics(x,
     weight_files: to draw samples from multiple weight sets, specify a list of
       weight files to load. These files must have been generated through
       keras's model.save_weights(...).
+    batch_size: number of examples per forward pass, and batch size of
+      `model.evaluate`. If None, the log likelihood function is evaluated on the
+      whole dataset at once, and `model.evaluate` uses its default batch size.
 
   Returns:
     metrics_dict: dictionary containing the metrics
   """
-  if weight_files is None:
-    ensemble_logprobs = [log_likelihood_fn([x, y])[0] for _ in range(n_samples)]
-    metric_values = [model.evaluate(x, y, verbose=0)
-                     for _ in range(n_samples)]
-    ensemble_logits = [log_likelihood_fn([x, y])[1] for _ in range(n_samples)]
-  else:
-    ensemble_logprobs = []
-    metric_values = []
-    ensemble_logits = []
-    for filename in weight_files:
-      model.load_weights(filename)
-      ensemble_logprobs.extend([log_likelihood_fn([x, y])[0]
-                                for _ in range(n_samples)])
-      ensemble_logits.extend([log_likelihood_fn([x, y])[1]
-                              for _ in range(n_samples)])
-      metric_values.extend([model.evaluate(x, y, verbose=0)
-                            for _ in range(n_samples)])
-
-  metric_values = np.mean(np.array(metric_values), axis=0)
+  n = x.shape[0]
+  forward_batch_size = batch_size or n
+  total_samples = 0
+  metric_values = 0.
+  # Per example logsumexp of the log prob and sum of probs over samples.
+  logprob_logsumexp = np.full(n, -np.inf)
+  probs_sum = 0.
+  for filename in weight_files or [None]:
+    if filename is not None:
+      ub.utils.load_weights(model, filename)
+    for _ in range(n_samples):
+      probs = []
+      for start in range(0, n, forward_batch_size):
+        batch = slice(start, start + forward_batch_size)
+        logprob, logits = log_likelihood_fn([x[batch], y[batch]])
+        logprob = np.asarray(logprob)
+        if logprob.ndim > 1:
+          logprob = np.sum(logprob, axis=tuple(range(1, logprob.ndim)))
+        logprob_logsumexp[batch] = np.logaddexp(logprob_logsumexp[batch],
+                                                logprob)
+        probs.append(scipy.special.softmax(logits, axis=1))
+      probs_sum += np.concatenate(probs)
+      metric_values += np.array(
+          model.evaluate(x, y, batch_size=batch_size, verbose=0))
+      total_samples += 1
+
+  metric_values /= total_samples
   results = {}
-  for m, name in zip(metric_values, model.metrics_names):
+  for m, name in zip(np.atleast_1d(metric_values), model.metrics_names):
     results[name] = m
 
-  ensemble_logprobs = np.array(ensemble_logprobs)
-  probabilistic_log_likelihood = np.mean(
-      scipy.special.logsumexp(
-          np.sum(ensemble_logprobs, axis=2)
-          if len(ensemble_logprobs.shape) > 2 else ensemble_logprobs,
-          b=1. / ensemble_logprobs.shape[0],
-          axis=0),
-      axis=0)
-  results['probabilistic_log_likelihood'] = probabilistic_log_likelihood
-
-  ensemble_logits = np.array(ensemble_logits)
-  probs = np.mean(scipy.special.softmax(ensemble_logits, axis=2), axis=0)
+  results['probabilistic_log_likelihood'] = np.mean(
+      logprob_logsumexp - np.log(total_samples))
+
+  probs = probs_sum / total_samples
   class_pred = np.argmax(probs, axis=1)
   probabilistic_accuracy = np.mean(np.equal(y, class_pred))
   results['probabilistic_accuracy'] = probabilistic_accuracy
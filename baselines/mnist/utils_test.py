@@ -0,0 +1,98 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the (Fashion) MNIST utilities."""
+
+import os
+
+from absl.testing import parameterized
+import numpy as np
+import scipy
+import tensorflow as tf
+import uncertainty_baselines as ub
+import utils  # local file import from baselines.mnist
+
+_NUM_EXAMPLES = 10
+_NUM_CLASSES = 3
+
+
+def _reference_ensemble_metrics(x, y, model, log_likelihood_fn, n_samples,
+                                weight_files):
+  """Evaluates the metrics of an ensemble from the stacked predictions."""
+  ensemble_logprobs = []
+  ensemble_logits = []
+  metric_values = []
+  for filename in weight_files:
+    model.load_weights(filename)
+    for _ in range(n_samples):
+      logprob, logits = log_likelihood_fn([x, y])
+      ensemble_logprobs.append(logprob)
+      ensemble_logits.append(logits)
+      metric_values.append(model.evaluate(x, y, verbose=0))
+
+  results = dict(zip(model.metrics_names, np.mean(metric_values, axis=0)))
+  results['probabilistic_log_likelihood'] = np.mean(
+      scipy.special.logsumexp(
+          np.array(ensemble_logprobs), b=1. / len(ensemble_logprobs), axis=0))
+  probs = np.mean(scipy.special.softmax(ensemble_logits, axis=2), axis=0)
+  results['probabilistic_accuracy'] = np.mean(np.argmax(probs, axis=1) == y)
+  results['ece'], results['mce'] = utils.calibration(
+      utils.one_hot(y, _NUM_CLASSES), probs)
+  results['brier_score'] = utils.brier_score(
+      utils.one_hot(y, _NUM_CLASSES), probs)
+  return results
+
+
+class UtilsTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    ub.utils.clear_weights_cache()
+
+  @parameterized.parameters(None, 3)
+  def test_ensemble_metrics(self, batch_size):
+    rng = np.random.RandomState(0)
+    x = rng.randn(_NUM_EXAMPLES, 4).astype(np.float32)
+    y = rng.randint(0, _NUM_CLASSES, _NUM_EXAMPLES)
+    model = tf.keras.Sequential([tf.keras.layers.Dense(_NUM_CLASSES)])
+    model.build((None, 4))
+    model.compile(
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+        metrics=['sparse_categorical_accuracy'])
+
+    weight_files = []
+    for i in range(2):
+      model.set_weights([3. * w for w in model.get_weights()])
+      weight_files.append(os.path.join(self.get_temp_dir(), f'member_{i}'))
+      model.save_weights(weight_files[-1])
+
+    def log_likelihood_fn(inputs):
+      features, labels = inputs
+      logits = model(features).numpy()
+      logprob = scipy.special.log_softmax(logits, axis=1)
+      return logprob[np.arange(len(labels)), labels], logits
+
+    results = utils.ensemble_metrics(
+        x, y, model, log_likelihood_fn, n_samples=2,
+        weight_files=weight_files, batch_size=batch_size)
+    expected = _reference_ensemble_metrics(
+        x, y, model, log_likelihood_fn, n_samples=2, weight_files=weight_files)
+    self.assertCountEqual(results, expected)
+    for name, value in expected.items():
+      self.assertAllClose(results[name], value, msg=name)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -33,6 +33,10 @@ flags.DEFINE_enum('dataset', 'mnist',
                   help='Name of the image dataset.')
 flags.DEFINE_integer('training_steps', 30000, 'Training steps.')
 flags.DEFINE_integer('batch_size', 256, 'Batch size.')
+flags.DEFINE_integer(
+    'eval_batch_size', None,
+    'Batch size of the ensemble evaluation. If None, each split is evaluated '
+    'in a single batch.')
 flags.DEFINE_float('learning_rate', 0.001, 'Learning rate.')
 flags.DEFINE_float('learning_rate_for_sampling', 0.00001, 'Learning rate.')
 flags.DEFINE_integer('auxiliary_sampling_frequency', 100,
@@ -401,8 +405,20 @@ def main(argv):
     ])
 
     base_metrics = [
-        utils.ensemble_metrics(x_train, y_train, model, ll, n_samples=10),
-        utils.ensemble_metrics(x_test, y_test, model, ll, n_samples=10)
+        utils.ensemble_metrics(
+            x_train,
+            y_train,
+            model,
+            ll,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size),
+        utils.ensemble_metrics(
+            x_test,
+            y_test,
+            model,
+            ll,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size)
     ]
     model_dir = os.path.join(FLAGS.output_dir, 'models')
     tf.io.gfile.makedirs(model_dir)
@@ -417,8 +433,20 @@ def main(argv):
         initial_epoch=train_epochs)
 
     overtrained_metrics = [
-        utils.ensemble_metrics(x_train, y_train, model, ll, n_samples=10),
-        utils.ensemble_metrics(x_test, y_test, model, ll, n_samples=10)
+        utils.ensemble_metrics(
+            x_train,
+            y_train,
+            model,
+            ll,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size),
+        utils.ensemble_metrics(
+            x_test,
+            y_test,
+            model,
+            ll,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size)
     ]
 
     # Perform refined VI.
@@ -469,13 +497,17 @@ def main(argv):
             y_train,
             model,
             ll,
-            weight_files=ensemble_filenames, n_samples=10),
+            weight_files=ensemble_filenames,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size),
         utils.ensemble_metrics(
             x_test,
             y_test,
             model,
             ll,
-            weight_files=ensemble_filenames, n_samples=10)
+            weight_files=ensemble_filenames,
+            n_samples=10,
+            batch_size=FLAGS.eval_batch_size)
     ]
 
     for metrics, name in [(base_metrics, 'Base model'),
@@ -94,7 +94,9 @@ def main(argv):
   # Create dataset builders.
   dataset_kwargs = dict(
       shuffle_buffer_size=data_buffer_size,
-      tf_hub_preprocessor_url=FLAGS.bert_tokenizer_tf_hub_url)
+      tf_hub_preprocessor_url=FLAGS.bert_tokenizer_tf_hub_url,
+      bucket_by_sequence_length=FLAGS.bucket_by_sequence_length,
+      max_tokens_per_batch=FLAGS.max_tokens_per_batch)
 
   (train_dataset_builders, test_dataset_builders,
    train_split_name) = utils.make_train_and_test_dataset_builders(
@@ -213,7 +215,8 @@ def main(argv):
         ece_label_threshold=FLAGS.ece_label_threshold,
         eval_collab_metrics=FLAGS.eval_collab_metrics,
         num_approx_bins=FLAGS.num_approx_bins,
-        train_on_multi_task_label=FLAGS.train_on_multi_task_label)
+        train_on_multi_task_label=FLAGS.train_on_multi_task_label,
+        use_metric_bank=FLAGS.use_metric_bank)
 
   @tf.function
   def generate_sample_weight(labels, class_weight, label_threshold=0.7):
@@ -318,7 +321,8 @@ def main(argv):
 
     def step_fn(inputs):
       """Per-Replica StepFn."""
-      features, labels, _ = utils.create_feature_and_label(inputs)
+      features, labels, additional_labels = utils.create_feature_and_label(
+          inputs)
 
       eval_start_time = time.time()
       logits = model(features, training=False)
@@ -357,7 +361,8 @@ def main(argv):
           eval_time=eval_time,
           ece_label_threshold=FLAGS.ece_label_threshold,
           train_on_multi_task_label=FLAGS.train_on_multi_task_label,
-          eval_collab_metrics=FLAGS.eval_collab_metrics)
+          eval_collab_metrics=FLAGS.eval_collab_metrics,
+          additional_labels=additional_labels)
       update_fn(metrics)
 
     strategy.run(step_fn, args=(next(iterator),))
@@ -537,13 +542,13 @@ def main(argv):
         logging.info('Train Loss: %.4f, AUROC: %.4f',
                      metrics['train/loss'].result(),
                      metrics['train/auroc'].result())
-        logging.info('Test NLL: %.4f, AUROC: %.4f',
-                     metrics['test/negative_log_likelihood'].result(),
-                     metrics['test/auroc'].result())
 
         # record results
         total_results = {}
         for name, metric in metrics.items():
+          if name == utils.METRIC_BANK_NAME:
+            total_results.update(utils.metric_bank_results(metric))
+            continue
           try:
             total_results[name] = metric.result()
           except tf.errors.InvalidArgumentError:
@@ -556,6 +561,9 @@ def main(argv):
             k: (list(v.values())[0] if isinstance(v, dict) else v)
             for k, v in total_results.items()
         }
+        logging.info('Test NLL: %.4f, AUROC: %.4f',
+                     total_results['test/negative_log_likelihood'],
+                     total_results['test/auroc'])
 
         with summary_writer.as_default():
           for name, result in total_results.items():
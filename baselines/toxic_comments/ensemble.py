@@ -195,7 +195,8 @@ def main(argv):
       num_approx_bins=FLAGS.num_approx_bins,
       # Do not eval on bias predictions for now.
       train_on_multi_task_label=False,
-      log_eval_time=False)
+      log_eval_time=False,
+      use_metric_bank=FLAGS.use_metric_bank)
 
   @tf.function
   def generate_sample_weight(labels, class_weight, label_threshold=0.7):
@@ -279,7 +280,8 @@ def main(argv):
           # Do not eval on bias predictions for now.
           train_on_multi_task_label=False,
           multi_task_labels=None,
-          multi_task_probs=None)
+          multi_task_probs=None,
+          additional_labels=additional_labels)
       update_fn(metrics)
 
     ids_all = tf.concat(ids_list, axis=0)
@@ -319,6 +321,9 @@ def main(argv):
     # record results
     total_results = {}
     for name, metric in metrics.items():
+      if name == utils.METRIC_BANK_NAME:
+        total_results.update(utils.metric_bank_results(metric))
+        continue
       try:
         total_results[name] = metric.result()
       except tf.errors.InvalidArgumentError:
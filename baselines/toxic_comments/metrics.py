@@ -34,7 +34,7 @@ A model that collaborates with an oracle well should not be accurate, but also
 capable of quantifying its uncertainty well (i.e., its uncertainty should be
 calibrated such that uncertainty ≅ model accuracy).
 """
-from typing import Optional, Sequence
+from typing import Dict, Optional, Sequence, Union
 
 from robustness_metrics.metrics import uncertainty
 import tensorflow as tf
@@ -340,3 +340,403 @@ class AbstainRecall(AbstainPrecision):
       return incorrect_counts
 
     return incorrect_predictions_abstained / incorrect_counts
+
+
+# Policies ranking the examples to abstain on, or to send to the oracle.
+_POLICIES = ("uncertainty", "toxicity")
+
+# Per-example statistics summed by `ToxicityMetricBank.sums`.
+_SUMS = ("count", "negative_log_likelihood", "brier", "brier_weighted",
+         "weight", "correct", "correct_weighted", "true_positives",
+         "false_positives", "false_negatives", "f1_true_positives",
+         "f1_false_positives", "f1_false_negatives")
+
+
+def _bin_indices(values: tf.Tensor, num_bins: int) -> tf.Tensor:
+  """Returns the indices of the values' bins in a histogram over [0, 1]."""
+  indices = tf.cast(tf.floor(values * num_bins), tf.int32)
+  return tf.clip_by_value(indices, 0, num_bins - 1)
+
+
+def _histogram_auc(positives: tf.Tensor,
+                   negatives: tf.Tensor,
+                   curve: str = "ROC") -> tf.Tensor:
+  """Computes AUCs from score histograms of positive and negative examples.
+
+  Args:
+    positives: Counts of the positive examples in each score bin, ordered by
+      increasing score along the last axis.
+    negatives: Counts of the negative examples, same shape as `positives`.
+    curve: "ROC" for the area under the ROC curve (trapezoidal rule), or "PR"
+      for the area under the precision-recall curve (average precision).
+
+  Returns:
+    The AUCs, of shape positives.shape[:-1].
+  """
+  # Counts of examples scored in or above each bin, and above the last bin.
+  zeros = tf.zeros_like(positives[..., :1])
+  true_positives = tf.concat(
+      [tf.cumsum(positives, axis=-1, reverse=True), zeros], axis=-1)
+  false_positives = tf.concat(
+      [tf.cumsum(negatives, axis=-1, reverse=True), zeros], axis=-1)
+  tpr = tf.math.divide_no_nan(true_positives, true_positives[..., :1])
+  if curve == "ROC":
+    fpr = tf.math.divide_no_nan(false_positives, false_positives[..., :1])
+    return tf.reduce_sum(
+        (fpr[..., :-1] - fpr[..., 1:]) * (tpr[..., :-1] + tpr[..., 1:]) / 2.,
+        axis=-1)
+  precision = tf.math.divide_no_nan(
+      true_positives[..., :-1],
+      true_positives[..., :-1] + false_positives[..., :-1])
+  return tf.reduce_sum((tpr[..., :-1] - tpr[..., 1:]) * precision, axis=-1)
+
+
+def _abstained_shares(binned_total_counts: tf.Tensor,
+                      abstain_fraction: float) -> tf.Tensor:
+  """Computes the share of each bin abstained on, from the lowest bin up.
+
+  Same approximation as `AbstainPrecision`: the lowest bins are abstained on
+  entirely, and the final bin partially.
+
+  Args:
+    binned_total_counts: Number of examples in each bin, shape (..., num_bins).
+    abstain_fraction: The fraction of total examples to abstain on.
+
+  Returns:
+    The abstained shares, in [0, 1], of the same shape.
+  """
+  total_counts = tf.reduce_sum(binned_total_counts, axis=-1, keepdims=True)
+  total_count_abstained = tf.floor(total_counts * abstain_fraction)
+  count_before_bin = tf.cumsum(binned_total_counts, axis=-1, exclusive=True)
+  return tf.clip_by_value(
+      tf.math.divide_no_nan(total_count_abstained - count_before_bin,
+                            binned_total_counts), 0., 1.)
+
+
+class ToxicityMetricBank(tf.keras.metrics.Metric):
+  """Computes all the toxicity test metrics for many groups of examples.
+
+  The bank keeps the sufficient statistics of the test metrics of
+  `utils.create_train_and_test_metrics` in a few stacked tensors, with one row
+  per group of examples (e.g. a test dataset or an identity subgroup), and
+  updates all of them with a handful of segment sums per batch:
+
+    * `sums`: Counts, sums of log-likelihoods, squared errors and weights, and
+      confusion counts, shape (num_groups, len(_SUMS)).
+    * `score_counts`: Histogram of the toxicity probabilities of the negative
+      and positive examples, for AUROC/AUPR, shape (num_groups, num_auc_bins,
+      2). As in `tf.keras.metrics.AUC`, the examples with a nonzero (soft)
+      label are positive.
+    * `ece_counts`: Counts, confidences and correct predictions in each
+      confidence bin, for ECE, shape (num_groups, num_ece_bins, 3).
+    * `confidence_counts`: Histogram of the confidence of the incorrect and
+      correct predictions for each policy, for the calibration AUCs, the
+      abstention metrics and the collaborative accuracy, shape (num_groups,
+      len(_POLICIES), num_approx_bins, 2).
+    * `collab_counts`: Joint histogram of the confidence and of the toxicity
+      probability of the negative and positive examples, for the
+      collaborative AUCs, shape (num_groups, len(_POLICIES), num_collab_bins,
+      num_auc_bins, 2). Only kept if `fractions` is not empty. The confidence
+      axis is coarser than in `confidence_counts` to bound the size of the
+      joint histogram, and a batch only updates the bins it touches.
+
+  The metrics are computed from the bins when calling `result`, and are
+  approximations of the Keras and Robustness Metrics metrics at the
+  resolution of the bins.
+  """
+
+  def __init__(self,
+               group_names: Sequence[str],
+               fractions: Sequence[Union[float, str]] = (),
+               num_auc_bins: int = 200,
+               num_ece_bins: int = 15,
+               num_approx_bins: int = 1000,
+               num_collab_bins: int = 100,
+               ece_label_threshold: float = 0.5,
+               name: Optional[str] = None,
+               dtype: Optional[tf.DType] = None):
+    """Constructs the metric bank.
+
+    Args:
+      group_names: Names of the groups of examples.
+      fractions: Fractions of total examples to abstain on or to send to the
+        oracle, for the collaborative metrics. If empty, these metrics are not
+        computed.
+      num_auc_bins: Number of bins of the probability histograms.
+      num_ece_bins: Number of bins for ECE.
+      num_approx_bins: Number of bins of the confidence histograms.
+      num_collab_bins: Number of confidence bins of the joint histogram used
+        for the collaborative AUCs.
+      ece_label_threshold: Threshold above which a soft label is toxic.
+      name: (Optional) Name of this metric.
+      dtype: (Optional) Data type. Must be floating-point.
+    """
+    super().__init__(name=name, dtype=dtype)
+    self.group_names = tuple(group_names)
+    self.fractions = tuple(fractions)
+    self.num_auc_bins = num_auc_bins
+    self.num_ece_bins = num_ece_bins
+    self.num_approx_bins = num_approx_bins
+    self.num_collab_bins = num_collab_bins
+    self.ece_label_threshold = ece_label_threshold
+
+    num_groups = len(self.group_names)
+    self.sums = self.add_weight(
+        "sums",
+        shape=(num_groups, len(_SUMS)),
+        initializer=tf.zeros_initializer,
+        dtype=self.dtype)
+    self.score_counts = self.add_weight(
+        "score_counts",
+        shape=(num_groups, num_auc_bins, 2),
+        initializer=tf.zeros_initializer,
+        dtype=self.dtype)
+    self.ece_counts = self.add_weight(
+        "ece_counts",
+        shape=(num_groups, num_ece_bins, 3),
+        initializer=tf.zeros_initializer,
+        dtype=self.dtype)
+    self.confidence_counts = self.add_weight(
+        "confidence_counts",
+        shape=(num_groups, len(_POLICIES), num_approx_bins, 2),
+        initializer=tf.zeros_initializer,
+        dtype=self.dtype)
+    self.collab_counts = None
+    if self.fractions:
+      self.collab_counts = self.add_weight(
+          "collab_counts",
+          shape=(num_groups, len(_POLICIES), num_collab_bins, num_auc_bins, 2),
+          initializer=tf.zeros_initializer,
+          dtype=self.dtype)
+
+  def update_state(self,
+                   y_true: Sequence[float],
+                   y_pred: Sequence[float],
+                   group_mask: Sequence[float],
+                   negative_log_likelihood: Optional[Sequence[float]] = None,
+                   sample_weight: Optional[Sequence[float]] = None) -> None:
+    """Updates the statistics of all the groups.
+
+    Args:
+      y_true: The (soft) toxicity labels. Shape (batch_size, ).
+      y_pred: The predicted toxicity probabilities. Shape (batch_size, ) or
+        (batch_size, 1).
+      group_mask: Whether each example belongs to each group, an example can
+        belong to several groups. Shape (batch_size, num_groups).
+      negative_log_likelihood: (Optional) The negative log-likelihood of each
+        example, shape (batch_size, ), or of the batch.
+      sample_weight: (Optional) Weight of each example for the weighted Brier
+        score and accuracy. Shape (batch_size, ).
+    """
+    y_true = tf.reshape(tf.cast(y_true, self.dtype), [-1])
+    y_pred = tf.reshape(tf.cast(y_pred, self.dtype), [-1])
+    batch_size = tf.shape(y_true)[0]
+    ones = tf.ones([batch_size], dtype=self.dtype)
+    if sample_weight is None:
+      sample_weight = ones
+    sample_weight = tf.reshape(tf.cast(sample_weight, self.dtype), [-1])
+    if negative_log_likelihood is None:
+      negative_log_likelihood = tf.zeros([batch_size], dtype=self.dtype)
+    negative_log_likelihood = tf.broadcast_to(
+        tf.cast(negative_log_likelihood, self.dtype), [batch_size])
+
+    labels = tf.cast(y_true > self.ece_label_threshold, self.dtype)
+    preds = tf.cast(y_pred > 0.5, self.dtype)
+    correct = tf.cast(tf.equal(labels, preds), self.dtype)
+    squared_error = tf.square(y_true - y_pred)
+    # Micro-averaged F1 over the two classes, as `tfa.metrics.F1Score`.
+    class_probs = tf.stack([1. - y_pred, y_pred], axis=-1)
+    class_preds = tf.cast(class_probs > self.ece_label_threshold, self.dtype)
+    class_labels = tf.stack([1. - labels, labels], axis=-1)
+    example_sums = tf.stack([
+        ones,
+        negative_log_likelihood,
+        squared_error,
+        sample_weight * squared_error,
+        sample_weight,
+        correct,
+        sample_weight * correct,
+        preds * labels,
+        preds * (1. - labels),
+        (1. - preds) * labels,
+        tf.reduce_sum(class_preds * class_labels, axis=-1),
+        tf.reduce_sum(class_preds * (1. - class_labels), axis=-1),
+        tf.reduce_sum((1. - class_preds) * class_labels, axis=-1),
+    ], axis=-1)
+
+    # Segments are keyed by the pairs of examples and groups they belong to.
+    pairs = tf.cast(tf.where(tf.cast(group_mask, tf.bool)), tf.int32)
+    examples, groups = pairs[:, 0], pairs[:, 1]
+    num_groups = len(self.group_names)
+
+    def _add_histogram(variable, values, indices):
+      """Adds the values of the pairs to the bins of the given indices."""
+      shape = variable.shape.as_list()
+      flat_indices = groups
+      for index, size in zip(indices, shape[1:]):
+        flat_indices = flat_indices * size + index
+      num_bins = num_groups
+      for size in shape[1:len(indices) + 1]:
+        num_bins *= size
+      variable.assign_add(
+          tf.reshape(
+              tf.math.unsorted_segment_sum(values, flat_indices, num_bins),
+              shape))
+
+    _add_histogram(self.sums, tf.gather(example_sums, examples), [])
+
+    score_bins = tf.gather(_bin_indices(y_pred, self.num_auc_bins), examples)
+    positives = tf.cast(y_true > 0., self.dtype)
+    label_weights = tf.gather(
+        tf.stack([1. - positives, positives], axis=-1), examples)
+    _add_histogram(self.score_counts, label_weights, [score_bins])
+
+    confidence = tf.reduce_max(class_probs, axis=-1)
+    ece_values = tf.stack([ones, confidence, correct], axis=-1)
+    _add_histogram(self.ece_counts, tf.gather(ece_values, examples),
+                   [tf.gather(_bin_indices(confidence, self.num_ece_bins),
+                              examples)])
+
+    # Normalized binary predictive variance, or decreasing toxicity score.
+    policy_confidences = {
+        "uncertainty": 1. - y_pred * (1. - y_pred) / .25,
+        "toxicity": 1. - y_pred,
+    }
+    correct_values = tf.gather(tf.stack([1. - correct, correct], axis=-1),
+                               examples)
+    for policy_index, policy in enumerate(_POLICIES):
+      policies = tf.fill(tf.shape(examples), policy_index)
+      confidence_bins = tf.gather(
+          _bin_indices(policy_confidences[policy], self.num_approx_bins),
+          examples)
+      _add_histogram(self.confidence_counts, correct_values,
+                     [policies, confidence_bins])
+      if self.collab_counts is not None:
+        # A dense segment sum would materialize the whole joint histogram, so
+        # only the bins of the batch are updated.
+        collab_bins = tf.gather(
+            _bin_indices(policy_confidences[policy], self.num_collab_bins),
+            examples)
+        self.collab_counts.scatter_nd_add(
+            tf.stack([groups, policies, collab_bins, score_bins], axis=-1),
+            label_weights)
+
+  def group_results(self) -> Dict[str, Dict[str, tf.Tensor]]:
+    """Computes the metrics of each group.
+
+    Returns:
+      A dictionary mapping each group name to a dictionary of its metrics. The
+      metrics of the policies are named "{policy}/{metric}".
+    """
+    sums = dict(zip(_SUMS, tf.unstack(self.sums, axis=-1)))
+    count = sums["count"]
+    true_positives = sums["true_positives"]
+    f1_true_positives = sums["f1_true_positives"]
+    results = {
+        "negative_log_likelihood":
+            tf.math.divide_no_nan(sums["negative_log_likelihood"], count),
+        "auroc":
+            _histogram_auc(self.score_counts[..., 1],
+                           self.score_counts[..., 0], "ROC"),
+        "aupr":
+            _histogram_auc(self.score_counts[..., 1],
+                           self.score_counts[..., 0], "PR"),
+        "brier":
+            tf.math.divide_no_nan(sums["brier"], count),
+        "brier_weighted":
+            tf.math.divide_no_nan(sums["brier_weighted"], sums["weight"]),
+        "ece":
+            tf.math.divide_no_nan(
+                tf.reduce_sum(
+                    tf.abs(self.ece_counts[..., 2] - self.ece_counts[..., 1]),
+                    axis=-1), count),
+        "acc":
+            tf.math.divide_no_nan(sums["correct"], count),
+        "acc_weighted":
+            tf.math.divide_no_nan(sums["correct_weighted"], sums["weight"]),
+        "precision":
+            tf.math.divide_no_nan(
+                true_positives, true_positives + sums["false_positives"]),
+        "recall":
+            tf.math.divide_no_nan(
+                true_positives, true_positives + sums["false_negatives"]),
+        "f1":
+            tf.math.divide_no_nan(
+                2. * f1_true_positives,
+                2. * f1_true_positives + sums["f1_false_positives"] +
+                sums["f1_false_negatives"]),
+    }
+    # The incorrect predictions are the positives, ranked by uncertainty.
+    uncertainty_counts = tf.reverse(self.confidence_counts[:, 0], axis=[-2])
+    results["calibration_auroc"] = _histogram_auc(
+        uncertainty_counts[..., 0], uncertainty_counts[..., 1], "ROC")
+    results["calibration_auprc"] = _histogram_auc(
+        uncertainty_counts[..., 0], uncertainty_counts[..., 1], "PR")
+
+    if self.fractions:
+      for policy_index, policy in enumerate(_POLICIES):
+        results.update(self._policy_results(policy_index, policy))
+
+    return {
+        group_name: {name: value[i] for name, value in results.items()
+                    } for i, group_name in enumerate(self.group_names)
+    }
+
+  def _policy_results(self, policy_index: int,
+                      policy: str) -> Dict[str, tf.Tensor]:
+    """Computes the calibration and collaborative metrics of a policy."""
+    incorrect_counts = self.confidence_counts[:, policy_index, :, 0]
+    correct_counts = self.confidence_counts[:, policy_index, :, 1]
+    total_counts = incorrect_counts + correct_counts
+    total_count = tf.reduce_sum(total_counts, axis=-1)
+    total_correct = tf.reduce_sum(correct_counts, axis=-1)
+    collab_counts = self.collab_counts[:, policy_index]
+    results = {
+        f"{policy}/calibration_auroc":
+            _histogram_auc(correct_counts, incorrect_counts, "ROC"),
+        f"{policy}/calibration_auprc":
+            _histogram_auc(correct_counts, incorrect_counts, "PR"),
+    }
+    for fraction in self.fractions:
+      shares = _abstained_shares(total_counts, float(fraction))
+      count_abstained = tf.reduce_sum(shares * total_counts, axis=-1)
+      incorrect_abstained = tf.reduce_sum(shares * incorrect_counts, axis=-1)
+      results[f"{policy}/abstain_prec_{fraction}"] = tf.math.divide_no_nan(
+          incorrect_abstained, count_abstained)
+      results[f"{policy}/abstain_recall_{fraction}"] = tf.math.divide_no_nan(
+          incorrect_abstained, total_count - total_correct)
+      # The oracle corrects the predictions of the abstained examples.
+      results[f"{policy}/collab_acc_{fraction}"] = tf.math.divide_no_nan(
+          total_correct + incorrect_abstained, total_count)
+
+      # The oracle scores the abstained examples with their labels. The shares
+      # are recomputed on the coarser confidence bins of `collab_counts`.
+      collab_shares = _abstained_shares(
+          tf.reduce_sum(collab_counts, axis=[-2, -1]), float(fraction))
+      oracle_counts = tf.reduce_sum(
+          collab_shares[..., None, None] * collab_counts, axis=[1, 2])
+      score_counts = tf.reduce_sum(
+          (1. - collab_shares[..., None, None]) * collab_counts, axis=1)
+      num_auc_bins = self.num_auc_bins
+      score_counts += tf.stack([
+          tf.one_hot(0, num_auc_bins) * oracle_counts[:, None, 0],
+          tf.one_hot(num_auc_bins - 1, num_auc_bins) * oracle_counts[:, None, 1]
+      ], axis=-1)
+      for curve, name in (("ROC", "collab_auroc"), ("PR", "collab_auprc")):
+        results[f"{policy}/{name}_{fraction}"] = _histogram_auc(
+            score_counts[..., 1], score_counts[..., 0], curve)
+    return results
+
+  def result(self) -> Dict[str, tf.Tensor]:
+    """Computes the metrics, named "{group}/{metric}"."""
+    return {
+        f"{group_name}/{name}": value
+        for group_name, results in self.group_results().items()
+        for name, value in results.items()
+    }
+
+  def reset_states(self):
+    """Resets all of the metric state variables."""
+    tf.keras.backend.batch_set_value([
+        (v, tf.zeros(v.shape, dtype=v.dtype)) for v in self.variables
+    ])
@@ -658,5 +658,124 @@ class AbstainPrecisionTest(tf.test.TestCase, parameterized.TestCase):
     self.assertAllEqual(m.binned_correct_counts, zero_bins)
 
 
+class ToxicityMetricBankTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    rng = np.random.RandomState(0)
+    self.num_examples = 200
+    # Soft labels, with a third of non-toxic examples.
+    self.y_true = rng.uniform(size=self.num_examples).astype(np.float32)
+    self.y_true[rng.uniform(size=self.num_examples) < 1. / 3] = 0.
+    self.y_pred = rng.uniform(size=self.num_examples).astype(np.float32)
+    # The first group contains all the examples, the second one a third.
+    self.group_mask = np.stack([
+        np.ones(self.num_examples),
+        (np.arange(self.num_examples) % 3 == 0).astype(np.float32)
+    ], axis=-1)
+
+  def _update(self, metric_bank, num_batches=4):
+    for y_true, y_pred, group_mask in zip(
+        np.split(self.y_true, num_batches), np.split(self.y_pred, num_batches),
+        np.split(self.group_mask, num_batches)):
+      metric_bank.update_state(y_true, y_pred, group_mask)
+
+  def testMatchesKerasMetrics(self):
+    metric_bank = metrics.ToxicityMetricBank(['all', 'subgroup'],
+                                             num_auc_bins=1000)
+    self._update(metric_bank)
+    results = metric_bank.group_results()
+
+    for i, group_name in enumerate(['all', 'subgroup']):
+      mask = self.group_mask[:, i] > 0
+      y_true, y_pred = self.y_true[mask], self.y_pred[mask]
+      labels = (y_true > 0.5).astype(np.float32)
+      preds = (y_pred > 0.5).astype(np.float32)
+      auc = tf.keras.metrics.AUC(num_thresholds=1001)
+      auc.update_state(y_true, y_pred)
+      precision = tf.keras.metrics.Precision()
+      precision.update_state(labels, preds)
+
+      group_results = results[group_name]
+      self.assertAllClose(group_results['acc'], np.mean(labels == preds))
+      self.assertAllClose(group_results['brier'],
+                          np.mean(np.square(y_true - y_pred)))
+      self.assertAllClose(group_results['precision'], precision.result())
+      self.assertAllClose(group_results['recall'],
+                          np.sum(labels * preds) / np.sum(labels))
+      self.assertAllClose(group_results['auroc'], auc.result(), atol=1e-3)
+
+  @parameterized.parameters(0.1, 0.25, 0.5)
+  def testMatchesAbstainPrecisionAndRecall(self, fraction):
+    metric_bank = metrics.ToxicityMetricBank(['all', 'subgroup'],
+                                             fractions=[fraction])
+    self._update(metric_bank)
+    results = metric_bank.group_results()
+
+    for i, group_name in enumerate(['all', 'subgroup']):
+      mask = self.group_mask[:, i] > 0
+      y_true, y_pred = self.y_true[mask], self.y_pred[mask]
+      labels = (y_true > 0.5).astype(np.float32)
+      preds = (y_pred > 0.5).astype(np.float32)
+      confidence = 1. - y_pred * (1. - y_pred) / .25
+      abstain_precision = metrics.AbstainPrecision(abstain_fraction=fraction)
+      abstain_recall = metrics.AbstainRecall(abstain_fraction=fraction)
+
+      self.assertAllClose(
+          results[group_name][f'uncertainty/abstain_prec_{fraction}'],
+          abstain_precision(labels, preds, confidence))
+      self.assertAllClose(
+          results[group_name][f'uncertainty/abstain_recall_{fraction}'],
+          abstain_recall(labels, preds, confidence))
+
+  @parameterized.parameters(0.1, 0.25, 0.5)
+  def testMatchesOracleCollaborativeAUC(self, fraction):
+    metric_bank = metrics.ToxicityMetricBank(['all', 'subgroup'],
+                                             fractions=[fraction],
+                                             num_auc_bins=1000)
+    self._update(metric_bank)
+    results = metric_bank.group_results()
+
+    for i, group_name in enumerate(['all', 'subgroup']):
+      mask = self.group_mask[:, i] > 0
+      y_true, y_pred = self.y_true[mask], self.y_pred[mask]
+      # Every example of the group is counted once in the joint histogram.
+      self.assertAllClose(
+          tf.reduce_sum(metric_bank.collab_counts[i], axis=[1, 2, 3]),
+          [mask.sum()] * 2)
+      # The oracle replaces the scores of the least confident examples with
+      # their labels.
+      confidence = 1. - y_pred * (1. - y_pred) / .25
+      abstained = np.argsort(confidence, kind='stable')[:int(
+          len(y_pred) * fraction)]
+      oracle_pred = y_pred.copy()
+      oracle_pred[abstained] = (y_true[abstained] > 0.).astype(np.float32)
+      auc = tf.keras.metrics.AUC(num_thresholds=1001)
+      auc.update_state(y_true, oracle_pred)
+
+      self.assertAllClose(
+          results[group_name][f'uncertainty/collab_auroc_{fraction}'],
+          auc.result(), atol=2e-2)
+
+  def testUnitFractionIsPerfect(self):
+    metric_bank = metrics.ToxicityMetricBank(['all', 'subgroup'],
+                                             fractions=['1.0'])
+    self._update(metric_bank)
+    results = metric_bank.result()
+
+    for policy in ('uncertainty', 'toxicity'):
+      self.assertAllClose(results[f'all/{policy}/collab_acc_1.0'], 1.)
+      self.assertAllClose(results[f'subgroup/{policy}/collab_auroc_1.0'], 1.)
+
+  def testResetStates(self):
+    metric_bank = metrics.ToxicityMetricBank(['all', 'subgroup'],
+                                             fractions=['0.1'])
+    self._update(metric_bank)
+    metric_bank.reset_states()
+
+    for variable in metric_bank.variables:
+      self.assertAllEqual(variable, tf.zeros_like(variable))
+
+
 if __name__ == '__main__':
   tf.test.main()
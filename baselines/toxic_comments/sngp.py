@@ -52,7 +52,6 @@ from absl import app
 from absl import flags
 from absl import logging
 
-import edward2 as ed
 import tensorflow as tf
 from tensorflow_addons import losses as tfa_losses
 
@@ -177,7 +176,9 @@ def main(argv):
 
   dataset_kwargs = dict(
       shuffle_buffer_size=data_buffer_size,
-      tf_hub_preprocessor_url=FLAGS.bert_tokenizer_tf_hub_url)
+      tf_hub_preprocessor_url=FLAGS.bert_tokenizer_tf_hub_url,
+      bucket_by_sequence_length=FLAGS.bucket_by_sequence_length,
+      max_tokens_per_batch=FLAGS.max_tokens_per_batch)
 
   (train_dataset_builders, test_dataset_builders,
    train_split_name) = utils.make_train_and_test_dataset_builders(
@@ -260,7 +261,8 @@ def main(argv):
         gp_output_bias=FLAGS.gp_bias,
         normalize_input=FLAGS.gp_input_normalization,
         gp_cov_momentum=FLAGS.gp_cov_discount_factor,
-        gp_cov_ridge_penalty=FLAGS.gp_cov_ridge_penalty)
+        gp_cov_ridge_penalty=FLAGS.gp_cov_ridge_penalty,
+        return_gp_variance=True)
     spec_norm_kwargs = dict(
         iteration=FLAGS.spec_norm_iteration,
         norm_multiplier=FLAGS.spec_norm_bound)
@@ -320,7 +322,8 @@ def main(argv):
         ece_label_threshold=FLAGS.ece_label_threshold,
         eval_collab_metrics=FLAGS.eval_collab_metrics,
         num_approx_bins=FLAGS.num_approx_bins,
-        train_on_multi_task_label=FLAGS.train_on_multi_task_label)
+        train_on_multi_task_label=FLAGS.train_on_multi_task_label,
+        use_metric_bank=FLAGS.use_metric_bank)
 
   @tf.function
   def generate_sample_weight(labels, class_weight, label_threshold=0.7):
@@ -349,7 +352,7 @@ def main(argv):
           logits, multi_task_logits = logits
 
         if isinstance(logits, (list, tuple)):
-          # If model returns a tuple of (logits, covmat), extract logits
+          # If model returns a tuple of (logits, variances), extract logits
           logits, _ = logits
         if FLAGS.use_bfloat16:
           logits = tf.cast(logits, tf.float32)
@@ -429,7 +432,8 @@ def main(argv):
 
     def step_fn(inputs):
       """Per-Replica StepFn."""
-      features, labels, _ = utils.create_feature_and_label(inputs)
+      features, labels, additional_labels = utils.create_feature_and_label(
+          inputs)
 
       eval_start_time = time.time()
       # Compute ensemble prediction over Monte Carlo forward-pass samples.
@@ -445,18 +449,18 @@ def main(argv):
           multi_task_labels = inputs.get('multi_task_labels', None)
 
         if isinstance(logits, (list, tuple)):
-          # If model returns a tuple of (logits, covmat), extract both.
-          logits, covmat = logits
+          # If model returns a tuple of (logits, variances), extract both.
+          logits, variances = logits
         else:
-          covmat = tf.eye(test_batch_size)
+          variances = tf.ones(tf.shape(logits)[:1])
 
         if FLAGS.use_bfloat16:
           logits = tf.cast(logits, tf.float32)
-          covmat = tf.cast(covmat, tf.float32)
+          variances = tf.cast(variances, tf.float32)
 
-        logits = ed.layers.utils.mean_field_logits(
-            logits, covmat, mean_field_factor=FLAGS.gp_mean_field_factor)
-        stddev = tf.sqrt(tf.linalg.diag_part(covmat))
+        logits = ub.models.classifier_utils.mean_field_logits(
+            logits, variances, mean_field_factor=FLAGS.gp_mean_field_factor)
+        stddev = tf.sqrt(variances)
 
         logits_list.append(logits)
         stddev_list.append(stddev)
@@ -497,7 +501,8 @@ def main(argv):
           eval_time=eval_time,
           ece_label_threshold=FLAGS.ece_label_threshold,
           train_on_multi_task_label=FLAGS.train_on_multi_task_label,
-          eval_collab_metrics=FLAGS.eval_collab_metrics)
+          eval_collab_metrics=FLAGS.eval_collab_metrics,
+          additional_labels=additional_labels)
       update_fn(metrics)
 
     strategy.run(step_fn, args=(next(iterator),))
@@ -520,18 +525,17 @@ def main(argv):
         del multi_task_logits
 
       if isinstance(logits, (list, tuple)):
-        # If model returns a tuple of (logits, covmat), extract both.
-        logits, covmat = logits
+        # If model returns a tuple of (logits, variances), extract both.
+        logits, variances = logits
       else:
-        covmat = tf.eye(test_batch_size)
+        variances = tf.ones(tf.shape(logits)[:1])
 
       if FLAGS.use_bfloat16:
         logits = tf.cast(logits, tf.float32)
-        covmat = tf.cast(covmat, tf.float32)
+        variances = tf.cast(variances, tf.float32)
 
-      logits = ed.layers.utils.mean_field_logits(
-          logits, covmat, mean_field_factor=FLAGS.gp_mean_field_factor)
-      variances = tf.linalg.diag_part(covmat)
+      logits = ub.models.classifier_utils.mean_field_logits(
+          logits, variances, mean_field_factor=FLAGS.gp_mean_field_factor)
       return texts, text_ids, logits, variances, labels, additional_labels, ids
 
     (per_replica_texts, per_replica_text_ids, per_replica_logits,
@@ -568,6 +572,11 @@ def main(argv):
     return (texts_list, text_ids_list, logits_list, variances_list, labels_list,
             additional_labels_dict, ids_list)
 
+  if FLAGS.use_gp_layer:
+    # Factorizes the GP posterior covariance of the restored model, such that
+    # the test steps do not invert the precision matrix.
+    ub.models.classifier_utils.cache_gp_covariance(model)
+
   if FLAGS.prediction_mode:
     # Prediction and exit.
     for dataset_name, test_dataset in test_datasets.items():
@@ -690,6 +699,8 @@ def main(argv):
           logging.info('Done with testing on %s', dataset_name)
 
       if epoch % FLAGS.evaluation_interval == 0:
+        if FLAGS.use_gp_layer:
+          ub.models.classifier_utils.cache_gp_covariance(model)
         for dataset_name, test_dataset in test_datasets.items():
           test_iterator = iter(test_dataset)
           logging.info('Testing on dataset %s', dataset_name)
@@ -709,13 +720,13 @@ def main(argv):
                      metrics['train/loss'].result(),
                      metrics['train/ece'].result()['ece'],
                      metrics['train/accuracy'].result())
-        logging.info('Test NLL: %.4f, AUROC: %.4f',
-                     metrics['test/negative_log_likelihood'].result(),
-                     metrics['test/auroc'].result())
 
         # record results
         total_results = {}
         for name, metric in metrics.items():
+          if name == utils.METRIC_BANK_NAME:
+            total_results.update(utils.metric_bank_results(metric))
+            continue
           try:
             total_results[name] = metric.result()
           except tf.errors.InvalidArgumentError:
@@ -728,6 +739,9 @@ def main(argv):
             k: (list(v.values())[0] if isinstance(v, dict) else v)
             for k, v in total_results.items()
         }
+        logging.info('Test NLL: %.4f, AUROC: %.4f',
+                     total_results['test/negative_log_likelihood'],
+                     total_results['test/auroc'])
         with summary_writer.as_default():
           for name, result in total_results.items():
             tf.summary.scalar(name, result, step=epoch + 1)
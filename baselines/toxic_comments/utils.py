@@ -128,6 +128,14 @@ IDENTITY_TYPES = ('gender', 'sexual_orientation', 'religion', 'race',
 
 CHALLENGE_DATASET_NAMES = ('bias', 'uncertainty', 'noise', 'all')
 
+# Name of the ToxicityMetricBank in the metrics dictionary.
+METRIC_BANK_NAME = 'test/metric_bank'
+
+# Test dataset whose examples are grouped by identity in the metric bank, and
+# threshold above which an example mentions an identity.
+IDENTITY_SUBGROUP_DATASET_NAME = 'ood_identity'
+IDENTITY_LABEL_THRESHOLD = 0.5
+
 # Data flags
 flags.DEFINE_enum(
     'dataset_type', 'tfrecord', ['tfrecord', 'csv', 'tfds'],
@@ -183,6 +191,21 @@ flags.DEFINE_bool(
 flags.DEFINE_bool(
     'eval_collab_metrics', False,
     'Whether to compute collaboration effectiveness by score type.')
+flags.DEFINE_bool(
+    'use_metric_bank', False,
+    'Whether to compute the test metrics of all the test datasets and of the '
+    'identity subgroups of `ood_identity` with a single ToxicityMetricBank, '
+    'whose metrics approximate the separate Keras metrics with histograms.')
+flags.DEFINE_bool(
+    'bucket_by_sequence_length', False,
+    'Whether to batch together the comments of similar lengths, padded to the '
+    'smallest bucket that fits them, instead of padding all of them to the '
+    'maximum sequence length. Only supported on GPU.')
+flags.DEFINE_integer(
+    'max_tokens_per_batch', None,
+    'Optional token budget of the test batches when bucketing by sequence '
+    'length, which then replaces the test batch size. The train batches keep '
+    'per_core_batch_size examples, so that an epoch is a pass over the data.')
 
 flags.DEFINE_string(
     'in_dataset_dir', None,
@@ -286,6 +309,14 @@ def _check_dataset_dir_for_identity_prediction(flags_dict):
       flags_dict['identity_type_dataset_dir'] is not None)
 
 
+@flags.multi_flags_validator(
+    ['bucket_by_sequence_length', 'use_gpu'],
+    message='`bucket_by_sequence_length` is only supported on GPU, since the '
+    'batches of different buckets have different shapes.')
+def _check_gpu_for_bucket_by_sequence_length(flags_dict):
+  return not flags_dict['bucket_by_sequence_length'] or flags_dict['use_gpu']
+
+
 def get_num_examples(dataset_builder, dataset_name, split_name):
   """Extracts number of examples in a dataset."""
   custom_num_examples = dataset_builder._dataset_builder.info.metadata.get(  # pylint:disable=protected-access
@@ -333,6 +364,10 @@ def make_train_and_test_dataset_builders(in_dataset_dir,
   def get_challenge_dir(name):
     return os.path.join(challenge_dataset_dir, f'challenge_eval_{name}')
 
+  # The token budget only applies to evaluation: `build_datasets` counts the
+  # steps of a training epoch from the batch size.
+  train_ds_kwargs = dict(ds_kwargs, max_tokens_per_batch=None)
+
   if use_cross_validation and train_dataset_type == 'tfrecord':
     raise ValueError('Cannot use local data when in cross_validation mode.'
                      'Please set `train_dataset_type` to "tfds" or "csv".')
@@ -373,7 +408,7 @@ def make_train_and_test_dataset_builders(in_dataset_dir,
       data_dir=maybe_get_train_dir(in_dataset_dir),
       multi_task_labels=train_on_multi_task_label,
       multi_task_label_threshold=multi_task_label_threshold,
-      **ds_kwargs)
+      **train_ds_kwargs)
 
   # Optionally, add identity specific examples to training data.
   if train_on_identity_subgroup_data:
@@ -382,7 +417,7 @@ def make_train_and_test_dataset_builders(in_dataset_dir,
       identity_data_dir = get_identity_dir(dataset_name)
       identity_train_dataset_builders[
           dataset_name] = ds.CivilCommentsIdentitiesDataset(
-              split='train', data_dir=identity_data_dir, **ds_kwargs)
+              split='train', data_dir=identity_data_dir, **train_ds_kwargs)
 
   # Create testing data.
   ind_dataset_builder = IND_DATA_CLS(
@@ -548,7 +583,10 @@ def build_datasets(train_dataset_builders, test_dataset_builders,
     # for k-fold cross validation.
     test_num_examples = get_num_examples(
         dataset_builder, dataset_name, split_name=dataset_builder.split)
-    test_steps_per_eval[dataset_name] = test_num_examples // test_batch_size
+    # An upper bound when bucketing by sequence length, the evaluation loops
+    # stop at the end of the dataset.
+    test_steps_per_eval[dataset_name] = dataset_builder.num_batches(
+        test_num_examples, test_batch_size)
 
   return train_datasets, test_datasets, train_steps_per_epoch, test_steps_per_eval
 
@@ -639,8 +677,14 @@ def create_train_and_test_metrics(test_datasets,
                                   eval_collab_metrics,
                                   num_approx_bins,
                                   log_eval_time=True,
-                                  train_on_multi_task_label=False):
-  """Creates metrics for train and test eval."""
+                                  train_on_multi_task_label=False,
+                                  use_metric_bank=False):
+  """Creates metrics for train and test eval.
+
+  If `use_metric_bank`, the test metrics of the toxicity predictions are all
+  computed by a single `ToxicityMetricBank`, stored under `METRIC_BANK_NAME`,
+  instead of separate metrics. Its results are named by `metric_bank_results`.
+  """
   # Train metrics.
   metrics = {
       'train/negative_log_likelihood':
@@ -684,39 +728,47 @@ def create_train_and_test_metrics(test_datasets,
     })
 
   # Main test metrics.
-  metrics.update({
-      'test/negative_log_likelihood':
-          tf.keras.metrics.Mean(),
-      'test/auroc':
-          tf.keras.metrics.AUC(curve='ROC'),
-      'test/aupr':
-          tf.keras.metrics.AUC(curve='PR'),
-      'test/brier':
-          tf.keras.metrics.MeanSquaredError(),
-      'test/brier_weighted':
-          tf.keras.metrics.MeanSquaredError(),
-      'test/ece':
-          rm.metrics.ExpectedCalibrationError(num_bins=num_ece_bins),
-      'test/acc':
-          tf.keras.metrics.Accuracy(),
-      'test/acc_weighted':
-          tf.keras.metrics.Accuracy(),
-      'test/precision':
-          tf.keras.metrics.Precision(),
-      'test/recall':
-          tf.keras.metrics.Recall(),
-      'test/f1':
-          tfa_metrics.F1Score(
-              num_classes=num_classes,
-              average='micro',
-              threshold=ece_label_threshold),
-      'test/calibration_auroc':
-          tc_metrics.CalibrationAUC(
-              curve='ROC', correct_pred_as_pos_label=False),
-      'test/calibration_auprc':
-          tc_metrics.CalibrationAUC(
-              curve='PR', correct_pred_as_pos_label=False)
-  })
+  if not use_metric_bank:
+    metrics.update({
+        'test/negative_log_likelihood':
+            tf.keras.metrics.Mean(),
+        'test/auroc':
+            tf.keras.metrics.AUC(curve='ROC'),
+        'test/aupr':
+            tf.keras.metrics.AUC(curve='PR'),
+        'test/brier':
+            tf.keras.metrics.MeanSquaredError(),
+        'test/brier_weighted':
+            tf.keras.metrics.MeanSquaredError(),
+        'test/ece':
+            rm.metrics.ExpectedCalibrationError(num_bins=num_ece_bins),
+        'test/acc':
+            tf.keras.metrics.Accuracy(),
+        'test/acc_weighted':
+            tf.keras.metrics.Accuracy(),
+        'test/precision':
+            tf.keras.metrics.Precision(),
+        'test/recall':
+            tf.keras.metrics.Recall(),
+        'test/f1':
+            tfa_metrics.F1Score(
+                num_classes=num_classes,
+                average='micro',
+                threshold=ece_label_threshold),
+        'test/calibration_auroc':
+            tc_metrics.CalibrationAUC(
+                curve='ROC', correct_pred_as_pos_label=False),
+        'test/calibration_auprc':
+            tc_metrics.CalibrationAUC(
+                curve='PR', correct_pred_as_pos_label=False)
+    })
+  else:
+    metrics[METRIC_BANK_NAME] = tc_metrics.ToxicityMetricBank(
+        metric_bank_group_names(test_datasets),
+        fractions=FLAGS.fractions if eval_collab_metrics else (),
+        num_ece_bins=num_ece_bins,
+        num_approx_bins=num_approx_bins,
+        ece_label_threshold=ece_label_threshold)
 
   if log_eval_time:
     metrics['test/eval_time'] = tf.keras.metrics.Mean()
@@ -739,7 +791,7 @@ def create_train_and_test_metrics(test_datasets,
     })
 
   # Main collaborative metrics.
-  if eval_collab_metrics:
+  if eval_collab_metrics and not use_metric_bank:
     for policy in ('uncertainty', 'toxicity'):
       metrics.update({
           'test_{}/calibration_auroc'.format(policy):
@@ -773,7 +825,7 @@ def create_train_and_test_metrics(test_datasets,
 
   # Dataset-specific test metrics.
   for dataset_name in test_datasets.keys():
-    if dataset_name != 'ind':
+    if dataset_name != 'ind' and not use_metric_bank:
       metrics.update({
           'test/nll_{}'.format(dataset_name):
               tf.keras.metrics.Mean(),
@@ -829,7 +881,7 @@ def create_train_and_test_metrics(test_datasets,
                   num_classes=num_classes, average='micro', threshold=0.5),
       })
 
-    if eval_collab_metrics:
+    if eval_collab_metrics and not use_metric_bank:
       for policy in ('uncertainty', 'toxicity'):
         metrics.update({
             'test_{}/calibration_auroc_{}'.format(policy, dataset_name):
@@ -880,8 +932,15 @@ def make_test_metrics_update_fn(dataset_name,
                                 eval_time=None,
                                 ece_label_threshold=0.5,
                                 train_on_multi_task_label=False,
-                                eval_collab_metrics=False):
-  """Makes an update function for test step metrics."""
+                                eval_collab_metrics=False,
+                                additional_labels=None):
+  """Makes an update function for test step metrics.
+
+  If the metrics contain a `ToxicityMetricBank` under `METRIC_BANK_NAME`, it is
+  updated instead of the separate test metrics, and `additional_labels` (as
+  returned by `create_feature_and_label`) assign the examples of
+  `IDENTITY_SUBGROUP_DATASET_NAME` to their identity subgroups.
+  """
   # Cast labels to discrete for ECE computation.
   ece_labels = tf.cast(labels > ece_label_threshold, tf.float32)
   one_hot_labels = tf.one_hot(tf.cast(ece_labels, tf.int32), depth=num_classes)
@@ -907,25 +966,37 @@ def make_test_metrics_update_fn(dataset_name,
     multi_task_auc_probs = tf.squeeze(multi_task_probs, axis=1)
 
   def update_fn(metrics):
+    use_metric_bank = METRIC_BANK_NAME in metrics
+    if use_metric_bank:
+      metric_bank = metrics[METRIC_BANK_NAME]
+      metric_bank.update_state(
+          labels,
+          probs,
+          metric_bank_group_mask(metric_bank.group_names, dataset_name, labels,
+                                 additional_labels),
+          negative_log_likelihood=negative_log_likelihood,
+          sample_weight=sample_weight)
+
     if dataset_name == 'ind':
-      metrics['test/negative_log_likelihood'].update_state(
-          negative_log_likelihood)
-      metrics['test/auroc'].update_state(labels, auc_probs)
-      metrics['test/aupr'].update_state(labels, auc_probs)
-      metrics['test/brier'].update_state(labels, auc_probs)
-      metrics['test/brier_weighted'].update_state(
-          tf.expand_dims(labels, -1), probs, sample_weight=sample_weight)
-      metrics['test/ece'].add_batch(ece_probs, label=ece_labels)
-      metrics['test/acc'].update_state(ece_labels, pred_labels)
-      metrics['test/acc_weighted'].update_state(
-          ece_labels, pred_labels, sample_weight=sample_weight)
-      metrics['test/precision'].update_state(ece_labels, pred_labels)
-      metrics['test/recall'].update_state(ece_labels, pred_labels)
-      metrics['test/f1'].update_state(one_hot_labels, ece_probs)
-      metrics['test/calibration_auroc'].update_state(ece_labels, pred_labels,
-                                                     calib_confidence)
-      metrics['test/calibration_auprc'].update_state(ece_labels, pred_labels,
-                                                     calib_confidence)
+      if not use_metric_bank:
+        metrics['test/negative_log_likelihood'].update_state(
+            negative_log_likelihood)
+        metrics['test/auroc'].update_state(labels, auc_probs)
+        metrics['test/aupr'].update_state(labels, auc_probs)
+        metrics['test/brier'].update_state(labels, auc_probs)
+        metrics['test/brier_weighted'].update_state(
+            tf.expand_dims(labels, -1), probs, sample_weight=sample_weight)
+        metrics['test/ece'].add_batch(ece_probs, label=ece_labels)
+        metrics['test/acc'].update_state(ece_labels, pred_labels)
+        metrics['test/acc_weighted'].update_state(
+            ece_labels, pred_labels, sample_weight=sample_weight)
+        metrics['test/precision'].update_state(ece_labels, pred_labels)
+        metrics['test/recall'].update_state(ece_labels, pred_labels)
+        metrics['test/f1'].update_state(one_hot_labels, ece_probs)
+        metrics['test/calibration_auroc'].update_state(ece_labels, pred_labels,
+                                                       calib_confidence)
+        metrics['test/calibration_auprc'].update_state(ece_labels, pred_labels,
+                                                       calib_confidence)
 
       if eval_time:
         metrics['test/eval_time'].update_state(eval_time)
@@ -944,7 +1015,7 @@ def make_test_metrics_update_fn(dataset_name,
         metrics['test/multi_task_f1'].update_state(multi_task_one_hot_labels,
                                                    multi_task_ece_probs)
 
-      if eval_collab_metrics:
+      if eval_collab_metrics and not use_metric_bank:
         for policy in ('uncertainty', 'toxicity'):
           # calib_confidence or decreasing toxicity score.
           confidence = 1. - probs if policy == 'toxicity' else calib_confidence
@@ -974,32 +1045,33 @@ def make_test_metrics_update_fn(dataset_name,
                     labels, auc_probs, custom_binning_score=binning_confidence)
 
     else:
-      metrics['test/nll_{}'.format(dataset_name)].update_state(
-          negative_log_likelihood)
-      metrics['test/auroc_{}'.format(dataset_name)].update_state(
-          labels, auc_probs)
-      metrics['test/aupr_{}'.format(dataset_name)].update_state(
-          labels, auc_probs)
-      metrics['test/brier_{}'.format(dataset_name)].update_state(
-          labels, auc_probs)
-      metrics['test/brier_weighted_{}'.format(dataset_name)].update_state(
-          tf.expand_dims(labels, -1), probs, sample_weight=sample_weight)
-      metrics['test/ece_{}'.format(dataset_name)].add_batch(
-          ece_probs, label=ece_labels)
-      metrics['test/acc_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels)
-      metrics['test/acc_weighted_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels, sample_weight=sample_weight)
-      metrics['test/precision_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels)
-      metrics['test/recall_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels)
-      metrics['test/f1_{}'.format(dataset_name)].update_state(
-          one_hot_labels, ece_probs)
-      metrics['test/calibration_auroc_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels, calib_confidence)
-      metrics['test/calibration_auprc_{}'.format(dataset_name)].update_state(
-          ece_labels, pred_labels, calib_confidence)
+      if not use_metric_bank:
+        metrics['test/nll_{}'.format(dataset_name)].update_state(
+            negative_log_likelihood)
+        metrics['test/auroc_{}'.format(dataset_name)].update_state(
+            labels, auc_probs)
+        metrics['test/aupr_{}'.format(dataset_name)].update_state(
+            labels, auc_probs)
+        metrics['test/brier_{}'.format(dataset_name)].update_state(
+            labels, auc_probs)
+        metrics['test/brier_weighted_{}'.format(dataset_name)].update_state(
+            tf.expand_dims(labels, -1), probs, sample_weight=sample_weight)
+        metrics['test/ece_{}'.format(dataset_name)].add_batch(
+            ece_probs, label=ece_labels)
+        metrics['test/acc_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels)
+        metrics['test/acc_weighted_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels, sample_weight=sample_weight)
+        metrics['test/precision_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels)
+        metrics['test/recall_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels)
+        metrics['test/f1_{}'.format(dataset_name)].update_state(
+            one_hot_labels, ece_probs)
+        metrics['test/calibration_auroc_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels, calib_confidence)
+        metrics['test/calibration_auprc_{}'.format(dataset_name)].update_state(
+            ece_labels, pred_labels, calib_confidence)
 
       if eval_time:
         metrics['test/eval_time_{}'.format(dataset_name)].update_state(
@@ -1019,7 +1091,7 @@ def make_test_metrics_update_fn(dataset_name,
         metrics['test/multi_task_f1_{}'.format(dataset_name)].update_state(
             multi_task_one_hot_labels, multi_task_ece_probs)
 
-      if eval_collab_metrics:
+      if eval_collab_metrics and not use_metric_bank:
         for policy in ('uncertainty', 'toxicity'):
           # calib_confidence or decreasing toxicity score.
           confidence = 1. - probs if policy == 'toxicity' else calib_confidence
@@ -1054,6 +1126,56 @@ def make_test_metrics_update_fn(dataset_name,
   return update_fn
 
 
+def metric_bank_group_names(test_datasets) -> List[str]:
+  """Returns the groups of the metric bank: test datasets and subgroups."""
+  group_names = list(test_datasets.keys())
+  if IDENTITY_SUBGROUP_DATASET_NAME in test_datasets:
+    for identity in IDENTITY_LABELS:
+      # Same criterion as for the identity specific test datasets.
+      if NUM_EXAMPLES[identity]['test'] > 100:
+        group_names.append('{}_{}'.format(IDENTITY_SUBGROUP_DATASET_NAME,
+                                          identity))
+  return group_names
+
+
+def metric_bank_group_mask(group_names, dataset_name, labels,
+                           additional_labels=None) -> tf.Tensor:
+  """Returns the [batch_size, num_groups] mask of the examples' groups."""
+  additional_labels = additional_labels or {}
+  ones = tf.ones_like(labels, dtype=tf.float32)
+  group_mask = []
+  for group_name in group_names:
+    identity = group_name[len(dataset_name) + 1:]
+    if group_name == dataset_name:
+      group_mask.append(ones)
+    elif (dataset_name == IDENTITY_SUBGROUP_DATASET_NAME and
+          group_name.startswith(dataset_name + '_') and
+          identity in additional_labels):
+      group_mask.append(
+          tf.cast(
+              tf.reshape(additional_labels[identity], [-1]) >
+              IDENTITY_LABEL_THRESHOLD, tf.float32))
+    else:
+      group_mask.append(tf.zeros_like(ones))
+  return tf.stack(group_mask, axis=-1)
+
+
+def metric_bank_results(metric_bank) -> Dict[str, tf.Tensor]:
+  """Names the results of the metric bank as the separate test metrics."""
+  results = {}
+  for group_name, group_results in metric_bank.group_results().items():
+    for name, result in group_results.items():
+      prefix, name = name.rsplit('/', 1) if '/' in name else ('', name)
+      prefix = 'test_{}'.format(prefix) if prefix else 'test'
+      if group_name == 'ind':
+        results['{}/{}'.format(prefix, name)] = result
+      else:
+        if name == 'negative_log_likelihood':
+          name = 'nll'
+        results['{}/{}_{}'.format(prefix, name, group_name)] = result
+  return results
+
+
 def create_config(config_dir: str) -> configs.BertConfig:
   """Load a BERT config object from directory."""
   with tf.io.gfile.GFile(config_dir) as config_file:
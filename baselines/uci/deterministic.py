@@ -41,6 +41,10 @@ flags.DEFINE_boolean('bootstrap', False,
                      'Sample the training set for bootstrapping.')
 flags.DEFINE_integer('training_steps', 2500, 'Training steps.')
 flags.DEFINE_integer('batch_size', 256, 'Batch size.')
+flags.DEFINE_integer(
+    'eval_batch_size', None,
+    'Batch size of the ensemble evaluation. If None, each split is evaluated '
+    'in a single batch.')
 flags.DEFINE_float('learning_rate', 0.001, 'Learning rate.')
 flags.DEFINE_float('epsilon', 0.,
                    'Epsilon for adversarial training. It is given as a ratio '
@@ -214,9 +218,19 @@ def main(argv):
 
   ensemble_metrics_vals = {
       'train': utils.ensemble_metrics(
-          x_train, y_train, model, ll, weight_files=ensemble_filenames),
+          x_train,
+          y_train,
+          model,
+          ll,
+          weight_files=ensemble_filenames,
+          batch_size=FLAGS.eval_batch_size),
       'test': utils.ensemble_metrics(
-          x_test, y_test, model, ll, weight_files=ensemble_filenames),
+          x_test,
+          y_test,
+          model,
+          ll,
+          weight_files=ensemble_filenames,
+          batch_size=FLAGS.eval_batch_size),
   }
 
   for split, metrics in ensemble_metrics_vals.items():
@@ -19,8 +19,8 @@ import collections
 import os
 import numpy as np
 import pandas as pd
-import scipy
 import tensorflow as tf
+import uncertainty_baselines as ub
 
 
 class DataSpec(collections.namedtuple(
@@ -140,9 +140,14 @@ def ensemble_metrics(x,
                      model,
                      log_likelihood_fn,
                      n_samples=1,
-                     weight_files=None):
+                     weight_files=None,
+                     batch_size=None):
   """Evaluate metrics of an ensemble.
 
+  The predictions are streamed: each Monte Carlo sample takes a single forward
+  pass per batch, and only running sums over the samples are kept, so memory
+  does not grow with the number of samples.
+
   Args:
     x: numpy array of inputs
     y: numpy array of labels
@@ -154,36 +159,44 @@ def ensemble_metrics(x,
     weight_files: to draw samples from multiple weight sets, specify a list of
       weight files to load. These files must have been generated through
       keras's model.save_weights(...).
+    batch_size: number of examples per forward pass. If None, the whole dataset
+      is evaluated at once.
 
   Returns:
     metrics_dict: dictionary containing the metrics
   """
-  if weight_files is None:
-    ensemble_logprobs = [log_likelihood_fn([x, y])[0] for _ in range(n_samples)]
-    ensemble_error = [log_likelihood_fn([x, y])[1] for _ in range(n_samples)]
-  else:
-    ensemble_logprobs = []
-    ensemble_error = []
-    for filename in weight_files:
-      model.load_weights(filename)
-      ensemble_logprobs.extend([
-          log_likelihood_fn([x, y])[0] for _ in range(n_samples)])
-      ensemble_error.extend([
-          log_likelihood_fn([x, y])[1] for _ in range(n_samples)])
+  n = x.shape[0]
+  forward_batch_size = batch_size or n
+  total_samples = 0
+  logprob_sum, logprob_count, squared_error_sum = 0., 0, 0.
+  # Per example logsumexp of the joint log prob and sum of errors over samples.
+  logprob_logsumexp = np.full(n, -np.inf)
+  error_sum = 0.
+  for filename in weight_files or [None]:
+    if filename is not None:
+      ub.utils.load_weights(model, filename)
+    for _ in range(n_samples):
+      errors = []
+      for start in range(0, n, forward_batch_size):
+        batch = slice(start, start + forward_batch_size)
+        logprob, error = log_likelihood_fn([x[batch], y[batch]])
+        logprob, error = np.asarray(logprob), np.asarray(error)
+        logprob_sum += np.sum(logprob)
+        logprob_count += logprob.size
+        squared_error_sum += np.sum(np.square(error))
+        if logprob.ndim > 1:
+          logprob = np.sum(logprob, axis=tuple(range(1, logprob.ndim)))
+        logprob_logsumexp[batch] = np.logaddexp(logprob_logsumexp[batch],
+                                                logprob)
+        errors.append(error)
+      error_sum += np.concatenate(errors)
+      total_samples += 1
 
   results = {}
-  ensemble_logprobs = np.array(ensemble_logprobs)
-  results['log_likelihood'] = np.mean(ensemble_logprobs)
-  results['mse'] = np.mean(np.square(ensemble_error))
-  probabilistic_log_likelihood = np.mean(
-      scipy.special.logsumexp(
-          np.sum(ensemble_logprobs, axis=2)
-          if len(ensemble_logprobs.shape) > 2 else ensemble_logprobs,
-          b=1. / ensemble_logprobs.shape[0],
-          axis=0),
-      axis=0)
-  results['probabilistic_log_likelihood'] = probabilistic_log_likelihood
-  ensemble_error = np.stack([np.array(l) for l in ensemble_error])
+  results['log_likelihood'] = logprob_sum / logprob_count
+  results['mse'] = squared_error_sum / np.size(error_sum) / total_samples
+  results['probabilistic_log_likelihood'] = np.mean(
+      logprob_logsumexp - np.log(total_samples))
   results['probabilistic_mse'] = np.mean(
-      np.square(np.mean(ensemble_error, axis=0)))
+      np.square(error_sum / total_samples))
   return results
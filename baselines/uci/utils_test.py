@@ -0,0 +1,96 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the UCI utilities."""
+
+import os
+
+from absl.testing import parameterized
+import numpy as np
+import scipy
+import tensorflow as tf
+import uncertainty_baselines as ub
+import utils  # local file import from baselines.uci
+
+_NUM_EXAMPLES = 10
+
+
+def _reference_ensemble_metrics(x, y, model, log_likelihood_fn, n_samples,
+                                weight_files):
+  """Evaluates the metrics of an ensemble from the stacked predictions."""
+  ensemble_logprobs = []
+  ensemble_error = []
+  for filename in weight_files:
+    model.load_weights(filename)
+    for _ in range(n_samples):
+      logprob, error = log_likelihood_fn([x, y])
+      ensemble_logprobs.append(logprob)
+      ensemble_error.append(error)
+
+  ensemble_logprobs = np.array(ensemble_logprobs)
+  return {
+      'log_likelihood':
+          np.mean(ensemble_logprobs),
+      'mse':
+          np.mean(np.square(ensemble_error)),
+      'probabilistic_log_likelihood':
+          np.mean(
+              scipy.special.logsumexp(
+                  np.sum(ensemble_logprobs, axis=2),
+                  b=1. / len(ensemble_logprobs),
+                  axis=0)),
+      'probabilistic_mse':
+          np.mean(np.square(np.mean(ensemble_error, axis=0))),
+  }
+
+
+class UtilsTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    ub.utils.clear_weights_cache()
+
+  @parameterized.parameters(None, 3)
+  def test_ensemble_metrics(self, batch_size):
+    rng = np.random.RandomState(0)
+    x = rng.randn(_NUM_EXAMPLES, 4).astype(np.float32)
+    y = rng.randn(_NUM_EXAMPLES, 1).astype(np.float32)
+    model = tf.keras.Sequential([tf.keras.layers.Dense(1)])
+    model.build((None, 4))
+
+    weight_files = []
+    for i in range(2):
+      model.set_weights([3. * w + 1. for w in model.get_weights()])
+      weight_files.append(os.path.join(self.get_temp_dir(), f'member_{i}'))
+      model.save_weights(weight_files[-1])
+
+    def log_likelihood_fn(inputs):
+      features, labels = inputs
+      error = model(features).numpy() - labels
+      logprob = -0.5 * np.square(error) - 0.5 * np.log(2. * np.pi)
+      return logprob, error
+
+    results = utils.ensemble_metrics(
+        x, y, model, log_likelihood_fn, n_samples=2,
+        weight_files=weight_files, batch_size=batch_size)
+    expected = _reference_ensemble_metrics(
+        x, y, model, log_likelihood_fn, n_samples=2, weight_files=weight_files)
+    self.assertCountEqual(results, expected)
+    for name, value in expected.items():
+      self.assertAllClose(results[name], value, msg=name)
+
+
+if __name__ == '__main__':
+  tf.test.main()
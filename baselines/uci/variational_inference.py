@@ -40,6 +40,10 @@ flags.DEFINE_enum('dataset', 'boston_housing',
                   help='Name of the UCI dataset.')
 flags.DEFINE_integer('training_steps', 30000, 'Training steps.')
 flags.DEFINE_integer('batch_size', 256, 'Batch size.')
+flags.DEFINE_integer(
+    'eval_batch_size', None,
+    'Batch size of the ensemble evaluation. If None, each split is evaluated '
+    'in a single batch.')
 flags.DEFINE_float('learning_rate', 0.001, 'Learning rate.')
 flags.DEFINE_float('learning_rate_for_sampling', 0.00001, 'Learning rate.')
 flags.DEFINE_integer('auxiliary_sampling_frequency', 100,
@@ -370,8 +374,10 @@ def main(argv):
          model.output.distribution.loc - labels])
 
     base_metrics = [
-        utils.ensemble_metrics(x_train, y_train, model, ll),
-        utils.ensemble_metrics(x_test, y_test, model, ll),
+        utils.ensemble_metrics(
+            x_train, y_train, model, ll, batch_size=FLAGS.eval_batch_size),
+        utils.ensemble_metrics(
+            x_test, y_test, model, ll, batch_size=FLAGS.eval_batch_size),
     ]
     model_dir = os.path.join(FLAGS.output_dir, 'models')
     tf.io.gfile.makedirs(model_dir)
@@ -386,8 +392,10 @@ def main(argv):
         initial_epoch=train_epochs)
 
     overtrained_metrics = [
-        utils.ensemble_metrics(x_train, y_train, model, ll),
-        utils.ensemble_metrics(x_test, y_test, model, ll),
+        utils.ensemble_metrics(
+            x_train, y_train, model, ll, batch_size=FLAGS.eval_batch_size),
+        utils.ensemble_metrics(
+            x_test, y_test, model, ll, batch_size=FLAGS.eval_batch_size),
     ]
 
     # Perform refined VI.
@@ -437,13 +445,15 @@ def main(argv):
             y_train,
             model,
             ll,
-            weight_files=ensemble_filenames),
+            weight_files=ensemble_filenames,
+            batch_size=FLAGS.eval_batch_size),
         utils.ensemble_metrics(
             x_test,
             y_test,
             model,
             ll,
-            weight_files=ensemble_filenames),
+            weight_files=ensemble_filenames,
+            batch_size=FLAGS.eval_batch_size),
     ]
 
     for metrics, name in [(base_metrics, 'Base model'),
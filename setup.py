@@ -52,8 +52,6 @@ setup(
             'scipy',
         ],
         'datasets': [
-            'librosa',  # Needed for speech_commands dataset
-            'scipy',  # Needed for speech_commands dataset
             'tensorflow_federated',  # Needed for CIFAR subpopulation dataset
             # TODO(dusenberrymw): Add these without causing a dependency
             # resolution issue.
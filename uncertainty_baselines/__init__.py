@@ -22,6 +22,7 @@ from absl import logging
 
 _IMPORTS = [
     'datasets',
+    'ensemble_selection',
     'halton',
     'models',
     'optimizers',
@@ -60,6 +60,7 @@ from uncertainty_baselines.datasets.movielens import MovieLensDataset
 from uncertainty_baselines.datasets.places import Places365Dataset
 from uncertainty_baselines.datasets.random import RandomGaussianImageDataset
 from uncertainty_baselines.datasets.random import RandomRademacherImageDataset
+from uncertainty_baselines.datasets.speech_commands import SpeechCommandsDataset
 from uncertainty_baselines.datasets.svhn import SvhnDataset
 from uncertainty_baselines.datasets.test_utils import DatasetTest
 from uncertainty_baselines.datasets.toxic_comments import CivilCommentsDataset
@@ -75,16 +76,3 @@ except ImportError:
       'Skipped importing the SMCalflow dataset due to ImportError. Try '
       'installing uncertainty baselines with the `datasets` extras.',
       exc_info=True)
-
-try:
-  # Try to import datasets depending on librosa.
-  from uncertainty_baselines.datasets.speech_commands import SpeechCommandsDataset  # pylint: disable=g-import-not-at-top
-except ImportError:
-  logging.warning(
-      'Skipped importing the Speech Commands dataset due to ImportError. Try '
-      'installing uncertainty baselines with the `datasets` extras.',
-      exc_info=True)
-except OSError:
-  logging.warning(
-      'Skipped importing the Speech Commands dataset due to OSError.',
-      exc_info=True)
@@ -25,6 +25,7 @@ import tensorflow.compat.v2 as tf
 import tensorflow_datasets as tfds
 
 from uncertainty_baselines.datasets import base
+from uncertainty_baselines.datasets import diabetic_retinopathy_dataset_utils
 from uncertainty_baselines.datasets.diabetic_retinopathy_dataset_utils import _btgraham_processing
 
 _DESCRIPTION = """\
@@ -260,7 +261,8 @@ class APTOSDataset(base.BaseDataset):
                download_data: bool = False,
                drop_remainder: bool = True,
                decision_threshold: Optional[str] = "moderate",
-               cache: bool = False):
+               cache: bool = False,
+               cache_dir: Optional[str] = None):
     """Create a APTOS 2019 Blindness Detection tf.data.Dataset builder.
 
     Args:
@@ -285,6 +287,8 @@ class APTOSDataset(base.BaseDataset):
         'moderate': classify {0, 1} vs {2, 3, 4}, i.e., moderate DR or worse?
       cache: Whether or not to cache the dataset in memory. Can lead to OOM
         errors in host memory.
+      cache_dir: Optional directory of a persistent on-disk cache of the
+        images resized to 512x512, which is reused across runs.
     """
     print(f"Using APTOS builder config {builder_config}.")
     dataset_builder = tfds.builder(builder_config, data_dir=data_dir)
@@ -296,20 +300,25 @@ class APTOSDataset(base.BaseDataset):
         num_parallel_parser_calls=num_parallel_parser_calls,
         download_data=download_data,
         drop_remainder=drop_remainder,
-        cache=cache)
+        cache=cache,
+        cache_dir=cache_dir)
     self.decision_threshold = decision_threshold
     print(f"Building APTOS OOD dataset with decision threshold: "
           f"{decision_threshold}.")
     if not drop_remainder:
       print("Not dropping the remainder (i.e., not truncating last batch).")
 
+  def _create_cache_process_example_fn(self) -> base.PreProcessFn:
+    return diabetic_retinopathy_dataset_utils.resize_image_for_cache
+
   def _create_process_example_fn(self) -> base.PreProcessFn:
 
     def _example_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
       """Preprocess images to range [0, 1], binarize task based on provided decision threshold, produce example `Dict`."""
       image = example["image"]
       image = tf.image.convert_image_dtype(image, tf.float32)
-      image = tf.image.resize(image, size=(512, 512), method="bilinear")
+      if not self._uses_disk_cache:
+        image = tf.image.resize(image, size=(512, 512), method="bilinear")
 
       if self.decision_threshold == "mild":
         highest_negative_class = 0
@@ -15,8 +15,14 @@
 
 """Abstract base classes which defines interfaces for datasets."""
 
+import hashlib
+import inspect
+import json
 import logging
-from typing import Callable, Dict, Optional, Sequence, Type, TypeVar, Union
+import os
+import re
+from typing import Any, Callable, Dict, Optional, Sequence, Type, TypeVar, Union
+import uuid
 
 from robustness_metrics.common import ops
 from robustness_metrics.common import types
@@ -37,6 +43,11 @@ _EnumeratedPreProcessFn = Callable[
     [int, Union[int, tf.Tensor, Sequence[tf.Tensor], types.Features]],
     types.Features]
 
+# Version of the format of the on-disk preprocessed cache. Bumping it
+# invalidates all the existing caches.
+_DISK_CACHE_VERSION = 1
+_DISK_CACHE_NUM_SHARDS = 32
+
 
 def get_validation_percent_split(
     dataset_builder,
@@ -107,7 +118,10 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
                download_data: bool = False,
                decoders: Optional[Dict[str, tfds.decode.Decoder]] = None,
                cache: bool = False,
-               label_key: str = 'label'):
+               label_key: str = 'label',
+               cache_dir: Optional[str] = None,
+               bucket_by_sequence_length: bool = False,
+               max_tokens_per_batch: Optional[int] = None):
     """Create a tf.data.Dataset builder.
 
     Args:
@@ -147,6 +161,22 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
       cache: Whether or not to cache the dataset after it is returned from
         dataset_builder.as_dataset(...) (before preprocessing is applied).
       label_key: The name of the field holding the label.
+      cache_dir: Optional directory of a persistent on-disk cache of the
+        examples after the deterministic part of the preprocessing (see
+        `_create_cache_process_example_fn`), such as decoding and resizing
+        images. The cache is keyed by the dataset, split and preprocessing
+        configuration, and reused across runs and seeds. Random augmentations
+        are still applied after the cache by `_create_process_example_fn`.
+      bucket_by_sequence_length: Whether or not to batch together examples of
+        similar sequence lengths, for datasets of token sequences (see
+        `_sequence_length_buckets`). Each batch is padded to the length of its
+        bucket instead of the maximum sequence length, so the model sees a
+        bounded number of input shapes.
+      max_tokens_per_batch: Optional token budget of the batches when
+        bucketing by sequence length. If set, the batches of a bucket hold
+        `max_tokens_per_batch // bucket_length` examples instead of
+        `batch_size`. Only supported for evaluation splits, since the number
+        of batches in an epoch then depends on the sequence lengths.
     """
     self.name = name
     self._split = split
@@ -167,6 +197,16 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
     self._download_data = download_data
     self._decoders = decoders
     self._cache = cache
+    self._cache_dir = cache_dir
+    self._bucket_by_sequence_length = bucket_by_sequence_length
+    self._max_tokens_per_batch = max_tokens_per_batch
+
+    if bucket_by_sequence_length and mask_and_pad:
+      raise ValueError(
+          'bucket_by_sequence_length is not supported with mask_and_pad.')
+    if max_tokens_per_batch is not None and not bucket_by_sequence_length:
+      raise ValueError(
+          'max_tokens_per_batch requires bucket_by_sequence_length.')
 
     known_splits = [
         'train', 'validation', 'test', tfds.Split.TRAIN, tfds.Split.VALIDATION,
@@ -181,6 +221,10 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
             'than "train", "validation", "test".'.format(split))
 
     self._is_training = is_training
+    if max_tokens_per_batch is not None and is_training:
+      raise ValueError(
+          'max_tokens_per_batch is not supported for training, since the '
+          'number of batches per epoch would depend on the sequence lengths.')
     # TODO(znado): properly parse the number of train/validation/test examples
     # from the provided split, see `make_file_instructions(...)` in
     # tensorflow_datasets/core/tfrecords_reader.py.
@@ -227,6 +271,111 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
     raise NotImplementedError(
         'Must override dataset _create_process_example_fn!')
 
+  def _create_cache_process_example_fn(self) -> Optional[PreProcessFn]:
+    """Create the deterministic part of the pre-processing, if cacheable.
+
+    When the dataset is loaded with a `cache_dir`, this function is applied to
+    the elements of `dataset_builder.as_dataset()` and its outputs are stored on
+    disk. `_create_process_example_fn` is then applied to the cached elements,
+    and should check `self._uses_disk_cache` to skip the work done here.
+
+    Returns:
+      None if the dataset does not support the on-disk cache. Otherwise, a
+      function which takes as input a single element of the dataset and
+      returns it with deterministically preprocessed, fixed-shape features
+      (e.g. decoded and resized uint8 images).
+    """
+    return None
+
+  def _cache_process_config(self) -> Dict[str, Any]:
+    """Returns the parameters of `_create_cache_process_example_fn`.
+
+    They are part of the key of the on-disk cache, so that changing them
+    invalidates the cache.
+    """
+    return {}
+
+  @property
+  def _uses_disk_cache(self) -> bool:
+    return self._cache_dir is not None
+
+  def _disk_cache_path(self, cache_process_fn: PreProcessFn) -> str:
+    """Returns the directory of the on-disk cache of this dataset and split.
+
+    Args:
+      cache_process_fn: the function returned by
+        `_create_cache_process_example_fn`. Its source code is part of the
+        cache key, with that of `_create_cache_process_example_fn`.
+    """
+    sources = []
+    for fn in (type(self)._create_cache_process_example_fn, cache_process_fn):
+      try:
+        sources.append(inspect.getsource(fn))
+      except (OSError, TypeError):
+        sources.append(getattr(fn, '__qualname__', repr(fn)))
+    source = '\n'.join(sources)
+    key = {
+        'dataset': self._dataset_builder.info.full_name,
+        'name': self.name,
+        'split': str(self._split),
+        'config': self._cache_process_config(),
+        'source': hashlib.sha256(source.encode('utf-8')).hexdigest(),
+        'version': _DISK_CACHE_VERSION,
+    }
+    digest = hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode('utf-8'))
+    dirname = '{}_{}'.format(
+        re.sub(r'[^\w.-]+', '_', self.name), digest.hexdigest()[:16])
+    return os.path.join(self._cache_dir, dirname)
+
+  def _load_disk_cache(self, dataset: tf.data.Dataset) -> tf.data.Dataset:
+    """Returns `dataset` preprocessed and read from the on-disk cache.
+
+    The cache is written first if it does not exist yet.
+
+    Args:
+      dataset: the dataset returned by `dataset_builder.as_dataset()`.
+
+    Returns:
+      The dataset of cached elements.
+    """
+    cache_process_fn = self._create_cache_process_example_fn()  # pylint: disable=assignment-from-none
+    if cache_process_fn is None:
+      raise ValueError(
+          'Dataset {} does not support an on-disk cache.'.format(self.name))
+    # Elements are enumerated to be written to contiguous shards, which keeps
+    # them in their original order when the cache is read.
+    dataset = dataset.map(
+        cache_process_fn,
+        num_parallel_calls=self._num_parallel_parser_calls).enumerate()
+    num_examples = int(dataset.cardinality())
+    shard_size = -(-num_examples // _DISK_CACHE_NUM_SHARDS)
+    if shard_size <= 0:
+      # The number of examples is unknown, write a single shard.
+      shard_size = tf.int64.max
+    path = self._disk_cache_path(cache_process_fn)
+    if not tf.io.gfile.exists(path):
+      logging.info('Writing the preprocessed cache of %s (split %s) to %s.',
+                   self.name, self._split, path)
+      # Write to a temporary directory that is renamed once complete, so an
+      # interrupted write is never read, even by concurrent jobs.
+      tmp_path = '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+      tf.data.experimental.save(
+          dataset,
+          tmp_path,
+          shard_func=lambda index, _: index // shard_size)
+      try:
+        tf.io.gfile.rename(tmp_path, path)
+      except tf.errors.OpError:
+        if not tf.io.gfile.exists(path):
+          raise
+        # Another job wrote the same cache in the meantime.
+        tf.io.gfile.rmtree(tmp_path)
+    logging.info('Reading the preprocessed cache of %s (split %s) from %s.',
+                 self.name, self._split, path)
+    dataset = tf.data.experimental.load(path, element_spec=dataset.element_spec)
+    return dataset.map(lambda _, example: example)
+
   def _create_process_batch_fn(self, batch_size: int) -> Optional[PreProcessFn]:
     """Create a function to perform pre-processing on batches, such as mixup.
 
@@ -241,6 +390,94 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
     """
     return None
 
+  def _sequence_length_buckets(self) -> Optional[Sequence[int]]:
+    """Returns the increasing padded lengths of the sequence length buckets.
+
+    The last one must be the maximum sequence length. None if the dataset does
+    not support bucketing by sequence length.
+    """
+    return None
+
+  def _sequence_feature_keys(self) -> Sequence[str]:
+    """Returns the keys of the padded token features, of shape [..., length].
+
+    Their other dimensions must be static, since the batches pad all the
+    unknown dimensions to the length of their bucket.
+    """
+    return ()
+
+  def _sequence_length(self, example: types.Features) -> tf.Tensor:
+    """Returns the number of non-padding tokens of a preprocessed example."""
+    raise NotImplementedError(
+        'Must override dataset _sequence_length to bucket by sequence length!')
+
+  def bucket_batch_sizes(self, batch_size: int) -> Sequence[int]:
+    """Returns the batch size of each sequence length bucket.
+
+    Args:
+      batch_size: the batch size passed to `load()`.
+
+    Returns:
+      The batch sizes, in the order of `_sequence_length_buckets()`. If not
+      bucketing by sequence length, `[batch_size]`.
+    """
+    if not self._bucket_by_sequence_length:
+      return [batch_size]
+    buckets = self._sequence_length_buckets()
+    if not buckets:
+      raise ValueError(
+          'Dataset {} does not support bucket_by_sequence_length.'.format(
+              self.name))
+    if self._max_tokens_per_batch is None:
+      return [batch_size] * len(buckets)
+    return [max(1, self._max_tokens_per_batch // length) for length in buckets]
+
+  def num_batches(self, num_examples: int, batch_size: int) -> int:
+    """Returns the maximum number of batches of `num_examples` examples.
+
+    Unless `drop_remainder`, the last partial batch is counted, so that a loop
+    over the returned number of batches sees every example whether or not the
+    examples are bucketed by sequence length. When bucketing by sequence
+    length, each bucket may end with a partial batch, and the number of
+    batches depends on the sequence lengths. The returned bound then assumes
+    that all the examples are in the bucket with the smallest batch size.
+
+    Args:
+      num_examples: the number of examples.
+      batch_size: the batch size passed to `load()`.
+    """
+    batch_sizes = self.bucket_batch_sizes(batch_size)
+    if len(batch_sizes) == 1:
+      if self._drop_remainder:
+        return num_examples // batch_size
+      return -(-num_examples // batch_size)
+    return -(-num_examples // min(batch_sizes)) + len(batch_sizes)
+
+  def _batch_by_sequence_length(self, dataset: tf.data.Dataset,
+                                batch_size: int) -> tf.data.Dataset:
+    """Batches the examples in buckets of similar sequence lengths."""
+    buckets = self._sequence_length_buckets()
+    batch_sizes = self.bucket_batch_sizes(batch_size)
+    sequence_keys = self._sequence_feature_keys()
+
+    def _trim_padding(example):
+      length = tf.cast(self._sequence_length(example), tf.int32)
+      example = dict(example)
+      for key in sequence_keys:
+        example[key] = example[key][..., :length]
+      return example
+
+    dataset = dataset.map(
+        _trim_padding, num_parallel_calls=self._num_parallel_parser_calls)
+    # Each batch is padded to `bucket_boundary - 1`, and the last bucket of
+    # `bucket_by_sequence_length` (above the maximum length) is always empty.
+    return dataset.bucket_by_sequence_length(
+        element_length_func=lambda ex: tf.shape(ex[sequence_keys[0]])[-1],
+        bucket_boundaries=[length + 1 for length in buckets],
+        bucket_batch_sizes=batch_sizes + batch_sizes[-1:],
+        pad_to_bucket_boundary=True,
+        drop_remainder=self._drop_remainder)
+
   def _create_element_id(self, features: types.Features) -> types.Features:
     """Hash element id for a unique id per data element (NOT per-step)."""
     if 'element_id' in features:
@@ -291,6 +528,10 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
     dataset = self._dataset_builder.as_dataset(
         split=self._split, decoders=self._decoders)
 
+    # Possibly read the deterministically preprocessed examples from disk.
+    if self._uses_disk_cache:
+      dataset = self._load_disk_cache(dataset)
+
     # Possibly cache the original dataset before preprocessing is applied.
     if self._cache:
       dataset = dataset.cache()
@@ -361,6 +602,8 @@ class BaseDataset(robustness_metrics_base.TFDSDataset):
       padding_dataset = tf.data.Dataset.from_tensor_slices(padding_example)
       dataset = dataset.concatenate(padding_dataset.repeat(batch_size - 1))
       dataset = dataset.batch(batch_size, drop_remainder=True)
+    elif self._bucket_by_sequence_length:
+      dataset = self._batch_by_sequence_length(dataset, batch_size)
     else:
       dataset = dataset.batch(batch_size, drop_remainder=self._drop_remainder)
 
@@ -0,0 +1,115 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the on-disk cache of BaseDataset."""
+
+import os
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+from uncertainty_baselines.datasets import base
+from uncertainty_baselines.datasets import random
+
+
+class _CachedRangeDataset(base.BaseDataset):
+  """Dataset of the offset range integers, preprocessed in the cache."""
+
+  def __init__(self, offset, cache_dir):
+    self._offset = offset
+    super().__init__(
+        name='cached_range',
+        dataset_builder=random._RandomDatasetBuilder(image_shape=()),  # pylint: disable=protected-access
+        split=tfds.Split.TEST,
+        cache_dir=cache_dir)
+
+  def _create_cache_process_example_fn(self):
+
+    def _cache_process(range_val):
+      return {
+          'features': tf.cast(range_val + self._offset, tf.float32),
+          'labels': tf.cast(range_val % 2, tf.int32),
+      }
+
+    return _cache_process
+
+  def _cache_process_config(self):
+    return {'offset': self._offset}
+
+  def _create_process_example_fn(self):
+    cache_process_fn = self._create_cache_process_example_fn()
+
+    def _example_parser(example):
+      if not self._uses_disk_cache:
+        example = cache_process_fn(example)
+      return example
+
+    return _example_parser
+
+
+class BaseDatasetDiskCacheTest(tf.test.TestCase):
+
+  def _load(self, dataset_builder):
+    num_examples = dataset_builder.num_examples
+    element = next(iter(dataset_builder.load(batch_size=num_examples)))
+    return element['features'].numpy(), element['labels'].numpy()
+
+  def _cache_path(self, dataset_builder):
+    return dataset_builder._disk_cache_path(  # pylint: disable=protected-access
+        dataset_builder._create_cache_process_example_fn())  # pylint: disable=protected-access
+
+  def _mock_save(self):
+    return mock.patch.object(
+        base.tf.data.experimental,
+        'save',
+        wraps=base.tf.data.experimental.save)
+
+  def testDiskCache(self):
+    cache_dir = self.get_temp_dir()
+    expected_labels = np.arange(10000) % 2
+
+    # The first load writes the cache.
+    dataset_builder = _CachedRangeDataset(offset=1, cache_dir=cache_dir)
+    features, labels = self._load(dataset_builder)
+    np.testing.assert_array_equal(features, np.arange(10000) + 1)
+    np.testing.assert_array_equal(labels, expected_labels)
+    cache_path = self._cache_path(dataset_builder)
+    self.assertEqual(tf.io.gfile.listdir(cache_dir),
+                     [os.path.basename(cache_path)])
+
+    # A second load with the same configuration reads the existing cache.
+    dataset_builder = _CachedRangeDataset(offset=1, cache_dir=cache_dir)
+    self.assertEqual(self._cache_path(dataset_builder), cache_path)
+    with self._mock_save() as save:
+      features, labels = self._load(dataset_builder)
+    save.assert_not_called()
+    np.testing.assert_array_equal(features, np.arange(10000) + 1)
+    np.testing.assert_array_equal(labels, expected_labels)
+    self.assertLen(tf.io.gfile.listdir(cache_dir), 1)
+
+    # Changing the configuration of the cached preprocessing misses the cache.
+    dataset_builder = _CachedRangeDataset(offset=2, cache_dir=cache_dir)
+    self.assertNotEqual(self._cache_path(dataset_builder), cache_path)
+    with self._mock_save() as save:
+      features, labels = self._load(dataset_builder)
+    save.assert_called_once()
+    np.testing.assert_array_equal(features, np.arange(10000) + 2)
+    np.testing.assert_array_equal(labels, expected_labels)
+    self.assertLen(tf.io.gfile.listdir(cache_dir), 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -86,6 +86,9 @@ _NUM_TOKEN_NAME = 'utterance_num_tokens'
 
 _FEATURE_LENGTH = 32  # Maximum number of tokens per sentence
 
+# Padded lengths of the sequence length buckets.
+_SEQUENCE_LENGTH_BUCKETS = (8, 16, _FEATURE_LENGTH)
+
 
 def _build_dataset(glob_dir: str, is_training: bool) -> tf.data.Dataset:
   cycle_len = 10 if is_training else 1
@@ -266,7 +269,9 @@ class ClincIntentDetectionDataset(base.BaseDataset):
                data_mode: str = 'ind',
                download_data: bool = False,
                data_dir: Optional[str] = None,
-               is_training: Optional[bool] = None):
+               is_training: Optional[bool] = None,
+               bucket_by_sequence_length: bool = False,
+               max_tokens_per_batch: Optional[int] = None):
     """Create a CLINC tf.data.Dataset builder.
 
     Args:
@@ -286,6 +291,10 @@ class ClincIntentDetectionDataset(base.BaseDataset):
       is_training: Whether or not the given `split` is the training split. Only
         required when the passed split is not one of ['train', 'validation',
         'test', tfds.Split.TRAIN, tfds.Split.VALIDATION, tfds.Split.TEST].
+      bucket_by_sequence_length: Whether or not to batch together the
+        utterances of similar numbers of tokens, padded to 8, 16 or 32 tokens.
+      max_tokens_per_batch: Optional token budget of the batches when
+        bucketing by sequence length, see `base.BaseDataset`.
     """
     self.tokenizer = _load_tokenizer(
         tokenizer_dir=os.path.join(data_dir, _FILENAME_TOKENZIER))
@@ -297,7 +306,18 @@ class ClincIntentDetectionDataset(base.BaseDataset):
         is_training=is_training,
         shuffle_buffer_size=shuffle_buffer_size,
         num_parallel_parser_calls=num_parallel_parser_calls,
-        download_data=False)
+        download_data=False,
+        bucket_by_sequence_length=bucket_by_sequence_length,
+        max_tokens_per_batch=max_tokens_per_batch)
+
+  def _sequence_length_buckets(self) -> Tuple[int, ...]:
+    return _SEQUENCE_LENGTH_BUCKETS
+
+  def _sequence_feature_keys(self) -> Tuple[str, ...]:
+    return ('features',)
+
+  def _sequence_length(self, example: Dict[str, tf.Tensor]) -> tf.Tensor:
+    return tf.minimum(example['num_tokens'], _FEATURE_LENGTH)
 
   def _create_process_example_fn(self) -> base.PreProcessFn:
 
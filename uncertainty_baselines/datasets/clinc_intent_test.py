@@ -103,5 +103,34 @@ class ClincIntentDetectionDatasetTest(tf.test.TestCase, parameterized.TestCase):
 
     np.testing.assert_array_equal(num_tokens_loaded, num_tokens_expected)
 
+  @parameterized.named_parameters(('BatchSize', None, [7, 7, 7]),
+                                  ('TokenBudget', 128, [16, 8, 4]))
+  def testBucketBySequenceLength(self, max_tokens_per_batch,
+                                 expected_batch_sizes):
+    """Tests if the batches are padded to the length of their bucket."""
+    dataset_builder = ub.datasets.ClincIntentDetectionDataset(
+        split=tfds.Split.TEST,
+        bucket_by_sequence_length=True,
+        max_tokens_per_batch=max_tokens_per_batch)
+    self.assertEqual(
+        dataset_builder.bucket_batch_sizes(7), expected_batch_sizes)
+
+    dataset = dataset_builder.load(batch_size=7)
+    num_examples = 0
+    for element in dataset:
+      features = element['features'].numpy()
+      num_tokens = element['num_tokens'].numpy()
+      batch_size, length = features.shape
+      bucket = clinc_intent._SEQUENCE_LENGTH_BUCKETS.index(length)
+      num_examples += batch_size
+
+      self.assertLessEqual(batch_size, expected_batch_sizes[bucket])
+      if bucket:
+        self.assertTrue(np.all(
+            num_tokens > clinc_intent._SEQUENCE_LENGTH_BUCKETS[bucket - 1]))
+      np.testing.assert_array_equal(
+          np.sum(features != 0, axis=-1), np.minimum(num_tokens, length))
+    self.assertEqual(num_examples, dataset_builder.num_examples)
+
 if __name__ == '__main__':
   tf.test.main()
@@ -50,6 +50,7 @@ from uncertainty_baselines.datasets.movielens import MovieLensDataset
 from uncertainty_baselines.datasets.places import Places365Dataset
 from uncertainty_baselines.datasets.random import RandomGaussianImageDataset
 from uncertainty_baselines.datasets.random import RandomRademacherImageDataset
+from uncertainty_baselines.datasets.speech_commands import SpeechCommandsDataset
 from uncertainty_baselines.datasets.svhn import SvhnDataset
 from uncertainty_baselines.datasets.toxic_comments import CivilCommentsDataset
 from uncertainty_baselines.datasets.toxic_comments import CivilCommentsIdentitiesDataset
@@ -67,21 +68,6 @@ except ImportError:
   MultiWoZDataset = None
   SMCalflowDataset = None
 
-try:
-  # Try to import datasets depending on librosa.
-  from uncertainty_baselines.datasets.speech_commands import SpeechCommandsDataset  # pylint: disable=g-import-not-at-top
-except ImportError:
-  logging.warning(
-      'Skipped importing the Speech Commands dataset due to ImportError. Try '
-      'installing uncertainty baselines with the `datasets` extras.',
-      exc_info=True)
-  SpeechCommandsDataset = None
-except OSError:
-  logging.warning(
-      'Skipped importing the Speech Commands dataset due to OSError.',
-      exc_info=True)
-  SpeechCommandsDataset = None  # pylint: disable=invalid-name
-
 
 DATASETS = {
     'aptos': APTOSDataset,
@@ -236,6 +236,27 @@ class UBDiabeticRetinopathyDetection(tfds.core.GeneratorBasedBuilder):
             target_pixels=self.builder_config.target_pixels)
 
 
+def resize_image_for_cache(example, image_size=512):
+  """Resizes `example['image']` to a uint8 image of a fixed size.
+
+  This is the deterministic part of the preprocessing of the retinopathy
+  datasets, which can be stored in the on-disk cache of `base.BaseDataset`.
+
+  Args:
+    example: Dict containing a uint8 'image'.
+    image_size: Height and width of the resized image.
+
+  Returns:
+    The example with the resized image.
+  """
+  example = dict(example)
+  image = tf.image.resize(
+      example["image"], size=(image_size, image_size), method="bilinear")
+  example["image"] = tf.cast(
+      tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+  return example
+
+
 def _resize_image_if_necessary(image_fobj, target_pixels=None):
   """Resize an image to have (roughly) the given number of target pixels.
 
@@ -23,6 +23,7 @@ from typing import Dict, Optional
 import tensorflow as tf
 import tensorflow_datasets as tfds
 from uncertainty_baselines.datasets import base
+from uncertainty_baselines.datasets import diabetic_retinopathy_dataset_utils
 
 
 class UBDiabeticRetinopathyDetectionDataset(base.BaseDataset):
@@ -39,7 +40,8 @@ class UBDiabeticRetinopathyDetectionDataset(base.BaseDataset):
       data_dir: Optional[str] = None,
       is_training: Optional[bool] = None,
       decision_threshold: Optional[str] = 'moderate',
-      cache: bool = False):
+      cache: bool = False,
+      cache_dir: Optional[str] = None):
     """Create a Kaggle diabetic retinopathy detection tf.data.Dataset builder.
 
     Args:
@@ -65,6 +67,8 @@ class UBDiabeticRetinopathyDetectionDataset(base.BaseDataset):
         'moderate': classify {0, 1} vs {2, 3, 4}, i.e., moderate DR or worse?
       cache: Whether or not to cache the dataset in memory. Can lead to OOM
         errors in host memory.
+      cache_dir: Optional directory of a persistent on-disk cache of the
+        images resized to 512x512, which is reused across runs.
     """
     if is_training is None:
       is_training = split in ['train', tfds.Split.TRAIN]
@@ -78,13 +82,17 @@ class UBDiabeticRetinopathyDetectionDataset(base.BaseDataset):
         num_parallel_parser_calls=num_parallel_parser_calls,
         download_data=download_data,
         drop_remainder=drop_remainder,
-        cache=cache)
+        cache=cache,
+        cache_dir=cache_dir)
     self.decision_threshold = decision_threshold
     print(f'Building Kaggle DR dataset with decision threshold: '
           f'{decision_threshold}.')
     if not drop_remainder:
       print('Not dropping the remainder (i.e., not truncating last batch).')
 
+  def _create_cache_process_example_fn(self) -> base.PreProcessFn:
+    return diabetic_retinopathy_dataset_utils.resize_image_for_cache
+
   def _create_process_example_fn(self) -> base.PreProcessFn:
 
     def _example_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
@@ -102,7 +110,8 @@ class UBDiabeticRetinopathyDetectionDataset(base.BaseDataset):
       """
       image = example['image']
       image = tf.image.convert_image_dtype(image, tf.float32)
-      image = tf.image.resize(image, size=(512, 512), method='bilinear')
+      if not self._uses_disk_cache:
+        image = tf.image.resize(image, size=(512, 512), method='bilinear')
 
       if self.decision_threshold == 'mild':
         highest_negative_class = 0
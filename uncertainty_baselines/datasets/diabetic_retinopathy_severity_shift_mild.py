@@ -34,6 +34,7 @@ import tensorflow as tf
 import tensorflow.compat.v2 as tf
 import tensorflow_datasets as tfds
 from uncertainty_baselines.datasets import base
+from uncertainty_baselines.datasets import diabetic_retinopathy_dataset_utils
 from uncertainty_baselines.datasets.diabetic_retinopathy_dataset_utils import _btgraham_processing
 from uncertainty_baselines.datasets.diabetic_retinopathy_dataset_utils import _resize_image_if_necessary
 
@@ -75,7 +76,8 @@ class DiabeticRetinopathySeverityShiftMildDataset(base.BaseDataset):
                download_data: bool = False,
                is_training: Optional[bool] = None,
                drop_remainder: bool = True,
-               cache: bool = False):
+               cache: bool = False,
+               cache_dir: Optional[str] = None):
     """Create a Kaggle diabetic retinopathy detection tf.data.Dataset builder.
 
     Args:
@@ -97,6 +99,8 @@ class DiabeticRetinopathySeverityShiftMildDataset(base.BaseDataset):
       drop_remainder: Whether or not to drop the remaining partial batch.
       cache: Whether or not to cache the dataset in memory. Can lead to OOM
         errors in host memory.
+      cache_dir: Optional directory of a persistent on-disk cache of the
+        images resized to 512x512, which is reused across runs.
     """
     if is_training is None:
       is_training = split in ['train', tfds.Split.TRAIN]
@@ -113,7 +117,8 @@ class DiabeticRetinopathySeverityShiftMildDataset(base.BaseDataset):
         num_parallel_parser_calls=num_parallel_parser_calls,
         download_data=download_data,
         drop_remainder=drop_remainder,
-        cache=cache)
+        cache=cache,
+        cache_dir=cache_dir)
     logging.info(
         'Building Diabetic Retinopathy Severity Shift dataset with mild '
         'decision threshold.')
@@ -121,13 +126,17 @@ class DiabeticRetinopathySeverityShiftMildDataset(base.BaseDataset):
       logging.info(
           'Not dropping the remainder (i.e., not truncating last batch).')
 
+  def _create_cache_process_example_fn(self) -> base.PreProcessFn:
+    return diabetic_retinopathy_dataset_utils.resize_image_for_cache
+
   def _create_process_example_fn(self) -> base.PreProcessFn:
 
     def _example_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
       """A pre-process function to return images in [0, 1]."""
       image = example['image']
       image = tf.image.convert_image_dtype(image, tf.float32)
-      image = tf.image.resize(image, size=(512, 512), method='bilinear')
+      if not self._uses_disk_cache:
+        image = tf.image.resize(image, size=(512, 512), method='bilinear')
 
       # We place the decision threshold between 0 and 1 in the 'mild' case
       highest_negative_class = 0
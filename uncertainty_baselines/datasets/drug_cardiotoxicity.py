@@ -70,6 +70,9 @@ _MAX_NODES = 60
 _NODE_FEATURE_LENGTH = 27
 _EDGE_FEATURE_LENGTH = 12
 _NUM_CLASSES = 2
+# The first edge features one-hot encode the bond type, see
+# `uncertainty_baselines.models.mpnn.get_adjacency_matrix`.
+_NUM_EDGE_TYPES = 4
 
 
 def _build_dataset(glob_dir: str, is_training: bool) -> tf.data.Dataset:
@@ -117,6 +120,64 @@ def _get_num_examples_and_filenames() -> Tuple[Dict[str, int], Dict[str, str]]:
   return num_examples, file_names
 
 
+def pack_graph_batch(
+    features: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+  """Packs a batch of padded molecules into a single sparse graph.
+
+  The nodes of all molecules are concatenated without their padding, and the
+  bonds are represented as a list of edges rather than as a dense
+  [max_nodes, max_nodes] tensor, such that message passing only costs the
+  actual number of atoms and bonds of the batch.
+
+  Args:
+    features: Batch of dense features, e.g. 'atoms' with shape [batch_size,
+      max_nodes, num_node_features] and 'pairs' with shape [batch_size,
+      max_nodes, max_nodes, num_edge_features].
+
+  Returns:
+    Dictionary of the packed features:
+      * 'atoms': shape [num_nodes, num_node_features].
+      * 'edge_features': shape [num_edges, num_edge_features].
+      * 'senders', 'receivers': shape [num_edges], the indices of the source
+        and target atoms of every edge.
+      * 'node_graph_ids': shape [num_nodes], the molecule of every atom.
+      * 'num_nodes': shape [batch_size], the number of atoms of every molecule.
+    The molecule level features 'dist2topk_nbs' and 'molecule_id' are kept.
+  """
+  node_mask = features[_NODE_MASK_FEATURE_NAME] > 0
+  # Index of every atom in the packed batch.
+  packed_index = tf.reshape(
+      tf.cumsum(tf.reshape(tf.cast(node_mask, tf.int32), [-1])) - 1,
+      tf.shape(node_mask))
+  node_positions = tf.where(node_mask)  # (num_nodes, 2) of (graph, atom).
+
+  pairs = features[_EDGES_FEATURE_NAME]
+  adjacency = tf.reduce_any(
+      tf.cast(pairs[..., :_NUM_EDGE_TYPES], tf.bool), axis=-1)
+  adjacency &= node_mask[:, :, None] & node_mask[:, None, :]
+  # (num_edges, 3) of (graph, receiver atom, sender atom).
+  edge_positions = tf.where(adjacency)
+
+  packed = {
+      _NODES_FEATURE_NAME:
+          tf.gather_nd(features[_NODES_FEATURE_NAME], node_positions),
+      'edge_features':
+          tf.gather_nd(pairs, edge_positions),
+      'senders':
+          tf.gather_nd(packed_index, tf.gather(edge_positions, [0, 2], axis=1)),
+      'receivers':
+          tf.gather_nd(packed_index, edge_positions[:, :2]),
+      'node_graph_ids':
+          tf.cast(node_positions[:, 0], tf.int32),
+      'num_nodes':
+          tf.reduce_sum(tf.cast(node_mask, tf.int32), axis=1),
+  }
+  for name in (_DISTANCE_TO_TRAIN_NAME, _EXAMPLE_NAME):
+    if name in features:
+      packed[name] = features[name]
+  return packed
+
+
 _CITATION = """
 @ARTICLE{Han2021-tu,
   title         = "Reliable Graph Neural Networks for Drug Discovery Under
@@ -258,7 +319,8 @@ class DrugCardiotoxicityDataset(base.BaseDataset):
                download_data: bool = False,
                data_dir: Optional[str] = None,
                is_training: Optional[bool] = None,
-               drop_remainder: bool = False):
+               drop_remainder: bool = False,
+               graph_format: str = 'dense'):
     """Create a tf.data.Dataset builder.
 
     Args:
@@ -279,7 +341,16 @@ class DrugCardiotoxicityDataset(base.BaseDataset):
       drop_remainder: whether or not to drop the last batch of data if the
         number of points is not exactly equal to the batch size. This option
         needs to be True for running on TPUs.
+      graph_format: Either 'dense', for molecules padded to the same number of
+        atoms, or 'sparse', for batches of molecules packed into a single
+        graph with a list of edges by `pack_graph_batch`. Sparse batches have
+        a varying number of atoms and bonds, so they are not supported on
+        TPUs.
     """
+    if graph_format not in ('dense', 'sparse'):
+      raise ValueError(
+          f'graph_format must be "dense" or "sparse", received {graph_format}.')
+    self._graph_format = graph_format
     if data_dir is None:
       builder = tfds.builder('cardiotox')
       data_dir = builder.data_dir
@@ -306,3 +377,15 @@ class DrugCardiotoxicityDataset(base.BaseDataset):
       return {'features': features, 'labels': labels}
 
     return _example_parser
+
+  def _create_process_batch_fn(
+      self, batch_size: int) -> Optional[base.PreProcessFn]:
+    if self._graph_format == 'dense':
+      return None
+
+    def _pack_batch(batch: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+      batch = dict(batch)
+      batch['features'] = pack_graph_batch(batch['features'])
+      return batch
+
+    return _pack_batch
@@ -19,6 +19,7 @@ from absl.testing import parameterized
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import uncertainty_baselines as ub
+from uncertainty_baselines.datasets import drug_cardiotoxicity
 
 
 class DrugCardiotoxicityDatasetTest(tf.test.TestCase, parameterized.TestCase):
@@ -63,6 +64,33 @@ class DrugCardiotoxicityDatasetTest(tf.test.TestCase, parameterized.TestCase):
     self.assertEqual(molecule_id.shape, (batch_size,))
     self.assertEqual(labels.shape, (batch_size, 2))
 
+  def testPackGraphBatch(self):
+    # Two molecules of 2 and 3 atoms, padded to 4 atoms.
+    atom_mask = tf.constant([[1., 1., 0., 0.], [1., 1., 1., 0.]])
+    atoms = tf.reshape(tf.range(2 * 4 * 3, dtype=tf.float32), (2, 4, 3))
+    bonds = tf.constant([
+        [[0., 1., 0., 0.], [1., 0., 0., 0.], [0., 0., 0., 0.],
+         [0., 0., 0., 0.]],
+        [[0., 0., 1., 0.], [0., 0., 1., 0.], [1., 1., 0., 0.],
+         [0., 0., 0., 0.]],
+    ])
+    pairs = tf.stack([bonds, tf.zeros_like(bonds), 2. * bonds], axis=-1)
+    packed = drug_cardiotoxicity.pack_graph_batch({
+        'atoms': atoms,
+        'pairs': pairs,
+        'atom_mask': atom_mask,
+        'molecule_id': tf.constant(['a', 'b']),
+    })
+
+    self.assertAllEqual(packed['atoms'],
+                        tf.gather_nd(atoms, tf.where(atom_mask > 0)))
+    self.assertAllEqual(packed['num_nodes'], [2, 3])
+    self.assertAllEqual(packed['node_graph_ids'], [0, 0, 1, 1, 1])
+    self.assertAllEqual(packed['receivers'], [0, 1, 2, 3, 4, 4])
+    self.assertAllEqual(packed['senders'], [1, 0, 4, 4, 2, 3])
+    self.assertAllEqual(packed['edge_features'], [[1., 0., 2.]] * 6)
+    self.assertAllEqual(packed['molecule_id'], [b'a', b'b'])
+
 
 if __name__ == '__main__':
   tf.test.main()
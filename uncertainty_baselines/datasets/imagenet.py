@@ -72,7 +72,9 @@ class _ImageNetDataset(base.BaseDataset):
                one_hot: bool = False,
                mixup_params: Optional[Dict[str, Any]] = None,
                run_mixup: bool = False,
-               include_file_name: bool = False):
+               include_file_name: bool = False,
+               cache_dir: Optional[str] = None,
+               cache_image_size: Optional[int] = None):
     """Create an ImageNet tf.data.Dataset builder.
 
     Args:
@@ -118,6 +120,12 @@ class _ImageNetDataset(base.BaseDataset):
       include_file_name: Whether or not to include a string file_name field in
         each example. Since this field is a string, it is not compatible with
         TPUs.
+      cache_dir: Optional directory of a persistent on-disk cache of the
+        decoded images, resized and center-cropped to `cache_image_size`. The
+        random crops and flips of the training preprocessing are then taken
+        from the cached images. Only supported with 'resnet' preprocessing.
+      cache_image_size: The size of the cached images in pixels. Defaults to
+        `image_size` plus the crop padding of the resnet preprocessing.
     """
     dataset_builder = tfds.builder(name, try_gcs=try_gcs, data_dir=data_dir)
     if is_training is None:
@@ -144,7 +152,15 @@ class _ImageNetDataset(base.BaseDataset):
         mask_and_pad=mask_and_pad,
         fingerprint_key='file_name',
         download_data=download_data,
-        decoders=decoders)
+        decoders=decoders,
+        cache_dir=cache_dir)
+    if cache_dir is not None and preprocessing_type != 'resnet':
+      raise ValueError(
+          'The on-disk cache is only supported with "resnet" preprocessing, '
+          'received {}.'.format(preprocessing_type))
+    if cache_image_size is None:
+      cache_image_size = image_size + resnet_preprocessing.CROP_PADDING
+    self._cache_image_size = cache_image_size
     self._preprocessing_type = preprocessing_type
     self._use_bfloat16 = use_bfloat16
     self._normalize_input = normalize_input
@@ -159,6 +175,37 @@ class _ImageNetDataset(base.BaseDataset):
     self._mixup_params = mixup_params
     self._include_file_name = include_file_name
 
+  def _create_cache_process_example_fn(self) -> base.PreProcessFn:
+    """Create a function to decode and center-crop images for the cache."""
+
+    def _cache_example_parser(
+        example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+      """Resizes the shorter side of the image and crops its center."""
+      example = dict(example)
+      image = example['image']
+      if image.dtype == tf.string:
+        image = tf.io.decode_jpeg(image, channels=3)
+      shape = tf.cast(tf.shape(image)[:2], tf.float32)
+      scale = self._cache_image_size / tf.reduce_min(shape)
+      resized_shape = tf.maximum(
+          tf.cast(tf.round(shape * scale), tf.int32), self._cache_image_size)
+      image = tf.image.resize(
+          image, resized_shape,
+          method=self._resnet_preprocessing_resize_method or 'bicubic')
+      image = tf.image.resize_with_crop_or_pad(
+          image, self._cache_image_size, self._cache_image_size)
+      example['image'] = tf.cast(
+          tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+      return example
+
+    return _cache_example_parser
+
+  def _cache_process_config(self) -> Dict[str, Any]:
+    return {
+        'cache_image_size': self._cache_image_size,
+        'resize_method': self._resnet_preprocessing_resize_method,
+    }
+
   def _create_process_example_fn(self) -> base.PreProcessFn:
     """Create a pre-process function to return images in [0, 1]."""
 
@@ -24,11 +24,9 @@ Reference:
   Recognition" https://arxiv.org/abs/1804.03209
 """
 
-from typing import Callable, Dict, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
-import librosa
 import numpy as np
-from scipy import signal
 import tensorflow.compat.v2 as tf
 import tensorflow_datasets as tfds
 
@@ -45,6 +43,11 @@ SEMANTIC_SHIFT = 'semantic_shift'
 IN_DISTRIBUTION_MAX_LABEL = 10
 SEMANTIC_SHFIT_LABEL = 11
 
+# Frame length and step of the phase vocoder used for pitch shifting, the
+# defaults of `librosa.effects.pitch_shift()`.
+STFT_FRAME_LENGTH = 2048
+STFT_FRAME_STEP = 512
+
 
 def mix_white_noise(audio, noise_level_db):
   _, variance = tf.nn.moments(audio, axes=[0])
@@ -55,58 +58,202 @@ def mix_white_noise(audio, noise_level_db):
   return audio + noise
 
 
+def _phase_vocoder(stft, rate):
+  """Time-stretches a [num_frames, num_bins] STFT by a factor of `rate`."""
+  num_frames = tf.shape(stft)[0]
+  num_bins = tf.shape(stft)[1]
+  time_steps = tf.range(0., tf.cast(num_frames, tf.float32), rate)
+  # Expected phase advance of each frequency bin between two frames.
+  phase_advance = tf.linspace(0., np.pi * STFT_FRAME_STEP, num_bins)
+
+  # Interpolates the magnitudes between the two frames around each time step.
+  stft = tf.pad(stft, [[0, 2], [0, 0]])
+  frames = tf.cast(tf.floor(time_steps), tf.int32)
+  left_columns = tf.gather(stft, frames)
+  right_columns = tf.gather(stft, frames + 1)
+  alpha = (time_steps - tf.floor(time_steps))[:, tf.newaxis]
+  magnitude = (1. - alpha) * tf.abs(left_columns) + alpha * tf.abs(
+      right_columns)
+
+  # Accumulates the phase advances, wrapped to [-pi, pi) around the expected
+  # one, starting from the phase of the first frame.
+  phase_delta = (
+      tf.math.angle(right_columns) - tf.math.angle(left_columns) -
+      phase_advance)
+  phase_delta -= 2. * np.pi * tf.round(phase_delta / (2. * np.pi))
+  phase_step = tf.math.floormod(phase_advance + phase_delta, 2. * np.pi)
+  phase = tf.math.angle(stft[0]) + tf.math.cumsum(
+      phase_step, axis=0, exclusive=True)
+  return tf.complex(magnitude * tf.cos(phase), magnitude * tf.sin(phase))
+
+
+def _resample(audio, num_samples):
+  """Resamples `audio` to `num_samples` samples in the frequency domain."""
+  audio_length = tf.shape(audio)[0]
+  # `irfft` crops or zero-pads the spectrum to `num_samples // 2 + 1` bins.
+  resampled = tf.signal.irfft(tf.signal.rfft(audio), [num_samples])
+  return resampled * tf.cast(num_samples / audio_length, tf.float32)
+
+
 def pitch_shift(audio, semitones):
+  """Shifts the pitch of audio by the given number of semitones.
+
+  As `librosa.effects.pitch_shift()`, the audio is time-stretched with a phase
+  vocoder and resampled back to its original length.
 
-  def librosa_pitch_shift(x, semitones):
-    return librosa.effects.pitch_shift(
-        x.numpy(), SAMPLE_RATE_HZ, n_steps=semitones)
+  Args:
+    audio: A float32 tensor of shape [audio_length].
+    semitones: The amount of the pitch shift, can be negative or positive.
 
-  return tf.py_function(
-      func=librosa_pitch_shift, inp=[audio, semitones], Tout=tf.float32)
+  Returns:
+    The pitch shifted audio, with the same shape as `audio`.
+  """
+  rate = tf.pow(2., -tf.cast(semitones, tf.float32) / 12.)
+  audio_length = tf.shape(audio)[0]
+  stretched_length = tf.cast(
+      tf.round(tf.cast(audio_length, tf.float32) / rate), tf.int32)
+  # Centers the frames on multiples of the frame step.
+  padding = STFT_FRAME_LENGTH // 2
+  stft = tf.signal.stft(
+      tf.pad(audio, [[padding, padding]], mode='REFLECT'),
+      frame_length=STFT_FRAME_LENGTH,
+      frame_step=STFT_FRAME_STEP)
+  stretched = tf.signal.inverse_stft(
+      _phase_vocoder(stft, rate),
+      frame_length=STFT_FRAME_LENGTH,
+      frame_step=STFT_FRAME_STEP,
+      window_fn=tf.signal.inverse_stft_window_fn(STFT_FRAME_STEP))
+  stretched = stretched[padding:padding + stretched_length]
+  return _resample(stretched, audio_length)
 
 
 IIR_FILTER_ORDER = 8
-# Speech-commands dataset has a fixed sample rate of 16 kHz. So the Nyquist
-# frequency is 8 kHz.
-b_4khz, a_4khz = signal.butter(IIR_FILTER_ORDER, 0.5)
-b_2khz, a_2khz = signal.butter(IIR_FILTER_ORDER, 0.25)
-b_1khz, a_1khz = signal.butter(IIR_FILTER_ORDER, 0.125)
 
 
-def low_pass_filter(audio, cutoff_frequency_khz):
-  """Perform low-pass filtering at given cutoff frequency."""
-
-  def scipy_filt(x, cutoff_frequency_khz):
-    if cutoff_frequency_khz == 4:
-      b, a = b_4khz, a_4khz
-    elif cutoff_frequency_khz == 2:
-      b, a = b_2khz, a_2khz
-    elif cutoff_frequency_khz == 1:
-      b, a = b_1khz, a_1khz
-    else:
-      raise ValueError(
-          'Unsupported cutoff frequency (kHz): %s (Supported values: 1, 2, 4)' %
-          cutoff_frequency_khz)
-    return signal.filtfilt(b, a, x)
+def _butterworth_low_pass(order, cutoff):
+  """Returns the coefficients of a digital Butterworth low-pass filter.
 
-  return tf.py_function(
-      func=scipy_filt, inp=[audio, cutoff_frequency_khz], Tout=tf.float32)
+  As `scipy.signal.butter(order, cutoff)`, the analog prototype is mapped to
+  the digital domain with the bilinear transform.
 
+  Args:
+    order: The order of the filter.
+    cutoff: The cutoff frequency, normalized by the Nyquist frequency.
 
-def add_room_reverb(audio, room_size):
-  """Add simulated room reverberation to audio."""
+  Returns:
+    The numerator and denominator coefficients of the filter.
+  """
+  warped = 4. * np.tan(np.pi * cutoff / 2.)
+  poles = -np.exp(
+      1j * np.pi * np.arange(1 - order, order, 2) / (2 * order)) * warped
+  denominator = np.real(np.poly((4. + poles) / (4. - poles)))
+  numerator = np.poly(-np.ones(order))
+  # Normalizes the gain at zero frequency to 1.
+  return numerator * np.sum(denominator) / np.sum(numerator), denominator
 
-  def pra_add_room_reverb(x, room_size):
-    if room_size == 6:
-      return signal.convolve(x, rir_6m)[:len(x)]
-    elif room_size == 12:
-      return signal.convolve(x, rir_12m)[:len(x)]
-    else:
-      raise ValueError(
-          'Unsupported room size (m): %s (Supported value: 6, 12)' % room_size)
 
-  return tf.py_function(
-      func=pra_add_room_reverb, inp=[audio, room_size], Tout=tf.float32)
+def _steady_state(numerator, denominator):
+  """Returns the steady state of a filter for a unit step input.
+
+  As `scipy.signal.lfilter_zi()`, in the transposed direct form II state of
+  `scipy.signal.lfilter()`.
+  """
+  size = len(denominator) - 1
+  companion = np.zeros((size, size))
+  companion[0] = -denominator[1:] / denominator[0]
+  companion[1:, :-1] = np.eye(size - 1)
+  return np.linalg.solve(
+      np.eye(size) - companion.T,
+      numerator[1:] - denominator[1:] * numerator[0])
+
+
+def low_pass_filter(audio, cutoff_frequency_khz):
+  """Perform low-pass filtering at given cutoff frequency.
+
+  As `scipy.signal.filtfilt()`, the audio is extended at both ends by an odd
+  reflection and filtered forwards and backwards with a Butterworth filter of
+  order `IIR_FILTER_ORDER`, starting each pass from the steady state of its
+  first sample. Each pass is applied in the frequency domain, as the ratio of
+  the spectra of the filter coefficients.
+
+  Args:
+    audio: A float32 tensor of shape [audio_length].
+    cutoff_frequency_khz: The cutoff frequency, in kHz. The speech commands
+      dataset has a fixed sample rate of 16 kHz, so it must be below the
+      Nyquist frequency of 8 kHz.
+
+  Returns:
+    The filtered audio, with the same shape as `audio`.
+  """
+  nyquist_frequency_khz = SAMPLE_RATE_HZ / 2000
+  if not 0 < cutoff_frequency_khz < nyquist_frequency_khz:
+    raise ValueError(
+        'Unsupported cutoff frequency (kHz): %s (Supported values: between 0 '
+        'and %s)' % (cutoff_frequency_khz, nyquist_frequency_khz))
+  numerator, denominator = _butterworth_low_pass(
+      IIR_FILTER_ORDER, cutoff_frequency_khz / nyquist_frequency_khz)
+  steady_state = _steady_state(numerator, denominator)
+  # The recursive filter is unstable in single precision at low cutoffs.
+  audio = tf.cast(audio, tf.float64)
+  audio_length = tf.shape(audio)[0]
+  padding = 3 * len(denominator)
+  extended_audio = tf.concat([
+      2. * audio[0] - tf.reverse(audio[1:padding + 1], [0]),
+      audio,
+      2. * audio[-1] - tf.reverse(audio[-padding - 1:-1], [0]),
+  ], 0)
+  extended_length = audio_length + 2 * padding
+  # Zero-pads the audio so that the filter does not wrap around.
+  fft_length = 2 * extended_length
+  numerator_spectrum = tf.signal.rfft(
+      tf.constant(numerator, tf.float64), [fft_length])
+  denominator_spectrum = tf.signal.rfft(
+      tf.constant(denominator, tf.float64), [fft_length])
+  steady_state_spectrum = tf.signal.rfft(
+      tf.constant(steady_state, tf.float64), [fft_length])
+
+  def _filter(x):
+    # The initial state adds its zero-input response to the filtered audio.
+    spectrum = (
+        tf.signal.rfft(x, [fft_length]) * numerator_spectrum +
+        tf.cast(x[0], tf.complex128) * steady_state_spectrum)
+    return tf.signal.irfft(spectrum / denominator_spectrum,
+                           [fft_length])[:extended_length]
+
+  filtered = tf.reverse(_filter(tf.reverse(_filter(extended_audio), [0])), [0])
+  return tf.cast(filtered[padding:padding + audio_length], tf.float32)
+
+
+def _fft_convolve(audio, impulse_response):
+  """Returns the first samples of a convolution computed with FFTs."""
+  audio_length = tf.shape(audio)[0]
+  fft_length = audio_length + tf.shape(impulse_response)[0] - 1
+  spectrum = (
+      tf.signal.rfft(audio, [fft_length]) *
+      tf.signal.rfft(impulse_response, [fft_length]))
+  return tf.signal.irfft(spectrum, [fft_length])[:audio_length]
+
+
+def add_room_reverb(audio, room_size):
+  """Add simulated room reverberation to audio."""
+  if room_size == 6:
+    room_impulse_response = rir_6m
+  elif room_size == 12:
+    room_impulse_response = rir_12m
+  else:
+    raise ValueError(
+        'Unsupported room size (m): %s (Supported value: 6, 12)' % room_size)
+  return _fft_convolve(
+      audio, tf.constant(room_impulse_response, dtype=tf.float32))
+
+
+# Shifts which do not depend on the random state, and can thus be applied
+# before the on-disk cache.
+_DETERMINISTIC_SHIFTS = {
+    PITCH_SHIFT: pitch_shift,
+    LOW_PASS: low_pass_filter,
+    ROOM_REVERB: add_room_reverb,
+}
 
 
 class _SpeechCommandsDatasetBuilder(tfds.core.DatasetBuilder):
@@ -185,11 +332,11 @@ class SpeechCommandsDataset(base.BaseDataset):
       to the level of the original audio.
     - split=('pitch_shift', semitones): spectral (pitch) shift, the amount of
       which is specified by `semitones`, which can be a negative or positive
-      float number. This is based on `librosa.effects.pitch_shift()`.
+      float number. This follows `librosa.effects.pitch_shift()`.
     - split=('low_pass', cutoff_khz): performing low-pass filtering on the
       audio, with the cutoff frequency (in kHz) being `cutoff_khz`. The audio
-      has a fixed sample rate of 16 kHz. The supported values of the
-      `cutoff_khz` are: 4, 2, and 1.
+      has a fixed sample rate of 16 kHz. The benchmark uses the values of
+      `cutoff_khz`: 4, 2, and 1.
     - split=('room_reverb', room_size): simulating room reverberation through
       convolution with a room impulse response inside a "shoebox" room of
       `room_size` meters in size. The supported values of `room_size` are:
@@ -198,6 +345,11 @@ class SpeechCommandsDataset(base.BaseDataset):
   2. Semantic shift, with novel labels (words), not seen in the train
      and validation splits. This can be invoked with
      split=('semantic_shift',) during `build()` calls.
+
+  The perturbations are TensorFlow ops, and run in parallel over
+  `num_parallel_parser_calls` threads. With a `cache_dir`, the pitch shift,
+  low-pass and room reverb splits are computed once, the first time they are
+  loaded, and then read back from disk.
   """
 
   AUDIO_LENGTH = 16000
@@ -211,7 +363,8 @@ class SpeechCommandsDataset(base.BaseDataset):
       try_gcs: bool = False,
       download_data: bool = False,
       data_dir: Optional[str] = None,
-      is_training: Optional[bool] = None):
+      is_training: Optional[bool] = None,
+      cache_dir: Optional[str] = None):
     """Create a Speech commands tf.data.Dataset builder.
 
     Args:
@@ -231,6 +384,10 @@ class SpeechCommandsDataset(base.BaseDataset):
       is_training: Whether or not the given `split` is the training split. Only
         required when the passed split is not one of ['train', 'validation',
         'test', tfds.Split.TRAIN, tfds.Split.VALIDATION, tfds.Split.TEST].
+      cache_dir: Optional directory of a persistent on-disk cache of the audio,
+        padded or cropped to `AUDIO_LENGTH` and with the deterministic
+        perturbations of the shift splits applied. The white noise is still
+        sampled for each example after the cache.
     """
     name = 'speech_commands'
     tfds_dataset_builder = tfds.builder(
@@ -257,11 +414,12 @@ class SpeechCommandsDataset(base.BaseDataset):
         is_training=is_training,
         shuffle_buffer_size=shuffle_buffer_size,
         num_parallel_parser_calls=num_parallel_parser_calls,
-        download_data=download_data)
+        download_data=download_data,
+        cache_dir=cache_dir)
 
-  def _create_process_example_fn(self) -> base.PreProcessFn:
+  def _create_cache_process_example_fn(self) -> base.PreProcessFn:
 
-    def _example_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+    def _cache_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
       audio = tf.cast(example['audio'], dtype=tf.float32)
       audio_length = tf.size(audio)
       if audio_length < self.AUDIO_LENGTH:
@@ -272,27 +430,37 @@ class SpeechCommandsDataset(base.BaseDataset):
                           axis=-1)
       elif audio_length > self.AUDIO_LENGTH:
         audio = tf.slice(audio, [0], [self.AUDIO_LENGTH])
+      audio = tf.ensure_shape(audio, [self.AUDIO_LENGTH])
 
       if isinstance(self._original_split, tuple):
         split_name = self._original_split[0]
-        if split_name == WHITE_NOISE:
-          noise_level_db = float(self._original_split[1])
-          audio = mix_white_noise(audio, noise_level_db)
-        elif split_name == PITCH_SHIFT:
-          semitones = float(self._original_split[1])
-          audio = pitch_shift(audio, semitones)
-        elif split_name == LOW_PASS:
-          cutoff_frequency_khz = float(self._original_split[1])
-          audio = low_pass_filter(audio, cutoff_frequency_khz)
-        elif split_name == ROOM_REVERB:
-          room_size = float(self._original_split[1])
-          audio = add_room_reverb(audio, room_size)
-        elif split_name == SEMANTIC_SHIFT:
-          pass
-        else:
+        if split_name in _DETERMINISTIC_SHIFTS:
+          audio = _DETERMINISTIC_SHIFTS[split_name](
+              audio, float(self._original_split[1]))
+        elif split_name not in (WHITE_NOISE, SEMANTIC_SHIFT):
           raise ValueError(
               'Unrecognized shift split: {}'.format(self._original_split[0]))
 
+      return {'audio': audio, 'label': example['label']}
+
+    return _cache_parser
+
+  def _cache_process_config(self) -> Dict[str, Any]:
+    # All the shift splits read the test split.
+    return {'original_split': self._original_split}
+
+  def _create_process_example_fn(self) -> base.PreProcessFn:
+    cache_parser = self._create_cache_process_example_fn()
+
+    def _example_parser(example: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+      if not self._uses_disk_cache:
+        example = cache_parser(example)
+      audio = example['audio']
+      if (isinstance(self._original_split, tuple) and
+          self._original_split[0] == WHITE_NOISE):
+        noise_level_db = float(self._original_split[1])
+        audio = mix_white_noise(audio, noise_level_db)
+
       label = tf.cast(example['label'], tf.int32)
       parsed_example = {
           'features': audio,
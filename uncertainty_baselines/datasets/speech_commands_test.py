@@ -17,20 +17,21 @@
 
 from absl.testing import parameterized
 import numpy as np
+from scipy import signal
 import tensorflow.compat.v2 as tf
 import tensorflow_datasets as tfds
 import uncertainty_baselines as ub
+from uncertainty_baselines.datasets import speech_commands
 
 
 class SpeechCommandsDatasetTest(tf.test.TestCase, parameterized.TestCase):
 
-  # Deleting the following because it was causing test failures:
-  #    ('RoomReverb12M', ('room_reverb', 12))
-  #    ('LowPassFiltering4kHz', ('low_pass', 4))
   @parameterized.named_parameters(
       ('Train', tfds.Split.TRAIN), ('Validation', tfds.Split.VALIDATION),
       ('Test', tfds.Split.TEST), ('WhiteNoiseNegative5DB', ('white_noise', -5)),
-      ('PitchShift4Semitones', ('pitch_shift', 4)))
+      ('PitchShift4Semitones', ('pitch_shift', 4)),
+      ('RoomReverb12M', ('room_reverb', 12)),
+      ('LowPassFiltering4kHz', ('low_pass', 4)))
   def testSpeechCommandsDataset(self, split):
     batch_size = 35
     dataset_builder = ub.datasets.SpeechCommandsDataset(
@@ -82,6 +83,38 @@ class SpeechCommandsDatasetTest(tf.test.TestCase, parameterized.TestCase):
                                 r'Unrecognized shift split: nonsensical_split'):
       dataset_builder.load(batch_size=7)
 
+  @parameterized.parameters(0.5, 1, 2, 4, 7.5)
+  def testLowPassFilterMatchesFiltfilt(self, cutoff_frequency_khz):
+    audio = np.random.RandomState(0).randn(4000).astype(np.float32)
+    b, a = signal.butter(speech_commands.IIR_FILTER_ORDER,
+                         cutoff_frequency_khz / 8.)
+    expected = signal.filtfilt(b, a, audio)
+    filtered = speech_commands.low_pass_filter(audio, cutoff_frequency_khz)
+    self.assertAllClose(filtered, expected, atol=1e-5)
+
+  @parameterized.parameters(6, 12)
+  def testRoomReverbMatchesConvolution(self, room_size):
+    audio = np.random.RandomState(0).randn(4000).astype(np.float32)
+    room_impulse_response = {
+        6: speech_commands.rir_6m,
+        12: speech_commands.rir_12m,
+    }[room_size]
+    expected = signal.convolve(audio, room_impulse_response)[:4000]
+    reverberated = speech_commands.add_room_reverb(audio, room_size)
+    self.assertAllClose(reverberated, expected, atol=1e-4)
+
+  @parameterized.parameters(-4., 4.)
+  def testPitchShiftScalesFrequency(self, semitones):
+    sample_rate = speech_commands.SAMPLE_RATE_HZ
+    time = np.arange(sample_rate) / sample_rate
+    audio = np.sin(2 * np.pi * 440. * time).astype(np.float32)
+    shifted = speech_commands.pitch_shift(audio, semitones)
+    self.assertEqual(shifted.shape, audio.shape)
+    # Excludes the edges, where the frames of the phase vocoder are padded.
+    spectrum = np.abs(np.fft.rfft(shifted[2000:-2000]))
+    frequency = np.argmax(spectrum) * sample_rate / (sample_rate - 4000)
+    self.assertAllClose(frequency, 440. * 2**(semitones / 12), atol=2.)
+
 
 if __name__ == '__main__':
   tf.test.main()
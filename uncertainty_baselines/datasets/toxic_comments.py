@@ -50,6 +50,12 @@ _CSV_NAME_PATTERNS = {name: name + '*.csv' for name in DATA_SPLIT_NAMES}
 
 _DATASET_TYPES = ['tfrecord', 'csv', 'tfds']
 
+# Padded lengths of the sequence length buckets shorter than `max_seq_length`.
+# Most comments are much shorter than the default maximum of 512 tokens.
+_SEQUENCE_LENGTH_BUCKETS = (32, 64, 128, 256)
+
+_BERT_FEATURE_NAMES = ('input_ids', 'input_mask', 'segment_ids')
+
 NUM_EXAMPLES_JSON = 'num_examples.json'
 
 BIAS_EXAMPLE_IDS_JSON = 'bias_ids.json'
@@ -235,7 +241,9 @@ class _JigsawToxicityDataset(base.BaseDataset):
                data_dir: Optional[str] = None,
                dataset_type: str = 'tfrecord',
                is_training: Optional[bool] = None,
-               tf_hub_preprocessor_url: Optional[str] = None):  # pytype: disable=annotation-type-mismatch
+               tf_hub_preprocessor_url: Optional[str] = None,
+               bucket_by_sequence_length: bool = False,
+               max_tokens_per_batch: Optional[int] = None):  # pytype: disable=annotation-type-mismatch
     """Create a tf.data.Dataset builder.
 
     Args:
@@ -273,6 +281,12 @@ class _JigsawToxicityDataset(base.BaseDataset):
       tf_hub_preprocessor_url: The TF Hub url to the BERT tokenizer. If given,
         then the raw text from TFDS will be augmented with the BERT-compatible
         `input_mask`, `input_ids`, and `segment_ids`.
+      bucket_by_sequence_length: Whether or not to batch together the examples
+        of similar numbers of BERT tokens, padded to 32, 64, 128, 256 or
+        `max_seq_length` tokens. Requires BERT features, i.e. `dataset_type`
+        'tfrecord' or a `tf_hub_preprocessor_url`.
+      max_tokens_per_batch: Optional token budget of the batches when
+        bucketing by sequence length, see `base.BaseDataset`.
     """
     dataset_type = dataset_type.lower()
     if dataset_type not in _DATASET_TYPES:
@@ -281,6 +295,11 @@ class _JigsawToxicityDataset(base.BaseDataset):
       )
     if dataset_type != 'tfds' and data_dir is None:
       raise ValueError('`data_dir` cannot be None if `dataset_type`!="tfds".')
+    if (bucket_by_sequence_length and dataset_type != 'tfrecord' and
+        not tf_hub_preprocessor_url):
+      raise ValueError(
+          'bucket_by_sequence_length requires BERT features, from '
+          '`dataset_type`="tfrecord" or a `tf_hub_preprocessor_url`.')
 
     dataset_builder = _JigsawToxicityDatasetBuilder(
         tfds.builder(name, try_gcs=try_gcs), max_seq_length, data_dir,
@@ -289,6 +308,7 @@ class _JigsawToxicityDataset(base.BaseDataset):
     self.additional_labels = additional_labels
     self.multi_task_labels = multi_task_labels
     self.multi_task_label_threshold = multi_task_label_threshold
+    self.max_seq_length = max_seq_length
 
     self.feature_spec = _make_features_spec(max_seq_length, additional_labels)
     self.split_names = DATA_SPLIT_NAMES
@@ -338,7 +358,20 @@ class _JigsawToxicityDataset(base.BaseDataset):
         num_parallel_parser_calls=num_parallel_parser_calls,
         drop_remainder=drop_remainder,
         download_data=download_data,
-        label_key='toxicity')
+        label_key='toxicity',
+        bucket_by_sequence_length=bucket_by_sequence_length,
+        max_tokens_per_batch=max_tokens_per_batch)
+
+  def _sequence_length_buckets(self) -> Tuple[int, ...]:
+    return tuple(length for length in _SEQUENCE_LENGTH_BUCKETS
+                 if length < self.max_seq_length) + (self.max_seq_length,)
+
+  def _sequence_feature_keys(self) -> Tuple[str, ...]:
+    return _BERT_FEATURE_NAMES
+
+  def _sequence_length(self, example: Dict[str, tf.Tensor]) -> tf.Tensor:
+    # The input mask is zero on the padding, at the end of the sequence.
+    return tf.reduce_max(tf.reduce_sum(example['input_mask'], axis=-1))
 
   def _create_process_example_fn(self) -> base.PreProcessFn:
     """Create a pre-process function to return labels and sentence tokens."""
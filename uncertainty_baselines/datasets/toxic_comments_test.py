@@ -15,8 +15,11 @@
 
 """Tests for toxicity classification datasets."""
 
+import os
+
 from absl.testing import parameterized
 
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
@@ -29,6 +32,29 @@ CCIdentitiesDataClass = toxic_comments.CivilCommentsIdentitiesDataset
 WTDataClass = toxic_comments.WikipediaToxicityDataset
 
 
+def _write_bert_tfrecords(data_dir, split, sequence_lengths, max_seq_length):
+  """Writes examples with BERT features of the given sequence lengths."""
+  path = os.path.join(data_dir, f'{split}_0.tfrecord')
+  with tf.io.TFRecordWriter(path) as writer:
+    for i, length in enumerate(sequence_lengths):
+      input_mask = [1] * length + [0] * (max_seq_length - length)
+      input_ids = [token_id * mask for token_id, mask in
+                   enumerate(input_mask, start=1)]
+      int_feature = lambda values: tf.train.Feature(  # pylint: disable=g-long-lambda
+          int64_list=tf.train.Int64List(value=values))
+      example = tf.train.Example(features=tf.train.Features(feature={
+          'id': int_feature([i]),
+          'input_ids': int_feature(input_ids),
+          'input_mask': int_feature(input_mask),
+          'segment_ids': int_feature([0] * max_seq_length),
+          'features': tf.train.Feature(
+              bytes_list=tf.train.BytesList(value=[b'comment'])),
+          'labels': tf.train.Feature(
+              float_list=tf.train.FloatList(value=[0.5])),
+      }))
+      writer.write(example.SerializeToString())
+
+
 class ToxicCommentsDatasetTest(tf.test.TestCase, parameterized.TestCase):
 
   @parameterized.named_parameters(
@@ -102,6 +128,73 @@ class ToxicCommentsDatasetTest(tf.test.TestCase, parameterized.TestCase):
       self.assertEqual(element[subtype_name].shape[0], batch_size)
       self.assertEqual(element[subtype_name].dtype, tf.float32)
 
+  def testBucketBySequenceLength(self):
+    """Tests if the batches are padded to the length of their bucket."""
+    max_seq_length = 300
+    # The last two examples are longer than the largest bucket below
+    # `max_seq_length`, and are padded to `max_seq_length`.
+    sequence_lengths = [10, 32, 33, 40, 100, 200, 257, 300]
+    data_dir = self.create_tempdir().full_path
+    _write_bert_tfrecords(data_dir, 'test', sequence_lengths, max_seq_length)
+    dataset_builder = CCDataClass(
+        split=tfds.Split.TEST,
+        dataset_type='tfrecord',
+        data_dir=data_dir,
+        max_seq_length=max_seq_length,
+        bucket_by_sequence_length=True,
+        max_tokens_per_batch=1200)
+    buckets = (32, 64, 128, 256, max_seq_length)
+    self.assertEqual(dataset_builder.bucket_batch_sizes(5), [37, 18, 9, 4, 4])
+
+    loaded_lengths = []
+    for element in dataset_builder.load(batch_size=5):
+      input_ids = element['input_ids'].numpy()
+      input_mask = element['input_mask'].numpy()
+      length = input_ids.shape[1]
+      self.assertIn(length, buckets)
+      self.assertEqual(input_mask.shape, input_ids.shape)
+      self.assertEqual(element['segment_ids'].shape, input_ids.shape)
+      # The sequence length is the number of ones in the input mask, and the
+      # examples are in the smallest bucket that fits them.
+      batch_lengths = input_mask.sum(axis=-1)
+      bucket = buckets.index(length)
+      self.assertTrue(np.all(batch_lengths <= length))
+      if bucket:
+        self.assertTrue(np.all(batch_lengths > buckets[bucket - 1]))
+      np.testing.assert_array_equal(np.sum(input_ids != 0, axis=-1),
+                                    batch_lengths)
+      loaded_lengths.extend(batch_lengths)
+    self.assertCountEqual(loaded_lengths, sequence_lengths)
+
+  @parameterized.named_parameters(('FixedShape', False),
+                                  ('BucketBySequenceLength', True))
+  def testNumBatchesCoverAllExamples(self, bucket_by_sequence_length):
+    """Tests if both batching modes evaluate the same examples."""
+    sequence_lengths = [10, 20, 40, 50, 60, 100, 120, 128]
+    data_dir = self.create_tempdir().full_path
+    _write_bert_tfrecords(data_dir, 'test', sequence_lengths, 128)
+    dataset_builder = CCDataClass(
+        split=tfds.Split.TEST,
+        dataset_type='tfrecord',
+        data_dir=data_dir,
+        max_seq_length=128,
+        bucket_by_sequence_length=bucket_by_sequence_length)
+    num_batches = dataset_builder.num_batches(len(sequence_lengths), 3)
+
+    loaded_ids = []
+    for element in dataset_builder.load(batch_size=3).take(num_batches):
+      loaded_ids.extend(element['id'].numpy())
+    self.assertCountEqual(loaded_ids, range(len(sequence_lengths)))
+
+  def testTokenBudgetNotSupportedForTraining(self):
+    with self.assertRaisesRegex(ValueError, 'not supported for training'):
+      CCDataClass(
+          split=tfds.Split.TRAIN,
+          dataset_type='tfrecord',
+          data_dir=self.create_tempdir().full_path,
+          bucket_by_sequence_length=True,
+          max_tokens_per_batch=1200)
+
 
 if __name__ == '__main__':
   tf.test.main()
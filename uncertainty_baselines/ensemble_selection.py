@@ -0,0 +1,218 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Greedy ensemble selection from a pool of candidate members.
+
+Implements the forward selection of Caruana et al. (2004) [1] from the
+validation predictions of a pool of candidates, e.g. the models of a
+hyperparameter sweep. Rather than rebuilding the ensemble for every candidate
+at every step, `GreedyEnsembleSelector` keeps running sums over the current
+members and scores all the candidates at once, so a greedy step costs
+O(K * N * C) for K candidates, N examples and C classes, independently of the
+size of the ensemble.
+
+#### References
+[1]: Rich Caruana, Alexandru Niculescu-Mizil, Geoff Crew and Alex Ksikes.
+     Ensemble selection from libraries of models. In _International Conference
+     on Machine Learning_, 2004.
+     https://www.cs.cornell.edu/~alexn/papers/shotgun.icml04.revised.rev2.pdf
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+from absl import logging
+import numpy as np
+import scipy.special
+
+_OBJECTIVES = {
+    'nll': lambda acc, nll: nll,
+    'acc': lambda acc, nll: -acc,
+    'nll-acc': lambda acc, nll: nll - acc,
+}
+
+
+def _get_array_module(backend):
+  if backend == 'numpy':
+    return np
+  elif backend == 'jax':
+    import jax.numpy as jnp  # pylint: disable=g-import-not-at-top
+    return jnp
+  raise ValueError(
+      'Unknown backend (received {}), expected "numpy" or "jax".'.format(
+          backend))
+
+
+class GreedyEnsembleSelector:
+  """Incrementally grows an ensemble by scoring all candidates at once.
+
+  The candidate predictions are stored once as a preallocated array of
+  probabilities of shape [K, N, C] and of log-probabilities of the labels of
+  shape [K, N]. The selector keeps the sum of the probabilities of the current
+  members and the logsumexp of their label log-probabilities, from which the
+  accuracy and negative log-likelihood of the ensemble extended by any
+  candidate follow directly.
+  """
+
+  def __init__(self,
+               logits,
+               labels,
+               chunk_size: Optional[int] = None,
+               backend: str = 'numpy'):
+    """Initializes the selector.
+
+    Args:
+      logits: Sequence of K arrays of shape [N, C], or a single array of shape
+        [K, N, C], with the validation logits of the candidates.
+      labels: Integer array of shape [N] with the validation labels.
+      chunk_size: Number of candidates scored together when computing the
+        accuracies, which needs a temporary array of shape [chunk_size, N, C].
+        If None, all candidates are scored together.
+      backend: Either 'numpy' or 'jax', the array library used for scoring.
+    """
+    self._xp = _get_array_module(backend)
+    labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+    num_candidates = len(logits)
+    num_examples = labels.shape[0]
+    num_classes = np.shape(logits[0])[-1]
+    probs = np.empty((num_candidates, num_examples, num_classes), np.float32)
+    label_log_probs = np.empty((num_candidates, num_examples), np.float64)
+    for k in range(num_candidates):
+      log_probs = scipy.special.log_softmax(
+          np.asarray(logits[k], dtype=np.float64), axis=-1)
+      label_log_probs[k] = log_probs[np.arange(num_examples), labels]
+      probs[k] = np.exp(log_probs)
+
+    xp = self._xp
+    self._labels = xp.asarray(labels)
+    self._probs = xp.asarray(probs)
+    self._label_log_probs = xp.asarray(label_log_probs)
+    self._prob_sum = xp.zeros((num_examples, num_classes),
+                              self._label_log_probs.dtype)
+    self._label_logsumexp = xp.full((num_examples,), -np.inf,
+                                    self._label_log_probs.dtype)
+    self._chunk_size = chunk_size or num_candidates
+    self._members = []
+
+  @property
+  def num_candidates(self) -> int:
+    return self._probs.shape[0]
+
+  @property
+  def members(self) -> List[int]:
+    """Selected candidates, in order of selection and with repetitions."""
+    return list(self._members)
+
+  def candidate_metrics(self) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the metrics of the current ensemble extended by each candidate.
+
+    Returns:
+      Tuple of arrays of shape [K]: the accuracies and the negative
+      log-likelihoods of the ensembles with one more member.
+    """
+    xp = self._xp
+    log_size = np.log(len(self._members) + 1)
+    nll = -xp.mean(
+        xp.logaddexp(self._label_logsumexp[None], self._label_log_probs) -
+        log_size,
+        axis=1)
+    # The argmax of the summed probabilities is that of the ensemble average.
+    acc = []
+    for start in range(0, self.num_candidates, self._chunk_size):
+      chunk = self._probs[start:start + self._chunk_size]
+      predictions = xp.argmax(self._prob_sum[None] + chunk, axis=-1)
+      acc.append(xp.mean(predictions == self._labels[None], axis=1))
+    acc = xp.concatenate(acc)
+    return np.asarray(acc, np.float64), np.asarray(nll, np.float64)
+
+  def metrics(self) -> Tuple[float, float]:
+    """Returns the accuracy and negative log-likelihood of the ensemble."""
+    if not self._members:
+      raise ValueError('The ensemble is empty.')
+    xp = self._xp
+    acc = xp.mean(xp.argmax(self._prob_sum, axis=-1) == self._labels)
+    nll = -xp.mean(self._label_logsumexp - np.log(len(self._members)))
+    return float(acc), float(nll)
+
+  def add(self, member: int):
+    """Adds candidate `member` to the ensemble."""
+    xp = self._xp
+    self._prob_sum = self._prob_sum + self._probs[member]
+    self._label_logsumexp = xp.logaddexp(self._label_logsumexp,
+                                         self._label_log_probs[member])
+    self._members.append(member)
+
+
+def greedy_selection(
+    logits,
+    labels,
+    max_ensemble_size: int,
+    objective: str = 'nll',
+    replacement: bool = True,
+    chunk_size: Optional[int] = None,
+    backend: str = 'numpy',
+    initial_members: Sequence[int] = ()) -> Tuple[List[int], float, float]:
+  """Greedy procedure from Caruana et al. 2004.
+
+  At every step, the candidate that most improves the objective on the
+  validation set is added to the ensemble. The selection stops once the
+  ensemble has `max_ensemble_size` unique members or no candidate improves
+  the objective.
+
+  Args:
+    logits: Sequence of K arrays of shape [N, C], or a single array of shape
+      [K, N, C], with the validation logits of the candidates.
+    labels: Integer array of shape [N] with the validation labels.
+    max_ensemble_size: Maximum number of unique members.
+    objective: Objective minimized by the selection: the negative
+      log-likelihood 'nll', the error 'acc' or their combination 'nll-acc'.
+    replacement: Whether a candidate can be selected several times, in which
+      case it is weighted by its number of occurrences in the ensemble.
+    chunk_size: Number of candidates scored together, see
+      `GreedyEnsembleSelector`.
+    backend: Either 'numpy' or 'jax'.
+    initial_members: Candidates the ensemble is initialized with.
+
+  Returns:
+    Tuple with the list of selected candidates (with repetitions), and the
+    validation accuracy and negative log-likelihood of the ensemble.
+  """
+  if objective not in _OBJECTIVES:
+    raise ValueError('Unknown objective type (received {}).'.format(objective))
+  get_objective = _OBJECTIVES[objective]
+
+  selector = GreedyEnsembleSelector(
+      logits, labels, chunk_size=chunk_size, backend=backend)
+  for member in initial_members:
+    selector.add(member)
+
+  best_acc, best_nll, best_objective = 0., np.inf, np.inf
+  if initial_members:
+    best_acc, best_nll = selector.metrics()
+    best_objective = get_objective(best_acc, best_nll)
+
+  while len(set(selector.members)) < max_ensemble_size:
+    acc, nll = selector.candidate_metrics()
+    objectives = get_objective(acc, nll)
+    objectives[np.isnan(objectives)] = np.inf
+    if not replacement:
+      objectives[selector.members] = np.inf
+    best_member = int(np.argmin(objectives))
+    if not objectives[best_member] < best_objective:
+      logging.info('Ensemble could not be improved: Greedy selection stops.')
+      break
+    best_acc, best_nll = float(acc[best_member]), float(nll[best_member])
+    best_objective = objectives[best_member]
+    selector.add(best_member)
+  return selector.members, best_acc, best_nll
@@ -0,0 +1,81 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for ensemble_selection."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import scipy.special
+from uncertainty_baselines import ensemble_selection
+
+
+def _ensemble_metrics(logits, labels, members):
+  probs = np.mean(scipy.special.softmax(logits[members], axis=-1), axis=0)
+  acc = np.mean(np.argmax(probs, axis=-1) == labels)
+  nll = -np.mean(np.log(probs[np.arange(len(labels)), labels]))
+  return acc, nll
+
+
+class EnsembleSelectionTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    rng = np.random.RandomState(0)
+    self.logits = 3. * rng.randn(12, 50, 5)
+    self.labels = rng.randint(5, size=50)
+
+  @parameterized.parameters(('numpy', None), ('numpy', 5), ('jax', 5))
+  def test_candidate_metrics(self, backend, chunk_size):
+    selector = ensemble_selection.GreedyEnsembleSelector(
+        list(self.logits), self.labels, chunk_size=chunk_size, backend=backend)
+    for member in (3, 7, 3):
+      selector.add(member)
+    acc, nll = selector.candidate_metrics()
+    for k in range(len(self.logits)):
+      expected_acc, expected_nll = _ensemble_metrics(
+          self.logits, self.labels, selector.members + [k])
+      self.assertAlmostEqual(acc[k], expected_acc)
+      self.assertAlmostEqual(nll[k], expected_nll, places=5)
+    expected_acc, expected_nll = _ensemble_metrics(self.logits, self.labels,
+                                                   selector.members)
+    self.assertAlmostEqual(selector.metrics()[0], expected_acc)
+    self.assertAlmostEqual(selector.metrics()[1], expected_nll, places=5)
+
+  @parameterized.parameters(True, False)
+  def test_greedy_selection(self, replacement):
+    members, acc, nll = ensemble_selection.greedy_selection(
+        self.logits, self.labels, max_ensemble_size=4, objective='nll',
+        replacement=replacement)
+    if not replacement:
+      self.assertLen(set(members), len(members))
+    # Every step adds the candidate with the lowest NLL.
+    for i, member in enumerate(members):
+      nlls = [
+          _ensemble_metrics(self.logits, self.labels, members[:i] + [k])[1]
+          for k in range(len(self.logits))
+          if replacement or k not in members[:i]
+      ]
+      self.assertAlmostEqual(
+          _ensemble_metrics(self.logits, self.labels, members[:i + 1])[1],
+          min(nlls), places=5)
+    expected_acc, expected_nll = _ensemble_metrics(self.logits, self.labels,
+                                                   members)
+    self.assertAlmostEqual(acc, expected_acc)
+    self.assertAlmostEqual(nll, expected_nll, places=5)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -19,11 +19,14 @@ Based off the algorithms described in https://arxiv.org/abs/1706.03200.
 """
 
 import collections
+import collections.abc
 import functools
 import itertools
 import math
 
-from typing import Any, Callable, Dict, List, Sequence, Text, Tuple, Union
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Sequence,
+                    Text, Tuple, Union)
+import numpy as np
 from numpy import random
 
 
@@ -48,24 +51,21 @@ def _is_prime(n: int):
   return all(n % i != 0 for i in range(2, int(n ** 0.5) + 1)) and n != 2
 
 
-def _generate_dim(num_samples: int,
-                  base: int,
-                  per_dim_shift: bool,
-                  shuffled_seed_sequence: List[int]):
-  """Generate `num_samples` from a Van der Corput sequence with base `base`.
+def _dim_parameters(base: int,
+                    per_dim_shift: bool,
+                    shuffled_seed_sequence: Optional[Sequence[int]]):
+  """Returns the digit permutation and shift of a Van der Corput dimension.
 
   Args:
-    num_samples: int, the number of samples to generate.
     base: int, the base for the Van der Corput sequence. Must be prime.
-    per_dim_shift: boolean, if true then each dim in the sequence is shifted by
-      a random float (and then passed through fmod(n, 1.0) to keep in the range
-      [0, 1)).
+    per_dim_shift: boolean, if true then a random shift in [0, 1) is drawn for
+      the dimension.
     shuffled_seed_sequence: an optional list of length `base`, used as the input
       sequence to generate samples. Useful for deterministic testing.
 
   Returns:
-    A shuffled Van der Corput sequence of length `num_samples`, and optionally a
-    shift added to each dimension.
+    A tuple of the int64 array of length `base` that permutes the digits, and
+    the shift of the dimension (None if `per_dim_shift` is false).
 
   Raises:
     ValueError: if `base` is negative or not prime.
@@ -86,40 +86,65 @@ def _generate_dim(num_samples: int,
   # Optionally generate a random float in the range [0, 1) to shift this
   # dimension by.
   dim_shift = rng.random_sample() if per_dim_shift else None
+  return np.asarray(shuffled_seed_sequence, dtype=np.int64), dim_shift
 
-  dim_sequence = []
-  for i in range(1, num_samples + 1):
-    num = 0.
-    denominator = base
-    while i:
-      num += shuffled_seed_sequence[i % base] / denominator
-      denominator *= base
-      i //= base
-    if per_dim_shift:
-      num = math.fmod(num + dim_shift, 1.0)
-    dim_sequence.append(num)
-  return dim_sequence
+
+def _van_der_corput(indices: np.ndarray,
+                    base: int,
+                    digit_permutation: np.ndarray,
+                    dim_shift: Optional[float]) -> np.ndarray:
+  """Computes the (scrambled) Van der Corput points of `indices` at once.
+
+  The base-`base` digits of all indices are expanded together, least
+  significant first, so each point is summed in the same order as a scalar
+  digit expansion.
+
+  Args:
+    indices: int64 array of positive indices in the sequence.
+    base: int, the base for the Van der Corput sequence.
+    digit_permutation: int64 array of length `base` that permutes the digits.
+    dim_shift: optional float added to every point, modulo 1.
+
+  Returns:
+    A float64 array with the same shape as `indices`.
+  """
+  points = np.zeros(indices.shape, dtype=np.float64)
+  remainders = indices.copy()
+  denominator = base
+  while np.any(remainders):
+    points += digit_permutation[remainders % base] / denominator
+    denominator *= base
+    remainders //= base
+  if dim_shift is not None:
+    points = np.fmod(points + dim_shift, 1.0)
+  return points
 
 
 Matrix = List[List[int]]
 
 
-def generate_sequence(num_samples: int,
-                      num_dims: int,
-                      skip: int = 100,
-                      per_dim_shift: bool = True,
-                      shuffle_sequence: bool = True,
-                      primes: Sequence[int] = None,
-                      shuffled_seed_sequence: Matrix = None) -> Matrix:
-  """Generate `num_samples` from a Halton sequence of dimension `num_dims`.
+def generate_sequence_chunks(
+    num_samples: int,
+    num_dims: int,
+    chunk_size: int,
+    skip: int = 100,
+    per_dim_shift: bool = True,
+    shuffle_sequence: bool = True,
+    primes: Sequence[int] = None,
+    shuffled_seed_sequence: Matrix = None) -> Iterator[np.ndarray]:
+  """Generate a Halton sequence of dimension `num_dims` in chunks.
 
   Each dimension is generated independently from a shuffled Van der Corput
   sequence with a different base prime, and an optional shift added. The
-  generated points are, by default, shuffled before returning.
+  generated points are, by default, shuffled. Points are computed for a whole
+  chunk at once, and only one chunk is held in memory at a time, which allows
+  streaming large sweeps. Concatenating the chunks gives the same points, in
+  the same order, as `generate_sequence_array`.
 
   Args:
     num_samples: int, the number of samples to generate.
     num_dims: int, the number of dimensions per generated sample.
+    chunk_size: positive int, the number of samples per chunk.
     skip: non-negative int, if positive then a sequence is generated and the
       first `skip` samples are discarded in order to avoid unwanted
       correlations.
@@ -136,12 +161,12 @@ def generate_sequence(num_samples: int,
       to the Van der Corput sequence for each dimension. Useful for
       deterministic testing.
 
-  Returns:
-    A shuffled Halton sequence of length `num_samples`, where each sample has
-    `num_dims` dimensions, and optionally a shift added to each dimension.
+  Yields:
+    float64 arrays of shape [chunk_size, num_dims] (the last chunk may be
+    smaller), with values in [0, 1).
 
   Raises:
-    ValueError: if `skip` is negative.
+    ValueError: if `skip` is negative or `chunk_size` is not positive.
     ValueError: if `primes` is provided and not of length `num_dims`.
     ValueError: if `shuffled_seed_sequence` is provided and not of length
       `num_dims`.
@@ -150,6 +175,9 @@ def generate_sequence(num_samples: int,
   """
   if skip < 0:
     raise ValueError('Skip must be non-negative, received: {}.'.format(skip))
+  if chunk_size <= 0:
+    raise ValueError(
+        'Chunk size must be positive, received: {}.'.format(chunk_size))
 
   if primes is not None and len(primes) != num_dims:
     raise ValueError(
@@ -180,31 +208,189 @@ def generate_sequence(num_samples: int,
       prime_attempts += 1
     primes = primes[-num_dims-1:-1]
 
-  # Skip the first `skip` points in the sequence because they can have unwanted
-  # correlations.
-  num_samples += skip
-
-  halton_sequence = []
+  dim_parameters = []
   for d in range(num_dims):
     if shuffled_seed_sequence is None:
       dim_shuffled_seed_sequence = None
     else:
       dim_shuffled_seed_sequence = shuffled_seed_sequence[d]
-    dim_sequence = _generate_dim(
-        num_samples=num_samples,
-        base=primes[d],
-        shuffled_seed_sequence=dim_shuffled_seed_sequence,
-        per_dim_shift=per_dim_shift)
-    dim_sequence = dim_sequence[skip:]
-    halton_sequence.append(dim_sequence)
-
-  # Transpose the 2-D list to be shape [num_samples, num_dims].
-  halton_sequence = list(zip(*halton_sequence))
-
-  # Shuffle the sequence.
+    dim_parameters.append(
+        _dim_parameters(primes[d], per_dim_shift, dim_shuffled_seed_sequence))
+
+  # Skip the first `skip` points in the sequence because they can have unwanted
+  # correlations. Sequence indices start at 1.
   if shuffle_sequence:
-    random.shuffle(halton_sequence)
-  return halton_sequence
+    # Same permutation as shuffling the [num_samples, num_dims] sequence.
+    indices = random.permutation(num_samples) + skip + 1
+  else:
+    indices = np.arange(skip + 1, num_samples + skip + 1, dtype=np.int64)
+
+  for start in range(0, num_samples, chunk_size):
+    chunk_indices = indices[start:start + chunk_size]
+    chunk = np.empty((len(chunk_indices), num_dims), dtype=np.float64)
+    for d, (digit_permutation, dim_shift) in enumerate(dim_parameters):
+      chunk[:, d] = _van_der_corput(
+          chunk_indices, primes[d], digit_permutation, dim_shift)
+    yield chunk
+
+
+def generate_sequence_array(num_samples: int,
+                            num_dims: int,
+                            **kwargs) -> np.ndarray:
+  """Generate `num_samples` from a Halton sequence of dimension `num_dims`.
+
+  Args:
+    num_samples: int, the number of samples to generate.
+    num_dims: int, the number of dimensions per generated sample.
+    **kwargs: additional arguments of `generate_sequence_chunks`.
+
+  Returns:
+    A float64 array of shape [num_samples, num_dims], see `generate_sequence`.
+  """
+  chunks = list(
+      generate_sequence_chunks(
+          num_samples, num_dims, chunk_size=max(num_samples, 1), **kwargs))
+  if not chunks:
+    return np.empty((0, num_dims), dtype=np.float64)
+  return chunks[0]
+
+
+def generate_sequence(num_samples: int,
+                      num_dims: int,
+                      skip: int = 100,
+                      per_dim_shift: bool = True,
+                      shuffle_sequence: bool = True,
+                      primes: Sequence[int] = None,
+                      shuffled_seed_sequence: Matrix = None) -> Matrix:
+  """Generate `num_samples` from a Halton sequence of dimension `num_dims`.
+
+  Each dimension is generated independently from a shuffled Van der Corput
+  sequence with a different base prime, and an optional shift added. The
+  generated points are, by default, shuffled before returning. See
+  `generate_sequence_array` for the same points as a NumPy array.
+
+  Args:
+    num_samples: int, the number of samples to generate.
+    num_dims: int, the number of dimensions per generated sample.
+    skip: non-negative int, if positive then a sequence is generated and the
+      first `skip` samples are discarded in order to avoid unwanted
+      correlations.
+    per_dim_shift: boolean, if true then each dim in the sequence is shifted by
+      a random float (and then passed through fmod(n, 1.0) to keep in the range
+      [0, 1)).
+    shuffle_sequence: boolean, if true then shuffle the sequence before
+      returning.
+    primes: an optional sequence (of length `num_dims`) of prime numbers to use
+      as the base for the Van der Corput sequence for each dimension. Useful for
+      deterministic testing.
+    shuffled_seed_sequence: an optional list of length `num_dims`, with each
+      element being a sequence of length `primes[d]`, used as the input sequence
+      to the Van der Corput sequence for each dimension. Useful for
+      deterministic testing.
+
+  Returns:
+    A shuffled Halton sequence of length `num_samples`, where each sample has
+    `num_dims` dimensions, and optionally a shift added to each dimension.
+
+  Raises:
+    ValueError: if `skip` is negative.
+    ValueError: if `primes` is provided and not of length `num_dims`.
+    ValueError: if `shuffled_seed_sequence` is provided and not of length
+      `num_dims`.
+    ValueError: if `shuffled_seed_sequence[d]` is provided and not of length
+      `primes[d]` for any d in range(num_dims).
+  """
+  halton_sequence = generate_sequence_array(
+      num_samples,
+      num_dims,
+      skip=skip,
+      per_dim_shift=per_dim_shift,
+      shuffle_sequence=shuffle_sequence,
+      primes=primes,
+      shuffled_seed_sequence=shuffled_seed_sequence)
+  return list(map(tuple, halton_sequence.tolist()))
+
+
+def _object_column(values: Sequence[Any]) -> np.ndarray:
+  """Returns `values` as a 1-D object array, without unpacking sequences."""
+  column = np.empty(len(values), dtype=object)
+  for i, value in enumerate(values):
+    column[i] = value
+  return column
+
+
+class Sweep(collections.abc.Sequence):
+  """A hyperparameter sweep stored as one column of values per hyperparameter.
+
+  Combinators such as `zipit` and `product` operate on the columns, and the
+  points are only materialized as dictionaries when indexed or iterated over,
+  e.g. chunk by chunk with `chunks`.
+  """
+
+  def __init__(self,
+               columns: Dict[Text, np.ndarray],
+               length: Optional[int] = None):
+    """Creates a sweep from its columns.
+
+    Args:
+      columns: dictionary of hyperparameter names to arrays of values, all of
+        the same length.
+      length: the number of points, only needed if there are no columns, in
+        which case each point is an empty dictionary. Defaults to 0 then.
+    """
+    lengths = {len(column) for column in columns.values()}
+    if length is not None and columns:
+      lengths.add(length)
+    if len(lengths) > 1:
+      raise ValueError(
+          'All the columns of a sweep must have the same length, received '
+          '{} and length={}.'.format(
+              {name: len(c) for name, c in columns.items()}, length))
+    self.columns = columns
+    self._length = lengths.pop() if lengths else (length or 0)
+
+  def __len__(self) -> int:
+    return self._length
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return Sweep({name: c[index] for name, c in self.columns.items()},
+                   length=len(range(self._length)[index]))
+    index = range(self._length)[index]
+    return self.to_dicts(index, index + 1)[0]
+
+  def __iter__(self) -> Iterator[Dict[Text, Any]]:
+    for chunk in self.chunks():
+      yield from chunk
+
+  def to_dicts(self, start: int = 0,
+               stop: Optional[int] = None) -> _SweepSequence:
+    """Materializes the points in [start, stop) as dictionaries."""
+    names = list(self.columns)
+    if not names:
+      return [{} for _ in range(self._length)[start:stop]]
+    values = [self.columns[name][start:stop].tolist() for name in names]
+    return [dict(zip(names, point)) for point in zip(*values)]
+
+  def chunks(self, chunk_size: int = 1024) -> Iterator[_SweepSequence]:
+    """Yields the points as lists of at most `chunk_size` dictionaries."""
+    for start in range(0, self._length, chunk_size):
+      yield self.to_dicts(start, start + chunk_size)
+
+
+def _as_sweep(sweep_or_list: Union[Sweep, _SweepSequence]) -> Optional[Sweep]:
+  """Returns a list of dictionaries as a `Sweep`, if they share their keys."""
+  if isinstance(sweep_or_list, Sweep):
+    return sweep_or_list
+  if not sweep_or_list:
+    return Sweep({})
+  names = list(sweep_or_list[0])
+  if any(list(point) != names for point in sweep_or_list):
+    return None
+  return Sweep({
+      name: _object_column([point[name] for point in sweep_or_list])
+      for name in names
+  }, length=len(sweep_or_list))
 
 
 def _generate_double_point(
@@ -212,8 +398,8 @@ def _generate_double_point(
     min_val: float,
     max_val: float,
     scaling: Text,
-    halton_point: float) -> float:
-  """Generate a float hyperparameter value from a Halton sequence point."""
+    halton_point: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+  """Generate float hyperparameter values from Halton sequence points."""
   if scaling not in ['linear', 'log']:
     raise ValueError(
         'Only log or linear scaling is supported for floating point '
@@ -221,8 +407,12 @@ def _generate_double_point(
   if scaling == 'log':
     # To transform from [0, 1] to [min_val, max_val] on a log scale we do:
     # min_val * exp(x * log(max_val / min_val)).
-    rescaled_value = (
-        min_val * math.exp(halton_point * math.log(max_val / min_val)))
+    if isinstance(halton_point, np.ndarray):
+      rescaled_value = (
+          min_val * np.exp(halton_point * math.log(max_val / min_val)))
+    else:
+      rescaled_value = (
+          min_val * math.exp(halton_point * math.log(max_val / min_val)))
   else:
     rescaled_value = halton_point * (max_val - min_val) + min_val
   return name, rescaled_value
@@ -231,12 +421,26 @@ def _generate_double_point(
 def _generate_discrete_point(
     name: str,
     feasible_points: Sequence[Any],
-    halton_point: float) -> Any:
-  """Generate a discrete hyperparameter value from a Halton sequence point."""
+    halton_point: Union[float, np.ndarray]) -> Any:
+  """Generate discrete hyperparameter values from Halton sequence points."""
+  if isinstance(halton_point, np.ndarray):
+    indices = np.floor(halton_point * len(feasible_points)).astype(np.int64)
+    return name, _object_column(feasible_points)[indices]
   index = int(math.floor(halton_point * len(feasible_points)))
   return name, feasible_points[index]
 
 
+def _generate_column(generator_fn: _GeneratorFn,
+                     halton_points: np.ndarray) -> Tuple[Text, np.ndarray]:
+  """Applies `generator_fn` to a column of Halton sequence points."""
+  if (isinstance(generator_fn, functools.partial) and generator_fn.func in
+      (_generate_double_point, _generate_discrete_point)):
+    return generator_fn(halton_points)
+  # Arbitrary generator functions only accept a single point.
+  names, values = zip(*[generator_fn(x) for x in halton_points.tolist()])
+  return names[0], _object_column(values)
+
+
 _DiscretePoints = collections.namedtuple('_DiscretePoints', 'feasible_points')
 
 
@@ -272,27 +476,61 @@ def uniform(
       _generate_double_point, name, min_val, max_val, 'linear')
 
 
-def product(sweeps: Sequence[_SweepSequence]) -> _SweepSequence:
-  """Cartesian product of a list of hyperparameter generators."""
-  # A List[Dict] of hyperparameter names to sweep values.
-  hyperparameter_sweep = []
-  for hyperparameter_index in range(len(sweeps)):
-    hyperparameter_sweep.append([])
-    # Keep iterating until the iterator in sweep() ends.
-    sweep_i = sweeps[hyperparameter_index]
-    for point_index in range(len(sweep_i)):
-      hyperparameter_name, value = list(sweep_i[point_index].items())[0]
-      hyperparameter_sweep[-1].append((hyperparameter_name, value))
-  return list(map(dict, itertools.product(*hyperparameter_sweep)))
+def product(sweeps: Sequence[Union[Sweep, _SweepSequence]],
+            materialize: bool = True) -> Union[Sweep, _SweepSequence]:
+  """Cartesian product of a list of hyperparameter generators.
+
+  Args:
+    sweeps: a sequence of sweeps, either `Sweep`s or lists of dictionaries such
+      as those returned by halton.sweep() or halton.zipit().
+    materialize: if true, return a list of dictionaries, and otherwise a
+      `Sweep`.
+
+  Returns:
+    The product of the sweeps, where the points of the last sweep vary fastest.
+  """
+  columnar_sweeps = [_as_sweep(s) for s in sweeps]
+  if any(s is None for s in columnar_sweeps):
+    if not materialize:
+      raise ValueError(
+          'Sweeps whose points have different keys cannot be represented as '
+          'a `Sweep`.')
+    return [
+        dict(itertools.chain.from_iterable(p.items() for p in points))
+        for points in itertools.product(*sweeps)
+    ]
+
+  lengths = [len(s) for s in columnar_sweeps]
+  # The product of no sweeps has a single point without hyperparameters.
+  total_length = int(np.prod(lengths, dtype=np.int64))
+  point_indices = np.arange(total_length, dtype=np.int64)
+  columns = {}
+  stride = total_length
+  for s, length in zip(columnar_sweeps, lengths):
+    if total_length:
+      stride //= length
+      indices = (point_indices // stride) % length
+    else:
+      # One of the sweeps is empty, and so is the product.
+      indices = point_indices
+    for name, column in s.columns.items():
+      columns[name] = column[indices]
+  result = Sweep(columns, length=total_length)
+  return result.to_dicts() if materialize else result
 
 
-def sweep(name, feasible_points: _DiscretePoints) -> _SweepSequence:
-  return [{name: x} for x in feasible_points.feasible_points]
+def sweep(name,
+          feasible_points: _DiscretePoints,
+          materialize: bool = True) -> Union[Sweep, _SweepSequence]:
+  result = Sweep({name: _object_column(feasible_points.feasible_points)})
+  return result.to_dicts() if materialize else result
 
 
 def zipit(
-    generator_fns_or_sweeps: Sequence[Union[_GeneratorFn, _SweepSequence]],
-    length: int) -> _SweepSequence:
+    generator_fns_or_sweeps: Sequence[Union[_GeneratorFn, Sweep,
+                                            _SweepSequence]],
+    length: int,
+    materialize: bool = True) -> Union[Sweep, _SweepSequence]:
   """Zip together a list of hyperparameter generators.
 
   Args:
@@ -301,7 +539,7 @@ def zipit(
       quasi-ranom sample, such as those returned by halton.uniform() or
       halton.loguniform()
       -lists of dicts with one key/value such as those returned by
-      halton.sweep()
+      halton.sweep(), or `Sweep`s
       We need to support both of these (instead of having halton.sweep() return
       a list of generator functions) so that halton.sweep() can be used directly
       as a list.
@@ -309,29 +547,35 @@ def zipit(
       elements in generator_fns_or_sweeps are sweep lists, and their length is
       less than `length`, the sweep generation will be terminated and will be
       the same length as the shortest sweep sequence.
+    materialize: if true, return a list of dictionaries, and otherwise a
+      `Sweep`.
 
   Returns:
-    A list of dictionaries, one for each trial, with a key for each unique
-    hyperparameter name from generator_fns_or_sweeps.
+    A list of dictionaries (or a `Sweep`), one for each trial, with a key for
+    each unique hyperparameter name from generator_fns_or_sweeps.
   """
-  halton_sequence = generate_sequence(
+  halton_sequence = generate_sequence_array(
       num_samples=length,
       num_dims=len(generator_fns_or_sweeps))
-  # A List[Dict] of hyperparameter names to sweep values.
-  hyperparameter_sweep = []
-  for trial_index in range(length):
-    hyperparameter_sweep.append({})
-    for hyperparameter_index in range(len(generator_fns_or_sweeps)):
-      halton_point = halton_sequence[trial_index][hyperparameter_index]
-      if callable(generator_fns_or_sweeps[hyperparameter_index]):
-        generator_fn = generator_fns_or_sweeps[hyperparameter_index]
-        hyperparameter_name, value = generator_fn(halton_point)
+  for generator_fn_or_sweep in generator_fns_or_sweeps:
+    if not callable(generator_fn_or_sweep):
+      length = min(length, len(generator_fn_or_sweep))
+  columns = {}
+  if length:
+    for hyperparameter_index, generator_fn_or_sweep in enumerate(
+        generator_fns_or_sweeps):
+      if callable(generator_fn_or_sweep):
+        hyperparameter_name, values = _generate_column(
+            generator_fn_or_sweep,
+            halton_sequence[:length, hyperparameter_index])
+        columns[hyperparameter_name] = values
       else:
-        sweep_list = generator_fns_or_sweeps[hyperparameter_index]
-        if trial_index > len(sweep_list):
-          break
-        hyperparameter_point = sweep_list[trial_index]
-        hyperparameter_name, value = list(hyperparameter_point.items())[0]
-      hyperparameter_sweep[trial_index][hyperparameter_name] = value
-  return hyperparameter_sweep
-
+        sweep_columns = _as_sweep(generator_fn_or_sweep)
+        if sweep_columns is None:
+          raise ValueError(
+              'The points of a sweep passed to zipit must all have the same '
+              'keys.')
+        for hyperparameter_name, values in sweep_columns.columns.items():
+          columns[hyperparameter_name] = values[:length]
+  result = Sweep(columns, length=length)
+  return result.to_dicts() if materialize else result
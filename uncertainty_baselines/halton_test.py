@@ -46,6 +46,63 @@ class HaltonTest(absltest.TestCase):
     self.assertLen(sequence, 100)
     self.assertLen(sequence[0], 4)
 
+  def testSequenceArrayAndChunks(self):
+    np.random.seed(0)
+    sequence = halton.generate_sequence(num_samples=1000, num_dims=5)
+    np.random.seed(0)
+    array = halton.generate_sequence_array(num_samples=1000, num_dims=5)
+    np.random.seed(0)
+    chunks = list(
+        halton.generate_sequence_chunks(
+            num_samples=1000, num_dims=5, chunk_size=300))
+    self.assertEqual(array.shape, (1000, 5))
+    self.assertEqual(array.dtype, np.float64)
+    np.testing.assert_array_equal(array, np.array(sequence))
+    self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+    np.testing.assert_array_equal(array, np.concatenate(chunks))
+
+  def testVanDerCorputDigits(self):
+    # Without shuffling nor shifting, base 3 gives 1/3, 2/3, 1/9, 4/9, ...
+    sequence = halton.generate_sequence_array(
+        num_samples=4,
+        num_dims=1,
+        skip=0,
+        per_dim_shift=False,
+        shuffle_sequence=False,
+        primes=[3],
+        shuffled_seed_sequence=[[0, 1, 2]])
+    np.testing.assert_allclose(sequence[:, 0], [1 / 3, 2 / 3, 1 / 9, 4 / 9])
+
+  def testSweepCombinators(self):
+    zipped = halton.zipit(
+        [halton.uniform('a', halton.interval(0., 1.)),
+         halton.uniform('b', halton.discrete(['x', 'y'])),
+         halton.sweep('c', halton.discrete([1, 2, 3]))],
+        length=5,
+        materialize=False)
+    self.assertLen(zipped, 3)
+    self.assertEqual(zipped[2]['c'], 3)
+    self.assertIn(zipped[0]['b'], ['x', 'y'])
+    seeds = halton.sweep('seed', halton.discrete([0, 1]))
+    product = halton.product([zipped, seeds])
+    self.assertLen(product, 6)
+    self.assertEqual([p['seed'] for p in product], [0, 1] * 3)
+    self.assertEqual(product[0]['a'], product[1]['a'])
+    self.assertEqual(product, list(halton.product([zipped, seeds],
+                                                  materialize=False)))
+
+  def testProductOfEmptySweeps(self):
+    seeds = halton.sweep('seed', halton.discrete([0, 1]))
+    empty = halton.sweep('a', halton.discrete([]))
+    self.assertEqual(halton.product([seeds, empty]), [])
+    self.assertEqual(halton.product([empty, seeds]), [])
+    self.assertEqual(halton.product([seeds, []]), [])
+    self.assertEmpty(halton.product([seeds, empty], materialize=False))
+    self.assertEqual(halton.product([]), [{}])
+    self.assertEqual(list(halton.product([], materialize=False)), [{}])
+    self.assertEqual(halton.product([seeds, [{}]]), seeds)
+    self.assertEqual(halton.zipit([], length=2), [{}, {}])
+
   def testUniformness(self):
     """Perform a Kolmogorov-Smirnov test to check for sufficient uniformness."""
     alpha = 0.1
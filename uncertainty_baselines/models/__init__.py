@@ -23,6 +23,7 @@ import tensorflow as tf
 # corresponding try/except blocks below these main imports, otherwise you will
 # break the external build.
 # ==============================================================================
+from uncertainty_baselines.models import classifier_utils
 from uncertainty_baselines.models import efficientnet_utils
 from uncertainty_baselines.models.criteo_mlp import criteo_mlp
 from uncertainty_baselines.models.efficientnet import efficientnet
@@ -42,6 +42,7 @@ from official.modeling import tf_utils
 from official.nlp.bert import configs as bert_configs
 from official.nlp.modeling import layers as bert_layers
 from official.nlp.modeling import networks as bert_encoder
+from uncertainty_baselines.models import classifier_utils
 
 _EinsumDense = tf.keras.layers.experimental.EinsumDense
 
@@ -551,7 +552,7 @@ class BertGaussianProcessClassifier(tf.keras.Model):
       # (which is often suggested by the theoretical literature).
       # The reason is deep BERT model is sensitive to the scaling of the
       # initializers.
-      self.classifier = ed.layers.RandomFeatureGaussianProcess(
+      self.classifier = classifier_utils.CachedRandomFeatureGaussianProcess(
           units=num_classes,
           scale_random_features=False,
           use_custom_random_features=True,
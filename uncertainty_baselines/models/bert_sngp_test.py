@@ -20,6 +20,7 @@ import numpy as np
 import tensorflow as tf
 import uncertainty_baselines as ub
 
+from uncertainty_baselines.models import classifier_utils
 from uncertainty_baselines.models import bert_sngp
 from official.nlp.bert import configs as bert_configs
 
@@ -233,6 +234,7 @@ class SngpModelTest(tf.test.TestCase, parameterized.TestCase):
 
     self.assertEqual(logits_shape_observed, logits_shape_expected)
     self.assertEqual(stddev_shape_observed, stddev_shape_expected)
+    self.assertEqual(classifier_utils.cache_gp_covariance(model), 1)
 
   def test_create_model(self):
     """Integration test for create_model."""
@@ -15,12 +15,205 @@
 
 """Utilities related to classifier building."""
 
+import functools
 from typing import Dict, Any, Optional
 
 import edward2 as ed
 import tensorflow as tf
 
 
+class CachedLaplaceRandomFeatureCovariance(
+    ed.layers.LaplaceRandomFeatureCovariance):
+  """Laplace covariance which caches the Cholesky factor of the precision.
+
+  `cache_covariance` factorizes the precision matrix P = L L^T once, such that
+  inference calls compute the posterior covariance of a batch of random
+  features Phi as ridge_penalty * V^T V with V = L^{-1} Phi^T, using a
+  triangular solve instead of inverting the [D, D] precision matrix. The factor
+  is a non-trainable weight of the layer, and hence saved in its checkpoints.
+
+  The cache is invalidated whenever the precision matrix is reset or updated in
+  training, in which case inference falls back to the matrix inversion.
+
+  With `return_variance=True`, the layer returns the per-example predictive
+  variances of shape (batch_size,) instead of the (batch_size, batch_size)
+  covariance matrix, i.e. the column norms ridge_penalty * ||V_i||^2, such that
+  the batch covariance is never built.
+  """
+
+  def __init__(self, *args, return_variance: bool = False, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.return_variance = return_variance
+
+  def build(self, input_shape):
+    super().build(input_shape)
+    gp_feature_dim = input_shape[-1]
+    self.precision_matrix_cholesky = self.add_weight(
+        name='gp_precision_matrix_cholesky',
+        shape=(gp_feature_dim, gp_feature_dim),
+        dtype=self.dtype,
+        initializer='zeros',
+        trainable=False,
+        aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA)
+    self.is_cached = self.add_weight(
+        name='gp_covariance_is_cached',
+        shape=(),
+        dtype=self.dtype,
+        initializer='zeros',
+        trainable=False,
+        aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA)
+
+  def cache_covariance(self):
+    """Factorizes the current precision matrix for inference."""
+    self.precision_matrix_cholesky.assign(
+        tf.linalg.cholesky(self.precision_matrix))
+    self.is_cached.assign(1.)
+
+  def reset_precision_matrix(self):
+    super().reset_precision_matrix()
+    self.is_cached.assign(0.)
+
+  def compute_predictive_covariance(self, gp_feature):
+    invert_precision_matrix = super().compute_predictive_covariance
+
+    def _cached_predictive_covariance():
+      solved_feature = self._solve_cholesky(gp_feature,
+                                            self.precision_matrix_cholesky)
+      return self.ridge_penalty * tf.matmul(
+          solved_feature, solved_feature, transpose_a=True)
+
+    return tf.cond(self.is_cached > 0., _cached_predictive_covariance,
+                   lambda: invert_precision_matrix(gp_feature))
+
+  def compute_predictive_variance(self, gp_feature):
+    """Computes the diagonal of the posterior predictive covariance.
+
+    Args:
+      gp_feature: (tf.Tensor) The random feature of testing data, shape
+        (batch_size, gp_hidden_size).
+
+    Returns:
+      (tf.Tensor) Predictive variance of each example, shape (batch_size,).
+    """
+    # Without a cached factor, factorizes the precision matrix on the fly,
+    # which is as expensive as the inversion but still avoids the batch
+    # covariance.
+    precision_matrix_cholesky = tf.cond(
+        self.is_cached > 0., lambda: tf.identity(self.precision_matrix_cholesky),
+        lambda: tf.linalg.cholesky(self.precision_matrix))
+    solved_feature = self._solve_cholesky(gp_feature, precision_matrix_cholesky)
+    return self.ridge_penalty * tf.reduce_sum(
+        tf.square(solved_feature), axis=0)
+
+  def call(self, inputs, logits=None, training=None):
+    training = self._get_training_value(training)
+    if training:
+      self.is_cached.assign(0.)
+    if not self.return_variance:
+      return super().call(inputs, logits=logits, training=training)
+    if not training:
+      return self.compute_predictive_variance(inputs)
+    # Updates the precision matrix, and returns a null estimate.
+    super().call(inputs, logits=logits, training=training)
+    return tf.ones(tf.shape(inputs)[:1], dtype=self.dtype)
+
+  def _solve_cholesky(self, gp_feature, precision_matrix_cholesky):
+    # Computes L^{-1} Phi^T, shape (gp_feature_dim, batch_size).
+    return tf.linalg.triangular_solve(
+        precision_matrix_cholesky, tf.transpose(gp_feature), lower=True)
+
+
+class CachedRandomFeatureGaussianProcess(
+    ed.layers.RandomFeatureGaussianProcess):
+  """Random feature GP layer which caches its posterior covariance.
+
+  Identical to `ed.layers.RandomFeatureGaussianProcess`, except that the
+  posterior covariance can be cached with `cache_covariance` after training,
+  or after the last training step of an epoch which resets the covariance,
+  so that inference never inverts the precision matrix. With
+  `return_gp_variance=True`, the layer returns the per-example predictive
+  variances, of shape (batch_size,), instead of the covariance matrix; they
+  are the input of `mean_field_logits`. See
+  `CachedLaplaceRandomFeatureCovariance`.
+  """
+
+  def __init__(self, *args, return_gp_variance: bool = False, **kwargs):
+    self.return_gp_variance = return_gp_variance
+    super().__init__(*args, **kwargs)
+
+  def _build_sublayer_classes(self):
+    super()._build_sublayer_classes()
+    # The parent build creates the covariance layer from this class, named
+    # such that checkpoints of `ed.layers.RandomFeatureGaussianProcess` still
+    # restore.
+    self.covariance_layer = functools.partial(
+        CachedLaplaceRandomFeatureCovariance,
+        return_variance=self.return_gp_variance)
+
+  def cache_covariance(self):
+    """Caches the Cholesky factor of the current precision matrix."""
+    if self.return_gp_cov:
+      self._gp_cov_layer.cache_covariance()
+
+
+def cache_gp_covariance(model: tf.keras.Model) -> int:
+  """Caches the posterior covariance of all the GP layers of a model.
+
+  Args:
+    model: A Keras model or layer, e.g. built by `build_classifier` or one of
+      the SNGP models.
+
+  Returns:
+    The number of `CachedRandomFeatureGaussianProcess` layers found.
+  """
+  gp_layers = [
+      layer for layer in (model,) + tuple(model.submodules)
+      if isinstance(layer, CachedRandomFeatureGaussianProcess)
+  ]
+  for gp_layer in gp_layers:
+    gp_layer.cache_covariance()
+  return len(gp_layers)
+
+
+def mean_field_logits(logits: tf.Tensor,
+                      variances: Optional[tf.Tensor] = None,
+                      mean_field_factor: float = 1.,
+                      likelihood: str = 'logistic') -> tf.Tensor:
+  """Adjusts the logits with the per-example predictive variances.
+
+  Same as `ed.layers.utils.mean_field_logits`, but takes the variances of
+  a `CachedRandomFeatureGaussianProcess` built with `return_gp_variance=True`
+  rather than the diagonal of a covariance matrix.
+
+  Args:
+    logits: A float tensor of shape (batch_size, num_classes).
+    variances: A float tensor of shape (batch_size,). If None then the
+      variances are assumed to be one.
+    mean_field_factor: The scale factor for the mean-field approximation. No
+      adjustment is made if it is negative.
+    likelihood: The likelihood, one of 'logistic', 'binary_logistic' or
+      'poisson'.
+
+  Returns:
+    The adjusted logits, of the same shape as `logits`.
+  """
+  if likelihood not in ('logistic', 'binary_logistic', 'poisson'):
+    raise ValueError('"likelihood" must be one of (\'logistic\', '
+                     f'\'binary_logistic\', \'poisson\'), got {likelihood}.')
+  if mean_field_factor < 0:
+    return logits
+  if variances is None:
+    variances = 1.
+
+  if likelihood == 'poisson':
+    logits_scale = tf.exp(-variances * mean_field_factor / 2.)
+  else:
+    logits_scale = tf.sqrt(1. + variances * mean_field_factor)
+  if len(logits.shape) > 1:
+    logits_scale = tf.expand_dims(logits_scale, axis=-1)
+  return logits / logits_scale
+
+
 def build_classifier(
     num_classes: int,
     gp_layer_kwargs: Dict[str, Any],
@@ -41,7 +234,7 @@ def build_classifier(
   if use_gp_layer:
     # We use the stddev=0.05 (i.e., the tf keras default)
     # This can be adjusted in the future.
-    classifier = ed.layers.RandomFeatureGaussianProcess(
+    classifier = CachedRandomFeatureGaussianProcess(
         units=num_classes,
         scale_random_features=False,
         use_custom_random_features=True,
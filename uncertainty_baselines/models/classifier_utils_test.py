@@ -14,6 +14,7 @@
 # limitations under the License.
 
 """Tests for classifier utilities."""
+import edward2 as ed
 import tensorflow as tf
 
 from uncertainty_baselines.models import classifier_utils
@@ -60,6 +61,99 @@ class ClassifierUtilsTest(tf.test.TestCase):
     self.assertEqual(logits_shape_observed, logits_shape_expected)
     self.assertEqual(covmat_shape_observed, covmat_shape_expected)
 
+  def test_cached_gp_covariance(self):
+    """Tests if the cached covariance matches the inverted covariance."""
+    gp_layer_kwargs = dict(
+        num_inducing=32,
+        gp_kernel_scale=1.,
+        gp_output_bias=0.,
+        normalize_input=True,
+        gp_cov_momentum=-1.,
+        gp_cov_ridge_penalty=1.)
+    model = classifier_utils.build_classifier(
+        num_classes=self.num_classes,
+        gp_layer_kwargs=gp_layer_kwargs,
+        use_gp_layer=True)
+
+    tf.random.set_seed(self.random_seed)
+    train_inputs = tf.random.normal((64, self.hidden_dim))
+    test_inputs = tf.random.normal((self.batch_size, self.hidden_dim))
+    model(train_inputs, training=True)
+    _, covmat_expected = model(test_inputs, training=False)
+
+    num_cached_layers = classifier_utils.cache_gp_covariance(model)
+    _, covmat_observed = model(test_inputs, training=False)
+
+    self.assertEqual(num_cached_layers, 1)
+    self.assertAllClose(covmat_observed, covmat_expected, atol=1e-5)
+
+    # Updating the precision matrix invalidates the cache.
+    model(train_inputs, training=True)
+    self.assertEqual(float(model._gp_cov_layer.is_cached), 0.)  # pylint: disable=protected-access
+
+  def test_cached_gp_covariance_layer_weights(self):
+    """Tests if the GP layer only builds the cached covariance layer."""
+    gp_layer_kwargs = dict(num_inducing=32, gp_cov_ridge_penalty=1.)
+    inputs_tensor = tf.random.normal((self.batch_size, self.hidden_dim))
+    model = classifier_utils.CachedRandomFeatureGaussianProcess(
+        units=self.num_classes, **gp_layer_kwargs)
+    model(inputs_tensor, training=False)
+    reference_model = ed.layers.RandomFeatureGaussianProcess(
+        units=self.num_classes, **gp_layer_kwargs)
+    reference_model(inputs_tensor, training=False)
+
+    cov_layers = [
+        layer for layer in model.submodules
+        if isinstance(layer, ed.layers.LaplaceRandomFeatureCovariance)
+    ]
+    self.assertLen(cov_layers, 1)
+    self.assertIsInstance(
+        cov_layers[0], classifier_utils.CachedLaplaceRandomFeatureCovariance)
+    self.assertEqual(cov_layers[0].name, 'gp_covariance')
+    # The Cholesky factor and the cache flag are the only additional weights.
+    self.assertLen(model.weights, len(reference_model.weights) + 2)
+
+  def test_gp_variance(self):
+    """Tests if the variances are the diagonal of the covariance."""
+    gp_layer_kwargs = dict(
+        num_inducing=32,
+        gp_cov_momentum=-1.,
+        gp_cov_ridge_penalty=1.)
+    cov_model = classifier_utils.CachedRandomFeatureGaussianProcess(
+        units=self.num_classes, **gp_layer_kwargs)
+    var_model = classifier_utils.CachedRandomFeatureGaussianProcess(
+        units=self.num_classes, return_gp_variance=True, **gp_layer_kwargs)
+
+    tf.random.set_seed(self.random_seed)
+    train_inputs = tf.random.normal((64, self.hidden_dim))
+    test_inputs = tf.random.normal((self.batch_size, self.hidden_dim))
+    cov_model(test_inputs, training=False)
+    var_model(test_inputs, training=False)
+    var_model.set_weights(cov_model.get_weights())
+
+    _, train_variances = var_model(train_inputs, training=True)
+    cov_model(train_inputs, training=True)
+    self.assertAllEqual(train_variances, tf.ones(64))
+
+    logits_expected, covmat = cov_model(test_inputs, training=False)
+    variances_expected = tf.linalg.diag_part(covmat)
+    logits_observed, variances_observed = var_model(
+        test_inputs, training=False)
+    self.assertEqual(variances_observed.shape.as_list(), [self.batch_size])
+    self.assertAllClose(logits_observed, logits_expected)
+    self.assertAllClose(variances_observed, variances_expected, atol=1e-5)
+
+    classifier_utils.cache_gp_covariance(var_model)
+    _, variances_observed = var_model(test_inputs, training=False)
+    self.assertAllClose(variances_observed, variances_expected, atol=1e-5)
+
+    self.assertAllClose(
+        classifier_utils.mean_field_logits(
+            logits_observed, variances_observed, mean_field_factor=0.1),
+        ed.layers.utils.mean_field_logits(
+            logits_expected, covmat, mean_field_factor=0.1),
+        atol=1e-5)
+
 
 if __name__ == "__main__":
   tf.test.main()
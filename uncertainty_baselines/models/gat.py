@@ -18,6 +18,8 @@ from typing import Optional
 
 import tensorflow as tf
 from uncertainty_baselines.models.mpnn import get_adjacency_matrix
+from uncertainty_baselines.models.mpnn import graph_sum
+from uncertainty_baselines.models.mpnn import is_sparse_graph
 
 
 class GraphAttentionLayer(tf.keras.layers.Layer):
@@ -62,16 +64,22 @@ class GraphAttentionLayer(tf.keras.layers.Layer):
 
     Args:
       h: An incoming tensor contains node level features and it
-        should have dimension of (batch_size, num_nodes, node_feature_dim).
+        should have dimension of (batch_size, num_nodes, node_feature_dim),
+        or (num_nodes, node_feature_dim) for sparse graphs.
       adj: An incoming tensor contains adjacency matrices. Each adjacency
         matrix has added diagonal ones before entering the layer.
-        It should have dimension of (batch_size, num_nodes, num_nodes).
+        It should have dimension of (batch_size, num_nodes, num_nodes). For
+        sparse graphs, a tuple of the (senders, receivers) node indices of
+        the edges instead, each with dimension of (num_edges,).
 
     Returns:
       new_h: The new node level features tensor. It is aggregated
         from neighbours with attention and it has dimension of
         (batch_size, out_node_feature_dim).
     """
+    if isinstance(adj, (tuple, list)):
+      return self._call_sparse(h, *adj)
+
     wh = tf.matmul(h, self.w)  # (batch_size, num_nodes, out_node_feature_dim)
 
     # Go through attention.
@@ -90,6 +98,49 @@ class GraphAttentionLayer(tf.keras.layers.Layer):
                       wh)  # (batch_size, num_nodes, out_node_feature_dim)
     return new_h
 
+  def _call_sparse(self, h, senders, receivers):
+    """Forward pass computation of the layer on a packed graph batch.
+
+    The attention scores are only computed along the edges, and normalized
+    with a softmax over the incoming edges of every node.
+
+    Args:
+      h: Node level features with dimension of (num_nodes, node_feature_dim).
+      senders: Source node of every edge, with dimension of (num_edges,).
+      receivers: Target node of every edge, with dimension of (num_edges,).
+
+    Returns:
+      new_h: The new node level features tensor, with dimension of
+        (num_nodes, out_node_feature_dim).
+    """
+    num_nodes = tf.shape(h)[0]
+    wh = tf.matmul(h, self.w)  # (num_nodes, out_node_feature_dim)
+    wh_senders = tf.gather(wh, senders)  # (num_edges, out_node_feature_dim)
+
+    if self.constant_attention:
+      attention_scores = tf.zeros_like(senders, dtype=wh.dtype)
+    else:
+      # a^T [Wh_v || Wh_w], split into the receiver and sender halves.
+      a_receivers, a_senders = tf.split(self.a, 2, axis=0)
+      attention_scores = self.leakyrelu(
+          tf.squeeze(
+              tf.matmul(tf.gather(wh, receivers), a_receivers) +
+              tf.matmul(wh_senders, a_senders),
+              axis=1))  # (num_edges,)
+
+    # Softmax over the incoming edges of every node.
+    max_scores = tf.math.unsorted_segment_max(attention_scores, receivers,
+                                              num_nodes)
+    exp_scores = tf.exp(attention_scores - tf.gather(max_scores, receivers))
+    normalizers = tf.math.unsorted_segment_sum(exp_scores, receivers,
+                                               num_nodes)
+    attention_coeffs = exp_scores / tf.gather(normalizers, receivers)
+
+    new_h = tf.math.unsorted_segment_sum(
+        attention_coeffs[:, None] * wh_senders, receivers,
+        num_nodes)  # (num_nodes, out_node_feature_dim)
+    return new_h
+
   def _prepare_attention_inputs(self, wh):
     """Prepare inputs for downstream attention computation.
 
@@ -155,7 +206,8 @@ class GraphAttentionLayer(tf.keras.layers.Layer):
     direct neighbours to have positive attention coefficients; all the
     non-direct neighbours may have high attention scores, but we still assign
     zero coefficients to them. This can be dis-regulated in the future
-    because long-distance intra-molecular interactions are common.
+    because long-distance intra-molecular interactions are common. Nodes
+    without any neighbour get zero coefficients.
 
     Args:
       attention_scores: An incoming tensor contains pair-wise attention
@@ -189,6 +241,15 @@ class GraphAttentionLayer(tf.keras.layers.Layer):
     # attention coefficients.
     attention_coeffs = tf.nn.softmax(
         final_scores, axis=2)  # (batch_size, num_nodes, num_nodes)
+    # Nodes without any neighbour would otherwise attend uniformly to all
+    # nodes, padding included. Give them zero coefficients instead, as the
+    # softmax over the (empty) incoming edges of sparse graphs.
+    has_neighbours = tf.reduce_any(
+        whether_neighboring, axis=2,
+        keepdims=True)  # (batch_size, num_nodes, 1)
+    attention_coeffs = tf.where(
+        has_neighbours, attention_coeffs,
+        tf.zeros_like(attention_coeffs))  # (batch_size, num_nodes, num_nodes)
 
     return attention_coeffs
 
@@ -261,7 +322,8 @@ class GATModel(tf.keras.Model):
 
     self.softmax = tf.keras.layers.Softmax()
 
-  def graph_representation(self, nodes, adj, training=False):
+  def graph_representation(self, nodes, adj, training=False,
+                           graph_inputs=None):
     """Forward pass to compute molecular graph level representation.
 
     Args:
@@ -269,9 +331,13 @@ class GATModel(tf.keras.Model):
         should have dimension of (batch_size, num_nodes, node_feature_dim).
       adj: An incoming tensor contains adjacency matrices. Each adjacency
         matrix has added diagonal ones before entering the layer.
-        It should have dimension of (batch_size, num_nodes, num_nodes).
+        It should have dimension of (batch_size, num_nodes, num_nodes). For
+        a packed batch of sparse graphs, a tuple of the (senders, receivers)
+        node indices of the edges instead.
       training: A boolean indicating if the model is in training mode or not.
         This affects the behavior of dropout layers.
+      graph_inputs: The inputs dictionary of a packed batch of sparse graphs,
+        used to sum the node features of every graph. None for dense graphs.
 
     Returns:
       x_g: The graph level features tensor. It is aggregated
@@ -285,7 +351,7 @@ class GATModel(tf.keras.Model):
       nodes_under_iter = self.dropout(nodes_under_iter, training=training)
       nodes_under_iter = tf.concat(
           [a_head(nodes_under_iter, adj) for a_head in attention_heads],
-          axis=2)  # (batch_size, num_nodes, heads * out_node_feature_dim)
+          axis=-1)  # (batch_size, num_nodes, heads * out_node_feature_dim)
       nodes_under_iter = tf.nn.elu(
           nodes_under_iter
       )  # (batch_size, num_nodes, heads * out_node_feature_dim)
@@ -301,12 +367,12 @@ class GATModel(tf.keras.Model):
       nodes_under_iter = self.attention_heads3[0](nodes_under_iter, adj)
 
     # Go though graph level aggregation.
-    readout = tf.reduce_sum(
+    readout = graph_sum(
         tf.multiply(
             self.i_layer(
                 tf.keras.layers.Concatenate()([nodes_under_iter, nodes])),
             self.j_layer(nodes_under_iter)),
-        axis=1)  # (batch_size, graph_level_features)
+        graph_inputs or {})  # (batch_size, graph_level_features)
 
     return readout
 
@@ -321,9 +387,16 @@ class GATModel(tf.keras.Model):
       output: Logits tensor with dimension of (batch_size, classes)
         for classification.
     """
-    nodes, edges = inputs["atoms"], inputs["pairs"]
-    adjacency_matrix = tf.cast(get_adjacency_matrix(edges), tf.int32)
-    readout = self.graph_representation(nodes, adjacency_matrix, training)
+    nodes = inputs["atoms"]
+    if is_sparse_graph(inputs):
+      readout = self.graph_representation(
+          nodes, (inputs["senders"], inputs["receivers"]),
+          training,
+          graph_inputs=inputs)
+    else:
+      adjacency_matrix = tf.cast(get_adjacency_matrix(inputs["pairs"]),
+                                 tf.int32)
+      readout = self.graph_representation(nodes, adjacency_matrix, training)
 
     logits = self.classifier(
         readout, training=training)  # (batch_size, classes)
@@ -0,0 +1,103 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for GAT."""
+from absl.testing import parameterized
+import tensorflow as tf
+
+import uncertainty_baselines as ub
+from uncertainty_baselines.datasets import drug_cardiotoxicity
+from uncertainty_baselines.models.gat import GraphAttentionLayer
+from uncertainty_baselines.models.mpnn import get_adjacency_matrix
+
+
+class GatTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.random_seed = 42
+
+    self.num_classes = 2
+    self.batch_size = 4
+    self.max_nodes = 30
+    self.node_dim = 10
+    self.edge_dim = 12
+    self.attention_heads = 2
+    self.out_node_feature_dim = 8
+    self.readout_layer_size = 20
+
+  def _inputs(self):
+    """Returns molecules without padding atoms, where atom 0 has no bond."""
+    tf.random.set_seed(self.random_seed)
+    bonds = tf.cast(
+        tf.random.uniform((self.batch_size, self.max_nodes, self.max_nodes)) <
+        0.1, tf.float32)
+    not_isolated = tf.concat(
+        [tf.zeros([1]), tf.ones([self.max_nodes - 1])], axis=0)
+    bonds *= not_isolated[:, None] * not_isolated[None, :]
+    pairs = tf.concat([
+        bonds[..., None],
+        tf.zeros((self.batch_size, self.max_nodes, self.max_nodes,
+                  self.edge_dim - 1)),
+    ], axis=-1)
+    return {
+        "atoms":
+            tf.random.normal((self.batch_size, self.max_nodes, self.node_dim)),
+        "pairs":
+            pairs,
+        "atom_mask":
+            tf.ones((self.batch_size, self.max_nodes)),
+    }
+
+  @parameterized.parameters(False, True)
+  def test_isolated_node_attends_to_nothing(self, constant_attention):
+    """Tests if a node without neighbours aggregates no features."""
+    layer = GraphAttentionLayer(self.node_dim, self.out_node_feature_dim,
+                                constant_attention)
+    inputs = self._inputs()
+    adjacency_matrix = tf.cast(
+        get_adjacency_matrix(inputs["pairs"]), tf.int32)
+    sparse_inputs = drug_cardiotoxicity.pack_graph_batch(inputs)
+
+    new_h = layer(inputs["atoms"], adjacency_matrix)
+    self.assertAllEqual(new_h[:, 0],
+                        tf.zeros((self.batch_size, self.out_node_feature_dim)))
+    self.assertAllClose(
+        tf.reshape(new_h, (-1, self.out_node_feature_dim)),
+        layer(sparse_inputs["atoms"],
+              (sparse_inputs["senders"], sparse_inputs["receivers"])),
+        atol=1e-5)
+
+  @parameterized.parameters(False, True)
+  def test_gat_sparse_graph_matches_dense(self, constant_attention):
+    """Tests if GAT gives the same outputs on packed sparse graphs."""
+    model = ub.models.gat(
+        attention_heads=self.attention_heads,
+        node_feature_dim=self.node_dim,
+        out_node_feature_dim=self.out_node_feature_dim,
+        readout_layer_size=self.readout_layer_size,
+        num_classes=self.num_classes,
+        constant_attention=constant_attention)
+    inputs = self._inputs()
+    sparse_inputs = drug_cardiotoxicity.pack_graph_batch(inputs)
+
+    self.assertAllClose(
+        model(inputs, training=False),
+        model(sparse_inputs, training=False),
+        atol=1e-5)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,285 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory-efficient Monte Carlo estimation for heteroscedastic softmax heads.
+
+The heteroscedastic layers of edward2 draw all the Monte Carlo samples of the
+logits at once, i.e. a `[batch_size, num_mc_samples, num_classes]` tensor,
+before averaging the softmax probabilities over the samples. With thousands of
+samples, as used on ImageNet, that tensor dominates the memory and FLOPs of a
+training step.
+
+`ChunkedMCSoftmaxDenseFA` computes the same estimate of the predictive
+distribution with a low-rank plus diagonal covariance (as
+`ed.layers.MCSoftmaxDenseFA`), but only ever materializes a chunk of samples:
+the log-probabilities of each chunk are reduced with a logsumexp and
+accumulated over chunks in a `tf.while_loop`. It also supports
+
+  * separate numbers of samples for training and evaluation,
+  * antithetic samples, which pair every noise sample z with -z and reduce
+    the variance of the estimate for free, and
+  * stopping the evaluation once the Monte Carlo standard error of the
+    predictive probabilities falls below a tolerance.
+"""
+
+import math
+from typing import Optional
+
+import tensorflow as tf
+
+_MIN_SCALE_MONTE_CARLO = 1e-3
+_DEFAULT_TEMPERATURE_LOWER_BOUND = 0.05
+_DEFAULT_TEMPERATURE_UPPER_BOUND = 5.0
+
+
+class ChunkedMCSoftmaxDenseFA(tf.keras.layers.Layer):
+  """Heteroscedastic softmax output layer with chunked MC estimation.
+
+  The logits follow a Gaussian distribution with a mean and a low-rank plus
+  diagonal covariance that both depend on the inputs. The layer returns the
+  log of the Monte Carlo estimate of the predictive probabilities, clipped to
+  [eps, 1], so that it can be used as logits by a softmax cross-entropy loss.
+  The noise samples are shared across the batch.
+
+  With `ensemble_size > 1`, the layer is a multi-head layer (as
+  `ed.layers.MultiHeadMCSoftmaxDenseFA`) and returns log-probabilities of
+  shape [batch_size, ensemble_size, num_classes].
+  """
+
+  def __init__(self,
+               num_classes: int,
+               num_factors: int,
+               temperature: float = 1.0,
+               train_mc_samples: int = 1000,
+               test_mc_samples: int = 1000,
+               mc_chunk_size: int = 100,
+               antithetic: bool = False,
+               eval_mc_stderr_tolerance: Optional[float] = None,
+               ensemble_size: int = 1,
+               eps: float = 1e-7,
+               tune_temperature: bool = False,
+               temperature_lower_bound: Optional[float] = None,
+               temperature_upper_bound: Optional[float] = None,
+               **kwargs):
+    """Creates the layer.
+
+    Args:
+      num_classes: Number of output classes (per head).
+      num_factors: Rank of the low-rank part of the covariance of the logits.
+      temperature: Temperature the sampled logits are divided by before the
+        softmax.
+      train_mc_samples: Number of Monte Carlo samples during training, rounded
+        up to a multiple of `mc_chunk_size`.
+      test_mc_samples: Maximum number of Monte Carlo samples during
+        evaluation, rounded up to a multiple of `mc_chunk_size`.
+      mc_chunk_size: Number of samples drawn at a time, which bounds the size
+        of the sampled logits to [batch_size, mc_chunk_size, num_classes].
+      antithetic: Whether to draw the samples in antithetic pairs (z, -z). The
+        chunk size must then be even.
+      eval_mc_stderr_tolerance: If set, the evaluation stops drawing chunks of
+        samples once the largest Monte Carlo standard error of the predictive
+        probabilities over the batch is at most this tolerance.
+      ensemble_size: Number of heads.
+      eps: Minimum predictive probability, for numerical stability of the log.
+      tune_temperature: Whether the temperature is optimized with the other
+        parameters, within [temperature_lower_bound, temperature_upper_bound].
+      temperature_lower_bound: Lowest tunable temperature.
+      temperature_upper_bound: Highest tunable temperature.
+      **kwargs: Keyword arguments of tf.keras.layers.Layer.
+    """
+    super().__init__(**kwargs)
+    if mc_chunk_size <= 0:
+      raise ValueError(
+          'mc_chunk_size must be positive, got {}.'.format(mc_chunk_size))
+    if antithetic and mc_chunk_size % 2:
+      raise ValueError('Antithetic sampling needs an even mc_chunk_size, got '
+                       '{}.'.format(mc_chunk_size))
+    self._num_classes = num_classes
+    self._num_factors = num_factors
+    self._temperature = temperature
+    self._train_mc_samples = train_mc_samples
+    self._test_mc_samples = test_mc_samples
+    self._mc_chunk_size = mc_chunk_size
+    self._antithetic = antithetic
+    self._eval_mc_stderr_tolerance = eval_mc_stderr_tolerance
+    self._ensemble_size = ensemble_size
+    self._eps = eps
+    self._tune_temperature = tune_temperature
+    self._temperature_lower_bound = (
+        _DEFAULT_TEMPERATURE_LOWER_BOUND
+        if temperature_lower_bound is None else temperature_lower_bound)
+    self._temperature_upper_bound = (
+        _DEFAULT_TEMPERATURE_UPPER_BOUND
+        if temperature_upper_bound is None else temperature_upper_bound)
+
+    num_outputs = ensemble_size * num_classes
+    self._loc_layer = tf.keras.layers.Dense(
+        num_outputs, name=self.name + '_loc')
+    self._scale_layer_homoscedastic = tf.keras.layers.Dense(
+        num_outputs, name=self.name + '_scale_homoscedastic')
+    self._scale_layer_heteroscedastic = tf.keras.layers.Dense(
+        num_outputs * num_factors, name=self.name + '_scale_heteroscedastic')
+
+  def build(self, input_shape):
+    if self._tune_temperature:
+      # Parameterize the temperature through a sigmoid between its bounds and
+      # initialize it to `temperature`.
+      lower, upper = self._temperature_lower_bound, self._temperature_upper_bound
+      ratio = (self._temperature - lower) / (upper - lower)
+      if not 0. < ratio < 1.:
+        raise ValueError(
+            'The initial temperature {} must be within the bounds ({}, '
+            '{}).'.format(self._temperature, lower, upper))
+      self._pre_sigmoid_temperature = self.add_weight(
+          name='pre_sigmoid_temperature',
+          shape=(),
+          initializer=tf.keras.initializers.Constant(
+              math.log(ratio / (1. - ratio))),
+          trainable=True)
+    super().build(input_shape)
+
+  def _get_temperature(self):
+    if not self._tune_temperature:
+      return self._temperature
+    lower, upper = self._temperature_lower_bound, self._temperature_upper_bound
+    return lower + (upper - lower) * tf.math.sigmoid(
+        self._pre_sigmoid_temperature)
+
+  def _compute_chunk(self, locs, factor_loadings, diag_scale, temperature,
+                     standard_normal_samples, diag_normal_samples):
+    """Returns the chunk's logsumexp and sum of probabilities over samples.
+
+    Args:
+      locs: [batch_size, ensemble_size, num_classes] mean of the logits.
+      factor_loadings: [batch_size, ensemble_size, num_classes, num_factors]
+        low-rank factor of the covariance of the logits.
+      diag_scale: [batch_size, ensemble_size, num_classes] diagonal scale.
+      temperature: Softmax temperature.
+      standard_normal_samples: [num_samples, num_factors] noise samples.
+      diag_normal_samples: [num_samples, num_classes] noise samples.
+
+    Returns:
+      The logsumexp over samples of the log-probabilities and the sum over
+      (pairs of antithetic) samples of the squared probabilities, both of shape
+      [batch_size, ensemble_size, num_classes].
+    """
+    if self._antithetic:
+      standard_normal_samples = tf.concat(
+          [standard_normal_samples, -standard_normal_samples], axis=0)
+      diag_normal_samples = tf.concat(
+          [diag_normal_samples, -diag_normal_samples], axis=0)
+    # [batch_size, num_samples, ensemble_size, num_classes].
+    noise = tf.einsum('beck,sk->bsec', factor_loadings,
+                      standard_normal_samples)
+    noise += diag_scale[:, None] * diag_normal_samples[None, :, None]
+    log_probs = tf.nn.log_softmax((locs[:, None] + noise) / temperature,
+                                  axis=-1)
+    log_prob_sums = tf.reduce_logsumexp(log_probs, axis=1)
+    probs = tf.exp(log_probs)
+    if self._antithetic:
+      # The two samples of an antithetic pair are not independent, so the
+      # standard error is estimated from the averages of the pairs.
+      half = tf.shape(probs)[1] // 2
+      probs = 0.5 * (probs[:, :half] + probs[:, half:])
+    return log_prob_sums, tf.reduce_sum(tf.square(probs), axis=1)
+
+  def call(self, inputs, training=None):
+    batch_size = tf.shape(inputs)[0]
+    shape = [batch_size, self._ensemble_size, self._num_classes]
+    locs = tf.reshape(self._loc_layer(inputs), shape)
+    diag_scale = tf.reshape(
+        tf.math.softplus(self._scale_layer_homoscedastic(inputs)) +
+        _MIN_SCALE_MONTE_CARLO, shape)
+    factor_loadings = tf.reshape(
+        self._scale_layer_heteroscedastic(inputs), shape + [self._num_factors])
+    temperature = tf.convert_to_tensor(self._get_temperature(), locs.dtype)
+
+    num_mc_samples = (
+        self._train_mc_samples if training else self._test_mc_samples)
+    num_chunks = max(-(-num_mc_samples // self._mc_chunk_size), 1)
+    num_draws = self._mc_chunk_size // 2 if self._antithetic else (
+        self._mc_chunk_size)
+    # Rematerialize the sampled logits of every chunk in the backward pass, so
+    # that training does not keep the logits of all the samples in memory. The
+    # noise is drawn outside the rematerialized function to be reused as is.
+    compute_chunk = tf.recompute_grad(self._compute_chunk)
+    check_stderr = (not training and
+                    self._eval_mc_stderr_tolerance is not None)
+
+    def cond(i, unused_log_prob_sums, prob_sums, prob_square_sums):
+      if not check_stderr:
+        return i < num_chunks
+      # Number of independent samples (or antithetic pairs) drawn so far.
+      num_samples = tf.cast(i * num_draws, prob_sums.dtype)
+      means = prob_sums / tf.maximum(num_samples, 1.)
+      variances = tf.nn.relu(prob_square_sums / tf.maximum(num_samples, 1.) -
+                             tf.square(means))
+      max_stderr = tf.sqrt(
+          tf.reduce_max(variances) / tf.maximum(num_samples - 1., 1.))
+      converged = tf.logical_and(i > 0,
+                                 max_stderr <= self._eval_mc_stderr_tolerance)
+      return tf.logical_and(i < num_chunks, tf.logical_not(converged))
+
+    def body(i, log_prob_sums, prob_sums, prob_square_sums):
+      standard_normal_samples = tf.random.normal(
+          [num_draws, self._num_factors], dtype=locs.dtype)
+      diag_normal_samples = tf.random.normal(
+          [num_draws, self._num_classes], dtype=locs.dtype)
+      chunk_log_prob_sums, chunk_prob_square_sums = compute_chunk(
+          locs, factor_loadings, diag_scale, temperature,
+          standard_normal_samples, diag_normal_samples)
+      log_prob_sums = tf.math.reduce_logsumexp(
+          tf.stack([log_prob_sums, chunk_log_prob_sums]), axis=0)
+      if check_stderr:
+        # The sum over a chunk of the (pair averaged) probabilities follows
+        # from the logsumexp of its log-probabilities.
+        prob_sums += tf.exp(chunk_log_prob_sums) * (
+            num_draws / self._mc_chunk_size)
+        prob_square_sums += chunk_prob_square_sums
+      return i + 1, log_prob_sums, prob_sums, prob_square_sums
+
+    zeros = tf.zeros_like(locs)
+    num_iterations, log_prob_sums, _, _ = tf.while_loop(
+        cond,
+        body,
+        (tf.constant(0), tf.fill(tf.shape(locs),
+                                 tf.constant(-float('inf'), locs.dtype)),
+         zeros, zeros),
+        maximum_iterations=num_chunks)
+    num_samples = tf.cast(num_iterations * self._mc_chunk_size, locs.dtype)
+    log_probs = log_prob_sums - tf.math.log(num_samples)
+    log_probs = tf.maximum(log_probs, tf.math.log(self._eps))
+    if self._ensemble_size == 1:
+      log_probs = tf.squeeze(log_probs, axis=1)
+    return log_probs
+
+  def get_config(self):
+    config = {
+        'num_classes': self._num_classes,
+        'num_factors': self._num_factors,
+        'temperature': self._temperature,
+        'train_mc_samples': self._train_mc_samples,
+        'test_mc_samples': self._test_mc_samples,
+        'mc_chunk_size': self._mc_chunk_size,
+        'antithetic': self._antithetic,
+        'eval_mc_stderr_tolerance': self._eval_mc_stderr_tolerance,
+        'ensemble_size': self._ensemble_size,
+        'eps': self._eps,
+        'tune_temperature': self._tune_temperature,
+        'temperature_lower_bound': self._temperature_lower_bound,
+        'temperature_upper_bound': self._temperature_upper_bound,
+    }
+    config.update(super().get_config())
+    return config
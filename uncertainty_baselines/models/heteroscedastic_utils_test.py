@@ -0,0 +1,96 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for heteroscedastic_utils."""
+
+from absl.testing import parameterized
+import tensorflow as tf
+from uncertainty_baselines.models import heteroscedastic_utils
+
+
+class _ChunkCountingMCSoftmaxDenseFA(
+    heteroscedastic_utils.ChunkedMCSoftmaxDenseFA):
+  """Counts the chunks of samples evaluated by the (eager) layer."""
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self.num_chunks = 0
+
+  def _compute_chunk(self, *args):
+    self.num_chunks += 1
+    return super()._compute_chunk(*args)
+
+
+class ChunkedMCSoftmaxDenseFATest(tf.test.TestCase, parameterized.TestCase):
+
+  @parameterized.parameters((1, False), (1, True), (3, True))
+  def testPredictiveDistribution(self, ensemble_size, antithetic):
+    tf.random.set_seed(1)
+    batch_size, num_classes = 4, 5
+    inputs = tf.random.normal([batch_size, 8])
+    layer = heteroscedastic_utils.ChunkedMCSoftmaxDenseFA(
+        num_classes=num_classes,
+        num_factors=2,
+        train_mc_samples=40,
+        test_mc_samples=4000,
+        mc_chunk_size=100,
+        antithetic=antithetic,
+        ensemble_size=ensemble_size)
+    log_probs = layer(inputs, training=False)
+    expected_shape = [batch_size, num_classes]
+    if ensemble_size > 1:
+      expected_shape.insert(1, ensemble_size)
+    self.assertEqual(log_probs.shape, expected_shape)
+    self.assertAllClose(
+        tf.reduce_sum(tf.exp(log_probs), axis=-1),
+        tf.ones(expected_shape[:-1]), atol=1e-5)
+    # A second estimate with independent samples agrees within MC error.
+    self.assertAllClose(
+        tf.exp(log_probs), tf.exp(layer(inputs, training=False)), atol=0.03)
+
+  def testGradients(self):
+    inputs = tf.random.normal([4, 8])
+    layer = heteroscedastic_utils.ChunkedMCSoftmaxDenseFA(
+        num_classes=3, num_factors=2, train_mc_samples=30, mc_chunk_size=10,
+        antithetic=True, tune_temperature=True)
+    with tf.GradientTape() as tape:
+      loss = tf.reduce_mean(
+          tf.nn.sparse_softmax_cross_entropy_with_logits(
+              labels=[0, 1, 2, 0], logits=layer(inputs, training=True)))
+    grads = tape.gradient(loss, layer.trainable_variables)
+    self.assertLen(grads, 7)
+    for grad in grads:
+      self.assertIsNotNone(grad)
+      self.assertAllEqual(tf.math.is_finite(grad), tf.ones_like(grad, tf.bool))
+
+  def testEarlyStopping(self):
+    inputs = tf.random.normal([4, 8])
+    layer = _ChunkCountingMCSoftmaxDenseFA(
+        num_classes=3, num_factors=2, test_mc_samples=100000, mc_chunk_size=10,
+        eval_mc_stderr_tolerance=1.)
+    # Any estimate has a standard error below 1, so one chunk suffices.
+    log_probs = layer(inputs, training=False)
+    self.assertEqual(layer.num_chunks, 1)
+    self.assertAllClose(
+        tf.reduce_sum(tf.exp(log_probs), axis=-1), tf.ones([4]), atol=1e-5)
+
+    # Without a tolerance, all the chunks of the test samples are drawn.
+    layer = _ChunkCountingMCSoftmaxDenseFA(
+        num_classes=3, num_factors=2, test_mc_samples=50, mc_chunk_size=10)
+    layer(inputs, training=False)
+    self.assertEqual(layer.num_chunks, 5)
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -88,6 +88,29 @@ class MpnnLayer(tf.keras.layers.Layer):
 
     return message_input
 
+  def prepare_sparse_message_input(self, nodes: tf.Tensor, edges: tf.Tensor,
+                                   senders: tf.Tensor,
+                                   receivers: tf.Tensor) -> tf.Tensor:
+    """Prepares the message input tensor of a packed graph batch.
+
+    As in `prepare_message_input`, the message from node-w to node-v
+    concatenates h_v, h_w and e_{vw}, but only for the edges of the graphs
+    rather than for all pairs of nodes.
+
+    Args:
+      nodes: Float tensor with shape [num_nodes, num_node_features].
+      edges: Float tensor with shape [num_edges, num_edge_features].
+      senders: Integer tensor with shape [num_edges], the index of node-w.
+      receivers: Integer tensor with shape [num_edges], the index of node-v.
+
+    Returns:
+      Message input tensor with shape [num_edges, 2 * num_node_features +
+        num_edge_features].
+    """
+    return tf.concat(
+        [tf.gather(nodes, receivers),
+         tf.gather(nodes, senders), edges], axis=-1)
+
   def aggregate(self, messages: tf.Tensor,
                 adjacency_matrix: tf.Tensor) -> tf.Tensor:
     """Aggregates messages from node-v's neighbors.
@@ -107,6 +130,20 @@ class MpnnLayer(tf.keras.layers.Layer):
         tf.expand_dims(tf.cast(adjacency_matrix, messages.dtype), axis=-1))
     return tf.reduce_sum(neighbor_messages, axis=2)
 
+  def aggregate_sparse(self, messages: tf.Tensor, receivers: tf.Tensor,
+                       num_nodes: tf.Tensor) -> tf.Tensor:
+    """Sums the messages of the edges of a packed graph batch per receiver.
+
+    Args:
+      messages: Float tensor with shape [num_edges, message_layer_size].
+      receivers: Integer tensor with shape [num_edges].
+      num_nodes: Number of nodes of the packed graph batch.
+
+    Returns:
+      Aggregated messages with shape [num_nodes, message_layer_size].
+    """
+    return tf.math.unsorted_segment_sum(messages, receivers, num_nodes)
+
   def prepare_update_function_inputs(
       self, aggregated_messages: tf.Tensor,
       nodes: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
@@ -126,24 +163,46 @@ class MpnnLayer(tf.keras.layers.Layer):
 
     return messages_inputs, nodes_inputs
 
-  def call(self, nodes: tf.Tensor, edges: tf.Tensor) -> tf.Tensor:
+  def call(self,
+           nodes: tf.Tensor,
+           edges: tf.Tensor,
+           senders: Optional[tf.Tensor] = None,
+           receivers: Optional[tf.Tensor] = None) -> tf.Tensor:
     """Applies the layer to the given inputs.
 
+    The graphs are either dense, padded to the same number of nodes, or sparse,
+    packed into a single graph given by its list of edges (see
+    `is_sparse_graph`).
+
     Args:
-      nodes: Float tensor with shape [batch_size, num_nodes, num_node_features].
+      nodes: Float tensor with shape [batch_size, num_nodes, num_node_features],
+        or [num_nodes, num_node_features] for sparse graphs.
       edges: Float tensor with shape [batch_size, num_nodes, num_nodes,
-        num_edge_features].
+        num_edge_features], or [num_edges, num_edge_features] for sparse
+        graphs.
+      senders: Integer tensor with shape [num_edges] with the source node of
+        every edge of sparse graphs, None for dense graphs.
+      receivers: Integer tensor with shape [num_edges] with the target node of
+        every edge of sparse graphs, None for dense graphs.
 
     Returns:
       Updated nodes tensor.
     """
-    # Generate messages from nodes and edges.
-    message_input = self.prepare_message_input(nodes, edges)
-    messages = self.message_function(message_input)
-
-    # Aggregates messages from neighbors.
-    adjacency_matrix = get_adjacency_matrix(edges)
-    aggregated_messages = self.aggregate(messages, adjacency_matrix)
+    if senders is None:
+      # Generate messages from nodes and edges.
+      message_input = self.prepare_message_input(nodes, edges)
+      messages = self.message_function(message_input)
+
+      # Aggregates messages from neighbors.
+      adjacency_matrix = get_adjacency_matrix(edges)
+      aggregated_messages = self.aggregate(messages, adjacency_matrix)
+    else:
+      # Only the messages along the edges are computed.
+      message_input = self.prepare_sparse_message_input(
+          nodes, edges, senders, receivers)
+      messages = self.message_function(message_input)
+      aggregated_messages = self.aggregate_sparse(messages, receivers,
+                                                  tf.shape(nodes)[0])
 
     # Update nodes features by feeding messages into original
     # nodes features.
@@ -176,6 +235,47 @@ def get_adjacency_matrix(pairs: tf.Tensor) -> tf.Tensor:
       tf.cast(pairs[:, :, :, :num_edge_types], tf.bool), axis=-1)
 
 
+def is_sparse_graph(inputs: Dict[str, tf.Tensor]) -> bool:
+  """Returns whether the inputs are a packed batch of sparse graphs.
+
+  A packed batch concatenates the nodes of all graphs, without padding, and
+  represents the edges as a list. It has features:
+    * 'atoms': Float tensor with shape [num_nodes, num_node_features].
+    * 'edge_features': Float tensor with shape [num_edges, num_edge_features].
+    * 'senders', 'receivers': Integer tensors with shape [num_edges], the
+      source and target nodes of every edge.
+    * 'node_graph_ids': Integer tensor with shape [num_nodes], the graph of
+      every node.
+    * 'num_nodes': Integer tensor with shape [batch_size], the number of nodes
+      of every graph.
+
+  Args:
+    inputs: Dictionary of input features.
+
+  Returns:
+    True for a packed batch of sparse graphs, False for padded dense graphs.
+  """
+  return 'senders' in inputs
+
+
+def graph_sum(node_values: tf.Tensor,
+              inputs: Dict[str, tf.Tensor]) -> tf.Tensor:
+  """Sums node level values over the nodes of every graph.
+
+  Args:
+    node_values: Float tensor with shape [batch_size, num_nodes, dim], or
+      [num_nodes, dim] for sparse graphs.
+    inputs: Dictionary of input features of the graphs.
+
+  Returns:
+    Graph level values with shape [batch_size, dim].
+  """
+  if is_sparse_graph(inputs):
+    return tf.math.unsorted_segment_sum(node_values, inputs['node_graph_ids'],
+                                        tf.shape(inputs['num_nodes'])[0])
+  return tf.reduce_sum(node_values, axis=1)
+
+
 class MpnnModel(tf.keras.Model):
   """Classifier model based on a MPNN encoder."""
 
@@ -254,17 +354,24 @@ class MpnnModel(tf.keras.Model):
 
   def call(self, inputs, training=False):
 
-    nodes, edges = inputs['atoms'], inputs['pairs']
+    nodes = inputs['atoms']
+    if is_sparse_graph(inputs):
+      edges = inputs['edge_features']
+      senders, receivers = inputs['senders'], inputs['receivers']
+    else:
+      edges = inputs['pairs']
+      senders, receivers = None, None
     nodes_under_iter = nodes
     for mpnn_layer in self.mpnn_layers:
-      nodes_under_iter = mpnn_layer(nodes_under_iter, edges)
+      nodes_under_iter = mpnn_layer(
+          nodes_under_iter, edges, senders=senders, receivers=receivers)
 
-    readout = tf.reduce_sum(
+    readout = graph_sum(
         tf.multiply(
             self.i_layer_final(
                 tf.keras.layers.Concatenate()([nodes_under_iter, nodes])),
             self.j_layer_final(nodes_under_iter)),
-        axis=1)
+        inputs)
 
     logits = self.classifier(readout, training=training)
     if self.use_gp_layer:
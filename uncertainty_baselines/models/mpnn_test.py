@@ -17,6 +17,7 @@
 import tensorflow as tf
 
 import uncertainty_baselines as ub
+from uncertainty_baselines.datasets import drug_cardiotoxicity
 
 
 class MpnnTest(tf.test.TestCase):
@@ -62,5 +63,41 @@ class MpnnTest(tf.test.TestCase):
 
     self.assertEqual(logits_shape_observed, logits_shape_expected)
 
+  def test_mpnn_sparse_graph_matches_dense(self):
+    """Tests if MPNN gives the same outputs on packed sparse graphs."""
+    model = ub.models.mpnn(
+        node_feature_dim=self.node_dim,
+        num_classes=self.num_classes,
+        num_layers=self.num_layers,
+        message_layer_size=self.message_layer_size,
+        readout_layer_size=self.readout_layer_size)
+
+    # Molecules without padding atoms, with random bonds.
+    tf.random.set_seed(self.random_seed)
+    bonds = tf.cast(
+        tf.random.uniform((self.batch_size, self.max_nodes, self.max_nodes)) <
+        0.1, tf.float32)
+    pairs = tf.concat([
+        bonds[..., None],
+        tf.zeros((self.batch_size, self.max_nodes, self.max_nodes, 3)),
+        bonds[..., None] * tf.random.normal(
+            (self.batch_size, self.max_nodes, self.max_nodes,
+             self.edge_dim - 4))
+    ], axis=-1)
+    inputs = {
+        "atoms":
+            tf.random.normal((self.batch_size, self.max_nodes, self.node_dim)),
+        "pairs":
+            pairs,
+        "atom_mask":
+            tf.ones((self.batch_size, self.max_nodes)),
+    }
+    sparse_inputs = drug_cardiotoxicity.pack_graph_batch(inputs)
+
+    self.assertAllClose(
+        model(inputs, training=False),
+        model(sparse_inputs, training=False),
+        atol=1e-5)
+
 if __name__ == "__main__":
   tf.test.main()
@@ -16,8 +16,11 @@
 """ResNet50 model."""
 
 import string
+from typing import Optional
+
 import edward2 as ed
 import tensorflow as tf
+from uncertainty_baselines.models import heteroscedastic_utils
 
 # Use batch normalization defaults from Pytorch.
 BATCH_NORM_DECAY = 0.9
@@ -123,7 +126,11 @@ def resnet50_het_mimo(
     num_mc_samples=10000,
     eps=1e-5,
     width_multiplier=1,
-    return_unaveraged_logits=False):
+    return_unaveraged_logits=False,
+    num_eval_mc_samples: Optional[int] = None,
+    mc_chunk_size: Optional[int] = None,
+    antithetic_mc_samples: bool = False,
+    eval_mc_stderr_tolerance: Optional[float] = None):
   """Builds a multiheaded ResNet50 with an heteroscedastic layer.
 
   Using strided conv, pooling, four groups of residual blocks, and pooling, the
@@ -143,13 +150,24 @@ def resnet50_het_mimo(
         layer of output size (num_classes * ensemble_size), or to generate an
         ensemble size number of het. layers with num_classes as output size.
     num_mc_samples: The number of Monte-Carlo samples used to estimate the
-        predictive distribution.
+        predictive distribution during training, and during evaluation unless
+        `num_eval_mc_samples` is set.
     eps: Float. Clip probabilities into [eps, 1.0] softmax or
         [eps, 1.0 - eps] sigmoid before applying log (softmax), or inverse
         sigmoid.
     width_multiplier: Multiply the number of filters for wide ResNet.
     return_unaveraged_logits: Boolean. Whether to also return the logits
         before taking the MC average over samples.
+    num_eval_mc_samples: Optional number of Monte-Carlo samples used during
+      evaluation. Defaults to `num_mc_samples`.
+    mc_chunk_size: If set, the Monte-Carlo estimate is accumulated over chunks
+      of `mc_chunk_size` samples with `ChunkedMCSoftmaxDenseFA`, which never
+      materializes the logits of all the samples.
+    antithetic_mc_samples: Whether to draw antithetic pairs of samples. Requires
+      `mc_chunk_size`.
+    eval_mc_stderr_tolerance: If set, the evaluation stops sampling once the
+      Monte-Carlo standard error of the predictive probabilities is below this
+      tolerance. Requires `mc_chunk_size`.
 
   Returns:
     tf.keras.Model.
@@ -190,23 +208,45 @@ def resnet50_het_mimo(
                 width_multiplier * 2048], stage=5, num_blocks=3, strides=2)
   x = tf.keras.layers.GlobalAveragePooling2D(name='avg_pool')(x)
   assert num_factors > 0
-  het_layer_args = {'temperature': temperature,
-                    'train_mc_samples': num_mc_samples,
-                    'test_mc_samples': num_mc_samples,
-                    'share_samples_across_batch': True,
-                    'num_classes': num_classes, 'num_factors': num_factors,
-                    'logits_only': True, 'eps': eps,
-                    'dtype': tf.float32, 'name': 'fc1000',
-                    'return_unaveraged_logits': return_unaveraged_logits}
+  if num_eval_mc_samples is None:
+    num_eval_mc_samples = num_mc_samples
+  if mc_chunk_size is not None:
+    if return_unaveraged_logits:
+      raise ValueError('Chunked Monte-Carlo sampling does not materialize the '
+                       'unaveraged logits.')
+    het_layer_args = {'temperature': temperature,
+                      'train_mc_samples': num_mc_samples,
+                      'test_mc_samples': num_eval_mc_samples,
+                      'mc_chunk_size': mc_chunk_size,
+                      'antithetic': antithetic_mc_samples,
+                      'eval_mc_stderr_tolerance': eval_mc_stderr_tolerance,
+                      'num_classes': num_classes, 'num_factors': num_factors,
+                      'eps': eps, 'dtype': tf.float32, 'name': 'fc1000'}
+    het_layer_cls = heteroscedastic_utils.ChunkedMCSoftmaxDenseFA
+    multi_head_het_layer_cls = heteroscedastic_utils.ChunkedMCSoftmaxDenseFA
+  else:
+    if antithetic_mc_samples or eval_mc_stderr_tolerance is not None:
+      raise ValueError('Antithetic sampling and early stopping of the '
+                       'Monte-Carlo estimate require mc_chunk_size.')
+    het_layer_args = {'temperature': temperature,
+                      'train_mc_samples': num_mc_samples,
+                      'test_mc_samples': num_eval_mc_samples,
+                      'share_samples_across_batch': True,
+                      'num_classes': num_classes, 'num_factors': num_factors,
+                      'logits_only': True, 'eps': eps,
+                      'dtype': tf.float32, 'name': 'fc1000',
+                      'return_unaveraged_logits': return_unaveraged_logits}
+    het_layer_cls = ed.layers.MCSoftmaxDenseFA
+    multi_head_het_layer_cls = ed.layers.MultiHeadMCSoftmaxDenseFA
   if share_het_layer:
     het_layer_args.update({'ensemble_size': ensemble_size})
-    output_layer = ed.layers.MultiHeadMCSoftmaxDenseFA(**het_layer_args)
+    output_layer = multi_head_het_layer_cls(**het_layer_args)
     x = output_layer(x)
   else:
     output_het = []
     for i in range(ensemble_size):
       het_layer_args.update({'name': 'ensemble_' + str(i) + '_fc1000'})
-      output_layer = ed.layers.MCSoftmaxDenseFA(**het_layer_args)
+      output_layer = het_layer_cls(**het_layer_args)
       output_het.append(output_layer(x))
     x = tf.stack(output_het, axis=1)
   return tf.keras.Model(inputs=inputs, outputs=x, name='resnet50')
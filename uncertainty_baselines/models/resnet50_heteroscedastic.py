@@ -32,6 +32,7 @@ from typing import Optional
 
 import edward2 as ed
 import tensorflow as tf
+from uncertainty_baselines.models import heteroscedastic_utils
 
 # Use batch normalization defaults from Pytorch.
 BATCH_NORM_DECAY = 0.9
@@ -137,7 +138,11 @@ def resnet50_heteroscedastic(input_shape,
                              return_unaveraged_logits=False,
                              tune_temperature: bool = False,
                              temperature_lower_bound: Optional[float] = None,
-                             temperature_upper_bound: Optional[float] = None):
+                             temperature_upper_bound: Optional[float] = None,
+                             num_eval_mc_samples: Optional[int] = None,
+                             mc_chunk_size: Optional[int] = None,
+                             antithetic_mc_samples: bool = False,
+                             eval_mc_stderr_tolerance: Optional[float] = None):
   """Builds ResNet50.
 
   Using strided conv, pooling, four groups of residual blocks, and pooling, the
@@ -153,7 +158,8 @@ def resnet50_heteroscedastic(input_shape,
       rank covariance matrix. If num_factors <= 0, then the diagonal covariance
       method MCSoftmaxDense is used.
     num_mc_samples: The number of Monte-Carlo samples used to estimate the
-        predictive distribution.
+        predictive distribution during training, and during evaluation unless
+        `num_eval_mc_samples` is set.
     multiclass: Boolean. If True then return a multiclass classifier, otherwise
       a multilabel classifier.
     eps: Float. Clip probabilities into [eps, 1.0] softmax or
@@ -167,6 +173,17 @@ def resnet50_heteroscedastic(input_shape,
       when it is optimized. By default, a pre-defined lower bound is used.
     temperature_upper_bound: Float. The highest value the temperature can take
       when it is optimized. By default, a pre-defined upper bound is used.
+    num_eval_mc_samples: Optional number of Monte-Carlo samples used during
+      evaluation. Defaults to `num_mc_samples`.
+    mc_chunk_size: If set, the Monte-Carlo estimate is accumulated over chunks
+      of `mc_chunk_size` samples with `ChunkedMCSoftmaxDenseFA`, which never
+      materializes the logits of all the samples. Requires a multiclass
+      classifier with `num_factors > 0`.
+    antithetic_mc_samples: Whether to draw antithetic pairs of samples. Requires
+      `mc_chunk_size`.
+    eval_mc_stderr_tolerance: If set, the evaluation stops sampling once the
+      Monte-Carlo standard error of the predictive probabilities is below this
+      tolerance. Requires `mc_chunk_size`.
 
   Returns:
     tf.keras.Model.
@@ -194,9 +211,39 @@ def resnet50_heteroscedastic(input_shape,
 
   x = tf.keras.layers.GlobalAveragePooling2D(name='avg_pool')(x)
 
+  if num_eval_mc_samples is None:
+    num_eval_mc_samples = num_mc_samples
+  if mc_chunk_size is not None:
+    if not multiclass or num_factors <= 0:
+      raise ValueError('Chunked Monte-Carlo sampling requires a multiclass '
+                       'classifier with num_factors > 0.')
+    if return_unaveraged_logits:
+      raise ValueError('Chunked Monte-Carlo sampling does not materialize the '
+                       'unaveraged logits.')
+    output_layer = heteroscedastic_utils.ChunkedMCSoftmaxDenseFA(
+        num_classes=num_classes,
+        num_factors=num_factors,
+        temperature=temperature,
+        train_mc_samples=num_mc_samples,
+        test_mc_samples=num_eval_mc_samples,
+        mc_chunk_size=mc_chunk_size,
+        antithetic=antithetic_mc_samples,
+        eval_mc_stderr_tolerance=eval_mc_stderr_tolerance,
+        eps=eps,
+        tune_temperature=tune_temperature,
+        temperature_lower_bound=temperature_lower_bound,
+        temperature_upper_bound=temperature_upper_bound,
+        dtype=tf.float32,
+        name='fc1000')
+    return tf.keras.Model(
+        inputs=inputs, outputs=output_layer(x), name='resnet50')
+  if antithetic_mc_samples or eval_mc_stderr_tolerance is not None:
+    raise ValueError('Antithetic sampling and early stopping of the '
+                     'Monte-Carlo estimate require mc_chunk_size.')
+
   het_layer_args = {'temperature': temperature,
                     'train_mc_samples': num_mc_samples,
-                    'test_mc_samples': num_mc_samples,
+                    'test_mc_samples': num_eval_mc_samples,
                     'share_samples_across_batch': True,
                     'logits_only': True, 'eps': eps,
                     'dtype': tf.float32, 'name': 'fc1000',
@@ -187,7 +187,7 @@ def resnet50_hetsngp_add_last_layer(
     gp_bias, gp_input_normalization, gp_random_feature_type,
     gp_cov_discount_factor, gp_cov_ridge_penalty,
     gp_output_imagenet_initializer, temperature, num_mc_samples, eps,
-    sngp_var_weight, het_var_weight):
+    sngp_var_weight, het_var_weight, num_eval_mc_samples=None):
   """Builds ResNet50.
 
   Using strided conv, pooling, four groups of residual blocks, and pooling, the
@@ -217,17 +217,22 @@ def resnet50_hetsngp_add_last_layer(
     temperature: Float or scalar `Tensor` representing the softmax
       temperature.
     num_mc_samples: The number of Monte-Carlo samples used to estimate the
-        predictive distribution.
+        predictive distribution during training, and during evaluation unless
+        `num_eval_mc_samples` is set.
     eps: Float. Clip probabilities into [eps, 1.0] softmax or
         [eps, 1.0 - eps] sigmoid before applying log (softmax), or inverse
         sigmoid.
     sngp_var_weight: Weight in [0,1] for the SNGP variance in the output.
     het_var_weight: Weight in [0,1] for the het. variance in the output.
+    num_eval_mc_samples: Optional number of Monte-Carlo samples used during
+      evaluation. Defaults to `num_mc_samples`.
 
   Returns:
     tf.keras.Model.
   """
   x = tf.keras.layers.GlobalAveragePooling2D(name='avg_pool')(x)
+  if num_eval_mc_samples is None:
+    num_eval_mc_samples = num_mc_samples
 
   if use_gp_layer:
     gp_output_initializer = None
@@ -250,7 +255,7 @@ def resnet50_hetsngp_add_last_layer(
         kernel_initializer=gp_output_initializer,
         temperature=temperature,
         train_mc_samples=num_mc_samples,
-        test_mc_samples=num_mc_samples,
+        test_mc_samples=num_eval_mc_samples,
         share_samples_across_batch=True,
         logits_only=True,
         eps=eps,
@@ -292,7 +297,8 @@ def resnet50_hetsngp(input_shape,
                      eps=1e-5,
                      sngp_var_weight=1.,
                      het_var_weight=1.,
-                     omit_last_layer=False):
+                     omit_last_layer=False,
+                     num_eval_mc_samples=None):
   """Builds ResNet50.
 
   Using strided conv, pooling, four groups of residual blocks, and pooling, the
@@ -331,7 +337,8 @@ def resnet50_hetsngp(input_shape,
     temperature: Float or scalar `Tensor` representing the softmax
       temperature.
     num_mc_samples: The number of Monte-Carlo samples used to estimate the
-        predictive distribution.
+        predictive distribution during training, and during evaluation unless
+        `num_eval_mc_samples` is set.
     eps: Float. Clip probabilities into [eps, 1.0] softmax or
         [eps, 1.0 - eps] sigmoid before applying log (softmax), or inverse
         sigmoid.
@@ -339,6 +346,8 @@ def resnet50_hetsngp(input_shape,
     het_var_weight: Weight in [0,1] for the het. variance in the output.
     omit_last_layer: Optional. Omits the last pooling layer if it is set to
       True.
+    num_eval_mc_samples: Optional number of Monte-Carlo samples used during
+      evaluation. Defaults to `num_mc_samples`.
 
   Returns:
     tf.keras.Model.
@@ -408,4 +417,4 @@ def resnet50_hetsngp(input_shape,
       gp_scale, gp_bias, gp_input_normalization, gp_random_feature_type,
       gp_cov_discount_factor, gp_cov_ridge_penalty,
       gp_output_imagenet_initializer, temperature, num_mc_samples, eps,
-      sngp_var_weight, het_var_weight)
+      sngp_var_weight, het_var_weight, num_eval_mc_samples)
@@ -19,6 +19,7 @@ import string
 
 import edward2 as ed
 import tensorflow as tf
+from uncertainty_baselines.models import classifier_utils
 
 
 # Use batch normalization defaults from Pytorch.
@@ -224,7 +225,7 @@ def resnet50_sngp_add_last_layer(inputs, x, num_classes, use_gp_layer,
       # Use the same initializer as dense
       gp_output_initializer = tf.keras.initializers.RandomNormal(stddev=0.01)
     output_layer = functools.partial(
-        ed.layers.RandomFeatureGaussianProcess,
+        classifier_utils.CachedRandomFeatureGaussianProcess,
         num_inducing=gp_hidden_dim,
         gp_kernel_scale=gp_scale,
         gp_output_bias=gp_bias,
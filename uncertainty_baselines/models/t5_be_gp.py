@@ -52,6 +52,11 @@ class BEGpDecoder(t5_gp.GaussianProcessDecoder):
   mean_field_factor: float = -1.
   ridge_penalty: float = 1.
   steps_per_epoch: Optional[int] = None
+  # Parameters of the precision matrix updates, see
+  # `t5_gp.GaussianProcessDecoder`.
+  covmat_position_stride: int = 1
+  covmat_accumulation_dtype: Optional[DType] = None
+  covmat_refresh_steps: int = 1
 
   @nn.compact
   def __call__(self,
@@ -143,7 +148,7 @@ class BEGpDecoder(t5_gp.GaussianProcessDecoder):
     # TODO(phandu): Consider adding a new class field like
     # `store_random_features` for `return_random_features` argument
     # of RandomFeatureGaussianProcess.
-    x_gp = self._apply_gp_layer(y, train=train)
+    x_gp = self._apply_gp_layer(y, train=train, decode=decode)
 
     # Gaussian process layer output: a tuple of logits, covmat, and
     # optionally random features.
@@ -183,6 +188,11 @@ class TransformerBEGp(t5_network.Transformer):
   mean_field_factor: float = -1.
   ridge_penalty: float = 1.
   steps_per_epoch: Optional[int] = None
+  # Parameters of the precision matrix updates, see
+  # `t5_gp.GaussianProcessDecoder`.
+  covmat_position_stride: int = 1
+  covmat_accumulation_dtype: Optional[DType] = None
+  covmat_refresh_steps: int = 1
 
   def setup(self):
     cfg = self.config
@@ -206,6 +216,9 @@ class TransformerBEGp(t5_network.Transformer):
         mean_field_factor=self.mean_field_factor,
         ridge_penalty=self.ridge_penalty,
         steps_per_epoch=self.steps_per_epoch,
+        covmat_position_stride=self.covmat_position_stride,
+        covmat_accumulation_dtype=self.covmat_accumulation_dtype,
+        covmat_refresh_steps=self.covmat_refresh_steps,
         ens_size=self.ens_size,
         random_sign_init=self.random_sign_init,
         be_decoder_layers=self.be_decoder_layers)
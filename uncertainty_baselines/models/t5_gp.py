@@ -21,11 +21,73 @@ import flax.core
 import flax.linen as nn
 import jax
 import jax.numpy as jnp
+import jax.scipy.linalg
 import t5x.examples.t5.layers as t5_layers
 import t5x.examples.t5.network as t5_network
 
 # Jax data types.
 Array = Any
+DType = Any
+
+
+def _random_features_and_logits(gp_layer, inputs):
+  """Computes the random features and the logits of `gp_layer`."""
+  if gp_layer.normalize_input:
+    inputs = gp_layer.norm_layer(inputs)
+  gp_features = gp_layer.hidden_layer(inputs)
+  return gp_features, gp_layer.output_layer(gp_features)
+
+
+def subsample_positions(gp_features: Array, stride: int,
+                        offset: Array) -> Array:
+  """Selects every `stride`-th position of the random features.
+
+  Args:
+    gp_features: Random features of shape [batch, length, hidden_features].
+    stride: Distance between two selected positions.
+    offset: Index of the first selected position, in [0, stride).
+
+  Returns:
+    The random features of the selected positions, flattened to shape
+    [batch * ceil(length / stride), hidden_features]. The positions past the
+    end of the sequences are filled with zeros.
+  """
+  hidden_features = gp_features.shape[-1]
+  if stride > 1:
+    length = gp_features.shape[-2]
+    padding = [(0, 0)] * (gp_features.ndim - 2) + [(0, -length % stride),
+                                                    (0, 0)]
+    gp_features = jnp.pad(gp_features, padding)
+    gp_features = gp_features.reshape(gp_features.shape[:-2] +
+                                      (-1, stride, hidden_features))
+    gp_features = jnp.take(gp_features, offset, axis=-2)
+  return gp_features.reshape(-1, hidden_features)
+
+
+def predictive_variance(precision_matrix: Array, gp_features: Array,
+                        ridge_penalty: float) -> Array:
+  """Computes the posterior variance of each position.
+
+  The variance ridge_penalty * phi^T P^{-1} phi of each random feature phi is
+  computed with a Cholesky factorization of the precision matrix P and a
+  triangular solve, rather than by inverting P.
+
+  Args:
+    precision_matrix: Precision matrix of shape [hidden_features,
+      hidden_features].
+    gp_features: Random features of shape [..., hidden_features].
+    ridge_penalty: Ridge penalty of the covariance.
+
+  Returns:
+    The variances, of shape gp_features.shape[:-1].
+  """
+  batch_shape = gp_features.shape[:-1]
+  gp_features = gp_features.reshape(-1, gp_features.shape[-1])
+  cholesky = jnp.linalg.cholesky(precision_matrix)
+  solved_features = jax.scipy.linalg.solve_triangular(
+      cholesky, gp_features.T.astype(cholesky.dtype), lower=True)
+  variance = ridge_penalty * jnp.sum(jnp.square(solved_features), axis=0)
+  return variance.reshape(batch_shape)
 
 
 # This class follows `network.Decoder` implementation.
@@ -42,11 +104,27 @@ class GaussianProcessDecoder(nn.Module):
   mean_field_factor: float = -1.
   ridge_penalty: float = 1.
   steps_per_epoch: Optional[int] = None
+  # Parameters of the precision matrix updates. Every train step updates the
+  # precision matrix from one in `covmat_position_stride` decoder positions,
+  # cycling through the positions across steps. If
+  # `covmat_accumulation_dtype` is set, the updates are accumulated in that
+  # dtype and added to the float32 precision matrix every
+  # `covmat_refresh_steps` steps.
+  covmat_position_stride: int = 1
+  covmat_accumulation_dtype: Optional[DType] = None
+  covmat_refresh_steps: int = 1
 
   def setup(self):
     if self.config.logits_via_embedding:
       raise ValueError('Sharing the embedding weights in the decoder output '
                        'layer is not supported in the GP decoder.')
+    if self.covmat_position_stride < 1 or self.covmat_refresh_steps < 1:
+      raise ValueError('covmat_position_stride and covmat_refresh_steps must '
+                       'be positive.')
+    if (self.covmat_accumulation_dtype is not None and
+        self.covmat_momentum >= 0.):
+      raise ValueError('Accumulating the precision matrix updates requires '
+                       'exact updates, i.e. a negative covmat_momentum.')
     # pylint:disable=not-a-mapping
     if self.use_gp_layer:
       covmat_momentum = None if self.covmat_momentum < 0. else self.covmat_momentum
@@ -56,7 +134,43 @@ class GaussianProcessDecoder(nn.Module):
           features=self.config.vocab_size, name='gp_head', **gp_layer_kwargs)
     # pylint:enable=not-a-mapping
 
-  def _apply_gp_layer(self, y, train=True):
+  def _update_precision_matrix(self, gp_state, gp_features, step):
+    """Updates the precision matrix from the features of a train step."""
+    covmat_collection_name = self.gp_layer.covmat_layer.collection_name
+    covmat_state = gp_state[covmat_collection_name]['covmat_layer']
+    precision_matrix = covmat_state['precision_matrix']
+    stride = self.covmat_position_stride
+    offset = (step % stride).astype(jnp.int32)
+    gp_features = subsample_positions(gp_features, stride, offset)
+    gp_features = gp_features.astype(precision_matrix.dtype)
+    batch_precision_matrix = jnp.matmul(gp_features.T, gp_features)
+    if self.covmat_momentum >= 0.:
+      batch_precision_matrix /= gp_features.shape[0]
+      precision_matrix = (
+          self.covmat_momentum * precision_matrix +
+          (1. - self.covmat_momentum) * batch_precision_matrix)
+    else:
+      # Rescales the update of the subsampled positions to estimate the
+      # update of all positions.
+      batch_precision_matrix *= stride
+      if self.covmat_accumulation_dtype is None:
+        precision_matrix += batch_precision_matrix
+      else:
+        precision_matrix_delta = (
+            gp_state['precision_matrix_delta'] +
+            batch_precision_matrix.astype(self.covmat_accumulation_dtype))
+        refresh = (step + 1.) % self.covmat_refresh_steps < 0.5
+        precision_matrix = jnp.where(
+            refresh, precision_matrix +
+            precision_matrix_delta.astype(precision_matrix.dtype),
+            precision_matrix)
+        gp_state['precision_matrix_delta'] = jnp.where(
+            refresh, jnp.zeros_like(precision_matrix_delta),
+            precision_matrix_delta)
+    covmat_state['precision_matrix'] = precision_matrix
+    return gp_state
+
+  def _apply_gp_layer(self, y, train=True, decode=False):
     initializing = self.is_mutable_collection('params')
     if initializing:
       rng = self.make_rng('params')
@@ -71,46 +185,68 @@ class GaussianProcessDecoder(nn.Module):
       # variables of the random fourier feature module) into the 'params'
       # scope.
       variables['step'] = jnp.array(0., dtype=jnp.float32)
+      if self.covmat_accumulation_dtype is not None:
+        covmat_collection_name = self.gp_layer.covmat_layer.collection_name
+        precision_matrix = variables[covmat_collection_name]['covmat_layer'][
+            'precision_matrix']
+        variables['precision_matrix_delta'] = jnp.zeros(
+            precision_matrix.shape, dtype=self.covmat_accumulation_dtype)
       variables = flax.core.freeze(variables)
       self.scope.put_variable('params', 'gp_head_state', variables)
+      return x_gp
+
+    gp_params = self.scope.get_variable('params', self.gp_layer.name)
+    gp_state = self.scope.get_variable('params', 'gp_head_state')
+    # We will stop gradient here so that the gradient of the loss with
+    # respect to those states will be zero.
+    gp_state = jax.lax.stop_gradient(flax.core.unfreeze(gp_state))
+    step = gp_state.pop('step')
+    covmat_collection_name = self.gp_layer.covmat_layer.collection_name
+    covmat_state = gp_state[covmat_collection_name]['covmat_layer']
+    if train and self.covmat_momentum < 0 and (self.steps_per_epoch
+                                               is not None):
+      # Reset precision matrix at the start of the new epoch.
+      reset_covmat = (step % self.steps_per_epoch) < 0.5
+      precision_matrix = covmat_state['precision_matrix']
+      covmat_state['precision_matrix'] = jnp.where(
+          reset_covmat,
+          self.ridge_penalty * jnp.eye(precision_matrix.shape[0],
+                                       dtype=precision_matrix.dtype),
+          precision_matrix)
+      if self.covmat_accumulation_dtype is not None:
+        gp_state['precision_matrix_delta'] = jnp.where(
+            reset_covmat, 0., gp_state['precision_matrix_delta']).astype(
+                self.covmat_accumulation_dtype)
+
+    variables = {k: v for k, v in gp_state.items()
+                 if k != 'precision_matrix_delta'}
+    variables['params'] = gp_params
+    variables = flax.core.freeze(variables)
+    gp_features, gp_logits = self.gp_layer.apply(
+        variables, y, method=_random_features_and_logits)
+
+    if train:
+      # The predictive covariance is not needed in training, so only the
+      # precision matrix is updated.
+      gp_covmat = None
+      new_state = self._update_precision_matrix(gp_state, gp_features, step)
+      new_state['step'] = step + 1.
+      new_state = flax.core.freeze(new_state)
+      self.sow('intermediates', 'gp_head_state_new', new_state)
+    elif decode and self.mean_field_factor < 0:
+      # Decoding steps only need the variances to adjust the logits. The
+      # variances of the decoded sequences are computed by scoring them.
+      gp_covmat = None
     else:
-      gp_params = self.scope.get_variable('params', self.gp_layer.name)
-      gp_state = self.scope.get_variable('params', 'gp_head_state')
-      gp_state = flax.core.unfreeze(gp_state)
-      step = gp_state.pop('step')
-      if self.covmat_momentum < 0 and (self.steps_per_epoch is not None):
-        # Reset precision matrix at the start of the new epoch.
-        reset_covmat = (step % self.steps_per_epoch) < 0.5
-      else:
-        reset_covmat = 0.
-      covmat_collection_name = self.gp_layer.covmat_layer.collection_name
-      covmat_state = gp_state[covmat_collection_name]['covmat_layer']
-      prec_mat_old = covmat_state['precision_matrix']
-      prec_mat_new = (
-          (1. - reset_covmat) * prec_mat_old +
-          reset_covmat * jnp.eye(prec_mat_old.shape[0]) * self.ridge_penalty)
-      covmat_state['precision_matrix'] = prec_mat_new
-
-      # We will stop gradient here so that the gradient of the loss with
-      # respect to those states will be zero.
-      variables = jax.lax.stop_gradient(gp_state)
-      variables['params'] = gp_params
-      variables = flax.core.freeze(variables)
-      if train:
-        x_gp, new_state = self.gp_layer.apply(
-            variables,
-            y,
-            return_full_covmat=False,
-            mutable=list(gp_state.keys()))
-        # Update step.
-        new_state = flax.core.unfreeze(new_state)
-        new_state['step'] = step + 1.
-        new_state = flax.core.freeze(new_state)
-        self.sow('intermediates', 'gp_head_state_new', new_state)
-      else:
-        x_gp = self.gp_layer.apply(variables, y, return_full_covmat=False)
+      precision_matrix = covmat_state['precision_matrix']
+      if self.covmat_accumulation_dtype is not None:
+        precision_matrix += gp_state['precision_matrix_delta'].astype(
+            precision_matrix.dtype)
+      gp_covmat = predictive_variance(
+          precision_matrix, gp_features,
+          self.gp_layer.covmat_layer.ridge_penalty)
 
-    return x_gp
+    return gp_logits, gp_covmat
 
   # Different from ViT implementation, we will store the intermediate values
   # using `self.sow('intermediates', ...)` to preserve the signature of this
@@ -190,7 +326,7 @@ class GaussianProcessDecoder(nn.Module):
       # TODO(phandu): Consider adding a new class field like
       # `store_random_features` for `return_random_features` argument
       # of RandomFeatureGaussianProcess.
-      x_gp = self._apply_gp_layer(y, train=train)
+      x_gp = self._apply_gp_layer(y, train=train, decode=decode)
 
       # Gaussian process layer output: a tuple of logits, covmat, and
       # optionally random features.
@@ -227,6 +363,10 @@ class TransformerGaussianProcess(t5_network.Transformer):
   mean_field_factor: float = -1.
   ridge_penalty: float = 1.
   steps_per_epoch: Optional[int] = None
+  # Parameters of the precision matrix updates, see `GaussianProcessDecoder`.
+  covmat_position_stride: int = 1
+  covmat_accumulation_dtype: Optional[DType] = None
+  covmat_refresh_steps: int = 1
 
   def setup(self):
     cfg = self.config
@@ -249,4 +389,7 @@ class TransformerGaussianProcess(t5_network.Transformer):
         normalize_input=self.normalize_input,
         mean_field_factor=self.mean_field_factor,
         ridge_penalty=self.ridge_penalty,
-        steps_per_epoch=self.steps_per_epoch)
+        steps_per_epoch=self.steps_per_epoch,
+        covmat_position_stride=self.covmat_position_stride,
+        covmat_accumulation_dtype=self.covmat_accumulation_dtype,
+        covmat_refresh_steps=self.covmat_refresh_steps)
@@ -203,6 +203,53 @@ class T5Test(absltest.TestCase):
                 ['precision_matrix'],
                 rtol=0.1))
 
+  def test_accumulated_precision_matrix_updates(self):
+    module = dataclasses.replace(
+        self.module,
+        steps_per_epoch=None,
+        covmat_position_stride=2,
+        covmat_accumulation_dtype=jnp.bfloat16,
+        covmat_refresh_steps=2)
+    params = {
+        'params':
+            module.init(
+                jax.random.PRNGKey(3), **self.data,
+                enable_dropout=False)['params']
+    }
+    state_init = params['params']['decoder']['gp_head_state']
+    states = []
+    for i in range(2):
+      _, variables = module.apply(
+          params,
+          **self.data,
+          enable_dropout=True,
+          rngs={'dropout': jax.random.PRNGKey(i)},
+          mutable='intermediates')
+      state_new = variables['intermediates']['decoder']['gp_head_state_new'][0]
+      params = flax.core.unfreeze(params)
+      params['params']['decoder']['gp_head_state'] = state_new
+      params = flax.core.freeze(params)
+      states.append(state_new)
+
+    get_precision_matrix = (
+        lambda s: s['laplace_covariance']['covmat_layer']['precision_matrix'])
+    # The first update is only accumulated in low precision.
+    self.assertEqual(states[0]['precision_matrix_delta'].dtype, jnp.bfloat16)
+    np.testing.assert_allclose(
+        get_precision_matrix(states[0]), get_precision_matrix(state_init))
+    self.assertGreater(jnp.abs(states[0]['precision_matrix_delta']).max(), 0.)
+    # The second update refreshes the float32 precision matrix.
+    np.testing.assert_allclose(states[1]['precision_matrix_delta'], 0.)
+    self.assertFalse(
+        jnp.allclose(
+            get_precision_matrix(states[1]), get_precision_matrix(state_init)))
+
+    # The evaluation uses the accumulated updates.
+    _, variables = module.apply(
+        params, **self.data, enable_dropout=False, mutable='intermediates')
+    covmat = variables['intermediates']['decoder']['covmat'][0]
+    self.assertEqual(covmat.shape, self.data['decoder_target_tokens'].shape)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -19,6 +19,7 @@ from absl import logging
 
 import edward2 as ed
 import tensorflow as tf
+from uncertainty_baselines.models import classifier_utils
 
 
 # pylint: disable=invalid-name
@@ -197,7 +198,7 @@ def wide_resnet_sngp(input_shape, batch_size, depth, width_multiplier,
                              spec_norm_iteration,
                              spec_norm_bound)
   GaussianProcess = functools.partial(  # pylint: disable=invalid-name
-      ed.layers.RandomFeatureGaussianProcess,
+      classifier_utils.CachedRandomFeatureGaussianProcess,
       num_inducing=gp_hidden_dim,
       gp_kernel_scale=gp_scale,
       gp_output_bias=gp_bias,
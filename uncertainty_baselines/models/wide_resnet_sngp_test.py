@@ -0,0 +1,66 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for Wide SNGP ResNet."""
+
+import tensorflow as tf
+import uncertainty_baselines as ub
+
+
+class WideResnetSNGPTest(tf.test.TestCase):
+
+  def testWideResnetSNGP(self):
+    tf.random.set_seed(83922)
+    batch_size = 5
+    input_shape = (32, 32, 1)
+    num_classes = 3
+
+    model = ub.models.wide_resnet_sngp(
+        input_shape=input_shape,
+        batch_size=batch_size,
+        depth=10,
+        width_multiplier=1,
+        num_classes=num_classes,
+        l2=0.,
+        use_mc_dropout=False,
+        use_filterwise_dropout=False,
+        dropout_rate=0.,
+        use_gp_layer=True,
+        gp_input_dim=128,
+        gp_hidden_dim=1024,
+        gp_scale=1.,
+        gp_bias=0.,
+        gp_input_normalization=False,
+        gp_random_feature_type='orf',
+        gp_cov_discount_factor=-1.,
+        gp_cov_ridge_penalty=1.,
+        use_spec_norm=True,
+        spec_norm_iteration=1,
+        spec_norm_bound=6)
+
+    features = tf.random.normal((batch_size,) + input_shape)
+    model(features, training=True)
+    logits, covmat = model(features, training=False)
+    self.assertEqual(logits.shape, (batch_size, num_classes))
+    self.assertEqual(covmat.shape, (batch_size, batch_size))
+
+    num_cached_layers = ub.models.classifier_utils.cache_gp_covariance(model)
+    _, cached_covmat = model(features, training=False)
+    self.assertEqual(num_cached_layers, 1)
+    self.assertAllClose(cached_covmat, covmat, atol=1e-4)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -15,6 +15,8 @@
 
 """Collection of shared utility functions."""
 
+import collections
+import os
 from typing import Any, Callable, Dict, Optional
 
 from absl import logging
@@ -81,6 +83,56 @@ def assert_weights_loaded(model: tf.keras.Model, before_restore_vars):
       raise ValueError(error_message)
 
 
+# Weights read by `load_weights`, keyed by weight file and modification time,
+# from the least to the most recently used.
+_WEIGHTS_CACHE = collections.OrderedDict()
+
+
+def clear_weights_cache():
+  """Clears the weights cached by `load_weights`."""
+  _WEIGHTS_CACHE.clear()
+
+
+def _weights_mtime(filename: str) -> Optional[int]:
+  """Returns the last modification time of the weight file, in nanoseconds."""
+  # Keras saves the weights either in a single file, or in a TensorFlow
+  # checkpoint whose files are prefixed by `filename`.
+  paths = tf.io.gfile.glob(filename + '*')
+  if '://' in filename:
+    return max((tf.io.gfile.stat(path).mtime_nsec for path in paths),
+               default=None)
+  # `tf.io.gfile.stat` only has a precision of one second on local files.
+  return max((os.stat(path).st_mtime_ns for path in paths), default=None)
+
+
+def load_weights(model: tf.keras.Model, filename: str, max_cached: int = 16):
+  """Loads the weights in `filename` into `model`, reading each file once.
+
+  The weights are cached in memory, e.g. for evaluating the same ensemble
+  members on several splits. The cache is keyed by the modification time of
+  the file, so a rewritten file is read again, and holds the weights of at most
+  `max_cached` files, evicting the least recently used ones.
+
+  Args:
+    model: tf.keras.Model.
+    filename: weight file generated through keras's model.save_weights(...).
+    max_cached: maximum number of weight files cached.
+  """
+  key = (filename, _weights_mtime(filename))
+  weights = _WEIGHTS_CACHE.pop(key, None)
+  if weights is None:
+    model.load_weights(filename)
+    weights = model.get_weights()
+    # Drops the weights of previous versions of the file.
+    for cached_key in [k for k in _WEIGHTS_CACHE if k[0] == filename]:
+      del _WEIGHTS_CACHE[cached_key]
+  else:
+    model.set_weights(weights)
+  _WEIGHTS_CACHE[key] = weights
+  while len(_WEIGHTS_CACHE) > max_cached:
+    _WEIGHTS_CACHE.popitem(last=False)
+
+
 _TensorDict = Dict[str, tf.Tensor]
 _StepFn = Callable[[_TensorDict], Optional[_TensorDict]]
 
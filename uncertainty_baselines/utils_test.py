@@ -0,0 +1,75 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the shared utility functions."""
+
+import os
+import time
+from unittest import mock
+
+import tensorflow as tf
+from uncertainty_baselines import utils
+
+
+class LoadWeightsTest(tf.test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    utils.clear_weights_cache()
+    self.model = tf.keras.Sequential([tf.keras.layers.Dense(2)])
+    self.model.build((None, 3))
+    self._values = {}
+
+  def _save_weights(self, name, value):
+    self.model.set_weights(
+        [tf.fill(w.shape, value) for w in self.model.weights])
+    path = os.path.join(self.get_temp_dir(), name)
+    self.model.save_weights(path)
+    return path
+
+  def _load_weights(self, path, max_cached=16):
+    with mock.patch.object(
+        self.model, 'load_weights', wraps=self.model.load_weights) as load:
+      utils.load_weights(self.model, path, max_cached=max_cached)
+    self.assertAllEqual(self.model.weights[0],
+                        tf.fill([3, 2], self._values[path]))
+    return load.call_count
+
+  def testLoadWeights(self):
+    paths = []
+    for i in range(3):
+      paths.append(self._save_weights(f'member_{i}', float(i)))
+      self._values[paths[-1]] = float(i)
+
+    # Each file is only read once.
+    self.assertEqual(self._load_weights(paths[0]), 1)
+    self.assertEqual(self._load_weights(paths[1]), 1)
+    self.assertEqual(self._load_weights(paths[0]), 0)
+
+    # A rewritten file is read again.
+    time.sleep(0.01)
+    self._save_weights('member_0', 5.)
+    self._values[paths[0]] = 5.
+    self.assertEqual(self._load_weights(paths[0]), 1)
+    self.assertEqual(self._load_weights(paths[0]), 0)
+
+    # The least recently used file is evicted.
+    self.assertEqual(self._load_weights(paths[2], max_cached=2), 1)
+    self.assertEqual(self._load_weights(paths[0], max_cached=2), 0)
+    self.assertEqual(self._load_weights(paths[1], max_cached=2), 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()